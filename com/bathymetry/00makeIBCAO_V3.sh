@@ -10,6 +10,11 @@ source ../../demPaths.sh
 #
 echo $arcticGrd
 echo $arcticXyz
-grd2xyz	$arcticGrd -S -V	| blockmedian -R-180/180/65/90 -fg -I1m/.5m > $arcticXyz
+#
+# 02worldMakeAllTiles.sh no longer needs $arcticXyz: arctic_blend.py reads $arcticGrd a tile at a time and block
+# medians it onto the 15c nodes itself, so the whole grid is not dumped to text here any more
+#
+# grd2xyz	$arcticGrd -S -V	| blockmedian -R-180/180/65/90 -fg -I1m/.5m > $arcticXyz
+ls -l $arcticGrd
 
 exit
@@ -43,19 +43,9 @@ wet=$debugDir/wet
 #
 # surfaceOpts set in ../../demPaths.sh
 #
-# Convert the img file to predicted.xyz
+# The predicted grid is made straight from the img file and the IBCAO grid by arctic_blend.py (below): no
+# predicted.xyz or arctic xyz is written.
 #
-if [ 6 == 6 ]; then
-#
-# Altimetry is used up to 70 N, also convert Altimetry data from 0/360 to +/-180.
-#
-# Block median filter Altimetry implicitly switching Altimetry
-# grid from pixel to node registered.
-#
-	rm -f $pred.xyz
-        ls -l $arcticXyz
-	../../bin/img2web $img -90 $maxPred 0 360 1 | awk '{tmp=$1;if(tmp>180)tmp=tmp-360;printf "%.7lf %s %s\n",tmp,$2,$3}'  > $pred.xyz
-fi
 #
 # interpolate predicted (and IBCAO) grid onto the final resolution grid
 # -and- convert them from pixel to node registered
@@ -72,23 +62,26 @@ if [ 6 == 6 ]; then
 #
 	purge
 #
-# a 1 means wet, NaN means not wet, aka dry. This is slow, run in parallel"
+# a 1 means wet, NaN means not wet, aka dry. The land mask cache is built once (grdlandmask over the world, in
+# parallel; skipped when it is already built) and the wet grid is read from it
 #
        echo $land.grd
        echo $wet.grd
-       grdlandmask	-R$land.grd -Df+ -N1/Nan -G$wet.grd > /dev/null 2>&1 
+       python ../../human_editing/GUI/land_mask.py build --increment 15c --resolution f+ || exit 1
+       python ../../human_editing/GUI/land_mask.py grid $land.grd $wet.grd 1/NaN --resolution f+ || exit 1
 #
-#   changed to 30 arcseconds
+# blend IBCAO into predicted between $minArctic and $maxPred on 15c tiles, read straight from the img and IBCAO
+# grids (was img2web | blockmedian -I30c, and surface_pred_arctic.csh of the arctic xyz), then paste the tiles
 #
- 	blockmedian $pred.xyz -V -fg -R-180/180/-90/90 -bod -I30c > $pred.median.xyz
-        echo $pred.median.xyz $arcticXyz
- 	surface_pred_arctic.csh $pred.median.xyz $arcticXyz $pred.unmasked.grd $surfaceOpts
+	python ../../human_editing/GUI/arctic_blend.py $img $arcticGrd $pred.tiles --increment 15c \
+		--min-arctic $minArctic --max-pred $maxPred
+	python ../../human_editing/GUI/world_tiles.py paste $pred.tiles $pred.unmasked.grd
  	wait;wait;
  	grdmath -V -fg $wet.grd $pred.unmasked.grd MUL = $pred.grd
 fi
 #
-# FIXME: at this point we have -81 to +90 latitude covered in +/-180 longitude format.
-# FIXME: still need to do something for -90 to -81 (maybe).
+# at this point we have -90 to +90 latitude covered in +/-180 longitude format: arctic_blend.py fills south of the
+# last img row (-80.738) from that row, tapering to its mean at the pole
 #
 # create difference of measured (pings) and predicted (altimetry data)
 #
@@ -111,7 +104,7 @@ if [ 6 == 6 ]; then
 #  fill land areas and ocean data voids with zero
 #
 lowResZero=4m
-xyz2grd $huge.xyzi -Rd -I$lowResZero -An -Gnum.grd -N0 -V
+xyz2grd $huge.xyzi -bi4 -Rd -I$lowResZero -An -Gnum.grd -N0 -V
 grdfilter num.grd -D3 -Fg20 -Ghit.grd -V
 grdmath hit.grd 1 GE 1 NAN = $zero.grd
 grd2xyz $zero.grd -S > $zero.xyz
@@ -124,7 +117,7 @@ if [ 6 == 6 ]; then
 #
 purge
 #
-	../../bin/medianId  -V -fg -R$land.grd -C -bo4 $huge.xyzi > $ping.xyzi
+	../../bin/medianId  -V -fg -R$land.grd -C -bi4 -bo4 $huge.xyzi > $ping.xyzi
 #
 	grdtrack $ping.xyzi -bi4 -V -fg -R$land.grd -G$pred.grd -S | tee $ping.xyzip 	|\
 	awk "$awkString"					  | tee $ping.xyd	|\
@@ -135,7 +128,13 @@ purge
 # FIXME: tell OSX to free up unused memory and avoid swapping
 #
 	purge
-	surface_tile.csh $ping.xyd.landZeros.median $ping.xyd.grd $surfaceOpts
+#
+# with surfaceEngine=python only the nodes within the search radius of the pings are solved, the difference is 0
+# (predicted) elsewhere; gmt solves every node and ignores --pings and --empty
+#
+	SURFACE_ENGINE=$surfaceEngine surface_tile.csh $ping.xyd.landZeros.median $ping.xyd.grd $surfaceOpts \
+		--pings $ping.xyzi --empty 0 || \
+		{ echo "`date`: surface failed or left unconverged tiles in $ping.xyd.grd" ; exit 1 ; }
 #
 # add actual-predicted (diff) to predicted to get actual, where we have actual,
 # but more importantly, to interpolate predicted data near the pings.
@@ -18,35 +18,8 @@ fi
 cmFile=$1;		shift
 predicted=$1;	shift
 
-t=$cmFile.timeStamp
-xyzufip=$cmFile.xyzufip
-
-# grdtrack must have x,y in first 2 cols...
-# grdtrack must have x,y in same principle value (0-360 or +/-180) as grid being sampled
-#
-# save column 1 (aka time), then slice column 1 off and convert longitude to +/-180
-# 	and -then- sample predicted from grid
-# paste pieces back together
-
-cut -f 1 -d ' ' $cmFile > $t
-awkString='{x=$2;if(x>180)x=x-360;printf "%.7lf %s %s %s %s %s\n",x,$3,$4,$5,$6,$7}'
-awk "$awkString" < $cmFile | grdtrack -G$predicted -V > $xyzufip
-paste $t $xyzufip > $cmFile.corrected
-
-# make versions with one extra column  of difference between ping and predicted depth
-
-awk '{print $0,$4-$8}' < $cmFile.corrected	> $cmFile.corrected.diff
-awk '{if ($6 == 9999) {print $0 } }'		< $cmFile.corrected.diff > $cmFile.corrected.diff.bad
-awk '{if ($6 != 9999) {print $0 } }'		< $cmFile.corrected.diff > $cmFile.corrected.diff.good
-
-# make histograms
-
-histogramCmFile.sh NOAA_geodas.cm.corrected.diff "All Corrected NOAA_geodas"
-histogramCmFile.sh NOAA_geodas.cm.corrected.diff.good "Bad Pings in Corrected NOAA_geodas"
-histogramCmFile.sh NOAA_geodas.cm.corrected.diff.bad "Good Pings in Corrected NOAA_geodas"
-
-# clean up
-
-$t $xyzufip
+# cm_qc.py samples $predicted at every ping (longitudes wrapped to the grid) and computes the good and bad (9999)
+# histograms of ping, predicted and ping-predicted in one pass, without the .corrected.diff.good/.bad copies;
+# histogramCmFile.sh is not needed for them. Report: $cmFile:r.qc.json, $cmFile:r.sid.csv, $cmFile:r.qc.png
+python ../../human_editing/GUI/cm_qc.py $predicted $cmFile
 exit
-
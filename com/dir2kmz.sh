@@ -28,22 +28,8 @@ if [ $fileCnt == "0" ] ; then
 fi
 echo "`basename $0`: processing $fileCnt files"
 
-for item in $srcDir/*.grd
-do
-	echo "`basename $0` processing $item"
-	#FIXME: put grd2kmz someplace that isn't stupid...
-	/Users/jj/Desktop/SRTM15/com/grd2kmz.sh $item $dstDir &
-	sleep 3
-	((jobsRunning=`ps -C | grep grd2kmz | grep -v grep | wc -l`))
-	# do NOT launch zillion jobs at once. They are light, but thrash file system
-	# use about a third of possible threads, ad hoc but reasonable
-	while [ $jobsRunning -ge `sysctl hw.activecpu | awk '{print $2 /3 }'` ]
-	do
-		echo "$jobsRunning grd2kmz jobs are running..."
-		sleep 30
-		((jobsRunning=`ps -C | grep grd2kmz | grep -v grep | wc -l`))
-	done
-done
-wait; wait; wait;
+# kmz_pyramid.py shades each grid straight from its values and writes its super-overlay into the .kmz, the grids
+# on a pool of processes (one grd2kmz.sh job per grid in the background is in git history)
+python `dirname $0`/../human_editing/GUI/kmz_pyramid.py $srcDir $dstDir
 echo "`date`: finished com/$0 $@ "
 exit
@@ -10,15 +10,12 @@ ifilePath=$1;	shift
 ofilePath=$1;	shift
 maskValue=$1;	shift
 
-stem=`basename -s .grd $ifilePath`
-workingDir="/tmp/`basename -s .sh $0`"$RANDOM
-mkdir -p $workingDir
-
-grdlandmask -R$ifilePath -G$workingDir/$stem.mask.grd -N$maskValue -Df > /dev/null 2>&1
-# avoid issues with ifile = ofile in the grdmath step by making copy of ifile
-cp $ifilePath $workingDir/$stem.cp.grd
-grdmath $workingDir/$stem.mask.grd $workingDir/$stem.cp.grd MUL = $ofilePath
-rm -rf $workingDir
+# the mask is read from the land mask cache instead of running grdlandmask and grdmath on every tile; ifile may be
+# ofile. The mask used has the node spacing of ifile; build it once before running the tiles (grdlandmask -Df once
+# for the whole world), e.g. for 15c tiles:
+#	python human_editing/GUI/land_mask.py build --increment 15c --resolution f
+# this fails (exit 1) if that mask is not built, rather than every tile job building it
+python `dirname $0`/../../human_editing/GUI/land_mask.py mask $ifilePath $ofilePath $maskValue --resolution f || exit 1
 
 exit
 
@@ -1,7 +1,7 @@
 #!/bin/bash -x
 
 if [ "$#" != "7" ] ; then
-	echo "usage: `basename $0` name resolution west east south north pingFile "
+	echo "usage: `basename $0` name resolution west east south north pingFile|pingIndexDir "
 	echo "  example: `basename $0` azores 300e -35 -25 30 40 /Volumes/RAID/doNotBackup/srtm15_plus/debug/huge.xyzi "
 	exit
 fi
@@ -19,8 +19,14 @@ srcPings="$1";	shift
 # median filter to a (typically) 300m grid, --PIXEL-- registered
 # turn ASCII into a netCDF grid, , --PIXEL-- registered
 
-cat $srcPings | \
-	../bin/selectAndSort /dev/stdin /dev/stdout /dev/null $w $e $s $n | \
+# pingFile may be a ping index directory (human_editing/GUI/ping_index.py), which only reads the blocks in the box
+
+if [ -d "$srcPings" ] ; then
+	python ../human_editing/GUI/ping_index.py query $srcPings $w $e $s $n
+else
+	# huge.xyzi is binary since make_huge.py (01makeHuge.csh); selectAndSort only reads text
+	python ../human_editing/GUI/ping_index.py select $srcPings $w $e $s $n
+fi | \
 	blockmedian -R$w/$e/$s/$n -I$resolution -V -C -F | \
 	xyz2grd -R$w/$e/$s/$n -I$resolution -V -F -G$name.pings.grd
 
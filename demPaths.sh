@@ -35,8 +35,12 @@ tension=-T0.55
 convergence=-C1.0	# meters
 search=-S300m		# arc minutes
 relaxFactor=-Z1.4
-# FIXME: if surface goes max iterations, then inaccurate grid, but no limit could spin.
+# if surface goes max iterations, then inaccurate grid, but no limit could spin. surface_engine.py counts -N in
+# multigrid cycles per block, and reports the blocks (and exits 1) still changing by more than -C after them.
 #maxItertion=-N123456
 #maxItertion=-N100
 maxItertion=-N200
 surfaceOpts="$tension $relaxFactor $convergence $maxItertion $search"
+# how surface_tile.csh grids the world: gmt (six latitude bands of GMT surface) or python (surface_engine.py blocks).
+# keep gmt until surface_engine passes "tile_benchmark.py check" against the golden outputs of GMT
+surfaceEngine=gmt
@@ -1,33 +1,31 @@
 import os
 import sys
 import glob
+import shutil
 import subprocess
 import webbrowser
-import folium
-import geojson
 import json
-import matplotlib as mpl
 import numpy as np
-import math as m
 import wx
 import wx.py as py
 import wx.lib.agw.aui as aui
-from matplotlib import pyplot as plt
 from wx.lib.buttons import GenBitmapButton
 from wx import html2
-from three_dim_viewer import ThreeDimViewer
+from cm_engine import load_cruise, save_cruise, score_classes, map_colors, flag_polygons, sample_predicted, \
+    regrid as regrid_cruise, PREDICTED_IMG
+from cruise_session import CruiseSession
+from cruise_store import FLAGS_CHANGED
+from ping_archive import ArchiveIndex, archive_dirs, read_dem_paths
+from ping_index import PingIndex
+from polygon_io import read_polygons, parse_geojson, write_gmt, write_geojson
+from instrumentation import INSTRUMENTS, span
+from projection import PROJECTIONS
 # from old_three_dim_viewer import ThreeDimViewer
-from folium import LayerControl
-from custom_folium_draw import Draw
-from folium.plugins import MousePosition
-from folium.plugins import FastMarkerCluster
-import shapely.speedups
-shapely.speedups.enable()
-from shapely.geometry import Polygon
-import geopandas as gpd
+
+# N.B. folium, matplotlib AND vtk (THROUGH three_dim_viewer) ARE IMPORTED THE FIRST TIME THEY ARE NEEDED, NOT HERE,
+# SO THE EDITOR OPENS WITHOUT LOADING THEM
 
 # to-do vtk.vtkRadiusOutlierRemoval
-mpl.use('WXAgg')
 
 """
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -76,6 +74,16 @@ Documentation created using Sphinx.
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+# THE EMPTY BASE MAP IS BUILT WITH FOLIUM ONCE AND CACHED AS A STATIC PAGE. INCREASE BASE_MAP_VERSION WHENEVER
+# build_map CHANGES SO THE CACHED PAGE IS REBUILT
+BASE_MAP_VERSION = 1
+BASE_MAP_HTML = 'Py-CMeditor_base_v%d.html' % BASE_MAP_VERSION
+MAP_HTML = 'Py-CMeditor.html'
+
+# FIXED ID OF THE LEAFLET MAP, SO THE CACHED PAGE AND THE PAGES REBUILT WITH DATA SHARE ONE JAVASCRIPT NAME
+MAP_ID = 'pycmeditor'
+MAP_NAME = 'map_' + MAP_ID
+
 
 class PyCMeditor(wx.Frame):
     """
@@ -128,8 +136,9 @@ class PyCMeditor(wx.Frame):
         intro = "###############################################################\r" \
                 "!USE import sys; then sys.Gmg.OBJECT TO ACCESS PROGRAM OBJECTS \r" \
                 "ctrl+up FOR COMMAND HISTORY                                    \r" \
+                "instruments.report() OR instruments.export('timings.json')     \r" \
                 "###############################################################"
-        py_local = {'__app__': 'gmg Application'}
+        py_local = {'__app__': 'gmg Application', 'instruments': INSTRUMENTS}
         sys.t = self
         self.win = py.shell.Shell(self.ConsolePanel, -1, size=(2200, 1100),
                                   locals=py_local, introText=intro)
@@ -174,9 +183,10 @@ class PyCMeditor(wx.Frame):
         # MAXIMIZE FRAME
         self.Maximize()
 
-        # INITIALISE THREE DIMENSION VIEWER OBJECTS
-        self.predicted_xyz = None
-        self.difference_xyz = None
+        # INITIALISE THE .cm DATA STORE (SHARED BY THE MAP AND THE 3D VIEWER)
+        self.store = None
+        self.session = None  # CruiseSession WHEN MANY .cm FILES ARE OPEN TOGETHER
+        self.tdv = None  # THE 3D VIEWER, WHILE ONE IS OPEN
 
     def create_menu(self):
         """# CREATES GUI MENUBAR"""
@@ -190,6 +200,18 @@ class PyCMeditor(wx.Frame):
         m_open_cm_file = self.file.Append(-1, "Open \tCtrl-L", "Open")
         self.Bind(wx.EVT_MENU, self.open_cm_file, m_open_cm_file)
 
+        m_open_cm_session = self.file.Append(-1, "Open session (many .cm files) \tCtrl-M", "Open session")
+        self.Bind(wx.EVT_MENU, self.open_cm_session, m_open_cm_session)
+
+        m_session_view = self.file.Append(-1, "Session: edit cruises in map view", "Session view")
+        self.Bind(wx.EVT_MENU, self.set_session_view, m_session_view)
+
+        m_open_region = self.file.Append(-1, "Open region from archive (drawn polygons) \tCtrl-R", "Open region")
+        self.Bind(wx.EVT_MENU, self.open_region, m_open_region)
+
+        m_index_archive = self.file.Append(-1, "Update archive index", "Update archive index")
+        self.Bind(wx.EVT_MENU, self.update_archive_index, m_index_archive)
+
         self.file.AppendSeparator()
 
         m_exit = self.file.Append(-1, "Exit...\tCtrl-X", "Exit...")
@@ -218,6 +240,12 @@ class PyCMeditor(wx.Frame):
         # VIEW MENU'  # CREATE MENUBAR ITEM
         self.view = wx.Menu()
 
+        m_timings_report = self.view.Append(-1, "Timings report", "Print the timing spans and counters")
+        self.Bind(wx.EVT_MENU, self.timings_report, m_timings_report)
+
+        m_export_timings = self.view.Append(-1, "Export timings...", "Save the timing spans and counters")
+        self.Bind(wx.EVT_MENU, self.export_timings, m_export_timings)
+
         self.menubar.Append(self.view, "&View")  # DRAW VIEW MENU
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -263,7 +291,47 @@ class PyCMeditor(wx.Frame):
         self.toolbar.SetSize((1790, 36))
 
     def draw_map_window(self):
-        """INITIALISE FOLIUM INTERACTIVE MAP"""
+        """INITIALISE THE INTERACTIVE MAP (THE CACHED BASE PAGE; FOLIUM IS ONLY LOADED WHEN DATA IS DRAWN)"""
+
+        # THE FOLIUM MAP OBJECTS ARE BUILT THE FIRST TIME DATA IS DRAWN (SEE map_layers); layers_stale = THE .cm
+        # LAYERS NO LONGER MATCH THE STORE (FLAGS WERE UPDATED IN THE PAGE ONLY) AND ARE REDRAWN BEFORE THE NEXT SAVE
+        self.folium_map = None
+        self.layers_stale = False
+
+        # BUILD THE BASE PAGE IF IT IS NOT CACHED YET
+        if not os.path.isfile(self.cwd + '/' + BASE_MAP_HTML):
+            self.build_map()
+            self.folium_map.save(self.cwd + '/' + BASE_MAP_HTML)
+
+        # CREATE GUI HTML WINDOW
+        # wx.html2.WebView.MSWSetEmulationLevel(wx.html2.WEBVIEWIE_EMU_IE11)
+        self.browser = wx.html2.WebView.New(self.right_panel_bottom, -1)
+        # self.browser.MSWSetEmulationLevel(level=wx.html2.WEBVIEWIE_EMU_IE11)
+        # self.browser.Bind(wx.html2.EVT_HTML_LINK_CLICKED, self.on_import)
+        # wx.html2.WebView.WEBVIEW_
+
+        # LOAD THE BASE MAP INTO WXPYTHON HTML WINDOW
+        self.browser.LoadURL(self.cwd + '/' + BASE_MAP_HTML)
+
+        # SET MAIN MAP NAME
+        self.main_map_url = str(self.browser.GetCurrentURL())
+
+        # DRAW BUTTON WINDOW
+        self.draw_button_and_list_frame()
+
+        # UPDATE DISPLAY
+        self.size_handler()
+
+        # REFRESH SIZER POSITIONS
+        self.Hide()
+        self.Show()
+
+    def build_map(self):
+        """CREATE THE FOLIUM MAP OBJECTS (BASE LAYERS, DRAWING TOOLS AND THE EMPTY .cm LAYERS)"""
+        import folium
+        from folium import LayerControl
+        from folium.plugins import MousePosition
+        from custom_folium_draw import Draw
 
         # CREATE MAP
         self.folium_map = folium.Map(location=[0.0, 0.0],
@@ -273,6 +341,7 @@ class PyCMeditor(wx.Frame):
                                      name='map',
                                      control_scale=True,
                                      tiles=None)
+        self.folium_map._id = MAP_ID
 
         # ADD SRTM15+ TILES
         self.tiles = folium.TileLayer(tiles='/Users/brook/PROJECTS/ML/Bathymetry/human_editing/8-xyz-tiles/{z}/{x}/{y}.png',
@@ -315,31 +384,21 @@ class PyCMeditor(wx.Frame):
         self.controls = LayerControl(position='bottomright', collapsed=False)
         self.controls.add_to(self.folium_map)
 
-        # SAVE MAP AS HTML
-        self.folium_map.save("Py-CMeditor.html")
-
-        # CREATE GUI HTML WINDOW
-        # wx.html2.WebView.MSWSetEmulationLevel(wx.html2.WEBVIEWIE_EMU_IE11)
-        self.browser = wx.html2.WebView.New(self.right_panel_bottom, -1)
-        # self.browser.MSWSetEmulationLevel(level=wx.html2.WEBVIEWIE_EMU_IE11)
-        # self.browser.Bind(wx.html2.EVT_HTML_LINK_CLICKED, self.on_import)
-        # wx.html2.WebView.WEBVIEW_
-
-        # LOAD FOLIUM MAP INTO WXPYTHON HTML WINDOW
-        self.browser.LoadURL(self.cwd + '/Py-CMeditor.html')
-
-        # SET MAIN MAP NAME
-        self.main_map_url = str(self.browser.GetCurrentURL())
-
-        # DRAW BUTTON WINDOW
-        self.draw_button_and_list_frame()
-
-        # UPDATE DISPLAY
-        self.size_handler()
-
-        # REFRESH SIZER POSITIONS
-        self.Hide()
-        self.Show()
+    def map_layers(self):
+        """RETURN THE SIX .cm LAYERS OF THE FOLIUM MAP, BUILDING THE MAP FIRST IF NEEDED"""
+        if self.folium_map is None:
+            self.build_map()
+        return [self.bad_fg, self.uncertain_fg, self.good_fg,
+                self.bad_fg_depthdiff, self.uncertain_fg_depthdiff, self.good_fg_depthdiff]
+
+    def save_map(self):
+        """SAVE THE FOLIUM MAP (INCLUDING THE .cm LAYERS) AND SHOW IT"""
+        self.map_layers()
+        if self.layers_stale:
+            self.draw_cm_layers()
+        with span('map_save'):
+            self.folium_map.save(self.cwd + '/' + MAP_HTML)
+        self.browser.LoadURL(self.cwd + '/' + MAP_HTML)
 
     def draw_button_and_list_frame(self):
         """#% CREATE LEFT HAND BUTTON MENU"""
@@ -416,22 +475,26 @@ class PyCMeditor(wx.Frame):
 
     # GUI INTERACTION~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    def color_score(self, value):
-        """SET COLOR FOR POINT PLOTTING"""
-        if value != -9999:
-            cmap = plt.cm.get_cmap('RdYlBu')
-            norm = plt.Normalize(0.0, 1.0)
-            rgb = cmap(norm(value))[:3]
-        else:
-            rgb = (0, 0, 0)  # SET FLAGGED NODES AS BLACK
-        return (mpl.colors.rgb2hex(rgb))
+    def show_status(self, text):
+        """SHOW A MESSAGE IN THE STATUS BAR (THE FIRST FIELDS HOLD THE CONTROLS AND CONSOLE BUTTONS)"""
+        self.statusbar.SetStatusText(text, 2)
 
-    def color_depth(self, value):
-        """SET COLOR FOR POINT PLOTTING"""
-        cmap = plt.cm.get_cmap('viridis')
-        norm = plt.Normalize(-10000.0, 0.0)
-        rgb = cmap(norm(value))[:3]
-        return (mpl.colors.rgb2hex(rgb))
+    def show_error(self, text):
+        """SHOW AN ERROR IN A MESSAGE BOX, AND LEAVE IT IN THE STATUS BAR"""
+        self.show_status("ERROR: " + text)
+        dlg = wx.MessageDialog(self, text, "Error", wx.OK | wx.ICON_ERROR)
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def color_score(self, scores, flagged):
+        """SET COLORS FOR POINT PLOTTING (FLAGGED NODES ARE BLACK)"""
+        colors = map_colors(scores, 'RdYlBu', 0.0, 1.0)
+        colors[flagged] = '#000000'  # SET FLAGGED NODES AS BLACK
+        return colors
+
+    def color_depth(self, depths):
+        """SET COLORS FOR POINT PLOTTING"""
+        return map_colors(depths, 'viridis', -10000.0, 0.0)
 
     def open_cm_file(self, event):
         """GET CM FILE TO LOAD"""
@@ -454,11 +517,7 @@ class PyCMeditor(wx.Frame):
                 return  # USER CHANGED THEIR MIND
             else:
                 #  IF A .cm FILE IS ALREADY LOADED THEN REMOVE IT BEFORE LOADING THE CURRENT FILE
-                try:
-                    self.cm_plot
-                except AttributeError:
-                    pass
-                else:
+                if self.store is not None:
                     self.delete_cm_file()
 
                 #  GET THE FILE NAME FROM FileDialog WINDOW
@@ -474,152 +533,263 @@ class PyCMeditor(wx.Frame):
                 # LOAD THE DATA
                 self.load_cm_file_as_cluster(self.bad_th, self.uncertain_th)
 
-    def load_cm_file_as_cluster(self, bad_th, uncertain_th):
-        """LOAD .cm FILE AND PLOT AS CLUSTERS"""
-        try:
-            # 1.0 OPEN THE .cm FILE USING NUMPY
-            self.cm = np.genfromtxt(self.cm_file, delimiter=' ', filling_values=-9999)
-
-            ## 1.1 SAVE XYZ FOR 3D VIEWER
-            self.xyz = self.cm[:, 1:4]
-            self.xyz_cm_id = self.cm[:, 0].astype(int)
-            self.xyz_width = self.cm.shape[1]
-            self.xyz_meta_data = self.cm[:, 4:self.xyz_width]
-            self.xyz_point_flags = np.zeros(shape=(1, len(self.xyz)))
-            self.xyz_cm_line_number = np.linspace(0, len(self.xyz), (len(self.xyz) + 1))
-            self.score_xyz = self.cm[:, [1, 2, 6]]  # ML SCORE
-
-            # 2.0 GENERATE COLORS FOR THE DEPTHS AND SCORES
-            colors = np.empty(shape=[self.cm.shape[0], 2], dtype=object)
-            for i in range(0, self.cm.shape[0]):
-                colors[i, 0] = self.color_score(self.cm[i, 5])
-                colors[i, 1] = self.color_depth(self.cm[i, 3])
-
-            # 2.1 ADD COLORS TO CM ARRAY
-            self.cm = np.column_stack((self.cm, colors))
-
-            # 3.0 DIVIDE RECORDS INTO BAD, UNCERTAIN, GOOD (BASED ON ML SCORE)
-
-            # 3.1 MAKE NUMPY ARRAY WITH BAD SCORES
-            scored_bad = self.cm[self.cm[:, 6] <= bad_th]
-
-            # 3.2 MAKE NUMPY ARRAY WITH UNCERTAIN SCORES
-            scored_uncertain = self.cm[self.cm[:, 6] > bad_th]
-            scored_uncertain = scored_uncertain[scored_uncertain[:, 6] <= uncertain_th]
-
-            # 3.3 MAKE NUMPY ARRAY WITH GOOD SCORES
-            scored_good = self.cm[self.cm[:, 6] > uncertain_th]
-
-            # 4.0 LOAD CM DATA INTO THE HTML WINDOW
-
-            # 4.1 CUSTOM JAVA SCRIPT FOR CREATING CIRCLE MARKERS & COLORING WITH SCORE VALUE
-            callback = ('function (input) {'
-                        'var circle = L.circle(new L.LatLng(input[0], input[1]), '
-                        '{color: input[2],  radius: 10,  opacity: 0.5});'
-                        "var popup = L.popup({maxWidth: '300'});"
-                        "const display_text = {text: input[3]};"
-                        "var mytext = $(`<div id='mytext' class='display_text' style='width: 100.0%; "
-                        "height: 100.0%;'> ${display_text.text}</div>`)[0];"
-                        "popup.setContent(mytext);"
-                        "circle.bindPopup(popup);"
-                        'return circle};')
-
-            callback2 = ('function (input) {'
-                         'var circle = L.circle(new L.LatLng(input[0], input[1]), '
-                         '{color: input[2],  radius: 10,  opacity: 0.5});'
-                         "var popup = L.popup({maxWidth: '300'});"
-                         "const display_text = {text: input[3]};"
-                         "var mytext = $(`<div id='mytext' class='display_text' style='width: 100.0%; "
-                         "height: 100.0%;'> ${display_text.text}</div>`)[0];"
-                         "popup.setContent(mytext);"
-                         "circle.bindPopup(popup);"
-                         'return circle};')
+    def open_cm_session(self, event):
+        """OPEN MANY .cm FILES TOGETHER AS ONE EDITING SESSION"""
 
-            # CREATE CLUSTER OBJECTS
-            self.bad_fg.add_child(FastMarkerCluster((scored_bad[:, (2, 1, 9, 6)]).tolist(),
-                                                    callback=callback, disableClusteringAtZoom=self.zoom_level))
+        # OPEN THE DIALOG BOX TO ENTER THE THRESHOLD VALUES
+        if not self.ask_load_options('Loading a session of .cm files'):
+            return
+
+        # SELECT THE FILES
+        open_file_dialog = wx.FileDialog(self, "Open .cm files", "", "", "All files (*.cm)|*.*", wx.FD_OPEN |
+                                         wx.FD_FILE_MUST_EXIST | wx.FD_MULTIPLE)
+        if open_file_dialog.ShowModal() == wx.ID_CANCEL:
+            return  # USER CHANGED THEIR MIND
 
-            self.uncertain_fg.add_child(FastMarkerCluster((scored_uncertain[:, (2, 1, 9, 6)]).tolist(),
-                                                          callback=callback, disableClusteringAtZoom=self.zoom_level))
+        #  REMOVE THE CURRENT .cm DATA
+        if self.store is not None:
+            self.delete_cm_file()
 
-            self.good_fg.add_child(FastMarkerCluster((scored_good[:, (2, 1, 9, 6)]).tolist(),
-                                                     callback=callback, disableClusteringAtZoom=self.zoom_level))
+        # LOAD ALL THE CRUISES INTO ONE MERGED STORE (FILES ARE READ LAZILY AND DROPPED WHEN OUT OF VIEW)
+        self.session = CruiseSession(open_file_dialog.GetPaths())
+        self.cm_file = self.session.name
+        self.show_store(self.session.set_view(None))
 
-            # CREATE DEPTH DIFFERENCE CLUSTER OBJECTS
-            self.bad_fg_depthdiff.add_child(FastMarkerCluster((scored_bad[:, (2, 1, 10, 8)]).tolist(),
-                                                              callback=callback2,
-                                                              disableClusteringAtZoom=self.zoom_level))
+    def ask_load_options(self, title):
+        """ASK FOR THE SCORE THRESHOLDS AND CLUSTERING MODE. RETURNS False IF THE USER CANCELLED"""
+        open_cm_dialogbox = OpenCmDialog(self, -1, title)
+        open_cm_dialogbox.ShowModal()
+        if open_cm_dialogbox.regular_load_button is not True and open_cm_dialogbox.cluster_load_button is not True:
+            return False
+        self.bad_th = float(open_cm_dialogbox.bad_th_value)
+        self.uncertain_th = float(open_cm_dialogbox.uncertain_th_value)
+        self.zoom_level = 1 if open_cm_dialogbox.regular_load_button is True else 8
+        return True
+
+    def set_session_view(self, event):
+        """RESTRICT THE SESSION TO THE CRUISES OVERLAPPING THE CURRENT MAP VIEW"""
+        if self.session is None:
+            self.show_error("no session open")
+            return
+        bounds = []
+        for side in ('getWest', 'getEast', 'getSouth', 'getNorth'):
+            r, value = self.browser.RunScript(MAP_NAME + '.getBounds().' + side + '()')
+            bounds.append(float(value))
+        self.store.unsubscribe(self.on_store_changed)
+        self.show_store(self.session.set_view(tuple(bounds)))
+
+    def archive_index(self):
+        """RETURN THE INDEX OF THE .cm ARCHIVE (THE AGENCY DIRS IN demPaths.sh), BUILDING IT IF THERE IS NONE"""
+        index = ArchiveIndex(self.cwd + '/' + 'archive_index.json')
+        if len(index) == 0:
+            self.update_archive_index(None, index)
+        return index
+
+    def ping_index(self):
+        """
+        RETURN THE PING INDEX OF THE .cm ARCHIVE (ping_index.py build ping_index <.cm files>, NEXT TO
+        archive_index.json), OR None IF THERE IS NONE OR ITS FILES CHANGED SINCE (THE REGION IS THEN SCANNED)
+        """
+        directory = self.cwd + '/' + 'ping_index'
+        if not os.path.exists(directory + '/' + 'index.json'):
+            return None
+        index = PingIndex(directory)
+        stale = index.stale_sources()
+        if stale:
+            self.show_status("WARNING: %s FILES CHANGED SINCE THE PING INDEX WAS BUILT, SCANNING THE ARCHIVE INSTEAD "
+                             "(python ping_index.py refresh %s)" % (len(stale), directory))
+            return None
+        return index
+
+    def update_archive_index(self, event, index=None):
+        """INDEX NEW AND CHANGED .cm FILES IN THE ARCHIVE"""
+        if index is None:
+            index = ArchiveIndex(self.cwd + '/' + 'archive_index.json')
+        moa_public, moa_private = read_dem_paths(self.cwd + '/../../demPaths.sh')
+        self.busyDlg = wx.BusyInfo("Indexing the .cm archive...")
+        n_read = index.build(archive_dirs(moa_public, moa_private))
+        self.busyDlg = None
+        message = "INDEXED %s FILES (%s IN THE ARCHIVE)" % (n_read, len(index))
+        if index.errors:
+            message += "; %s COULD NOT BE READ" % len(index.errors)
+        self.show_status(message)
+
+    def open_region(self, event):
+        """OPEN THE PINGS FROM ALL ARCHIVE FILES THAT FALL INSIDE THE POLYGONS DRAWN ON THE MAP"""
+
+        # 1.0 GET THE DRAWN POLYGONS (RECTANGLES ARE POLYGONS TOO)
+        polygons = self.drawn_polygons()
+        if len(polygons) == 0:
+            self.show_error("draw a rectangle or polygon around the region first")
+            return
+        if not self.ask_load_options('Loading a region from the .cm archive'):
+            return
+
+        #  REMOVE THE CURRENT .cm DATA
+        if self.store is not None:
+            self.delete_cm_file()
 
-            self.uncertain_fg_depthdiff.add_child(FastMarkerCluster((scored_uncertain[:, (2, 1, 10, 8)]).tolist(),
-                                                                    callback=callback2,
-                                                                    disableClusteringAtZoom=self.zoom_level))
+        # 2.0 READ ONLY THE PINGS INSIDE THE POLYGONS (EDITS ARE SAVED BACK TO EACH ORIGINATING FILE)
+        self.session, store = self.archive_index().open_region(polygons=polygons, pings=self.ping_index())
+        self.cm_file = self.session.name
+        self.show_status("OPENED %s PINGS FROM %s FILES" % (len(store), len(self.session.merged_ids)))
+        self.show_store(store)
+
+    def show_store(self, store):
+        """MAKE store THE .cm DATA SHOWN (AND EDITED) IN THE MAP"""
+        self.store = store
+        self.store.subscribe(self.on_store_changed)
+        self.draw_cm_layers()
+        self.get_predicted()
+        self.set_map_location()
+        self.save_map()
+
+        # AN OPEN 3D VIEWER IS REOPENED ON THE NEW STORE (IT WOULD OTHERWISE KEEP EDITING THE ONE IT WAS OPENED WITH)
+        if self.tdv:
+            self.reload_three_dim()
+
+    def load_cm_file_as_cluster(self, bad_th, uncertain_th):
+        """LOAD .cm FILE AND PLOT AS CLUSTERS"""
+        try:
+            with span('load_cm_file'):
+                # 1.0 OPEN THE .cm FILE (OR ITS BINARY SIDECAR) INTO THE SHARED STORE
+                self.store = load_cruise(self.cm_file)
+                self.store.subscribe(self.on_store_changed)
 
-            self.good_fg_depthdiff.add_child(FastMarkerCluster((scored_good[:, (2, 1, 10, 8)]).tolist(),
-                                                               callback=callback2,
-                                                               disableClusteringAtZoom=self.zoom_level))
+                # 2.0 DRAW THE .cm DATA ON THE MAP
+                self.draw_cm_layers()
 
-            # IMPORT PREDICTED GRID
-            lon, lat = self.get_centeroid(self.cm[:, 1:3])
-            epsg_code = self.convert_wgs_to_utm_epsg_code(lon, lat)
-            self.get_predicted(epsg_code)
+                # IMPORT PREDICTED GRID
+                self.get_predicted()
 
-            # SAVE AND DISPLAY THE NEW FOLIUM MAP (INCLUDING THE .cm FILE)
-            self.set_map_location()
-            self.folium_map.save("Py-CMeditor.html")
-            self.browser.Reload()
+                # SAVE AND DISPLAY THE NEW FOLIUM MAP (INCLUDING THE .cm FILE)
+                self.set_map_location()
+                self.save_map()
 
+                # REOPEN AN OPEN 3D VIEWER ON THE NEW STORE
+                if self.tdv:
+                    self.reload_three_dim()
 
         except IndexError:
             error_message = "ERROR IN LOADING PROCESS - FILE MUST BE ASCII SPACE DELIMITED"
             wx.MessageDialog(self, -1, error_message, "Load Error")
             raise
 
-    def set_map_location(self):
-        map_name = self.folium_map.get_name()
-        r, lt = self.browser.RunScript(str(map_name) + '.getCenter()["lat"]')
-        r, ln = self.browser.RunScript(str(map_name) + '.getCenter()["lng"]')
-        r, zoom = self.browser.RunScript(str(map_name) + '.getZoom()')
-        self.folium_map.options['zoom'] = zoom
-        self.folium_map.location = [lt, ln]
+    def draw_cm_layers(self):
+        """(RE)DRAW THE .cm POINTS ON THE MAP AS BAD, UNCERTAIN AND GOOD CLUSTERS"""
 
+        from folium.plugins import FastMarkerCluster
 
-    def get_centeroid(self, arr):
-        length = arr.shape[0]
-        sum_x = np.sum(arr[:, 0])
-        sum_y = np.sum(arr[:, 1])
-        return sum_x/length, sum_y/length
+        # 1.0 REMOVE ANY EXISTING CLUSTERS
+        for layer in self.map_layers():
+            layer._children.clear()
 
-    def convert_wgs_to_utm_epsg_code(self, lon, lat):
-        utm_band = str((m.floor((lon + 180) / 6) % 60) + 1)
-        if len(utm_band) == 1:
-            utm_band = '0' + utm_band
-        if lat >= 0:
-            epsg_code = '326' + utm_band
+        # 2.0 GENERATE COLORS FOR THE DEPTHS AND SCORES
+        lat = self.store['lat']
+        lon = self.store['lon']
+        score = self.store['score']
+        if 'depth_diff' in self.store:
+            depth_diff = self.store['depth_diff']
         else:
-            epsg_code = '327' + utm_band
-        return epsg_code
+            depth_diff = np.zeros(len(self.store))
+        score_colors = self.color_score(score, self.store.flagged)
+        depth_colors = self.color_depth(self.store['depth'])
 
-    def get_predicted(self, epsg_code):
-        msg = "Please wait while we process your request..."
-        self.busyDlg = wx.BusyInfo(msg)
+        # 3.0 DIVIDE RECORDS INTO BAD, UNCERTAIN, GOOD (BASED ON ML SCORE)
+        scored_bad, scored_uncertain, scored_good = score_classes(score, self.bad_th, self.uncertain_th)
+
+        # 4.0 LOAD CM DATA INTO THE HTML WINDOW
+
+        # 4.1 CUSTOM JAVA SCRIPT FOR CREATING CIRCLE MARKERS & COLORING WITH SCORE VALUE. THE SCORE MARKERS ARE KEPT
+        # BY ROW NUMBER (input[4]) IN cmMarkers SO A FLAG EDIT CAN RECOLOUR JUST THEM (update_flag_markers)
+        callback = ('function (input) {'
+                    'var circle = L.circle(new L.LatLng(input[0], input[1]), '
+                    '{color: input[2],  radius: 10,  opacity: 0.5});'
+                    "var popup = L.popup({maxWidth: '300'});"
+                    "const display_text = {text: input[3]};"
+                    "var mytext = $(`<div id='mytext' class='display_text' style='width: 100.0%; "
+                    "height: 100.0%;'> ${display_text.text}</div>`)[0];"
+                    "popup.setContent(mytext);"
+                    "circle.bindPopup(popup);"
+                    'if (input[4] !== null) {window.cmMarkers = window.cmMarkers || {}; cmMarkers[input[4]] = circle;}'
+                    'return circle};')
+
+        def records(mask, colors, values, numbered=False):
+            rows = np.flatnonzero(mask).tolist() if numbered else [None] * int(mask.sum())
+            return list(zip(lat[mask].tolist(), lon[mask].tolist(), colors[mask].tolist(), values[mask].tolist(),
+                            rows))
+
+        with span('cluster_build'):
+            # CREATE CLUSTER OBJECTS
+            for layer, mask in ((self.bad_fg, scored_bad), (self.uncertain_fg, scored_uncertain),
+                                (self.good_fg, scored_good)):
+                layer.add_child(FastMarkerCluster(records(mask, score_colors, score, numbered=True),
+                                                  callback=callback, disableClusteringAtZoom=self.zoom_level))
 
-        try:
-            #  SAVE CM AS INPUT XYZ FOR BASH SCRIPT'
-            cm_file = self.cm[:, 1:4]
-            np.savetxt('input.xyz', cm_file, delimiter=" ", fmt="%10.6f %10.6f %10.6f")
+            # CREATE DEPTH DIFFERENCE CLUSTER OBJECTS
+            for layer, mask in ((self.bad_fg_depthdiff, scored_bad), (self.uncertain_fg_depthdiff, scored_uncertain),
+                                (self.good_fg_depthdiff, scored_good)):
+                layer.add_child(FastMarkerCluster(records(mask, depth_colors, depth_diff), callback=callback,
+                                                  disableClusteringAtZoom=self.zoom_level))
+        self.layers_stale = False
+
+    def on_store_changed(self, store, change, indices):
+        """REDRAW THE MAP AFTER AN EDIT TO THE SHARED STORE (FROM THE MAP OR THE 3D VIEWER)"""
+        if change == FLAGS_CHANGED and indices is not None:
+            # FLAGS ONLY CHANGE THE COLOUR OF THEIR OWN MARKERS: RECOLOUR THOSE IN THE PAGE, NO REBUILD OR RELOAD
+            self.update_flag_markers(indices)
+            return
+        self.draw_cm_layers()
+        self.set_map_location()
+        self.save_map()
+
+    def update_flag_markers(self, indices):
+        """RECOLOUR THE SCORE MARKERS OF THE ROWS indices IN THE PAGE (FLAGGED MARKERS ARE BLACK)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        colors = self.color_score(self.store['score'][indices], self.store.flagged[indices])
+        markers = json.dumps(list(zip(indices.tolist(), colors.tolist())))
+        with span('map_flag_update'):
+            self.browser.RunScript("%s.forEach(function (m) {var c = window.cmMarkers && cmMarkers[m[0]]; "
+                                   "if (c) {c.setStyle({color: m[1]});}})" % markers)
+        self.layers_stale = True
 
-            # RUN BASH SCRIPT '
-            subprocess.run(["bash", self.cwd + '/' + 'get_predicted.sh', self.cwd + '/' + self.cm_filename, epsg_code])
+    def set_map_location(self):
+        self.map_layers()
+        r, lt = self.browser.RunScript(MAP_NAME + '.getCenter()["lat"]')
+        r, ln = self.browser.RunScript(MAP_NAME + '.getCenter()["lng"]')
+        r, zoom = self.browser.RunScript(MAP_NAME + '.getZoom()')
+        self.folium_map.options['zoom'] = zoom
+        self.folium_map.location = [lt, ln]
 
-            # LOAD CURRENT GRID XYZ POINTS
-            self.predicted_xyz = np.genfromtxt('predicted.xyz', delimiter=' ', dtype=float, filling_values=-9999)
 
-            # LOAD DIFFERENCE CM
-            self.difference_xyz = np.genfromtxt('difference.xyz', delimiter=' ', dtype=float, filling_values=-9999)
+    def get_predicted(self):
+        """
+        SAMPLE THE PREDICTED BATHYMETRY AROUND THE CURRENT .cm FILE (get_predicted.sh). THE GRID NODES AND THE
+        PREDICTED-OBSERVED DIFFERENCES ARE KEPT IN LON/LAT; THE 3D VIEWER PROJECTS THEM WITH THE SHARED
+        PROJECTIONS CACHE.
+        """
+        msg = "Please wait while we process your request..."
+        self.busyDlg = wx.BusyInfo(msg)
+
+        error_message = None
+        try:
+            # A SESSION HAS NO SINGLE .cm FILE, SO THE ENGINE WRITES THE MERGED CRUISES OUT FOR THE SCRIPT
+            cm_path = None if self.session is not None else self.cm_file
+            if shutil.which('gmt') is None and os.path.isfile(PREDICTED_IMG):
+                # NO gmt FOR get_predicted.sh: READ THE SANDWELL .img DIRECTLY
+                sample_predicted(self.store, grid=PREDICTED_IMG)
+            else:
+                sample_predicted(self.store, cm_path, workdir=self.cwd)
 
         except AttributeError:
-            print("ERROR: no .cm file loaded")
+            error_message = "no .cm file loaded"
+        except subprocess.CalledProcessError as error:
+            error_message = "get_predicted.sh failed (%s)" % error
+        except ValueError as error:
+            error_message = str(error)
         self.busyDlg = None
+        if error_message is not None:
+            self.show_error(error_message)
 
     def delete_cm_file(self):
         """
@@ -628,20 +798,12 @@ class PyCMeditor(wx.Frame):
 
         #  REMOVE .cm DATA from MAP FRAME
         del self.cm_file
-        del self.cm
-        self.cm_plot.set_visible(False)
-        self.cm_plot.remove()
-        del self.cm_plot
-
-        #  REMOVE .cm DATA from MAP FRAME
-        del self.xyz
-        del self.xyz_cm_id
-        del self.xyz_width
-        del self.xyz_meta_data
-        del self.xyz_point_flags
-        del self.xyz_cm_line_number
-
-        self.draw()
+        self.store.unsubscribe(self.on_store_changed)
+        PROJECTIONS.forget(self.store)
+        self.store = None
+        self.session = None
+        for layer in self.map_layers():
+            layer._children.clear()
 
     def open_cm_directory(self, event):
         """
@@ -659,6 +821,12 @@ class PyCMeditor(wx.Frame):
     def save_cm_file(self, event):
         """SAVE THE CURRENTLY OPEN .cm FILE TO DISC (INCLUDING EDITS)"""
 
+        # IN A SESSION EACH EDITED CRUISE IS WRITTEN BACK TO ITS OWN FILE
+        if self.session is not None:
+            saved = self.session.save()
+            self.show_status("SAVED %s" % ', '.join(saved) if saved else "NO CHANGES TO SAVE")
+            return
+
         # 1.0 OPEN A FILE NAV WINDOW AND SELECT THE OUTPUT FILE
         save_file_dialog = wx.FileDialog(self, "Save model file", "", "", "Model files (*.cm)|*.cm", wx.FD_SAVE
                                          | wx.FD_OVERWRITE_PROMPT)
@@ -668,23 +836,18 @@ class PyCMeditor(wx.Frame):
         # 2.0 GET FILE NAME
         output_filename = save_file_dialog.GetPath()
 
-        # 3.0 SAVE .cm TO DISC
-        print(self.cm[1, :])
-        np.savetxt(output_filename, self.cm[:, 0:9], fmt="%1d %4.6f %4.6f %4.16f %1d %1d %1d %1.1f %1.1f")
+        # 3.0 SAVE .cm TO DISC (ATOMICALLY, WITH A BINARY SIDECAR FOR FAST RELOADING)
+        save_cruise(self.store, output_filename, binary=True)
+        self.show_status("SAVED %s" % output_filename)
 
     def list_item_selected(self, event):
         """ACTIVATED WHEN A FILE FROM THE LIST CONTROL IS SELECTED"""
 
         file = event.GetText()
         self.selected_file = str(self.active_dir) + "/" + str(file)
-        print(self.selected_file)
 
         #  IF A .cm FILE IS ALREADY LOADED THEN REMOVE IT BEFORE LOADING THE CURRENT FILE'
-        try:
-            self.cm_plot
-        except AttributeError:
-            pass
-        else:
+        if self.store is not None:
             self.delete_cm_file()
 
         # LOAD NEW .cm FILE DATA INTO VIEWERS'
@@ -695,21 +858,16 @@ class PyCMeditor(wx.Frame):
         pass
 
     def regrid(self, event):
-        # STEP 1: WRITE OUT TMP CM FILE
-        self.cm_out= np.copy(self.cm)
-        self.cm_out
-        np.savetxt('current_cm.tmp', self.cm_out[:, 0:8], fmt="%1d %4.6f %4.6f %4.16f %1d %1d %1d %1.1f")
-
-        # RUN BASH SCRIPT FOR REGRIDDING
-        subprocess.run(["bash", self.cwd + '/' + 'regrid.sh', self.cwd + '/' + 'current_cm.tmp'])
+        # STEP 1: REGRID WITH THE EDITED .cm FILE PASTED IN (regrid.sh)
+        tiles_dir = regrid_cruise(self.store, workdir=self.cwd)
 
         # LOAD NEW GRID
-        self.regridded.tiles = '/Users/brook/PROJECTS/ML/Bathymetry/human_editing/GUI/TMP_RESTORED/{z}/{x}/{y}.png'
+        self.map_layers()
+        self.regridded.tiles = tiles_dir + '/{z}/{x}/{y}.png'
         self.regridded.overlay = True
         self.regridded.control = True
         # SAVE AND DISPLAY THE NEW FOLIUM MAP (INCLUDING THE .cm FILE)
-        self.folium_map.save("Py-CMeditor.html")
-        self.browser.Reload()
+        self.save_map()
 
     def on_wx_import_button(self, event):
         """
@@ -717,43 +875,31 @@ class PyCMeditor(wx.Frame):
         """
 
         # 1.0 OPEN A FILE NAV WINDOW AND SELECT THE FILE TO OPEN
-        open_file_dialog = wx.FileDialog(self, "Open model file", "", "", "Model files (*.geojson)|*.geojson",
+        open_file_dialog = wx.FileDialog(self, "Open polygon file", "", "",
+                                         "Polygon files (*.geojson;*.txt)|*.geojson;*.txt|All files (*.*)|*.*",
                                          wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
         if open_file_dialog.ShowModal() == wx.ID_CANCEL:
             return  # USER CHANGED THEIR MIND
 
-        with open(open_file_dialog.GetPath(), 'rb') as input_file:
-            self.imported_data = json.load(input_file)
-
-        # 2.0 CONVERT STR TO GEOJSON
-        self.fc = geojson.FeatureCollection(eval(str(self.imported_data)))
-
-        # 3.0 GET NUMBER OF LAYERS
-        number_of_layers = len(self.fc['features']['id']['features'])
-        print(number_of_layers)
-
-        # 4.0 LOOP THROUGH LAYERS AND EXTRACT THE COORDINATES
-        for i in range(number_of_layers):
-            # 4.1 GET COORDINATES
-            layer_coords = self.fc['features']['id']['features'][i]['geometry']['coordinates'][0]
-            # 4.2 CHECK FOR LONGS > 180 AND REFORMAT TO -180<->180
-            # for c in range(len(layer_coords)):
-            #     if layer_coords[0, c] > 180.:
-            #         layer_coords[0, c] -= 360.
-            # 4.3 REVERSE ORDER OF COORDINATES AS REQUIRED FOR INPUT
-            layer_coords = [elem[::-1] for elem in layer_coords]
-            # 4.4 ADD LAYER TO CURRENT MAP
-            self.browser.RunScript("L.polygon(%s).addTo(drawnItems)" % layer_coords)
+        # 2.0 READ THE POLYGONS (GEOJSON OR GMT MULTI-SEGMENT TEXT)
+        polygons = read_polygons(open_file_dialog.GetPath())
+
+        # 3.0 ADD ALL THE POLYGONS TO THE CURRENT MAP IN ONE CALL (LEAFLET TAKES LAT/LON, SO SWAP THE COLUMNS)
+        layers = json.dumps([polygon[:, ::-1].tolist() for polygon in polygons])
+        self.browser.RunScript("%s.forEach(function (c) {L.polygon(c).addTo(drawnItems);})" % layers)
+
+    def drawn_polygons(self):
+        """RETURN THE POLYGONS DRAWN ON THE MAP AS A PolygonSet"""
+        success, text = self.browser.RunScript("JSON.stringify(drawnItems.toGeoJSON())")
+        return parse_geojson(text)
 
     def on_wx_export_button(self, event):
         """
         FIRERS WHEN EXPORT BUTTON IS PRESSED
         """
-        print("EXPORT BUTTON PRESSED")
 
         # 1.0 GET THE POLYGON DATA FRM THE FOLIUM JAVASCRIPT
-        success, text = self.browser.RunScript("drawnItems.toGeoJSON()")
-        self.fc = geojson.FeatureCollection(eval(text))
+        polygons = self.drawn_polygons()
 
         # 2.0 OPEN A FILE NAV WINDOW AND SELECT THE OUTPUT FILE
         save_file_dialog = wx.FileDialog(self, "Save model file", "", "", "Model files (*.txt)|*.txt", wx.FD_SAVE
@@ -765,19 +911,11 @@ class PyCMeditor(wx.Frame):
         output_filename = save_file_dialog.GetPath()
         output_prefix = output_filename.split('.')[0]
 
-        # 4.0 WRITE DATA TO ASCII TEXT FILE
-        with open(output_filename, 'wb') as output_f:
-            for i in range(len(self.fc.features)):
-                spacer = np.array([['>>', 'Polygon ' + str(i)]]).astype(str)
-                np.savetxt(output_f, spacer, fmt='%2s')
-                coords = list(geojson.utils.coords(self.fc.features[i]))
-                output_coords = np.array(coords).astype(str)
-                np.savetxt(output_f, output_coords, fmt='%10s')
+        # 4.0 WRITE DATA TO GMT MULTI-SEGMENT ASCII TEXT FILE
+        write_gmt(output_filename, polygons)
 
         # 5.0 WRITE OUT THE POLYGONS AS A GEOJSON FORMATTED FILE (WHICH CAN BE LOADED BACK LATER)
-        output_geojson_file = geojson.Feature(eval(text))
-        with open(output_prefix+'.geojson', 'w') as f:
-            geojson.dump(output_geojson_file, f)
+        write_geojson(output_prefix + '.geojson', polygons)
 
     def plot_three_dim(self, event):
         """
@@ -785,27 +923,20 @@ class PyCMeditor(wx.Frame):
 
         inputs::
 
-        self.cm =
-        self.xyz =
-        self.xyz_cm_id =
-        self.xyz_meta_data =
-        self.xyz_cm_line_number =
-        self.predicted_xyz =
-        self.difference_xyz =
-        self.score_xyz =
+        self.store = CruiseStore HOLDING THE .cm COLUMNS, PREDICTED GRID AND PREDICTED-OBSERVED DIFFERENCES.
+                     THE 3D VIEWER EDITS THE SAME STORE SO BOTH VIEWS STAY IN SYNC.
         """
 
-        # OPEN A vtk 3D VIEWER WINDOW AND CREATE A RENDER'
-        self.tdv = ThreeDimViewer(self, -1, 'Modify Current Model', self.cm, self.xyz, self.xyz_cm_id,
-                                  self.xyz_meta_data, self.xyz_cm_line_number, self.predicted_xyz,
-                                  self.difference_xyz, self.score_xyz)
+        # OPEN A vtk 3D VIEWER WINDOW AND CREATE A RENDER' (vtk IS LOADED THE FIRST TIME THE VIEWER IS OPENED)
+        from three_dim_viewer import ThreeDimViewer
+        self.tdv = ThreeDimViewer(self, -1, 'Modify Current Model', self.store)
         self.tdv.Show(True)
 
     def reload_three_dim(self):
         """REMOVE 3D VIEWER AND REPLACE WITH NEWLY LOADED DATA"""
-        self.tdv.Show(False)
-        del self.tdv
-        self.plot_three_dim(self)
+        self.tdv.Close()  # UNSUBSCRIBES IT FROM THE OLD STORE AND DESTROYS IT
+        self.tdv = None
+        self.plot_three_dim(None)
 
     def show_controls(self, event):
         pass
@@ -820,29 +951,11 @@ class PyCMeditor(wx.Frame):
     def flag_points_using_polygons(self, event):
         """Flag all points that fall within the user defined polygons"""
 
-        # 1.0 STEP UP INPUT POINTS
-        self.input_points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(self.cm[:, 1], self.cm[:, 2]))
-
-        # 2.0 GET POLYGONS
-        success, self.text = self.browser.RunScript("drawnItems.toGeoJSON()")
-        self.fc = geojson.FeatureCollection(eval(self.text))
-
-        # 3.0 CREATE OUTPUT ARRAY
-        self.output_result = np.zeros(shape=(len(self.input_points), len(self.fc.features))).astype(str)
-
-        # 4.0 LOOP THROUGH POLYGONS
-        for i in range(len(self.fc.features)):
-            # 3.1 GET POLYGON COORDINATES
-            self.polygon = Polygon(self.fc.features[i]['geometry']['coordinates'][0])
-            # 3.2 LOOP OVER EACH INPUT POINT
-            self.output_result[:, i] = self.input_points.within(self.polygon)
-
-        # 5.0 CHECK IF A POINT IS IN ANY OF THE POLYGONS. IF TRUE THEN SET THE POINT FLAG AS A 1
-        for i in range(len(self.output_result)):
-            for p in range(np.shape(self.output_result)[1]):
-                if self.output_result[i, p] == 'True':
-                    self.cm[i, 5] = -9999
+        # 1.0 GET POLYGONS
+        polygons = self.drawn_polygons()
 
+        # 2.0 FLAG THE POINTS INSIDE THE POLYGONS (THE STORE NOTIFIES THE MAP AND THE 3D VIEWER)
+        flag_polygons(self.store, polygons)
 
     # DOCUMENTATION~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -884,6 +997,21 @@ class PyCMeditor(wx.Frame):
 
     # EXIT FUNCTIONS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+    def timings_report(self, event):
+        """PRINT THE TIMING SPANS AND COUNTERS OF THIS SESSION IN THE CONSOLE"""
+        self.mgr.GetPaneByName('console').Show()
+        self.mgr.Update()
+        self.win.write(INSTRUMENTS.report(show=False) + '\n')
+
+    def export_timings(self, event):
+        """SAVE THE TIMING SPANS AND COUNTERS OF THIS SESSION (.json OR .csv)"""
+        save_file_dialog = wx.FileDialog(self, "Export timings", "", "timings.json",
+                                         "JSON files (*.json)|*.json|CSV files (*.csv)|*.csv",
+                                         wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if save_file_dialog.ShowModal() == wx.ID_CANCEL:
+            return  # USER CHANGED THEIR MIND
+        INSTRUMENTS.export(save_file_dialog.GetPath())
+
     def exit(self, event):
         """# SHUTDOWN APP (FROM FILE MENU)"""
         dlg = wx.MessageDialog(self, "Do you really want to exit", "Confirm Exit", wx.OK | wx.CANCEL | wx.ICON_QUESTION)
@@ -984,38 +1112,6 @@ class OpenCmDialog(wx.Dialog):
         self.regular_load_button = False
         self.EndModal(1)
 
-    def redraw(self):
-        """REDRAW THE CM POINT DATA ON THEE MAP AFTER APPLYING FLAGS TO THE DATA WITHIN USER DERIVED POLYGONS"""
-        # 1.0 GENERATE NEW COLORS FOR THE DEPTHS (FLAGGED= -9999)
-        colors = np.empty(shape=[self.cm.shape[0], 1], dtype=object)
-        for i in range(0, self.cm.shape[0]):
-            colors[i, 1] = self.color_depth(self.cm[i, 3])
-
-        # 1.1 ADD COLORS TO CM ARRAY
-        self.cm[:, 7] = colors
-
-        # 3.0 DIVIDE RECORDS INTO BAD, UNCERTAIN, GOOD (BASED ON ML SCORE)
-        scored_bad = self.cm[self.cm[:, 6] <= self.bad_th]
-        bad_list = scored_bad[:, (2, 1, 9, 6)].tolist()
-
-        scored_uncertain = self.cm[self.cm[:, 6] > self.bad_th]
-        scored_uncertain = scored_uncertain[scored_uncertain[:, 6] <= self.uncertain_th]
-        uncertain_list = scored_uncertain[:, (2, 1, 9, 6)].tolist()
-
-        # 3.3 MAKE NUMPY ARRAY WITH GOOD SCORES
-        scored_good = self.cm[self.cm[:, 6] > self.uncertain_th]
-        scored_good = scored_good[:, (2, 1, 9, 6)].tolist()
-
-        # 4.0 GET THE CURRENT JAVA SCRIPT OBJECTS DATA POINTERS
-        bad_fg_data_java_pointer = self.bad_fg._children[list(self.bad_fg._children.keys())[0]].data
-        uncertain_fg_java_pointer = self.uncertain_fg._children[list(self.uncertain_fg._children.keys())[0]].data
-        good_fg_java_pointer = self.good_fg._children[list(self.good_fg._children.keys())[0]].data
-
-        # CREATE NEW DATA ARRAY
-        new_bad_data = [list(i) for i in zip(g.cm[:, 2], g.cm[:, 3], g.cm[:, 4], g.cm[:, 9])]
-
-        # INSET NEW DATA INTO JAVA OBJECT
-        self.bad_fg._children[list(self.bad_fg._children.keys())[0]].data = new_bad_data
 
 class SavePolygonsDialog(wx.Dialog):
     """
@@ -0,0 +1,153 @@
+"""
+Apply a directory of editing polygons to the whole .cm archive (workflow step 6).
+
+Every polygon drawn in Google Earth (KML/KMZ) or exported from Py-CMeditor (GeoJSON, GMT '>>' text) in the polygon
+directory is read into one PolygonSet. The archive index (ping_archive.ArchiveIndex, refreshed first) finds the .cm
+files near each polygon, and each of those files is read once, flagged (sigma_d = 9999) where its pings fall inside a
+polygon, and rewritten atomically. Only the flag field of the lines whose flag changed is rewritten; every other byte
+of the file is copied through, and no binary sidecar is written into the archive. Files are processed in parallel.
+
+A change report is written as two CSV files: <report>.files.csv (one line per file tested, with the error if it could
+not be read or written) and <report>.pings.csv (one line per ping whose flag changed, with the flag field it had
+before), so a round of edits can be reviewed and undone with --undo <report>.pings.csv, which puts each recorded flag
+field back. Both are written as each file is done, so an interrupted run still records the files it rewrote. Broken
+.cm lines are left alone and do not stop a file being flagged. --unflag clears the flags (sigma_d
+= 0) inside the polygons instead of setting them.
+
+Usage:
+    python apply_polygons.py polygonDir [--index archive_index.json] [--dem-paths demPaths.sh | --archive dir ...]
+                             [--workers N] [--report report] [--unflag] [--dry-run]
+    python apply_polygons.py --undo report.pings.csv
+"""
+import os
+import sys
+import glob
+import argparse
+import time
+from polygon_io import PolygonSet, read_polygons
+from ping_archive import ArchiveIndex, archive_dirs, read_dem_paths, restore_flags
+
+# POLYGON FILE EXTENSIONS READ FROM THE POLYGON DIRECTORY
+POLYGON_EXTENSIONS = ('.kml', '.kmz', '.geojson', '.json', '.txt', '.gmt')
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+
+def read_polygon_dir(directory):
+    """READ EVERY POLYGON FILE IN A DIRECTORY. RETURNS (PolygonSet, FILE NAME OF EACH POLYGON)"""
+    polygons = PolygonSet.from_polygons([])
+    names = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if not path.lower().endswith(POLYGON_EXTENSIONS):
+            continue
+        file_polygons = read_polygons(path)
+        polygons = polygons + file_polygons
+        names += [os.path.basename(path)] * len(file_polygons)
+    return polygons, names
+
+
+class ChangeReport:
+    """
+    THE PER-FILE AND PER-PING CHANGE REPORTS, <prefix>.files.csv AND <prefix>.pings.csv, WRITTEN ONE FILE AT A TIME
+    (CALL IT WITH EACH FileChange) AND FLUSHED AFTER EACH
+    """
+    def __init__(self, prefix, polygon_names):
+        self.polygon_names = polygon_names
+        self.files_csv = open(prefix + '.files.csv', 'w')
+        self.pings_csv = open(prefix + '.pings.csv', 'w')
+        self.files_csv.write('file,pings,inside,changed,polygon_files,error\n')
+        self.pings_csv.write('file,row,cm_id,lon,lat,depth,sigma_d\n')
+
+    def __call__(self, change):
+        for row, cm_id, lon, lat, depth, sigma_d in zip(change.rows.tolist(), change.cm_id.tolist(),
+                                                        change.lon.tolist(), change.lat.tolist(),
+                                                        change.depth.tolist(), change.sigma_d):
+            self.pings_csv.write('%s,%d,%d,%.6f,%.6f,%.4f,%s\n' % (change.path, row, cm_id, lon, lat, depth, sigma_d))
+        self.pings_csv.flush()
+        sources = sorted(set(self.polygon_names[i] for i in change.polygons))
+        self.files_csv.write('%s,%d,%d,%d,%s,%s\n' % (change.path, change.n_rows, change.n_inside, change.n_changed,
+                                                      ';'.join(sources), (change.error or '').replace(',', ';')))
+        self.files_csv.flush()
+
+    def close(self):
+        self.files_csv.close()
+        self.pings_csv.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def undo_report(pings_csv_path):
+    """PUT BACK THE FLAG FIELDS RECORDED IN A <report>.pings.csv. RETURNS {.cm PATH: PINGS RESTORED}"""
+    files = {}
+    with open(pings_csv_path) as pings_csv:
+        if pings_csv.readline().strip().split(',')[-1] != 'sigma_d':
+            raise ValueError("%s does not record the flags before the change" % pings_csv_path)
+        for line in pings_csv:
+            path, row, cm_id, lon, lat, depth, sigma_d = line.rstrip('\n').rsplit(',', 6)
+            rows, cm_ids, flags = files.setdefault(path, ([], [], []))
+            rows.append(int(row))
+            cm_ids.append(int(cm_id))
+            flags.append(sigma_d)
+    for path, (rows, cm_ids, flags) in files.items():
+        restore_flags(path, rows, cm_ids, flags)
+    return dict((path, len(rows)) for path, (rows, cm_ids, flags) in files.items())
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Flag the .cm pings inside a directory of polygons')
+    parser.add_argument('polygon_dir', nargs='?', help='directory of .kml/.kmz/.geojson/GMT polygon files')
+    parser.add_argument('--index', default=os.path.join(HERE, 'archive_index.json'), help='archive index file')
+    parser.add_argument('--dem-paths', default=os.path.join(HERE, '..', '..', 'demPaths.sh'),
+                        help='demPaths.sh giving MOA_public and MOA_private')
+    parser.add_argument('--archive', nargs='*', help='.cm directories to use instead of the demPaths.sh agencies')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    parser.add_argument('--report', default='apply_polygons', help='prefix of the change report files')
+    parser.add_argument('--unflag', action='store_true', help='clear the flags inside the polygons instead')
+    parser.add_argument('--dry-run', action='store_true', help='report the changes without writing any .cm file')
+    parser.add_argument('--undo', metavar='PINGS_CSV', help='put back the flags recorded in a <report>.pings.csv')
+    args = parser.parse_args(argv)
+    if args.undo:
+        restored = undo_report(args.undo)
+        print("restored %d flags in %d files from %s" % (sum(restored.values()), len(restored), args.undo))
+        return 0
+    if args.polygon_dir is None:
+        parser.error('a polygon directory (or --undo) is needed')
+
+    # 1.0 READ THE POLYGONS
+    start = time.time()
+    polygons, polygon_names = read_polygon_dir(args.polygon_dir)
+    print("read %d polygons from %s" % (len(polygons), args.polygon_dir))
+    if len(polygons) == 0:
+        return 1
+
+    # 2.0 BRING THE ARCHIVE INDEX UP TO DATE
+    if args.archive:
+        dirs = args.archive
+    else:
+        dirs = archive_dirs(*read_dem_paths(args.dem_paths))
+    index = ArchiveIndex(args.index)
+    n_read = index.build(dirs)
+    print("indexed %d new or changed files (%d in the archive)" % (n_read, len(index)))
+    for cm_path, error in sorted(index.errors.items()):
+        print("could not index %s: %s" % (cm_path, error))
+
+    # 3.0 FLAG THE PINGS INSIDE THE POLYGONS, REPORTING EACH FILE AS IT IS DONE
+    with ChangeReport(args.report, polygon_names) as report:
+        changes = index.apply_polygons(polygons, flagged=not args.unflag, workers=args.workers,
+                                       dry_run=args.dry_run, report=report)
+    for change in changes:
+        if change.error is not None:
+            print("could not flag %s: %s" % (change.path, change.error))
+    print("%s %d pings in %d of %d files tested (%.1f s); report in %s.files.csv, %s.pings.csv" %
+          ('would change' if args.dry_run else 'changed', sum(change.n_changed for change in changes),
+           sum(1 for change in changes if change.n_changed), len(changes), time.time() - start, args.report,
+           args.report))
+    return 1 if any(change.error is not None for change in changes) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,190 @@
+"""
+Blend the IBCAO arctic grid into the predicted bathymetry, tile by tile, straight from the grids (replaces the
+grd2xyz | blockmedian of 00makeIBCAO_V3.sh and the predicted.xyz, blockmedian and surface_pred_arctic.csh passes of
+02worldMakeAllTiles.sh).
+
+Each output tile (gridline nodes, named as world_tiles.py names them) is made on a pool of processes:
+
+    predicted   THE SANDWELL .img (MEMORY MAPPED) OR A PREDICTED GRID, SAMPLED BILINEARLY AT THE NODES, SOUTH OF maxPred
+    arctic      THE WINDOW OF THE IBCAO GRID AROUND THE TILE, NORTH OF minArctic, BLOCK MEDIANED ONTO THE NODES WHEN
+                IT IS FINER THAN THEM (blockmedian -I OF 00makeIBCAO_V3.sh) AND SAMPLED BILINEARLY OTHERWISE
+
+and between minArctic and maxPred (demPaths.sh) the two are blended with a weight rising linearly with latitude from
+0 (all predicted) to 1 (all IBCAO); where only one of them has a value, that value is used. Only the tiles reaching
+north of minArctic read IBCAO at all. No xyz text is written: paste the tiles with world_tiles.py for one grid.
+
+The .img stops at 80.738 S (the centre of its last row; 72.006 S for the 2 minute layout), where surface_pred_arctic.csh
+used to extrapolate down to 90 S. South of the last predicted row each column is filled from its value on that row,
+tapering linearly with latitude to the mean of the whole row at the pole, so the tiles have no hole over Antarctica
+and the fill is the same whichever tile a node is in.
+
+Usage:
+    python arctic_blend.py predicted.img|predicted.grd arctic.grd dstDir [--increment 15c] [--tile-size 15 15]
+                           [--min-arctic 69] [--max-pred 70] [--workers N] [--extension .grd]
+"""
+import os
+import sys
+import argparse
+import time
+import concurrent.futures
+import numpy as np
+from grid_io import GRIDLINE, Grid, block_median, grid_nodes, read_grid, read_nodes, write_grid
+from world_tiles import tile_strips
+
+# LATITUDES (DEG) OF THE BLEND: ALL PREDICTED SOUTH OF MIN_ARCTIC, ALL IBCAO NORTH OF MAX_PRED (demPaths.sh)
+MIN_ARCTIC = 69.
+MAX_PRED = 70.
+
+# A SOURCE THIS MUCH FINER THAN THE NODES IS BLOCK MEDIANED ONTO THEM RATHER THAN SAMPLED
+BLOCK_MEDIAN_RATIO = 1.5
+
+
+class GridSource:
+    """A GRID (OR SANDWELL .img) GIVING VALUES AT THE NODES OF A TILE, READING ONLY THE WINDOW AROUND THE TILE"""
+    def __init__(self, path):
+        self.path = path
+        self.img = None
+        if path.lower().endswith('.img'):
+            from sandwell_img import ImgGrid
+            self.img = ImgGrid(path)
+            self.spacing = self.img.spacing
+            self.south = float(self.img.row_latitudes(self.img.n_rows - 0.5))
+        else:
+            x, y, registration = read_nodes(path)
+            self.spacing = float(x[1] - x[0])
+            self.south = float(y[0])
+        self.pole = None
+
+    def values(self, x, y):
+        """VALUES [len(y), len(x)] AT THE NODES x, y"""
+        lon, lat = np.meshgrid(x, y)
+        if self.img is not None:
+            return self.img.sample(lon, lat).astype(np.float32)
+        spacing = float(x[1] - x[0])
+        halo = max(self.spacing, spacing)
+        window = read_grid(self.path, region=(x[0] - halo, x[-1] + halo, y[0] - halo, y[-1] + halo))
+        if window.z.size == 0:
+            return np.full(lon.shape, np.nan, dtype=np.float32)
+        if self.spacing * BLOCK_MEDIAN_RATIO > spacing:
+            return window.sample(lon, lat).astype(np.float32)
+
+        # BLOCK MEDIAN THE WINDOW NODES (NOT NaN) ONTO THE TILE NODES
+        source_lon, source_lat = np.meshgrid(window.x, window.y)
+        valid = np.isfinite(window.z)
+        values = np.column_stack((source_lon[valid], source_lat[valid], window.z[valid],
+                                  np.zeros(np.count_nonzero(valid))))
+        medians = block_median(values, (x[0], x[-1], y[0], y[-1]), spacing)
+        z = np.full(lon.shape, np.nan, dtype=np.float32)
+        rows = np.rint((medians[:, 1] - y[0]) / spacing).astype(np.int64)
+        cols = np.rint((medians[:, 0] - x[0]) / spacing).astype(np.int64)
+        z[rows, cols] = medians[:, 2]
+        return z
+
+    def edge_values(self, x):
+        """VALUES ALONG THE SOUTHERNMOST ROW OF THE SOURCE (LATITUDE self.south) AT LONGITUDES x"""
+        lat = np.full(len(x), self.south)
+        if self.img is not None:
+            return self.img.sample(x, lat)
+        window = read_grid(self.path, region=(x[0] - self.spacing, x[-1] + self.spacing, self.south,
+                                              self.south + self.spacing))
+        return window.sample(x, lat)
+
+    def fill_south(self, z, x, y):
+        """
+        FILL THE ROWS OF z [len(y), len(x)] SOUTH OF THE SOURCE: EACH COLUMN TAPERS LINEARLY FROM ITS VALUE ON THE
+        SOUTHERNMOST ROW TO THE MEAN OF THAT ROW (ALL AROUND THE WORLD) AT 90 S
+        """
+        rows = np.flatnonzero(np.asarray(y) < self.south)
+        if rows.size == 0:
+            return z
+        if self.pole is None:
+            self.pole = float(np.nanmean(self.edge_values(np.arange(-180., 180., self.spacing))))
+        edge = self.edge_values(x)
+        edge = np.where(np.isfinite(edge), edge, self.pole)
+        weight = ((np.asarray(y)[rows] + 90.) / (self.south + 90.))[:, None]
+        z[rows] = weight * edge[None, :] + (1. - weight) * self.pole
+        return z
+
+
+def arctic_weight(lat, min_arctic=MIN_ARCTIC, max_pred=MAX_PRED):
+    """WEIGHT OF IBCAO AT EACH LATITUDE: 0 SOUTH OF min_arctic, 1 NORTH OF max_pred, LINEAR BETWEEN"""
+    if max_pred <= min_arctic:
+        return (np.asarray(lat, dtype=float) >= max_pred).astype(float)
+    return np.clip((np.asarray(lat, dtype=float) - min_arctic) / (max_pred - min_arctic), 0., 1.)
+
+
+def blend(predicted, arctic, lat, min_arctic=MIN_ARCTIC, max_pred=MAX_PRED):
+    """
+    BLEND predicted AND arctic [len(lat), n] ROW BY ROW: TAPERED WHERE BOTH HAVE VALUES, EITHER ONE WHERE ONLY IT HAS
+    A VALUE, NaN WHERE NEITHER HAS
+    """
+    lat = np.asarray(lat, dtype=float)[:, None]
+    weight = arctic_weight(lat, min_arctic, max_pred)
+    has_predicted = np.isfinite(predicted) & (lat <= max_pred)
+    has_arctic = np.isfinite(arctic) & (lat >= min_arctic)
+    weight = np.where(has_arctic, np.where(has_predicted, weight, 1.), 0.)
+    z = weight * np.where(has_arctic, arctic, 0.) + (1. - weight) * np.where(has_predicted, predicted, 0.)
+    return np.where(has_predicted | has_arctic, z, np.nan).astype(np.float32)
+
+
+def blend_tile(path, region, increment, predicted, arctic, min_arctic=MIN_ARCTIC, max_pred=MAX_PRED):
+    """
+    WRITE THE BLENDED TILE OF A (west, east, south, north) REGION TO path (predicted AND arctic ARE GridSources).
+    RETURNS THE NUMBER OF NODES WITH A VALUE
+    """
+    x, y = grid_nodes(region, increment, GRIDLINE)
+    south, north = region[2], region[3]
+    nan = np.full((len(y), len(x)), np.nan, dtype=np.float32)
+    predicted_z = predicted.fill_south(predicted.values(x, y), x, y) if south <= max_pred else nan
+    arctic_z = arctic.values(x, y) if north >= min_arctic else nan
+    z = blend(predicted_z, arctic_z, y, min_arctic, max_pred)
+    write_grid(path, Grid(x, y, z, GRIDLINE))
+    return int(np.count_nonzero(np.isfinite(z)))
+
+
+def blend_tile_job(job):
+    path, region, increment, predicted_path, arctic_path, min_arctic, max_pred = job
+    return blend_tile(path, region, increment, GridSource(predicted_path), GridSource(arctic_path), min_arctic,
+                      max_pred)
+
+
+def blend_tiles(predicted_path, arctic_path, dst_dir, increment='15c', tile_width=15, tile_height=15,
+                min_arctic=MIN_ARCTIC, max_pred=MAX_PRED, workers=1, extension='.grd'):
+    """WRITE THE BLENDED TILES OF THE WORLD IN dst_dir. RETURNS [(path, NODES WITH A VALUE)]"""
+    os.makedirs(dst_dir, exist_ok=True)
+    jobs = [(os.path.join(dst_dir, name + extension), region, increment, predicted_path, arctic_path, min_arctic,
+             max_pred) for strip in tile_strips(tile_width, tile_height) for name, region in strip]
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(blend_tile_job, jobs))
+    else:
+        counts = [blend_tile_job(job) for job in jobs]
+    return [(job[0], count) for job, count in zip(jobs, counts)]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Blend the IBCAO arctic grid into the predicted bathymetry tiles')
+    parser.add_argument('predicted', help='Sandwell .img or predicted grid')
+    parser.add_argument('arctic', help='IBCAO grid (geographic)')
+    parser.add_argument('dst_dir')
+    parser.add_argument('--increment', default='15c', help='node spacing of the tiles (GMT -I)')
+    parser.add_argument('--tile-size', type=int, nargs=2, default=(15, 15), metavar=('WIDTH', 'HEIGHT'),
+                        help='degrees')
+    parser.add_argument('--min-arctic', type=float, default=MIN_ARCTIC, help='latitude where IBCAO starts')
+    parser.add_argument('--max-pred', type=float, default=MAX_PRED, help='latitude where predicted ends')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    parser.add_argument('--extension', default='.grd', help='tile file extension (.grd, .nc or .npz)')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    tiles = blend_tiles(args.predicted, args.arctic, args.dst_dir, args.increment, args.tile_size[0],
+                        args.tile_size[1], args.min_arctic, args.max_pred, args.workers, args.extension)
+    for path, count in tiles:
+        if count == 0:
+            print("WARNING: %s has no values" % path)
+    print("blended %d tiles into %s (%.1f s)" % (len(tiles), args.dst_dir, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
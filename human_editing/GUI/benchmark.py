@@ -0,0 +1,459 @@
+"""
+Benchmarks of the editor's data paths on synthetic cruises.
+
+generate writes a synthetic multibeam cruise of any size (10k - 50M pings): a ship track that wanders and turns, a
+swath of beams across it, a smooth seafloor with noise, spikes with low ML scores (some of them already flagged)
+and the predicted depth. run times each stage of the editor headlessly (no wx; VTK renders off screen) on cruises
+of the given sizes, each size in a fresh process:
+
+    load_cm_file_as_cluster   read the .cm text, divide by score, colour the pings, build the map marker records
+    get_predicted             get_predicted.sh if gmt and the grid are available, otherwise only reading its output
+    flag_points_using_polygons
+    project                   lon/lat -> metres for the 3D viewer
+    build_locator             picking index of the 3D viewer
+    do_point_render           VtkPointCloud and the first render (skipped without vtk)
+    re_render                 flag 1% of the pings and rebuild/render the point cloud as re_render does
+    save_cm_file              text and binary sidecar
+    reload_binary             read back through the sidecar
+
+Wall time and the process memory high water mark after each stage are appended to a JSON history, and each run is
+compared with the previous run of the same size. --trace-memory also records the peak memory allocated by each
+stage (tracemalloc, numpy included); tracing slows pure python code many times over, so traced runs are only
+compared with other traced runs.
+
+parse checks the .cm text parser make_huge.py uses (cm_io.parse_cm_text, whole and in chunks) against a line by line
+parse of a synthetic cruise with broken lines put in it: short lines, lines with fields that are not numbers, blank
+lines and lines with a column more or less than the others (kept, their first 8 fields read).
+
+Usage:
+    python benchmark.py generate out.cm --pings 1000000 [--seed 0]
+    python benchmark.py run [--pings 10000 100000 1000000] [--seed 0] [--data-dir dir] [--history file]
+                            [--label text] [--trace-memory]
+    python benchmark.py parse [--pings 20000] [--seed 0]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+from cruise_store import CM_COLUMNS
+from cm_io import (CM_FORMATS, CHUNK_ROWS, MIN_CM_FIELDS, atomic_write, format_chunks, sidecar_path,
+                   parse_cm_text, read_cm_text_chunks)
+from polygon_io import PolygonSet
+import cm_engine
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+# SYNTHETIC MULTIBEAM SURVEY
+BEAMS = 101
+SWATH_WIDTH = 4000.  # m ACROSS TRACK
+LINE_SPACING = 50.  # m ALONG TRACK BETWEEN PING LINES
+MAX_LATITUDE = 70.  # THE TRACK TURNS BACK AT THIS LATITUDE
+OUTLIER_FRACTION = 0.005
+FLAGGED_OUTLIER_FRACTION = 0.4
+METERS_PER_DEGREE = 111195.
+
+# GENERATED PINGS PER CHUNK (BOUNDS THE MEMORY USED TO WRITE LARGE CRUISES)
+GENERATE_CHUNK = 1000000
+
+# LARGEST PREDICTED GRID WRITTEN WHEN get_predicted.sh CANNOT BE RUN (NODES PER SIDE)
+MAX_GRID_NODES = 1000
+
+# A STAGE THIS MUCH SLOWER THAN THE PREVIOUS RUN OF THE SAME SIZE IS REPORTED AS A REGRESSION
+REGRESSION_RATIO = 1.25
+
+# BROKEN LINES PUT IN A SYNTHETIC CRUISE BY THE parse CHECK (EACH A FEW TIMES), AND THE CHUNK SIZES (BYTES) IT READS
+# THE CRUISE IN
+BROKEN_LINES = (b'1 2 3\n', b'1 -45.2 x 4 5 6 7 8 9\n', b'1 2 3 4 5 6 7 8 9.5q\n', b'\n', b'1 2 3 4 5 6 7 8 9 10\n',
+                b'1 2 3 4 5 6 7 8\n', b'1 2 3 4 5 6 7 8 9 10\n1 2 3 4 5 6 7 8\n', b'  \t 1,2 3 4 5 6 7 8 9\r\n')
+PARSE_CHUNK_BYTES = (1 << 10, 1 << 16, 1 << 30)
+
+
+# SYNTHETIC CRUISES ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def seafloor(lon, lat):
+    """SMOOTH SYNTHETIC SEAFLOOR (m, NEGATIVE DOWN): A REGIONAL SWELL WITH ABYSSAL HILLS ON IT"""
+    return (-4000. + 800. * np.sin(np.radians(lon) * 3.) * np.cos(np.radians(lat) * 2.) +
+            150. * np.sin(lon * 40.) * np.cos(lat * 35.))
+
+
+def reflect(values, limit):
+    """FOLD VALUES INTO -limit <-> limit (SO A TRACK PAST THE LIMIT TURNS BACK)"""
+    return limit - np.abs(np.mod(values + limit, 4. * limit) - 2. * limit)
+
+
+def synthetic_chunks(n_pings, seed=0, chunk_pings=GENERATE_CHUNK):
+    """YIELD DICTS OF .cm COLUMNS (CM_COLUMNS) OF A SYNTHETIC CRUISE, chunk_pings PINGS AT A TIME"""
+    rng = np.random.default_rng(seed)
+    lon, lat = rng.uniform(-170., 170.), rng.uniform(-60., 60.)
+    heading = rng.uniform(0., 2. * np.pi)
+    across = np.linspace(-0.5 * SWATH_WIDTH, 0.5 * SWATH_WIDTH, BEAMS)
+    done = 0
+    while done < n_pings:
+        n = min(chunk_pings, n_pings - done)
+        n_lines = -(-n // BEAMS)
+
+        # 1.0 SHIP TRACK: THE HEADING WANDERS, WITH AN OCCASIONAL TURN ONTO A NEW LINE
+        turns = rng.normal(0., 0.005, n_lines)
+        turns[rng.random(n_lines) < 2e-4] += rng.choice((-0.5, 0.5)) * np.pi
+        headings = heading + np.cumsum(turns)
+        track_lat = lat + np.cumsum(LINE_SPACING * np.cos(headings)) / METERS_PER_DEGREE
+        track_lon = lon + np.cumsum(LINE_SPACING * np.sin(headings) /
+                                    (METERS_PER_DEGREE * np.cos(np.radians(reflect(track_lat, MAX_LATITUDE)))))
+        heading, lon, lat = headings[-1], track_lon[-1], track_lat[-1]
+
+        # 2.0 SWATH OF BEAMS ACROSS THE TRACK
+        line_lat = reflect(track_lat, MAX_LATITUDE)
+        ping_lat = (line_lat[:, None] - np.outer(np.sin(headings), across) / METERS_PER_DEGREE).ravel()[:n]
+        ping_lon = (track_lon[:, None] + np.outer(np.cos(headings), across) /
+                    (METERS_PER_DEGREE * np.cos(np.radians(line_lat))[:, None])).ravel()[:n]
+        ping_lon = np.mod(ping_lon + 180., 360.) - 180.
+
+        # 3.0 DEPTHS, SPIKES, SCORES AND FLAGS
+        predicted = seafloor(ping_lon, ping_lat)
+        depth = predicted + rng.normal(0., 0.005, n) * predicted
+        outlier = rng.random(n) < OUTLIER_FRACTION
+        depth[outlier] += rng.choice((-1., 1.), outlier.sum()) * rng.uniform(500., 2000., outlier.sum())
+        score = rng.beta(8., 2., n)
+        score[outlier] = rng.beta(1., 8., outlier.sum())
+        sigma_d = np.zeros(n)
+        sigma_d[outlier & (rng.random(n) < FLAGGED_OUTLIER_FRACTION)] = 9999.
+
+        yield {'cm_id': np.arange(done + 1, done + n + 1, dtype=float), 'lon': ping_lon, 'lat': ping_lat,
+               'depth': np.round(depth, 1), 'sigma_h': np.zeros(n), 'sigma_d': sigma_d, 'score': score,
+               'pred_depth': predicted, 'depth_diff': predicted - depth}
+        done += n
+
+
+def write_synthetic_cm(path, n_pings, seed=0, workers=None):
+    """WRITE A SYNTHETIC CRUISE OF n_pings PINGS TO A .cm FILE"""
+    row_format = ' '.join(CM_FORMATS[name] for name in CM_COLUMNS) + '\n'
+    with atomic_write(path, 'w') as handle:
+        for chunk in synthetic_chunks(n_pings, seed):
+            columns = [chunk[name] for name in CM_COLUMNS]
+            for text in format_chunks(row_format, columns, len(columns[0]), CHUNK_ROWS, workers):
+                handle.write(text)
+
+
+def synthetic_polygons(store, n_polygons=50, half_size=0.01, seed=0):
+    """SMALL SQUARE POLYGONS CENTRED ON RANDOM PINGS OF A CRUISE"""
+    rng = np.random.default_rng(seed)
+    centres = rng.integers(0, len(store), n_polygons)
+    square = np.array([[-1., -1.], [1., -1.], [1., 1.], [-1., 1.]]) * half_size
+    return PolygonSet.from_polygons([square + (store['lon'][i], store['lat'][i]) for i in centres])
+
+
+def write_predicted_output(store, workdir):
+    """WRITE predicted.xyz AND difference.xyz AS get_predicted.sh WOULD (FOR MACHINES WITHOUT gmt OR THE GRID)"""
+    west, east = store['lon'].min(), store['lon'].max()
+    south, north = store['lat'].min(), store['lat'].max()
+    spacing = max(15. / 3600., (east - west) / MAX_GRID_NODES, (north - south) / MAX_GRID_NODES)
+    lon, lat = np.meshgrid(np.arange(west, east + spacing, spacing), np.arange(north, south - spacing, -spacing))
+    np.savetxt(os.path.join(workdir, 'predicted.xyz'),
+               np.column_stack((lon.ravel(), lat.ravel(), seafloor(lon, lat).ravel())), fmt='%.6f %.6f %.1f')
+    np.savetxt(os.path.join(workdir, 'difference.xyz'),
+               np.column_stack((store['lon'], store['lat'], store['pred_depth'] - store['depth'])),
+               fmt='%.6f %.6f %.1f')
+
+
+# STAGES ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def max_rss_mb():
+    """HIGH WATER MARK OF THE PROCESS MEMORY (MB)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024. ** 2 if sys.platform == 'darwin' else rss / 1024.
+
+
+class StageTimer:
+    """TIMES NAMED STAGES AND RECORDS THEIR WALL TIME AND MEMORY"""
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, name, function, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = function(*args, **kwargs)
+        result = {'wall_s': time.perf_counter() - start}
+        if self.trace_memory:
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        result['max_rss_mb'] = max_rss_mb()
+        self.results[name] = result
+        return value
+
+    def skip(self, name, reason):
+        self.results[name] = {'skipped': reason}
+
+
+def load_as_cluster(cm_path, bad_th=cm_engine.DEFAULT_BAD_TH, uncertain_th=cm_engine.DEFAULT_UNCERTAIN_TH):
+    """WHAT load_cm_file_as_cluster DOES BEFORE FOLIUM: READ, DIVIDE BY SCORE, COLOUR AND BUILD THE MARKER RECORDS"""
+    store = cm_engine.load_cruise(cm_path)
+    lat, lon, score = store['lat'], store['lon'], store['score']
+    try:
+        colors = cm_engine.map_colors(score, 'RdYlBu', 0.0, 1.0)
+        colors[store.flagged] = '#000000'
+    except ImportError:
+        colors = np.full(len(store), '#000000', dtype=object)
+    records = []
+    for mask in cm_engine.score_classes(score, bad_th, uncertain_th):
+        records.append(list(zip(lat[mask].tolist(), lon[mask].tolist(), colors[mask].tolist(),
+                                score[mask].tolist())))
+    return store
+
+
+def render_offscreen(xyz, store, window=None):
+    """BUILD THE VtkPointCloud OF THE PINGS AND RENDER IT IN AN OFF SCREEN WINDOW. RETURNS THE WINDOW"""
+    import vtk
+    from point_clouds import VtkPointCloud
+    if window is None:
+        window = vtk.vtkRenderWindow()
+        window.SetOffScreenRendering(1)
+        window.SetSize(1200, 900)
+        window.AddRenderer(vtk.vtkRenderer())
+    renderer = window.GetRenderers().GetFirstRenderer()
+    renderer.RemoveAllViewProps()
+    pointcloud = VtkPointCloud(xyz, store)
+    pointcloud.vtkActor.GetProperty().SetPointSize(4)
+    renderer.AddActor(pointcloud.vtkActor)
+    renderer.ResetCamera()
+    window.Render()
+    window.pointcloud = pointcloud
+    return window
+
+
+def run_stages(cm_path, workdir, trace_memory=False, seed=0):
+    """RUN EVERY STAGE ON ONE CRUISE AND RETURN {stage: result}"""
+    timer = StageTimer(trace_memory)
+
+    # 1.0 LOAD AND PREDICTED GRID
+    if os.path.exists(sidecar_path(cm_path)):
+        os.remove(sidecar_path(cm_path))
+    store = timer.run('load_cm_file_as_cluster', load_as_cluster, cm_path)
+    if shutil.which('gmt') and os.path.isfile(cm_engine.PREDICTED_GRID):
+        timer.run('get_predicted', cm_engine.sample_predicted, store, cm_path, workdir)
+    else:
+        write_predicted_output(store, workdir)
+        timer.run('get_predicted', cm_engine.read_predicted, store, workdir)
+        timer.results['get_predicted']['note'] = 'reading get_predicted.sh output only (no gmt or grid)'
+
+    # 2.0 POLYGON FLAGGING
+    polygons = synthetic_polygons(store, seed=seed)
+    timer.run('flag_points_using_polygons', cm_engine.flag_polygons, store, polygons)
+
+    # 3.0 3D VIEWER
+    try:
+        from projection import PROJECTIONS
+        x, y = timer.run('project', PROJECTIONS.project_store, store)
+        xyz = np.column_stack((x, y, store['depth']))
+    except ImportError as error:
+        xyz = None
+        timer.skip('project', str(error))
+    if xyz is not None:
+        from point_locator import PointLocator
+        timer.run('build_locator', PointLocator, xyz)
+    else:
+        timer.skip('build_locator', 'no projection')
+    try:
+        import vtk
+    except ImportError:
+        vtk = None
+    if vtk is not None and xyz is not None:
+        window = timer.run('do_point_render', render_offscreen, xyz, store)
+        rows = np.random.default_rng(seed).integers(0, len(store), max(1, len(store) // 100))
+
+        def re_render():
+            store.set_flags(rows)
+            return render_offscreen(xyz * (1., 1., 2.), store, window)
+
+        timer.run('re_render', re_render)
+    else:
+        timer.skip('do_point_render', 'vtk is not installed' if vtk is None else 'no projection')
+        timer.skip('re_render', 'vtk is not installed' if vtk is None else 'no projection')
+
+    # 4.0 SAVE AND RELOAD
+    saved_path = os.path.join(workdir, 'saved.cm')
+    timer.run('save_cm_file', cm_engine.save_cruise, store, saved_path)
+    timer.run('reload_binary', cm_engine.load_cruise, saved_path)
+    return timer.results
+
+
+# HISTORY ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# PARSE CHECK ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def parse_lines(text, min_fields):
+    """PARSE .cm TEXT (bytes) ONE LINE AT A TIME: (values, BROKEN LINE NUMBERS) AS parse_cm_text SHOULD GIVE THEM"""
+    rows, broken = [], []
+    lines = text.split(b'\n')
+    if not lines[-1].strip():
+        lines.pop()
+    for line_number, line in enumerate(lines, 1):
+        fields = line.split()
+        try:
+            row = [float(field) for field in fields[:min_fields]] if len(fields) >= min_fields else []
+        except ValueError:
+            row = []
+        if row:
+            rows.append(row)
+        else:
+            broken.append(line_number)
+    return np.array(rows).reshape(-1, min_fields), np.array(broken, dtype=np.int64)
+
+
+def check_parse(n_pings=20000, seed=0):
+    """
+    CHECK parse_cm_text AND read_cm_text_chunks AGAINST parse_lines ON A SYNTHETIC CRUISE WITH BROKEN_LINES PUT IN IT.
+    RETURNS FALSE IF ANY DIFFERS
+    """
+    rng = np.random.default_rng(seed)
+    workdir = tempfile.mkdtemp(prefix='cm_parse_')
+    try:
+        # 1.0 A SYNTHETIC CRUISE WITH EACH KIND OF BROKEN LINE PUT IN AT RANDOM LINES (AND AS THE LAST LINE)
+        cm_path = os.path.join(workdir, 'broken.cm')
+        write_synthetic_cm(cm_path, n_pings, seed, workers=1)
+        with open(cm_path, 'rb') as cm_file:
+            lines = cm_file.read().splitlines(keepends=True)
+        for broken_line in BROKEN_LINES * 3:
+            lines.insert(int(rng.integers(0, len(lines) + 1)), broken_line)
+        text = b''.join(lines) + BROKEN_LINES[1].rstrip()
+        with open(cm_path, 'wb') as cm_file:
+            cm_file.write(text)
+        expected, expected_broken = parse_lines(text, MIN_CM_FIELDS)
+
+        # 2.0 THE WHOLE TEXT, AND THE FILE IN CHUNKS OF EACH SIZE
+        results = [('whole text', parse_cm_text(text))]
+        for chunk_bytes in PARSE_CHUNK_BYTES:
+            chunks = list(read_cm_text_chunks(cm_path, chunk_bytes))
+            results.append(('chunks of %d bytes' % chunk_bytes,
+                            (np.concatenate([values for values, broken in chunks]),
+                             np.concatenate([broken for values, broken in chunks]))))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ok = True
+    for name, (values, broken) in results:
+        same = np.array_equal(values, expected) and np.array_equal(broken, expected_broken)
+        ok = ok and same
+        print("%-26s %8d rows %4d broken lines   %s" % (name, len(values), len(broken), 'ok' if same else 'FAILED'))
+    return ok
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def read_history(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as history_file:
+        return json.load(history_file)
+
+
+def compare(result, history):
+    """PRINT THE STAGES OF A RUN NEXT TO THE PREVIOUS RUN OF THE SAME SIZE, MARKING REGRESSIONS"""
+    previous = [old for old in history if old['pings'] == result['pings'] and
+                old.get('trace_memory') == result['trace_memory']]
+    previous = previous[-1]['stages'] if previous else {}
+    print("%d pings:" % result['pings'])
+    for name, stage in result['stages'].items():
+        if 'skipped' in stage:
+            print("  %-28s skipped (%s)" % (name, stage['skipped']))
+            continue
+        line = "  %-28s %9.3f s %9.1f MB rss" % (name, stage['wall_s'], stage['max_rss_mb'])
+        if 'peak_mb' in stage:
+            line += " %9.1f MB peak" % stage['peak_mb']
+        old = previous.get(name, {})
+        if 'wall_s' in old and old['wall_s'] > 0:
+            ratio = stage['wall_s'] / old['wall_s']
+            line += "   x%.2f of previous%s" % (ratio, '  <-- SLOWER' if ratio > REGRESSION_RATIO else '')
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the editor data paths on synthetic cruises')
+    commands = parser.add_subparsers(dest='command')
+    generate = commands.add_parser('generate', help='write a synthetic .cm file')
+    generate.add_argument('path')
+    generate.add_argument('--pings', type=int, default=100000)
+    generate.add_argument('--seed', type=int, default=0)
+    run = commands.add_parser('run', help='time every stage on synthetic cruises of the given sizes')
+    run.add_argument('--pings', type=int, nargs='+', default=[10000, 100000, 1000000])
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'cm_benchmark'),
+                     help='where the synthetic cruises are kept between runs')
+    run.add_argument('--history', default=os.path.join(HERE, 'benchmark_history.json'), help='JSON history file')
+    run.add_argument('--label', default='', help='note stored with the results')
+    run.add_argument('--trace-memory', action='store_true', help='record the peak allocation of each stage (slow)')
+    parse = commands.add_parser('parse', help='check the .cm text parser on a cruise with broken lines')
+    parse.add_argument('--pings', type=int, default=20000)
+    parse.add_argument('--seed', type=int, default=0)
+    child = commands.add_parser('stages')
+    child.add_argument('cm_path')
+    child.add_argument('--seed', type=int, default=0)
+    child.add_argument('--trace-memory', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        write_synthetic_cm(args.path, args.pings, args.seed)
+        return 0
+
+    if args.command == 'parse':
+        return 0 if check_parse(args.pings, args.seed) else 1
+
+    if args.command == 'stages':
+        # (RUN IN A CHILD PROCESS, SO EACH SIZE STARTS FROM AN EMPTY PROCESS)
+        workdir = tempfile.mkdtemp(prefix='cm_benchmark_')
+        try:
+            print(json.dumps(run_stages(args.cm_path, workdir, args.trace_memory, args.seed)))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return 0
+
+    if args.command != 'run':
+        parser.print_help()
+        return 1
+
+    # 1.0 GENERATE (OR REUSE) THE SYNTHETIC CRUISES
+    os.makedirs(args.data_dir, exist_ok=True)
+    history = read_history(args.history)
+    for n_pings in args.pings:
+        cm_path = os.path.join(args.data_dir, 'synthetic_%d_%d.cm' % (n_pings, args.seed))
+        if not os.path.isfile(cm_path):
+            print("generating %s" % cm_path)
+            write_synthetic_cm(cm_path, n_pings, args.seed)
+
+        # 2.0 TIME THE STAGES IN A FRESH PROCESS
+        command = [sys.executable, os.path.realpath(__file__), 'stages', cm_path, '--seed', str(args.seed)]
+        if args.trace_memory:
+            command.append('--trace-memory')
+        output = subprocess.run(command, cwd=HERE, stdout=subprocess.PIPE, universal_newlines=True,
+                                check=True).stdout
+        result = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+                  'label': args.label, 'pings': n_pings, 'seed': args.seed, 'trace_memory': args.trace_memory,
+                  'python': platform.python_version(), 'numpy': np.__version__,
+                  'stages': json.loads(output.strip().splitlines()[-1])}
+
+        # 3.0 REPORT AND RECORD
+        compare(result, history)
+        history.append(result)
+        with open(args.history, 'w') as history_file:
+            json.dump(history, history_file, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,301 @@
+"""
+Headless .cm editing engine: the Py-CMeditor steps that do not need a display.
+
+Loading, dividing the pings by ML score, colouring them for the map, sampling the predicted bathymetry
+(get_predicted.sh), flagging with polygons, regridding (regrid.sh) and saving all live here and work on a
+CruiseStore. Py-CMeditor calls these functions and only adds the map and the 3D viewer on top. This module imports
+nothing from wx, vtk, folium or geopandas (and matplotlib only when colours are first needed), so batch jobs on a
+compute server start quickly and run the same code as the GUI.
+
+The command line runs the steps over many cruises at once, one cruise per process:
+
+    python cm_engine.py [--polygons file ...] [--unflag] [--predicted] [--grid SRTM15+V2.1-bs.nc] [--regrid]
+                        [--bad 0.1] [--uncertain 0.2] [--output-dir dir] [--workers N] [--summary summary.json]
+                        file.cm ...
+
+--grid may also be a Sandwell .img (e.g. ../../img/topo.img), which is read directly without gmt.
+
+Each cruise is summarized (pings, flagged, bad/uncertain/good counts and, with --predicted, the predicted-observed
+differences) and is saved (in place, or into --output-dir) only if a flag changed.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+import functools
+import concurrent.futures
+import numpy as np
+from cm_io import read_cm, write_cm, wrap_longitude
+from polygon_io import read_polygons
+from instrumentation import timed, count
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+# DEFAULT SCORE THRESHOLDS (THE VALUES OFFERED BY THE OPEN .cm DIALOG)
+DEFAULT_BAD_TH = 0.1
+DEFAULT_UNCERTAIN_TH = 0.2
+
+# GRIDS USED BY get_predicted.sh AND regrid.sh (LOOKED FOR NEXT TO THIS FILE UNLESS GIVEN)
+PREDICTED_GRID = os.path.join(HERE, 'SRTM15+V2.1-bs.nc')
+GRID_DIR = HERE
+
+# SANDWELL PREDICTED BATHYMETRY (AS SET IN demPaths.sh), READ DIRECTLY WHEN A .img IS GIVEN AS THE PREDICTED GRID
+PREDICTED_IMG = os.path.join(HERE, '..', '..', 'img', 'topo.img')
+
+# THE PREDICTED GRID IS CUT AROUND A CRUISE TO WHOLE MULTIPLES OF THIS (DEG), AS get_predicted.sh DOES (gmtinfo -I0.1)
+PREDICTED_ROUNDING = 0.1
+
+# NUMBER OF .cm COLUMNS WRITTEN WHEN A CRUISE IS SAVED
+SAVED_COLUMNS = 9
+
+
+@timed('load')
+def load_cruise(cm_path):
+    """READ A .cm FILE (OR ITS BINARY SIDECAR) INTO A CruiseStore"""
+    store = read_cm(cm_path)
+    count('pings_loaded', len(store))
+    return store
+
+
+@timed('save')
+def save_cruise(store, cm_path, binary=True):
+    """WRITE A CruiseStore TO A .cm FILE (ATOMICALLY, WITH A BINARY SIDECAR FOR FAST RELOADING)"""
+    write_cm(cm_path, store, names=store.column_names[0:SAVED_COLUMNS], binary=binary)
+
+
+def score_classes(score, bad_th=DEFAULT_BAD_TH, uncertain_th=DEFAULT_UNCERTAIN_TH):
+    """DIVIDE THE PINGS BY ML SCORE. RETURNS (bad, uncertain, good) BOOLEAN MASKS"""
+    bad = score <= bad_th
+    uncertain = (score > bad_th) & (score <= uncertain_th)
+    good = score > uncertain_th
+    return bad, uncertain, good
+
+
+@functools.lru_cache(maxsize=None)
+def hex_colormap(name):
+    """RETURN THE COLOURS OF A MATPLOTLIB COLORMAP AS HEX STRINGS (MATPLOTLIB IS ONLY IMPORTED ON FIRST USE)"""
+    import matplotlib
+    from matplotlib import colors
+    cmap = matplotlib.colormaps[name]
+    return np.array([colors.rgb2hex(c) for c in cmap(np.arange(cmap.N))[:, :3]], dtype=object)
+
+
+@timed('colour')
+def map_colors(values, name, vmin, vmax):
+    """HEX COLOUR OF EACH VALUE (SAME BINNING AS MATPLOTLIB, VALUES OUTSIDE vmin-vmax GET THE END COLOURS)"""
+    lut = hex_colormap(name)
+    index = np.nan_to_num((np.asarray(values, dtype=float) - vmin) / (vmax - vmin) * len(lut))
+    return lut[np.clip(index, 0, len(lut) - 1).astype(np.int64)]
+
+
+def summarize(store, bad_th=DEFAULT_BAD_TH, uncertain_th=DEFAULT_UNCERTAIN_TH):
+    """RETURN A DICT OF PING COUNTS (AND PREDICTED-OBSERVED DIFFERENCE STATISTICS IF THEY HAVE BEEN SAMPLED)"""
+    bad, uncertain, good = score_classes(store['score'], bad_th, uncertain_th)
+    summary = {'file': store.filename, 'pings': len(store), 'flagged': int(store.flagged.sum()),
+               'bad': int(bad.sum()), 'uncertain': int(uncertain.sum()), 'good': int(good.sum())}
+    if 'difference' in store:
+        difference = np.abs(store['difference'])
+        difference = difference[np.isfinite(difference)]
+        if difference.size:
+            summary.update(median_abs_difference=float(np.median(difference)),
+                           max_abs_difference=float(difference.max()))
+    return summary
+
+
+@timed('flag_polygons')
+def flag_polygons(store, polygons, flagged=True):
+    """
+    FLAG (OR UNFLAG) THE PINGS INSIDE ANY OF THE POLYGONS (A PolygonSet). THE STORE NOTIFIES ITS LISTENERS (THE MAP
+    AND THE 3D VIEWER IN THE GUI). RETURNS THE NUMBER OF PINGS WHOSE FLAG CHANGED
+
+    PING LONGITUDES ARE WRAPPED TO -180 <-> 180 (THE ARCHIVE HOLDS 0 <-> 360 AS WELL) AND ALSO TESTED A TURN EAST OR
+    WEST WHEN A POLYGON REACHES PAST 180 OR -180 (DRAWN ACROSS THE DATELINE ON THE MAP)
+    """
+    lon, lat = wrap_longitude(store['lon']), store['lat']
+    inside = polygons.contains(lon, lat)
+    if len(polygons):
+        west, east = polygons.bbox[:2]
+        if east > 180.:
+            inside |= polygons.contains(lon + 360., lat)
+        if west < -180.:
+            inside |= polygons.contains(lon - 360., lat)
+    rows = np.flatnonzero(inside & (store.flagged != flagged))
+    store.set_flags(rows, flagged)
+    return len(rows)
+
+
+@timed('predicted_sampling')
+def sample_predicted(store, cm_path=None, workdir=HERE, grid=PREDICTED_GRID):
+    """
+    SAMPLE THE PREDICTED BATHYMETRY AROUND A CRUISE (get_predicted.sh, RUN IN workdir). THE GRID NODES GO TO
+    store.predicted_xyz AND THE PREDICTED-OBSERVED DIFFERENCE OF EACH PING TO THE 'difference' DERIVED COLUMN.
+    A SANDWELL .img GRID IS READ DIRECTLY INSTEAD (sample_predicted_img; NO gmt NEEDED).
+
+    cm_path = THE .cm FILE OF THE STORE; IF None (E.G. A MERGED SESSION) THE STORE IS WRITTEN TO workdir FIRST
+    """
+    if grid.endswith('.img'):
+        return sample_predicted_img(store, grid)
+    if cm_path is None:
+        cm_path = os.path.join(workdir, 'engine_cm.tmp')
+        write_cm(cm_path, store, names=store.column_names[0:SAVED_COLUMNS])
+    subprocess.run(['bash', os.path.join(HERE, 'get_predicted.sh'), os.path.abspath(cm_path), grid], cwd=workdir,
+                   check=True)
+    return read_predicted(store, workdir)
+
+
+def sample_predicted_img(store, img_path=PREDICTED_IMG):
+    """
+    SAMPLE THE PREDICTED BATHYMETRY AROUND A CRUISE FROM A SANDWELL .img GRID (MEMORY MAPPED, ONLY THE CELLS AROUND
+    THE CRUISE ARE READ). FILLS store.predicted_xyz (CELL CENTRES, NORTH TO SOUTH AS grd2xyz WRITES THEM) AND THE
+    'difference' DERIVED COLUMN LIKE read_predicted. RETURNS store.predicted_xyz
+    """
+    from sandwell_img import ImgGrid
+    img = ImgGrid(img_path)
+
+    # 1.0 THE CELLS OF THE CRUISE'S BOUNDING BOX
+    west, east = store['lon'].min(), store['lon'].max()
+    south, north = store['lat'].min(), store['lat'].max()
+    west, south = (np.floor(np.array([west, south]) / PREDICTED_ROUNDING) * PREDICTED_ROUNDING)
+    east, north = (np.ceil(np.array([east, north]) / PREDICTED_ROUNDING) * PREDICTED_ROUNDING)
+    window = img.window(west, max(east, west + img.spacing), south, max(north, south + img.spacing))
+    lon, lat = np.meshgrid(window.x, window.y[::-1])
+    store.predicted_xyz = np.column_stack((lon.ravel(), lat.ravel(), window.z[::-1].ravel()))
+
+    # 2.0 THE PREDICTED DEPTH AT EACH PING
+    store.set_derived('difference', img.sample(store['lon'], store['lat']) - store['depth'])
+    return store.predicted_xyz
+
+
+@timed('predicted_read')
+def read_predicted(store, workdir=HERE):
+    """
+    LOAD THE OUTPUT OF get_predicted.sh IN workdir INTO THE STORE. RETURNS store.predicted_xyz. RAISES ValueError IF
+    difference.xyz DOES NOT HAVE ONE ROW PER PING (grdtrack LEAVES OUT PINGS OFF THE GRID), SO NO DIFFERENCE IS PUT
+    AGAINST THE WRONG PING
+    """
+
+    # LOAD THE GRID NODES (LON LAT Z) AND THE DIFFERENCES (ONE ROW PER PING; ONLY THE DIFFERENCE COLUMN IS KEPT)
+    store.predicted_xyz = np.genfromtxt(os.path.join(workdir, 'predicted.xyz'), delimiter=' ', dtype=float,
+                                        filling_values=-9999)
+    difference_xyz = np.genfromtxt(os.path.join(workdir, 'difference.xyz'), delimiter=' ', dtype=float,
+                                   filling_values=-9999)
+    n_rows = len(difference_xyz) if difference_xyz.ndim == 2 else 0
+    if n_rows != len(store):
+        raise ValueError("difference.xyz has %d rows for %d pings (pings off the predicted grid?)" %
+                         (n_rows, len(store)))
+    store.set_derived('difference', difference_xyz[:, 2])
+    return store.predicted_xyz
+
+
+@timed('regrid')
+def regrid(store, workdir=HERE, grid_dir=GRID_DIR):
+    """
+    REGRID THE PREDICTED BATHYMETRY WITH THE EDITED CRUISE PASTED IN (regrid.sh, RUN IN workdir).
+    RETURNS THE DIRECTORY OF THE {z}/{x}/{y}.png MAP TILES OF THE RESULT
+    """
+    cm_path = os.path.join(workdir, 'current_cm.tmp')
+    write_cm(cm_path, store, names=store.column_names[0:8])
+    subprocess.run(['bash', os.path.join(HERE, 'regrid.sh'), cm_path, os.path.abspath(grid_dir)], cwd=workdir,
+                   check=True)
+    return os.path.join(workdir, 'TMP_RESTORED')
+
+
+# BATCH ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def process_cruise(cm_path, polygons=None, flagged=True, predicted=False, grid=PREDICTED_GRID, regridded=False,
+                   grid_dir=GRID_DIR, output_dir=None, bad_th=DEFAULT_BAD_TH, uncertain_th=DEFAULT_UNCERTAIN_TH,
+                   binary=True):
+    """RUN THE REQUESTED STEPS ON ONE CRUISE AND RETURN ITS SUMMARY (RUNS IN A WORKER PROCESS)"""
+
+    # 1.0 LOAD
+    store = load_cruise(cm_path)
+    n_changed = 0
+    predicted_error = None
+
+    # 2.0 FLAG THE PINGS INSIDE THE POLYGONS
+    if polygons is not None:
+        n_changed = flag_polygons(store, polygons, flagged)
+
+    # 3.0 SCRIPTS WRITE FIXED FILE NAMES, SO EACH CRUISE GETS ITS OWN WORK DIRECTORY
+    if predicted or regridded:
+        workdir = tempfile.mkdtemp(prefix='cm_engine_')
+        try:
+            if predicted:
+                try:
+                    sample_predicted(store, cm_path, workdir, grid)
+                except ValueError as error:
+                    predicted_error = str(error)
+            if regridded:
+                tiles = regrid(store, workdir, grid_dir)
+                tiles_dir = os.path.splitext(os.path.join(output_dir or os.path.dirname(cm_path),
+                                                          os.path.basename(cm_path)))[0] + '_tiles'
+                shutil.rmtree(tiles_dir, ignore_errors=True)
+                shutil.move(tiles, tiles_dir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # 4.0 SAVE IF ANYTHING CHANGED
+    summary = summarize(store, bad_th, uncertain_th)
+    summary['changed'] = n_changed
+    if predicted_error is not None:
+        summary['predicted_error'] = predicted_error
+    if n_changed:
+        output = os.path.join(output_dir, os.path.basename(cm_path)) if output_dir else cm_path
+        save_cruise(store, output, binary=binary)
+        summary['output'] = output
+    return summary
+
+
+def process_cruises(cm_paths, workers=1, **options):
+    """RUN process_cruise ON MANY CRUISES, workers AT A TIME. RETURNS THE SUMMARIES IN THE ORDER OF cm_paths"""
+    if workers > 1 and len(cm_paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_cruise, cm_path, **options) for cm_path in cm_paths]
+            return [future.result() for future in futures]
+    return [process_cruise(cm_path, **options) for cm_path in cm_paths]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Summarize, flag, sample and regrid .cm files without the GUI')
+    parser.add_argument('cm_files', nargs='+', help='.cm files to process')
+    parser.add_argument('--polygons', nargs='*', default=[], help='flag the pings inside these polygon files')
+    parser.add_argument('--unflag', action='store_true', help='clear the flags inside the polygons instead')
+    parser.add_argument('--predicted', action='store_true', help='sample the predicted bathymetry (get_predicted.sh)')
+    parser.add_argument('--grid', default=PREDICTED_GRID, help='predicted bathymetry grid (a .img is read directly)')
+    parser.add_argument('--regrid', action='store_true', help='regrid each cruise (regrid.sh) into <cruise>_tiles')
+    parser.add_argument('--grid-dir', default=GRID_DIR, help='directory of the grids used by regrid.sh')
+    parser.add_argument('--bad', type=float, default=DEFAULT_BAD_TH, help='bad score threshold')
+    parser.add_argument('--uncertain', type=float, default=DEFAULT_UNCERTAIN_TH, help='uncertain score threshold')
+    parser.add_argument('--output-dir', help='write changed cruises here instead of in place')
+    parser.add_argument('--text', action='store_true', help='do not write binary sidecars')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    parser.add_argument('--summary', help='also write the summaries to this JSON file')
+    args = parser.parse_args(argv)
+
+    # 1.0 READ THE POLYGONS ONCE (THEY ARE SENT TO EVERY WORKER)
+    polygons = None
+    for path in args.polygons:
+        polygons = read_polygons(path) if polygons is None else polygons + read_polygons(path)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # 2.0 PROCESS THE CRUISES
+    summaries = process_cruises(args.cm_files, workers=args.workers, polygons=polygons, flagged=not args.unflag,
+                                predicted=args.predicted, grid=args.grid, regridded=args.regrid,
+                                grid_dir=args.grid_dir, output_dir=args.output_dir, bad_th=args.bad,
+                                uncertain_th=args.uncertain, binary=not args.text)
+
+    # 3.0 REPORT
+    for summary in summaries:
+        print(' '.join('%s=%s' % (key, value) for key, value in summary.items()))
+    if args.summary:
+        with open(args.summary, 'w') as summary_file:
+            json.dump(summaries, summary_file, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,254 @@
+"""
+Reading and writing .cm files.
+
+write_cm formats the .cm text layout a chunk of rows at a time (one % operation per chunk instead of one per row as
+np.savetxt does, with chunks of large files formatted on a process pool), writes it to a temporary file in the
+destination directory and renames it over the target, so a crash part way through a save never leaves a truncated
+.cm file behind. It can also write a binary sidecar
+(<name>.cmb, numpy .npy format) that read_cm loads in preference to the text file while it is up to date.
+"""
+import os
+import itertools
+import warnings
+import contextlib
+import tempfile
+import concurrent.futures
+import numpy as np
+from cruise_store import CM_COLUMNS, CruiseStore
+
+# TEXT FORMAT OF EACH .cm COLUMN. cm_id IS AN INTEGER; EVERY OTHER COLUMN (AND ANY EXTRA ONE) IS WRITTEN WITH
+# FLOAT_FORMAT, 17 SIGNIFICANT DIGITS, WHICH READ BACK AS EXACTLY THE float64 WRITTEN, SO THE TEXT AND THE BINARY
+# SIDECAR HOLD THE SAME VALUES (WHOLE NUMBERS STAY WHOLE: 9999 IS WRITTEN 9999)
+FLOAT_FORMAT = '%.17g'
+CM_FORMATS = {'cm_id': '%1d', 'lon': FLOAT_FORMAT, 'lat': FLOAT_FORMAT, 'depth': FLOAT_FORMAT,
+              'sigma_h': FLOAT_FORMAT, 'sigma_d': FLOAT_FORMAT, 'score': FLOAT_FORMAT, 'pred_depth': FLOAT_FORMAT,
+              'depth_diff': FLOAT_FORMAT}
+EXTRA_FORMAT = FLOAT_FORMAT
+
+# BINARY SIDECAR TYPE OF EACH .cm COLUMN (DOUBLE PRECISION, SO THE SIDECAR HOLDS THE VALUES THE TEXT DOES). EXTRA
+# COLUMNS USE EXTRA_DTYPE
+CM_DTYPES = {'cm_id': '<i8', 'lon': '<f8', 'lat': '<f8', 'depth': '<f8', 'sigma_h': '<f8', 'sigma_d': '<f8',
+             'score': '<f8', 'pred_depth': '<f8', 'depth_diff': '<f8'}
+EXTRA_DTYPE = '<f8'
+
+SIDECAR_EXTENSION = '.cmb'
+
+# NUMBER OF ROWS FORMATTED PER WRITE
+CHUNK_ROWS = 100000
+
+# BYTES OF .cm TEXT PARSED AT A TIME BY read_cm_text_chunks
+CHUNK_BYTES = 64 << 20
+
+# FEWEST FIELDS ON A GOOD .cm LINE (THE TEST makeAgencyCm.csh MADE)
+MIN_CM_FIELDS = 8
+
+
+def wrap_longitude(lon):
+    """RETURN LONGITUDES IN -180 <-> 180 (AS makeAgencyCm.csh DOES)"""
+    return np.where(lon > 180., lon - 360., lon)
+
+
+def sidecar_path(path):
+    """RETURN THE BINARY SIDECAR PATH FOR A .cm FILE"""
+    return os.path.splitext(path)[0] + SIDECAR_EXTENSION
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """
+    OPEN A TEMPORARY FILE NEXT TO path FOR WRITING AND RENAME IT OVER path ONLY IF THE WITH BLOCK COMPLETES
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode) as handle:
+            yield handle
+            handle.flush()
+            os.fsync(handle.fileno())
+        # mkstemp CREATES THE FILE AS 0600; GIVE IT THE PERMISSIONS A NORMAL open() WOULD
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def select_columns(store, names=None):
+    """RETURN (names, list of 1D arrays) FOR A CruiseStore OR A DICT OF COLUMNS"""
+    if names is None:
+        if isinstance(store, CruiseStore):
+            names = store.column_names
+        else:
+            names = list(store.keys())
+    return list(names), [np.asarray(store[name]) for name in names]
+
+
+def format_rows(row_format, chunk):
+    """
+    FORMAT A CHUNK OF ROWS (LIST OF 1D COLUMN SLICES) AS .cm TEXT USING ONE % OPERATION.
+    INTEGER COLUMNS ARE CONVERTED ONCE HERE RATHER THAN BY %d FOR EVERY VALUE.
+    """
+    conversions = row_format.split()
+    lists = []
+    for conversion, column in zip(conversions, chunk):
+        if conversion.endswith('d'):
+            lists.append(column.astype(np.int64).tolist())
+        else:
+            lists.append(column.tolist())
+    return (row_format * len(lists[0])) % tuple(itertools.chain.from_iterable(zip(*lists)))
+
+
+def format_chunks(row_format, columns, n_rows, chunk_rows, workers):
+    """YIELD THE FORMATTED TEXT OF EACH CHUNK IN ORDER (FORMATTED IN PARALLEL FOR LARGE FILES)"""
+    chunks = ([column[start:start + chunk_rows] for column in columns] for start in range(0, n_rows, chunk_rows))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or n_rows <= 2 * chunk_rows:
+        for chunk in chunks:
+            yield format_rows(row_format, chunk)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for text in executor.map(format_rows, itertools.repeat(row_format), chunks):
+            yield text
+
+
+def write_cm(path, store, names=None, binary=False, chunk_rows=CHUNK_ROWS, workers=None):
+    """
+    WRITE .cm COLUMNS TO path ATOMICALLY.
+
+    store = CruiseStore (OR DICT OF COLUMNS); names = COLUMNS TO WRITE (DEFAULT ALL, IN STORE ORDER)
+    binary = ALSO WRITE THE .cmb SIDECAR
+    workers = NUMBER OF PROCESSES USED TO FORMAT LARGE FILES (DEFAULT = NUMBER OF CPUS)
+    """
+    names, columns = select_columns(store, names)
+    n_rows = len(columns[0]) if columns else 0
+    row_format = ' '.join(CM_FORMATS.get(name, EXTRA_FORMAT) for name in names) + '\n'
+
+    with atomic_write(path, 'w') as handle:
+        for text in format_chunks(row_format, columns, n_rows, chunk_rows, workers):
+            handle.write(text)
+
+    if binary:
+        write_cm_binary(sidecar_path(path), store, names)
+
+
+def write_cm_binary(path, store, names=None):
+    """WRITE .cm COLUMNS TO A BINARY (.npy STRUCTURED ARRAY) FILE ATOMICALLY"""
+    names, columns = select_columns(store, names)
+    dtype = np.dtype([(name, CM_DTYPES.get(name, EXTRA_DTYPE)) for name in names])
+    records = np.empty(len(columns[0]) if columns else 0, dtype=dtype)
+    for name, column in zip(names, columns):
+        records[name] = column
+
+    with atomic_write(path, 'wb') as handle:
+        np.save(handle, records, allow_pickle=False)
+
+
+def read_cm_binary(path):
+    """READ A BINARY SIDECAR AS A DICT OF float64 COLUMNS"""
+    records = np.load(path, mmap_mode='r', allow_pickle=False)
+    return dict((name, np.asarray(records[name], dtype=float)) for name in records.dtype.names)
+
+
+def parse_numbers(text):
+    """
+    ALL THE NUMBERS OF text (bytes, WHITESPACE SEPARATED) AS float64 BY ONE numpy CALL, OR None IF A FIELD IS NOT A
+    NUMBER (numpy RAISES ON IT, OR WARNS AND STOPS THERE)
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+
+
+def line_fields(text, n_lines):
+    """NUMBER OF WHITESPACE SEPARATED FIELDS ON EACH OF THE n_lines LINES OF text (bytes), WITHOUT SPLITTING IT"""
+    data = np.frombuffer(text, dtype=np.uint8)
+    space = (data <= ord(' ')).view(np.int8)
+    starts = np.flatnonzero(np.diff(space, prepend=np.int8(1)) == -1)
+    before = np.searchsorted(starts, np.flatnonzero(data == ord('\n')))
+    return np.diff(np.r_[0, before, starts.size])[:n_lines]
+
+
+def parse_cm_text(text, min_fields=MIN_CM_FIELDS):
+    """
+    PARSE .cm TEXT (bytes) AS A float64 ARRAY [n_rows, min_fields]: EVERY LINE WITH AT LEAST min_fields FIELDS IS KEPT
+    (AS makeAgencyCm.csh KEPT IT) AND ONLY ITS FIRST min_fields FIELDS ARE READ, SO A LINE WITH A COLUMN MORE OR LESS
+    THAN ITS NEIGHBOURS IS NOT LOST. A LINE IS BROKEN IF IT HAS FEWER FIELDS OR ONE OF THOSE IS NOT A NUMBER. RETURNS
+    (values, LINE NUMBERS (FROM 1) OF THE BROKEN LINES)
+
+    THE FIELDS OF EVERY LINE ARE COUNTED AND THE LINES WITH THE SAME COUNT PARSED BY ONE numpy CALL; LINES ARE ONLY
+    PARSED ONE BY ONE WHEN A FIELD IS NOT A NUMBER
+    """
+    n_lines = text.count(b'\n') + (1 if text[text.rfind(b'\n') + 1:].strip() else 0)
+    fields = line_fields(text, n_lines)
+    good = fields >= min_fields
+    values = np.empty((n_lines, min_fields))
+    lines = None
+    for n_fields in np.unique(fields[good]).tolist():
+        # 1.0 THE LINES WITH n_fields FIELDS, BY ONE numpy CALL
+        same = fields == n_fields
+        if same.all():
+            parsed = parse_numbers(text)
+        else:
+            lines = text.split(b'\n') if lines is None else lines
+            parsed = parse_numbers(b' '.join(itertools.compress(lines, same.tolist())))
+        if parsed is not None and parsed.size == np.count_nonzero(same) * n_fields:
+            values[same] = parsed.reshape(-1, n_fields)[:, :min_fields]
+            continue
+
+        # 2.0 A FIELD THAT IS NOT A NUMBER: PARSE THESE LINES ONE BY ONE AND LEAVE OUT THOSE THAT FAIL
+        lines = text.split(b'\n') if lines is None else lines
+        for line_number in np.flatnonzero(same).tolist():
+            row = parse_numbers(b' '.join(lines[line_number].split()[:min_fields]))
+            if row is not None and row.size == min_fields:
+                values[line_number] = row
+            else:
+                good[line_number] = False
+    return values[good], np.flatnonzero(~good) + 1
+
+
+def read_cm_text(path, min_fields=MIN_CM_FIELDS):
+    """READ A WHOLE .cm TEXT FILE WITH parse_cm_text (NO CruiseStore). RETURNS (values, BROKEN LINE NUMBERS)"""
+    with open(path, 'rb') as cm_file:
+        return parse_cm_text(cm_file.read(), min_fields)
+
+
+def read_cm_text_chunks(path, chunk_bytes=CHUNK_BYTES, min_fields=MIN_CM_FIELDS):
+    """YIELD (values, BROKEN LINE NUMBERS) FOR WHOLE LINES OF A .cm TEXT FILE ABOUT chunk_bytes AT A TIME"""
+    first_line = 1
+    rest = b''
+    with open(path, 'rb') as cm_file:
+        while True:
+            data = cm_file.read(chunk_bytes)
+            text = rest + data
+            end = text.rfind(b'\n') + 1 if data else len(text)
+            text, rest = text[:end], text[end:]
+            if text:
+                values, broken = parse_cm_text(text, min_fields)
+                yield values, broken + first_line - 1
+                first_line += text.count(b'\n')
+            if not data:
+                return
+
+
+def read_cm(path, use_sidecar=True):
+    """
+    READ A .cm FILE INTO A CruiseStore. THE BINARY SIDECAR IS USED WHEN IT IS NEWER THAN THE TEXT FILE.
+    """
+    binary_path = sidecar_path(path)
+    if use_sidecar and os.path.exists(binary_path) and os.path.getmtime(binary_path) >= os.path.getmtime(path):
+        return CruiseStore(read_cm_binary(binary_path), filename=path)
+
+    cm = np.genfromtxt(path, delimiter=' ', filling_values=-9999)
+    if cm.ndim == 1:
+        cm = cm.reshape(1, -1)
+    return CruiseStore.from_array(cm, filename=path)
@@ -0,0 +1,300 @@
+"""
+Quality control of .cm files against the predicted bathymetry (replaces fixNOAA_geodas.sh and its
+histogramCmFile.sh plots).
+
+A .cm file is read once, a chunk of lines at a time (cm_io.read_cm_text_chunks), and the predicted depth is sampled at
+each ping (bilinear, longitudes wrapped to the grid; a Sandwell .img is read directly). For every chunk the residual
+(predicted - observed depth) is computed and added to running statistics kept apart for good and bad (sigma_d = 9999)
+pings: histograms of depth, predicted depth and residual, residual mean / rms and the rate of outliers (|residual|
+over 800 m, the limit 02worldMakeAllTiles.sh uses), and the same per source id (sid, the 7th .cm column). No
+intermediate files are written.
+
+For each file the report is <stem>.qc.json (totals and histograms), <stem>.sid.csv (one line per sid) and
+<stem>.qc.png (good and bad histograms, log10 count, as histogramCmFile.sh drew them). Files are done in parallel.
+
+Usage:
+    python cm_qc.py predictedGrid file.cm [file.cm ...] [--output-dir dir] [--bin-width 250] [--outlier 800]
+                    [--workers N] [--no-plots]
+"""
+import os
+import sys
+import json
+import argparse
+import time
+import collections
+import concurrent.futures
+import numpy as np
+from cm_io import atomic_write, read_cm_text_chunks
+from cruise_store import FLAG_VALUE
+from grid_io import GRIDLINE, PIXEL, Grid, read_grid, read_nodes
+
+# .cm COLUMNS USED
+LON, LAT, DEPTH, FLAG, SID = 1, 2, 3, 5, 6
+
+# HISTOGRAM RANGE AND BIN WIDTH (m) OF histogramCmFile.sh
+HISTOGRAM_LIMITS = (-12000., 12000.)
+BIN_WIDTH = 250.
+
+# |predicted - observed| (m) ABOVE WHICH A PING IS COUNTED AS AN OUTLIER (maxD OF 02worldMakeAllTiles.sh)
+OUTLIER = 800.
+
+# THE PREDICTED GRID IS READ AROUND THE PINGS TO WHOLE MULTIPLES OF THIS (DEG)
+WINDOW_ROUNDING = 1.
+
+# PINGS ARE SAMPLED IN BUCKETS OF BUCKET_SIZE x BUCKET_SIZE DEGREES OF THE GRID, SO NO WINDOW READ IS LARGER THAN A
+# BUCKET (10 DEGREES OF A 15c GRID ARE 23 MB) HOWEVER FAR A CHUNK OF PINGS SPREADS; THE WINDOWS OF THE LAST
+# MAX_WINDOWS BUCKETS USED ARE KEPT
+BUCKET_SIZE = 10.
+MAX_WINDOWS = 4
+
+HISTOGRAM_COLUMNS = ('depth', 'predicted', 'residual')
+KINDS = ('good', 'bad')
+
+# RUNNING SUMS KEPT PER sid
+SID_SUMS = ('pings', 'flagged', 'sampled', 'residual_sum', 'residual_squares', 'outliers')
+
+
+class PredictedSampler:
+    """
+    SAMPLES A PREDICTED DEPTH GRID AT PINGS. A .img IS MEMORY MAPPED; OTHER GRIDS ARE READ ONLY AROUND THE PINGS OF
+    EACH BUCKET (BUCKET_SIZE DEGREES) THEY FALL IN, AND THE WINDOW READ FOR A BUCKET IS KEPT (windows, THE REGION
+    READ AND THE Grid OF THE LAST MAX_WINDOWS BUCKETS) FOR THE NEXT CHUNK OF PINGS IF IT COVERS THEM. THE PINGS
+    BETWEEN THE LAST AND FIRST COLUMNS OF A GLOBAL PIXEL GRID ARE A BUCKET OF THEIR OWN (SEAM)
+    """
+    SEAM = -1
+
+    def __init__(self, path):
+        self.path = path
+        self.img = None
+        self.windows = collections.OrderedDict()
+        if path.lower().endswith('.img'):
+            from sandwell_img import ImgGrid
+            self.img = ImgGrid(path)
+        else:
+            self.x, self.y, registration = read_nodes(path)
+            self.increment = float(self.x[1] - self.x[0])
+            self.periodic = registration == PIXEL and abs(len(self.x) * self.increment - 360.) < 0.5 * self.increment
+
+    def window(self, lon, lat):
+        """THE (west, east, south, north) A NODE PAST THE PINGS (IN THE GRID'S LONGITUDES), ROUNDED OUTWARD"""
+        west = max(np.floor((lon.min() - self.increment) / WINDOW_ROUNDING) * WINDOW_ROUNDING, self.x[0])
+        east = min(np.ceil((lon.max() + self.increment) / WINDOW_ROUNDING) * WINDOW_ROUNDING, self.x[-1])
+        south = max(np.floor((lat.min() - self.increment) / WINDOW_ROUNDING) * WINDOW_ROUNDING, self.y[0])
+        north = min(np.ceil((lat.max() + self.increment) / WINDOW_ROUNDING) * WINDOW_ROUNDING, self.y[-1])
+        return west, east, south, north
+
+    def read_window(self, west, east, south, north):
+        """READ A WINDOW OF THE GRID; ONE EAST OF ITS LAST COLUMN IS THE SEAM: THE LAST COLUMN AND THE FIRST, 360 ON"""
+        if east <= self.x[-1]:
+            return read_grid(self.path, region=(west, east, south, north))
+        last = read_grid(self.path, region=(self.x[-1], self.x[-1], south, north))
+        first = read_grid(self.path, region=(self.x[0], self.x[0], south, north))
+        return Grid(np.array([self.x[-1], self.x[0] + 360.]), last.y, np.hstack((last.z, first.z)), GRIDLINE)
+
+    def sample_bucket(self, bucket, lon, lat):
+        """SAMPLE THE PINGS OF A BUCKET (IN THE GRID'S LONGITUDES) FROM ITS WINDOW, READ IF IT DOES NOT COVER THEM"""
+        west, east, south, north = self.window(lon, lat)
+        if bucket == self.SEAM:
+            west, east = self.x[-1], self.x[0] + 360.
+        region, grid = self.windows.pop(bucket, (None, None))
+        if grid is None or region[0] > west or region[1] < east or region[2] > south or region[3] < north:
+            region, grid = (west, east, south, north), self.read_window(west, east, south, north)
+        self.windows[bucket] = region, grid
+        if len(self.windows) > MAX_WINDOWS:
+            self.windows.popitem(last=False)
+        return grid.sample(lon, lat)
+
+    def __call__(self, lon, lat):
+        if self.img is not None:
+            return self.img.sample(lon, lat)
+        if len(lon) == 0:
+            return np.empty(0)
+
+        # 1.0 THE BUCKET OF EACH PING, IN THE GRID'S LONGITUDES
+        lon = self.x[0] + np.mod(np.asarray(lon, dtype=float) - self.x[0], 360.)
+        lat = np.asarray(lat, dtype=float)
+        row = np.floor((lat - self.y[0]) / BUCKET_SIZE).astype(np.int64)
+        col = np.floor((lon - self.x[0]) / BUCKET_SIZE).astype(np.int64)
+        buckets = np.where(lon > self.x[-1], self.SEAM, row * int(np.ceil(360. / BUCKET_SIZE) + 1) + col)
+
+        # 2.0 SAMPLE THE PINGS OF EACH BUCKET TOGETHER (NaN OFF THE GRID)
+        on_grid = np.flatnonzero((lat >= self.y[0]) & (lat <= self.y[-1]) & ((lon <= self.x[-1]) | self.periodic))
+        order = on_grid[np.argsort(buckets[on_grid], kind='stable')]
+        keys, starts = np.unique(buckets[order], return_index=True)
+        predicted = np.full(len(lon), np.nan)
+        for bucket, pings in zip(keys.tolist(), np.split(order, starts[1:])):
+            predicted[pings] = self.sample_bucket(bucket, lon[pings], lat[pings])
+        return predicted
+
+
+class QcStats:
+    """
+    RUNNING QC STATISTICS OF ONE .cm FILE
+
+    histograms[kind][column] = COUNTS IN THE BINS edges (kind 'good' OR 'bad', column 'depth', 'predicted' OR
+    'residual'); sids, sid_sums [len(sids), len(SID_SUMS)], sid_max = LARGEST |residual| OF EACH sid
+    """
+    def __init__(self, bin_width=BIN_WIDTH, limits=HISTOGRAM_LIMITS, outlier=OUTLIER):
+        self.edges = np.arange(limits[0], limits[1] + 0.5 * bin_width, bin_width)
+        self.outlier = outlier
+        self.histograms = dict((kind, dict((column, np.zeros(len(self.edges) - 1, dtype=np.int64))
+                                           for column in HISTOGRAM_COLUMNS)) for kind in KINDS)
+        self.totals = dict((kind, {'sampled': 0, 'residual_sum': 0., 'residual_squares': 0., 'outliers': 0})
+                           for kind in KINDS)
+        self.n_pings = 0
+        self.n_flagged = 0
+        self.broken = []
+        self.sids = np.empty(0)
+        self.sid_sums = np.zeros((0, len(SID_SUMS)))
+        self.sid_max = np.zeros(0)
+
+    def add(self, depth, predicted, flagged, sid):
+        """ADD A CHUNK OF PINGS"""
+        residual = predicted - depth
+        sampled = np.isfinite(residual)
+        outlier = sampled & (np.abs(np.where(sampled, residual, 0.)) > self.outlier)
+        self.n_pings += len(depth)
+        self.n_flagged += int(np.count_nonzero(flagged))
+
+        # 1.0 GOOD AND BAD HISTOGRAMS AND TOTALS
+        for kind, pings in (('good', ~flagged), ('bad', flagged)):
+            for column, values in zip(HISTOGRAM_COLUMNS, (depth, predicted, residual)):
+                values = values[pings]
+                self.histograms[kind][column] += np.histogram(values[np.isfinite(values)], self.edges)[0]
+            kept = pings & sampled
+            totals = self.totals[kind]
+            totals['sampled'] += int(np.count_nonzero(kept))
+            totals['residual_sum'] += float(residual[kept].sum())
+            totals['residual_squares'] += float(np.square(residual[kept]).sum())
+            totals['outliers'] += int(np.count_nonzero(pings & outlier))
+
+        # 2.0 PER sid SUMS (OF GOOD PINGS), MERGED WITH THOSE OF THE EARLIER CHUNKS
+        sids, inverse = np.unique(sid, return_inverse=True)
+        good = ~flagged & sampled
+        good_residual = np.where(good, residual, 0.)
+        weights = (np.ones(len(sid)), flagged, good, good_residual, np.square(good_residual), ~flagged & outlier)
+        sums = np.column_stack([np.bincount(inverse, weights=np.asarray(weight, dtype=float), minlength=len(sids))
+                                for weight in weights])
+        largest = np.zeros(len(sids))
+        np.maximum.at(largest, inverse, np.abs(good_residual))
+        merged = np.union1d(self.sids, sids)
+        merged_sums = np.zeros((len(merged), len(SID_SUMS)))
+        merged_max = np.zeros(len(merged))
+        for known, known_sums, known_max in ((self.sids, self.sid_sums, self.sid_max), (sids, sums, largest)):
+            rows = np.searchsorted(merged, known)
+            merged_sums[rows] += known_sums
+            merged_max[rows] = np.maximum(merged_max[rows], known_max)
+        self.sids, self.sid_sums, self.sid_max = merged, merged_sums, merged_max
+
+    def summary(self, kind):
+        """RESIDUAL MEAN, STANDARD DEVIATION, RMS AND OUTLIER RATE OF THE GOOD OR BAD PINGS"""
+        totals = self.totals[kind]
+        n = totals['sampled']
+        mean = totals['residual_sum'] / n if n else float('nan')
+        squares = totals['residual_squares'] / n if n else float('nan')
+        return {'sampled': n, 'residual_mean': mean, 'residual_std': float(np.sqrt(max(squares - mean ** 2, 0.))),
+                'residual_rms': float(np.sqrt(squares)), 'outliers': totals['outliers'],
+                'outlier_rate': totals['outliers'] / n if n else float('nan')}
+
+    def report(self):
+        return {'pings': self.n_pings, 'flagged': self.n_flagged, 'broken_lines': self.broken,
+                'outlier_limit': self.outlier, 'good': self.summary('good'), 'bad': self.summary('bad'),
+                'histogram_edges': self.edges.tolist(),
+                'histograms': dict((kind, dict((column, counts.tolist()) for column, counts in columns.items()))
+                                   for kind, columns in self.histograms.items())}
+
+
+def qc_file(cm_path, grid_path, output_dir=None, bin_width=BIN_WIDTH, outlier=OUTLIER, plots=True):
+    """
+    RUN THE QC OF ONE .cm FILE AND WRITE ITS REPORT (AND PLOT) IN output_dir (DEFAULT NEXT TO THE FILE). RETURNS THE
+    REPORT (A DICT, AS WRITTEN TO <stem>.qc.json)
+    """
+    sampler = PredictedSampler(grid_path)
+    stats = QcStats(bin_width, outlier=outlier)
+    for values, broken in read_cm_text_chunks(cm_path):
+        stats.broken.extend(broken.tolist())
+        stats.add(values[:, DEPTH], sampler(values[:, LON], values[:, LAT]), values[:, FLAG] == FLAG_VALUE,
+                  values[:, SID])
+
+    # 1.0 REPORT: TOTALS AND HISTOGRAMS AS JSON, ONE LINE PER sid AS CSV
+    stem = os.path.join(output_dir or os.path.dirname(cm_path), os.path.splitext(os.path.basename(cm_path))[0])
+    report = stats.report()
+    report.update({'file': cm_path, 'predicted': grid_path})
+    with atomic_write(stem + '.qc.json') as report_file:
+        json.dump(report, report_file, indent=1)
+    with atomic_write(stem + '.sid.csv') as csv:
+        csv.write('sid,pings,flagged,sampled,residual_mean,residual_std,residual_max,outliers,outlier_rate\n')
+        for sid, sums, largest in zip(stats.sids.tolist(), stats.sid_sums.tolist(), stats.sid_max.tolist()):
+            pings, flagged, sampled, residual_sum, residual_squares, outliers = sums
+            mean = residual_sum / sampled if sampled else float('nan')
+            std = np.sqrt(max(residual_squares / sampled - mean ** 2, 0.)) if sampled else float('nan')
+            csv.write('%d,%d,%d,%d,%.2f,%.2f,%.2f,%d,%.4f\n' % (sid, pings, flagged, sampled, mean, std, largest,
+                                                              outliers, outliers / sampled if sampled else np.nan))
+    if plots:
+        plot_histograms(stats, stem + '.qc.png', os.path.basename(cm_path))
+    return report
+
+
+def plot_histograms(stats, path, title):
+    """DRAW THE GOOD AND BAD HISTOGRAMS (log10 COUNT) OF DEPTH, PREDICTED DEPTH AND RESIDUAL"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    labels = {'depth': 'Ping (m)', 'predicted': 'Predicted at ping location (m)',
+              'residual': 'Predicted - ping (m)'}
+    figure, axes = plt.subplots(len(HISTOGRAM_COLUMNS), 1, figsize=(6.4, 7.2), sharey=True)
+    for axis, column in zip(axes, HISTOGRAM_COLUMNS):
+        for kind, colour in zip(KINDS, ('gray', 'red')):
+            counts = stats.histograms[kind][column]
+            axis.hist(stats.edges[:-1], bins=stats.edges, weights=np.log10(np.maximum(counts, 1)), color=colour,
+                      histtype='stepfilled' if kind == 'good' else 'step', label='%s (%d)' % (kind, counts.sum()))
+        axis.set_xlabel(labels[column])
+        axis.set_ylabel('Log10 Count')
+        axis.legend(fontsize='small')
+    axes[0].set_title(title)
+    figure.tight_layout()
+    figure.savefig(path, dpi=100)
+    plt.close(figure)
+
+
+def qc_files(cm_paths, grid_path, workers=1, **options):
+    """qc_file EACH .cm FILE ON workers PROCESSES. RETURNS THE REPORTS IN THE ORDER OF cm_paths"""
+    if workers > 1 and len(cm_paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(qc_file, cm_path, grid_path, **options) for cm_path in cm_paths]
+            return [future.result() for future in futures]
+    return [qc_file(cm_path, grid_path, **options) for cm_path in cm_paths]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Compare .cm pings with the predicted bathymetry')
+    parser.add_argument('grid', help='predicted depth grid (.grd/.nc, or a Sandwell .img)')
+    parser.add_argument('cm_files', nargs='+')
+    parser.add_argument('--output-dir', help='directory of the reports (default next to each .cm file)')
+    parser.add_argument('--bin-width', type=float, default=BIN_WIDTH, help='histogram bin width (m)')
+    parser.add_argument('--outlier', type=float, default=OUTLIER, help='|predicted - ping| of an outlier (m)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    parser.add_argument('--no-plots', action='store_true', help='do not draw the histograms')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.output_dir:
+        names = [os.path.basename(cm_path) for cm_path in args.cm_files]
+        repeated = sorted(set(name for name in names if names.count(name) > 1))
+        if repeated:
+            parser.error("%s would overwrite each other's reports in %s" % (', '.join(repeated), args.output_dir))
+        os.makedirs(args.output_dir, exist_ok=True)
+    reports = qc_files(args.cm_files, args.grid, args.workers, output_dir=args.output_dir, bin_width=args.bin_width,
+                       outlier=args.outlier, plots=not args.no_plots)
+    print("%-30s %10s %10s %8s %10s %10s %10s" % ('file', 'pings', 'flagged', 'broken', 'good rms', 'good out',
+                                                  'bad out'))
+    for report in reports:
+        print("%-30s %10d %10d %8d %10.1f %10.4f %10.4f" %
+              (os.path.basename(report['file']), report['pings'], report['flagged'], len(report['broken_lines']),
+               report['good']['residual_rms'], report['good']['outlier_rate'], report['bad']['outlier_rate']))
+    print("checked %d files (%.1f s)" % (len(reports), time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
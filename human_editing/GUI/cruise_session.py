@@ -0,0 +1,202 @@
+"""
+Multi-cruise editing session.
+
+A CruiseSession holds many .cm files for a region. Each file is read lazily (through read_cm, so the binary sidecar
+is used when it is up to date) into its own CruiseStore. The cruises in view are merged into one CruiseStore, tagged
+with a source_id column (index of the file in the session) and a source_row column (row in that file), which the map
+and the 3D viewer edit exactly as they edit a single cruise. Flags and deletions made on the merged store are routed
+back to the store of the file they came from, and save() rewrites only the files that were edited.
+
+Cruises that are not in view are dropped from memory (least recently used first) once the session goes over its
+memory budget. Cruises with unsaved edits are never dropped.
+"""
+import os
+import collections
+import numpy as np
+from cruise_store import CruiseStore, FLAGS_CHANGED, ROWS_CHANGED, FLAG_COLUMN
+from cm_io import read_cm, write_cm
+from projection import PROJECTIONS
+
+SOURCE_COLUMN = 'source_id'
+SOURCE_ROW_COLUMN = 'source_row'
+
+# MEMORY (BYTES) THE LOADED CRUISES MAY USE BEFORE CRUISES OUT OF VIEW ARE DROPPED
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+
+
+def store_nbytes(store):
+    """APPROXIMATE MEMORY USED BY A CruiseStore"""
+    return sum(column.nbytes for column in store.columns.values()) + \
+        sum(np.asarray(column).nbytes for column in store.derived.values())
+
+
+def bbox_overlaps(a, b):
+    """TRUE IF TWO (west, east, south, north) BOXES OVERLAP"""
+    return a[0] <= b[1] and b[0] <= a[1] and a[2] <= b[3] and b[2] <= a[3]
+
+
+class CruiseSession:
+    """
+    A SET OF .cm FILES EDITED TOGETHER
+
+    paths = .cm FILES IN THE SESSION (source_id = POSITION IN THIS LIST)
+    memory_budget = BYTES OF CRUISE DATA KEPT IN MEMORY BEFORE CRUISES OUT OF VIEW ARE DROPPED
+    """
+    def __init__(self, paths, memory_budget=DEFAULT_MEMORY_BUDGET, name='session'):
+        self.paths = list(paths)
+        self.memory_budget = memory_budget
+        self.name = name
+        self.loaded = collections.OrderedDict()  # source_id -> CruiseStore (LEAST RECENTLY USED FIRST)
+        self.extents = {}  # source_id -> (west, east, south, north), KEPT AFTER A CRUISE IS DROPPED
+        self.dirty = set()  # source_ids WITH UNSAVED EDITS
+        self.view = None  # (west, east, south, north) OR None = WHOLE SESSION
+        self.store = None  # MERGED CruiseStore OF THE CRUISES IN VIEW
+        self.merged_ids = []  # source_ids IN THE MERGED STORE
+        self.merged_rows = {}  # source_id -> ROWS OF THAT CRUISE IN THE MERGED STORE (None = ALL ROWS)
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def memory_used(self):
+        return sum(store_nbytes(store) for store in self.loaded.values())
+
+    # LOADING ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def cruise(self, source_id):
+        """RETURN THE CruiseStore OF ONE FILE, READING IT IF IT IS NOT IN MEMORY"""
+        try:
+            self.loaded.move_to_end(source_id)
+            return self.loaded[source_id]
+        except KeyError:
+            pass
+        store = read_cm(self.paths[source_id])
+        self.loaded[source_id] = store
+        self.extents[source_id] = (store['lon'].min(), store['lon'].max(), store['lat'].min(), store['lat'].max())
+        return store
+
+    def in_view(self, source_id):
+        """TRUE IF A CRUISE OVERLAPS THE CURRENT VIEW (CRUISES NOT READ YET ARE ASSUMED TO)"""
+        if self.view is None or source_id not in self.extents:
+            return True
+        return bbox_overlaps(self.extents[source_id], self.view)
+
+    def evict(self, keep=()):
+        """DROP LEAST RECENTLY USED CRUISES (NOT IN keep, WITHOUT UNSAVED EDITS) UNTIL UNDER THE MEMORY BUDGET"""
+        for source_id in list(self.loaded.keys()):
+            if self.memory_used <= self.memory_budget:
+                break
+            if source_id in keep or source_id in self.dirty:
+                continue
+            del self.loaded[source_id]
+
+    def set_view(self, bbox=None):
+        """
+        SET THE REGION BEING EDITED (west, east, south, north), OR None FOR ALL CRUISES, AND RETURN THE MERGED
+        CruiseStore OF THE CRUISES IN IT
+        """
+        self.view = bbox
+        visible = []
+        for source_id in range(len(self.paths)):
+            if self.in_view(source_id):
+                self.cruise(source_id)
+                if self.in_view(source_id):
+                    visible.append(source_id)
+            self.evict(keep=visible)
+        return self.merge(visible)
+
+    # MERGED STORE ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def merge(self, source_ids, rows=None):
+        """
+        BUILD THE MERGED CruiseStore OF THE GIVEN CRUISES (COLUMNS COMMON TO ALL OF THEM, PLUS THE SOURCE TAGS)
+
+        rows = OPTIONAL DICT source_id -> ROW NUMBERS OF THAT CRUISE TO INCLUDE (e.g. THE PINGS INSIDE A REGION);
+               CRUISES NOT IN THE DICT ARE INCLUDED WHOLE
+        """
+        if self.store is not None:
+            self.store.unsubscribe(self.on_store_changed)
+            PROJECTIONS.forget(self.store)
+
+        rows = rows or {}
+        self.merged_ids = list(source_ids)
+        self.merged_rows = dict((source_id, rows.get(source_id)) for source_id in source_ids)
+        stores = [self.cruise(source_id) for source_id in source_ids]
+        selected = [np.arange(len(store)) if self.merged_rows[source_id] is None
+                    else np.asarray(self.merged_rows[source_id], dtype=np.int64)
+                    for source_id, store in zip(source_ids, stores)]
+        names = [name for name in stores[0].column_names if all(name in store.columns for store in stores)] \
+            if stores else []
+        columns = collections.OrderedDict()
+        for name in names:
+            columns[name] = np.concatenate([store[name][index] for store, index in zip(stores, selected)])
+        columns[SOURCE_COLUMN] = np.concatenate([np.full(len(index), source_id, dtype=float)
+                                                 for source_id, index in zip(source_ids, selected)]) \
+            if stores else np.empty(0)
+        columns[SOURCE_ROW_COLUMN] = np.concatenate(selected).astype(float) if stores else np.empty(0)
+
+        self.store = CruiseStore(columns, filename=self.name)
+        if stores and all('difference' in store.derived for store in stores):
+            self.store.derived['difference'] = np.concatenate([store.derived['difference'][index]
+                                                               for store, index in zip(stores, selected)])
+        self.store.subscribe(self.on_store_changed)
+        return self.store
+
+    def on_store_changed(self, store, change, indices):
+        """ROUTE EDITS MADE ON THE MERGED STORE BACK TO THE STORE OF EACH FILE"""
+        if change == FLAGS_CHANGED:
+            self.route_flags(indices)
+        elif change == ROWS_CHANGED:
+            self.route_deletions()
+
+    def route_flags(self, indices):
+        """COPY THE FLAG COLUMN OF THE GIVEN MERGED ROWS TO THE FILES THEY CAME FROM"""
+        if indices is None:
+            indices = np.arange(len(self.store))
+        source_ids = self.store[SOURCE_COLUMN][indices].astype(np.int64)
+        for source_id in np.unique(source_ids):
+            rows = indices[source_ids == source_id]
+            cruise = self.cruise(int(source_id))
+            cruise.columns[FLAG_COLUMN][self.store[SOURCE_ROW_COLUMN][rows].astype(np.int64)] = \
+                self.store[FLAG_COLUMN][rows]
+            cruise.version += 1
+            self.dirty.add(int(source_id))
+
+    def route_deletions(self):
+        """DELETE FROM EACH FILE THE ROWS NO LONGER IN THE MERGED STORE AND RENUMBER source_row"""
+        source_ids = self.store[SOURCE_COLUMN].astype(np.int64)
+        source_rows = self.store.columns[SOURCE_ROW_COLUMN]
+        for source_id in self.merged_ids:
+            cruise = self.cruise(source_id)
+            mask = source_ids == source_id
+            kept = source_rows[mask].astype(np.int64)
+            included = self.merged_rows[source_id]
+            if included is None:
+                included = np.arange(len(cruise))
+            deleted = np.setdiff1d(included, kept)
+            if deleted.size == 0:
+                continue
+            cruise.delete_rows(deleted)
+
+            # ROWS AFTER A DELETED ROW MOVE UP BY THE NUMBER OF ROWS DELETED BEFORE THEM
+            kept = kept - np.searchsorted(deleted, kept)
+            source_rows[mask] = kept
+            self.merged_rows[source_id] = None if self.merged_rows[source_id] is None else kept
+            self.dirty.add(source_id)
+
+    # SAVING ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def save(self, source_ids=None, binary=True):
+        """WRITE THE EDITED CRUISES BACK TO THEIR OWN FILES. RETURNS THE PATHS WRITTEN"""
+        if source_ids is None:
+            source_ids = sorted(self.dirty)
+        written = []
+        for source_id in source_ids:
+            cruise = self.loaded[source_id]
+            write_cm(self.paths[source_id], cruise, names=cruise.column_names[0:9], binary=binary)
+            self.dirty.discard(source_id)
+            written.append(self.paths[source_id])
+        return written
+
+    def source_name(self, source_id):
+        return os.path.basename(self.paths[source_id])
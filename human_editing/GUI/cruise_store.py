@@ -0,0 +1,150 @@
+"""
+Columnar store for the .cm data shared by the map view and the 3D viewer.
+
+Each .cm column is held once as a contiguous numpy array. Both viewers read (and VTK wraps) these arrays
+directly, and every edit goes through the store so that listeners can update only what changed.
+"""
+import itertools
+import numpy as np
+from instrumentation import count
+
+# .cm COLUMN NAMES (IN FILE ORDER). COLUMNS PAST THE END OF THIS LIST ARE NAMED col9, col10, ...
+CM_COLUMNS = ('cm_id', 'lon', 'lat', 'depth', 'sigma_h', 'sigma_d', 'score', 'pred_depth', 'depth_diff')
+
+# BAD PINGS ARE FLAGGED BY SETTING sigma_d = 9999 (THE SAME CONVENTION USED BY THE GRIDDING PIPELINE)
+FLAG_COLUMN = 'sigma_d'
+FLAG_VALUE = 9999.
+
+# CHANGE TYPES SENT TO LISTENERS
+FLAGS_CHANGED = 'flags'
+ROWS_CHANGED = 'rows'
+COLUMN_CHANGED = 'column'
+
+# SOURCE OF CruiseStore.token (NEVER REUSED IN A PROCESS, UNLIKE id() OF A STORE THAT HAS BEEN FREED)
+STORE_TOKENS = itertools.count()
+
+
+class CruiseStore:
+    """
+    Single copy of the .cm columns for one cruise.
+
+    Listeners are called as ``callback(store, change, indices)`` where ``change`` is one of FLAGS_CHANGED,
+    ROWS_CHANGED or COLUMN_CHANGED and ``indices`` holds the affected row numbers (None = all rows).
+    """
+    def __init__(self, columns, filename=None):
+        self.filename = filename
+        self.token = next(STORE_TOKENS)  # IDENTIFIES THIS STORE IN CACHES (projection.py)
+        self.columns = {}
+        for name, values in columns.items():
+            self.columns[name] = np.ascontiguousarray(values, dtype=float)
+        self.n_rows = len(next(iter(self.columns.values()))) if self.columns else 0
+        self.version = 0
+        self.geometry_version = 0  # ONLY CHANGES WHEN ROWS ARE ADDED OR REMOVED (USED TO CACHE PROJECTIONS)
+        self.listeners = []
+
+        # PER-PING DERIVED DATA (E.G. PREDICTED-OBSERVED DIFFERENCE) AND NON PER-PING DATA (PREDICTED GRID)
+        self.derived = {}
+        self.predicted_version = 0  # CHANGES EVERY TIME predicted_xyz IS SET (USED TO CACHE PROJECTIONS)
+        self._predicted_xyz = None
+
+    @property
+    def predicted_xyz(self):
+        """PREDICTED GRID NODES AROUND THE CRUISE AS AN (N, 3) ARRAY OF lon, lat, depth (None IF NOT SAMPLED)"""
+        return self._predicted_xyz
+
+    @predicted_xyz.setter
+    def predicted_xyz(self, xyz):
+        self._predicted_xyz = xyz
+        self.predicted_version += 1
+
+    @classmethod
+    def from_array(cls, cm, filename=None):
+        """CREATE A STORE FROM A 2D .cm ARRAY (ONE COPY OF EACH COLUMN IS MADE)"""
+        columns = {}
+        for i in range(cm.shape[1]):
+            name = CM_COLUMNS[i] if i < len(CM_COLUMNS) else 'col%d' % i
+            columns[name] = cm[:, i]
+        return cls(columns, filename=filename)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, name):
+        """RETURN A COLUMN (NOT A COPY - DO NOT WRITE INTO IT, USE THE STORE METHODS)"""
+        try:
+            return self.columns[name]
+        except KeyError:
+            return self.derived[name]
+
+    def __contains__(self, name):
+        return name in self.columns or name in self.derived
+
+    @property
+    def column_names(self):
+        return list(self.columns.keys())
+
+    @property
+    def line_number(self):
+        """ROW NUMBER OF EACH PING (USED TO MAP VTK/MAP SELECTIONS BACK INTO THE STORE)"""
+        return np.arange(self.n_rows, dtype=float)
+
+    @property
+    def flagged(self):
+        """BOOLEAN MASK OF FLAGGED PINGS"""
+        return self.columns[FLAG_COLUMN] == FLAG_VALUE
+
+    def as_array(self, names=None):
+        """RETURN THE STORE AS A 2D ARRAY IN FILE COLUMN ORDER (THIS IS A COPY)"""
+        if names is None:
+            names = self.column_names
+        return np.column_stack([self[name] for name in names])
+
+    # LISTENERS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def subscribe(self, callback):
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def notify(self, change, indices=None):
+        self.version += 1
+        for callback in list(self.listeners):
+            callback(self, change, indices)
+
+    # EDITS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def set_flags(self, indices, flagged=True):
+        """FLAG (OR UNFLAG) THE PINGS AT THE GIVEN ROW NUMBERS"""
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        if indices.size == 0:
+            return
+        self.columns[FLAG_COLUMN][indices] = FLAG_VALUE if flagged else 0.
+        count('pings_flagged' if flagged else 'pings_unflagged', indices.size)
+        self.notify(FLAGS_CHANGED, indices)
+
+    def set_flags_from_mask(self, mask, flagged=True):
+        """FLAG (OR UNFLAG) ALL PINGS WHERE mask IS TRUE"""
+        self.set_flags(np.flatnonzero(mask), flagged)
+
+    def delete_rows(self, indices):
+        """REMOVE THE PINGS AT THE GIVEN ROW NUMBERS FROM EVERY COLUMN"""
+        keep = np.ones(self.n_rows, dtype=bool)
+        keep[np.asarray(indices, dtype=np.int64)] = False
+        for name in self.columns:
+            self.columns[name] = np.ascontiguousarray(self.columns[name][keep])
+        for name in self.derived:
+            self.derived[name] = self.derived[name][keep]
+        self.n_rows = int(keep.sum())
+        self.geometry_version += 1
+        self.notify(ROWS_CHANGED)
+
+    def set_derived(self, name, values):
+        """ATTACH A PER-PING DERIVED COLUMN (E.G. PREDICTED-OBSERVED DIFFERENCE)"""
+        values = np.asarray(values)
+        if len(values) != self.n_rows:
+            raise ValueError("derived column %s has %d rows, store has %d" % (name, len(values), self.n_rows))
+        self.derived[name] = values
+        self.notify(COLUMN_CHANGED)
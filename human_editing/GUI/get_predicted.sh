@@ -1,36 +1,25 @@
 #!/usr/bin/env bash
 
-## 1. GET INPUT cm FILE
+## 1. GET INPUT cm FILE (AND OPTIONALLY THE PREDICTED GRID)
 cm_file=$1
-utm_epsg_code=$2
+grid=${2:-SRTM15+V2.1-bs.nc}
 
 ## 2. GET REGION LIMITS OF CM FILE + 0.5 arc min
 R=$(gmt gmtinfo -I0.1 -i1,2 -C ${cm_file} |\
     awk '{ print "-R"$1-0"/"$2+0"/"$3-0"/"$4+0}')
 
 ## 3. CUT THE PREDICTED BATHYMETRY FOR THE CM REGION
-gmt grdcut SRTM15+V2.1-bs.nc=bs ${R} -Gpredicted.nc=bs
+gmt grdcut ${grid}=bs ${R} -Gpredicted.nc=bs
 
-## 4. DUMP TO XYZ FOR LOADING INTO PY-CMeditor
-gmt grd2xyz --IO_COL_SEPARATOR=space predicted.nc > predicted.tmp
+## 4. DUMP TO XYZ (LON LAT Z) FOR LOADING INTO PY-CMeditor
+gmt grd2xyz --IO_COL_SEPARATOR=space predicted.nc > predicted.xyz
 
-## 5. GET THE PREDICTED VALUES AT THE CM POINTS
+## 5. GET THE PREDICTED VALUES AT THE CM POINTS (LON LAT PREDICTED-OBSERVED)
 gmt grdtrack -i1,2,3 ${cm_file} -Gpredicted.nc | awk '{
     if ($3 > $4) print $1, $2, $4-$3; else print $1, $2, $4-$3
-        }' > difference.tmp
+        }' > difference.xyz
 
-## 6. CONVERT LAT/LONG TO UTM X/Y
-awk '{ print $2, $1}' predicted.tmp |\
-  cs2cs EPSG:4326 EPSG:${utm_epsg_code} -f "%.2f" |\
-    awk '{ print $1, $2 }' > tmp
-
-awk '{ print $2, $1}' difference.tmp |\
-  cs2cs EPSG:4326 EPSG:${utm_epsg_code} -f "%.2f" |\
-    awk '{ print $1, $2 }' > tmp2
-
-## REPLACE LONG/LAT WITH X/Y
-paste tmp predicted.tmp | awk '{ print $1, $2, $5}' > predicted.xyz
-paste tmp2 difference.tmp | awk '{ print $1, $2, $5}' > difference.xyz
+## N.B. LON/LAT ARE PROJECTED TO METERS INSIDE PY-CMeditor (projection.py)
 
 ## EXIT
 exit 0
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""
+Reading and writing the grids of the tile pipeline.
+
+A Grid is a geographic grid held as numpy arrays: z[row, col] at latitude y[row] (south to north, the order GMT
+writes netCDF grids in) and longitude x[col], gridline or pixel registered. GMT grids (.grd, .nc) are read and written
+with netCDF4, which is imported the first time a netCDF grid is used. .npz files hold the same grid in numpy format
+(used for the golden grids of tile_benchmark.py, and where netCDF4 is not installed). A GridWriter fills a large grid
+file one window at a time.
+
+Increments are given in degrees or as GMT does, e.g. '15c' (arc seconds) or '1m' (arc minutes).
+"""
+import os
+import shutil
+import numpy as np
+
+GRIDLINE = 'gridline'
+PIXEL = 'pixel'
+
+# GMT netCDF node_offset ATTRIBUTE OF EACH REGISTRATION
+NODE_OFFSETS = {GRIDLINE: 0, PIXEL: 1}
+
+NETCDF_EXTENSIONS = ('.grd', '.nc')
+
+
+def parse_increment(increment):
+    """RETURN A GMT INCREMENT ('15c', '1m', '0.25d' OR A NUMBER) IN DEGREES"""
+    if isinstance(increment, (int, float)):
+        return float(increment)
+    units = {'c': 3600., 's': 3600., 'm': 60., 'd': 1.}
+    if increment[-1] in units:
+        return float(increment[:-1]) / units[increment[-1]]
+    return float(increment)
+
+
+def grid_nodes(region, increment, registration=GRIDLINE):
+    """RETURN THE NODE LONGITUDES AND LATITUDES (x, y) OF A (west, east, south, north) REGION"""
+    west, east, south, north = region
+    increment = parse_increment(increment)
+    offset = 0.5 * increment if registration == PIXEL else 0.
+    n_x = int(round((east - west) / increment)) + (0 if registration == PIXEL else 1)
+    n_y = int(round((north - south) / increment)) + (0 if registration == PIXEL else 1)
+    return west + offset + increment * np.arange(n_x), south + offset + increment * np.arange(n_y)
+
+
+def placement(x, y, grid):
+    """
+    RETURN THE (row, col) SLICES OF NODES x, y WHERE grid's NODES FALL (CLIPPED TO x, y), AND THE MATCHING SLICES
+    OF grid (THE SAME INCREMENT IS ASSUMED)
+    """
+    increment = float(x[1] - x[0]) if len(x) > 1 else float(y[1] - y[0])
+    row = int(round((grid.y[0] - y[0]) / increment))
+    col = int(round((grid.x[0] - x[0]) / increment))
+    row_start, col_start = min(max(row, 0), len(y)), min(max(col, 0), len(x))
+    rows = slice(row_start, max(min(row + len(grid.y), len(y)), row_start))
+    cols = slice(col_start, max(min(col + len(grid.x), len(x)), col_start))
+    return (rows, cols), (slice(rows.start - row, rows.stop - row), slice(cols.start - col, cols.stop - col))
+
+
+def block_median(values, region, increment):
+    """
+    medianId -C: THE MEDIAN z OF THE PINGS NEAREST EACH NODE, AT THE NODE, WITH THE sid OF THE (LOWER) MEDIAN PING.
+    RETURNS [n, 4] (x y z sid) IN NODE ORDER
+    """
+    west, east, south, north = region
+    x = west + np.mod(values[:, 0] - west, 360.)
+    y = values[:, 1]
+    inside = (x >= west) & (x <= east) & (y >= south) & (y <= north)
+    x, y, z, sid = x[inside], y[inside], values[inside, 2], values[inside, 3]
+    node_x, node_y = grid_nodes(region, increment)
+    col = np.clip(np.rint((x - west) / parse_increment(increment)).astype(np.int64), 0, len(node_x) - 1)
+    row = np.clip(np.rint((y - south) / parse_increment(increment)).astype(np.int64), 0, len(node_y) - 1)
+    block = row * len(node_x) + col
+
+    # SORT BY BLOCK, THEN DEPTH (THEN sid, SO EQUAL DEPTHS DO NOT DEPEND ON THE INPUT ORDER); THE MEDIAN OF EACH
+    # BLOCK IS IN THE MIDDLE OF ITS RUN
+    order = np.lexsort((sid, z, block))
+    block, z, sid = block[order], z[order], sid[order]
+    blocks, first, counts = np.unique(block, return_index=True, return_counts=True)
+    lower = first + (counts - 1) // 2
+    upper = first + counts // 2
+    return np.column_stack((node_x[blocks % len(node_x)], node_y[blocks // len(node_x)],
+                            0.5 * (z[lower] + z[upper]), sid[lower]))
+
+
+class Grid:
+    """
+    A GEOGRAPHIC GRID
+
+    x = NODE LONGITUDES (WEST TO EAST), y = NODE LATITUDES (SOUTH TO NORTH), z = VALUES [len(y), len(x)]
+    """
+    def __init__(self, x, y, z, registration=GRIDLINE):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.z = np.asarray(z)
+        self.registration = registration
+        if self.z.shape != (len(self.y), len(self.x)):
+            raise ValueError("grid values are %s, nodes are %d x %d" % (self.z.shape, len(self.y), len(self.x)))
+
+    @classmethod
+    def empty(cls, region, increment, registration=GRIDLINE, fill=np.nan, dtype=np.float32):
+        x, y = grid_nodes(region, increment, registration)
+        return cls(x, y, np.full((len(y), len(x)), fill, dtype=dtype), registration)
+
+    @property
+    def shape(self):
+        return self.z.shape
+
+    @property
+    def increment(self):
+        return float(self.x[1] - self.x[0]) if len(self.x) > 1 else float(self.y[1] - self.y[0])
+
+    @property
+    def region(self):
+        """(west, east, south, north) AS GMT GIVES IT (THE CELL EDGES OF A PIXEL REGISTERED GRID)"""
+        half = 0.5 * self.increment if self.registration == PIXEL else 0.
+        return self.x[0] - half, self.x[-1] + half, self.y[0] - half, self.y[-1] + half
+
+    def index_window(self, region):
+        """RETURN THE (row, col) SLICES OF THE NODES INSIDE A (west, east, south, north) REGION"""
+        west, east, south, north = region
+        tolerance = 1e-6 * self.increment
+        rows = slice(int(np.searchsorted(self.y, south - tolerance, side='left')),
+                     int(np.searchsorted(self.y, north + tolerance, side='right')))
+        cols = slice(int(np.searchsorted(self.x, west - tolerance, side='left')),
+                     int(np.searchsorted(self.x, east + tolerance, side='right')))
+        return rows, cols
+
+    def window(self, region):
+        """RETURN THE NODES INSIDE A (west, east, south, north) REGION AS A NEW Grid (SHARING THE VALUES)"""
+        rows, cols = self.index_window(region)
+        return Grid(self.x[cols], self.y[rows], self.z[rows, cols], self.registration)
+
+    def sample(self, lon, lat):
+        """
+        BILINEAR VALUES AT lon/lat POINTS (AS grdtrack -Q), NaN OFF THE GRID. LONGITUDES ARE WRAPPED INTO THE GRID'S
+        RANGE, AND A GLOBAL PIXEL REGISTERED GRID WRAPS AROUND FROM ITS LAST COLUMN TO ITS FIRST
+        """
+        n_rows, n_cols = self.shape
+        lon = self.x[0] + np.mod(np.asarray(lon, dtype=float) - self.x[0], 360.)
+        col_float = (lon - self.x[0]) / self.increment
+        row_float = (np.asarray(lat, dtype=float) - self.y[0]) / self.increment
+        inside = (row_float >= 0.) & (row_float <= n_rows - 1)
+        row = np.clip(np.floor(row_float), 0, max(n_rows - 2, 0)).astype(np.int64)
+        if self.registration == PIXEL and abs(n_cols * self.increment - 360.) < 0.5 * self.increment:
+            col = np.floor(col_float).astype(np.int64) % n_cols
+            next_col = (col + 1) % n_cols
+            t = col_float - np.floor(col_float)
+        else:
+            inside &= (col_float >= 0.) & (col_float <= n_cols - 1)
+            col = np.clip(np.floor(col_float), 0, max(n_cols - 2, 0)).astype(np.int64)
+            next_col = np.minimum(col + 1, n_cols - 1)
+            t = np.clip(col_float - col, 0., 1.)
+        u = np.clip(row_float - row, 0., 1.)
+        next_row = np.minimum(row + 1, n_rows - 1)
+        z = self.z
+        values = ((1. - t) * (1. - u) * z[row, col] + t * (1. - u) * z[row, next_col] + t * u * z[next_row, next_col] +
+                  (1. - t) * u * z[next_row, col])
+        return np.where(inside, values, np.nan)
+
+    def paste(self, grid):
+        """COPY THE VALUES OF A Grid (SAME INCREMENT) INTO THE NODES IT SHARES WITH THIS ONE"""
+        (rows, cols), (grid_rows, grid_cols) = placement(self.x, self.y, grid)
+        self.z[rows, cols] = grid.z[grid_rows, grid_cols]
+
+
+# FILES ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def gmt_command(module):
+    """RETURN THE COMMAND RUNNING A GMT MODULE (gmt <module> FOR GMT 5 AND LATER, <module> FOR GMT 4)"""
+    return ['gmt', module] if shutil.which('gmt') else [module]
+
+
+def is_netcdf(path):
+    return os.path.splitext(path)[1].lower() in NETCDF_EXTENSIONS
+
+
+def netcdf4():
+    """RETURN THE netCDF4 MODULE (ONLY NEEDED FOR GMT GRIDS)"""
+    try:
+        import netCDF4
+    except ImportError:
+        raise ImportError("netCDF4 is needed to read and write GMT (.grd/.nc) grids: pip install netCDF4")
+    return netCDF4
+
+
+def netcdf_variables(dataset):
+    """RETURN THE (x, y, z) VARIABLES OF A GMT netCDF GRID"""
+    z = [variable for variable in dataset.variables.values() if variable.ndim == 2][0]
+    y_name, x_name = z.dimensions
+    return dataset.variables[x_name], dataset.variables[y_name], z
+
+
+def read_nodes(path):
+    """RETURN THE NODES (x, y, registration) OF A GRID FILE WITHOUT READING ITS VALUES"""
+    if is_netcdf(path):
+        with netcdf4().Dataset(path) as dataset:
+            x, y, z = netcdf_variables(dataset)
+            return x[:], y[:], PIXEL if getattr(dataset, 'node_offset', 0) == 1 else GRIDLINE
+    with np.load(path) as archive:
+        return archive['x'], archive['y'], str(archive['registration'])
+
+
+def read_grid(path, region=None):
+    """READ A GRID (.grd/.nc OR .npz), OR ONLY THE NODES INSIDE A (west, east, south, north) REGION"""
+    if is_netcdf(path):
+        with netcdf4().Dataset(path) as dataset:
+            x, y, z = netcdf_variables(dataset)
+            z.set_auto_mask(False)
+            registration = PIXEL if getattr(dataset, 'node_offset', 0) == 1 else GRIDLINE
+            grid = Grid(x[:], y[:], np.empty((len(y), len(x)), dtype=np.float32), registration)
+            rows, cols = grid.index_window(region) if region is not None else (slice(None), slice(None))
+            values = z[rows, cols]
+            fill = getattr(z, '_FillValue', None)
+            if fill is not None and np.issubdtype(values.dtype, np.floating):
+                values[values == fill] = np.nan
+            return Grid(grid.x[cols], grid.y[rows], values, registration)
+    with np.load(path) as archive:
+        grid = Grid(archive['x'], archive['y'], archive['z'], str(archive['registration']))
+    return grid.window(region) if region is not None else grid
+
+
+def create_netcdf(path, x, y, registration=GRIDLINE, title=''):
+    """CREATE A GMT netCDF GRID OF NODES x, y (ALL NaN). RETURNS THE OPEN DATASET AND ITS z VARIABLE"""
+    dataset = netcdf4().Dataset(path, 'w')
+    dataset.createDimension('lon', len(x))
+    dataset.createDimension('lat', len(y))
+    lon = dataset.createVariable('lon', 'f8', ('lon',))
+    lon.units = 'degrees_east'
+    lon[:] = x
+    lat = dataset.createVariable('lat', 'f8', ('lat',))
+    lat.units = 'degrees_north'
+    lat[:] = y
+    z = dataset.createVariable('z', 'f4', ('lat', 'lon'), zlib=True, fill_value=np.float32(np.nan))
+    dataset.Conventions = 'COARDS, CF-1.5'
+    dataset.title = title
+    dataset.node_offset = NODE_OFFSETS[registration]
+    return dataset, z
+
+
+def write_grid(path, grid, title=''):
+    """WRITE A GRID AS A GMT netCDF GRID (.grd/.nc) OR IN NUMPY FORMAT (.npz)"""
+    if not is_netcdf(path):
+        np.savez(path, x=grid.x, y=grid.y, z=grid.z, registration=grid.registration)
+        return path
+    dataset, z = create_netcdf(path, grid.x, grid.y, grid.registration, title)
+    with dataset:
+        z[:] = grid.z
+    return path
+
+
+class GridWriter:
+    """
+    A GRID FILE FILLED ONE WINDOW AT A TIME
+
+    THE WHOLE GRID (NODES x, y) IS CREATED FIRST, ALL NaN, AND write() COPIES A Grid STRAIGHT INTO ITS ROWS AND
+    COLUMNS, SO A GLOBAL GRID IS ASSEMBLED WITHOUT HOLDING IT IN MEMORY. (AN .npz GRID IS HELD AND SAVED ON close.)
+    """
+    def __init__(self, path, x, y, registration=GRIDLINE, title=''):
+        self.path = path
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.registration = registration
+        if is_netcdf(path):
+            self.dataset, self.z = create_netcdf(path, self.x, self.y, registration, title)
+        else:
+            self.dataset, self.z = None, np.full((len(self.y), len(self.x)), np.nan, dtype=np.float32)
+
+    def write(self, grid):
+        """COPY A Grid (SAME INCREMENT AND REGISTRATION) INTO ITS PLACE. RETURNS THE NUMBER OF NODES WRITTEN"""
+        (rows, cols), (grid_rows, grid_cols) = placement(self.x, self.y, grid)
+        if rows.start >= rows.stop or cols.start >= cols.stop:
+            return 0
+        self.z[rows, cols] = grid.z[grid_rows, grid_cols]
+        return (rows.stop - rows.start) * (cols.stop - cols.start)
+
+    def close(self):
+        if self.dataset is None:
+            write_grid(self.path, Grid(self.x, self.y, self.z, self.registration))
+        else:
+            self.dataset.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
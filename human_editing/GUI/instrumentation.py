@@ -0,0 +1,168 @@
+"""
+Timing spans and counters for the editor pipeline.
+
+One Instrumentation (INSTRUMENTS) is shared by the editor, the 3D viewer and the headless engine. Code marks a step
+with a named span (``with span('load'):`` or the ``@timed('load')`` decorator) and counts things with
+``count('pings_flagged', n)``. Every span is aggregated per session (calls, total, mean, min, max and last time);
+the most recent spans are also kept in order with their start time, so a slow step on a real cruise can be found
+without attaching a profiler.
+
+In the Py-CMeditor console the object is available as ``instruments``: ``instruments.report()`` prints the table and
+``instruments.export('timings.json')`` (or .csv) writes it to a file. Setting the PYCMEDITOR_TIMINGS environment
+variable to a file name exports the timings there when the program exits.
+"""
+import os
+import csv
+import json
+import time
+import atexit
+import functools
+import contextlib
+import collections
+
+# NUMBER OF INDIVIDUAL SPANS KEPT (OLDEST ARE DROPPED); THE TOTALS INCLUDE EVERY SPAN
+MAX_RECENT_SPANS = 1000
+
+# ENVIRONMENT VARIABLE NAMING A FILE TO EXPORT THE TIMINGS TO AT EXIT
+EXPORT_ENVIRONMENT_VARIABLE = 'PYCMEDITOR_TIMINGS'
+
+
+class SpanTotals:
+    """AGGREGATED TIMES OF ONE NAMED SPAN"""
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.minimum = float('inf')
+        self.maximum = 0.
+        self.last = 0.
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.minimum = min(self.minimum, seconds)
+        self.maximum = max(self.maximum, seconds)
+        self.last = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.
+
+    def as_dict(self):
+        return {'calls': self.calls, 'total_s': self.total, 'mean_s': self.mean,
+                'min_s': self.minimum if self.calls else 0., 'max_s': self.maximum, 'last_s': self.last}
+
+
+class Instrumentation:
+    """
+    NAMED TIMING SPANS AND COUNTERS FOR ONE SESSION
+
+    Spans may be nested; a nested span is recorded under its own name and as part of the enclosing span's time.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.time()
+        self.spans = collections.OrderedDict()  # name -> SpanTotals
+        self.counters = collections.OrderedDict()  # name -> value
+        # (name, START (s SINCE THE SESSION STARTED), SECONDS, NESTING DEPTH)
+        self.recent = collections.deque(maxlen=MAX_RECENT_SPANS)
+        self.depth = 0
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """TIME THE BODY OF A with BLOCK UNDER name"""
+        if not self.enabled:
+            yield
+            return
+        offset = time.time() - self.started
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            self.record(name, time.perf_counter() - start, offset)
+
+    def record(self, name, seconds, start=None):
+        """ADD ONE TIMING OF name"""
+        if name not in self.spans:
+            self.spans[name] = SpanTotals()
+        self.spans[name].add(seconds)
+        self.recent.append((name, time.time() - self.started if start is None else start, seconds, self.depth))
+
+    def timed(self, name):
+        """DECORATOR: TIME EVERY CALL OF A FUNCTION UNDER name"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        """ADD n TO A COUNTER"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        self.started = time.time()
+        self.spans.clear()
+        self.counters.clear()
+        self.recent.clear()
+
+    # OUTPUT ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def as_dict(self):
+        return {'session_start': self.started,
+                'spans': collections.OrderedDict((name, totals.as_dict()) for name, totals in self.spans.items()),
+                'counters': dict(self.counters),
+                'recent': [{'name': name, 'start_s': start, 'seconds': seconds, 'depth': depth}
+                           for name, start, seconds, depth in self.recent]}
+
+    def report(self, show=True):
+        """RETURN (AND PRINT) A TABLE OF THE SPANS, SLOWEST TOTAL FIRST, AND THE COUNTERS"""
+        lines = ['%-32s %7s %10s %10s %10s %10s' % ('span', 'calls', 'total s', 'mean s', 'max s', 'last s')]
+        for name, totals in sorted(self.spans.items(), key=lambda item: -item[1].total):
+            lines.append('%-32s %7d %10.4f %10.4f %10.4f %10.4f' % (name, totals.calls, totals.total, totals.mean,
+                                                                   totals.maximum, totals.last))
+        if self.counters:
+            lines.append('')
+            lines.append('%-32s %12s' % ('counter', 'value'))
+            for name, value in self.counters.items():
+                lines.append('%-32s %12s' % (name, value))
+        text = '\n'.join(lines)
+        if show:
+            print(text)
+        return text
+
+    def export(self, path):
+        """WRITE THE TIMINGS TO path: .csv = ONE LINE PER SPAN NAME AND COUNTER, ANYTHING ELSE = JSON"""
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(['kind', 'name', 'calls', 'total_s', 'mean_s', 'min_s', 'max_s', 'last_s', 'value'])
+                for name, totals in self.spans.items():
+                    values = totals.as_dict()
+                    writer.writerow(['span', name, values['calls'], values['total_s'], values['mean_s'],
+                                     values['min_s'], values['max_s'], values['last_s'], ''])
+                for name, value in self.counters.items():
+                    writer.writerow(['counter', name, '', '', '', '', '', '', value])
+        else:
+            with open(path, 'w') as json_file:
+                json.dump(self.as_dict(), json_file, indent=1)
+        return path
+
+
+INSTRUMENTS = Instrumentation()
+span = INSTRUMENTS.span
+timed = INSTRUMENTS.timed
+count = INSTRUMENTS.count
+
+
+def export_at_exit():
+    path = os.environ.get(EXPORT_ENVIRONMENT_VARIABLE)
+    if path and INSTRUMENTS.spans:
+        INSTRUMENTS.export(path)
+
+
+atexit.register(export_at_exit)
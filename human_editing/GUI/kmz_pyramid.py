@@ -0,0 +1,380 @@
+"""
+Google Earth KMZ super-overlays of grids (replaces com/grd2kmz.sh and com/dir2kmz.sh).
+
+A grid is coloured with a GMT (RGB) colour table and shaded as grd2kmz.sh did (grdgradient -A300 -Ne0.6/2500/0 then
+grdimage -I), one image pixel per grid node, straight from the grid values: no PostScript, GeoTIFF or image2qtree.
+The gradient along the edges of a tile named as world_tiles.py names them (e.g. w135n45.grd) uses the edge nodes of
+its neighbours in the same directory, so the shading has no seams between tiles. The image is shaded once and the
+coarser levels of the pyramid are made by halving it. The PNG tiles and KML files of the super-overlay (Region / Lod
+NetworkLinks) are written straight into the .kmz from memory; tiles with no data are left out.
+
+The grids of a directory are done on a pool of processes, and <srcDir>.kml linking every .kmz is written with them.
+
+Usage:
+    python kmz_pyramid.py srcGrd|srcDir dstDir [--cpt ~/topo.cpt] [--workers N] [--tile-size 256] [--extension .grd]
+"""
+import os
+import sys
+import glob
+import argparse
+import time
+import struct
+import zipfile
+import zlib
+import concurrent.futures
+import numpy as np
+from cm_io import atomic_write
+from grid_io import Grid, read_grid
+from world_tiles import parse_tile_name, tile_name
+
+# grdgradient -A300 -Ne0.6/2500/0 OF grd2kmz.sh (THE SAME INTENSITY SCALE FOR EVERY TILE OF A GLOBAL GRID)
+AZIMUTH = 300.
+AMPLITUDE = 0.6
+SIGMA = 2500.
+OFFSET = 0.
+
+# GMT DEFAULT HSV LIMITS OF THE ILLUMINATION (grdimage -I)
+HSV_MIN_SATURATION = 1.
+HSV_MAX_SATURATION = 0.1
+HSV_MIN_VALUE = 0.3
+HSV_MAX_VALUE = 1.
+
+# PIXELS ON A SIDE OF A PNG TILE, AND THE SIZE ON SCREEN (PIXELS) FROM WHICH A TILE IS DRAWN
+TILE_SIZE = 256
+MIN_LOD_PIXELS = 128
+
+# THE FIXED (NOT ADAPTIVE) COLOUR TABLE OF grd2kmz.sh, SO ALL THE TILES OF A GLOBAL GRID MATCH
+CPT = os.path.expanduser('~/topo.cpt')
+
+# USED WHEN THERE IS NO ~/topo.cpt: DARK TO LIGHT BLUE OVER THE OCEAN, GREEN TO BROWN TO WHITE ON LAND
+DEFAULT_COLOURS = ((-11000., (10, 0, 121)), (-5500., (26, 77, 196)), (-2000., (64, 158, 230)),
+                   (-200., (141, 210, 245)), (0., (198, 236, 255)), (0., (51, 102, 0)), (500., (129, 195, 31)),
+                   (1500., (201, 191, 128)), (3000., (153, 102, 51)), (6000., (255, 255, 255)),
+                   (9000., (255, 255, 255)))
+
+KML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n'
+KML_FOOTER = '</Document>\n</kml>\n'
+
+
+# COLOUR AND SHADING ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class ColourTable:
+    """
+    A PIECEWISE LINEAR COLOUR TABLE
+
+    z = KNOT VALUES (INCREASING, A VALUE REPEATED FOR A STEP), rgb = KNOT COLOURS [len(z), 3] (0 <-> 255),
+    below, above = COLOURS OF VALUES OUTSIDE THE TABLE (None = THE END COLOURS). NaN IS TRANSPARENT
+    """
+    def __init__(self, z, rgb, below=None, above=None):
+        self.z = np.asarray(z, dtype=float)
+        self.rgb = np.asarray(rgb, dtype=float).reshape(-1, 3)
+        self.below = below
+        self.above = above
+
+    @classmethod
+    def read(cls, path):
+        """READ A GMT .cpt FILE (RGB, 'z0 r g b z1 r g b' SLICES, B F N LINES)"""
+        z, rgb, outside = [], [], {}
+        with open(path) as cpt:
+            for line in cpt:
+                if 'COLOR_MODEL' in line and 'RGB' not in line.upper():
+                    raise ValueError("%s: only RGB colour tables can be used" % path)
+                fields = line.split('#')[0].split()
+                if not fields:
+                    continue
+                if fields[0] in ('B', 'F', 'N'):
+                    if len(fields) >= 4:
+                        outside[fields[0]] = tuple(float(value) for value in fields[1:4])
+                    continue
+                if len(fields) < 8:
+                    raise ValueError("%s: can not read the colour slice '%s'" % (path, line.strip()))
+                values = [float(value) for value in fields[0:8]]
+                z.extend((values[0], values[4]))
+                rgb.extend((values[1:4], values[5:8]))
+        return cls(z, rgb, outside.get('B'), outside.get('F'))
+
+    @classmethod
+    def default(cls, path=CPT):
+        """THE COLOUR TABLE IN path IF THERE IS ONE, ELSE DEFAULT_COLOURS"""
+        if path and os.path.isfile(path):
+            return cls.read(path)
+        return cls([z for z, rgb in DEFAULT_COLOURS], [rgb for z, rgb in DEFAULT_COLOURS])
+
+    def __call__(self, values):
+        """RETURN THE COLOURS (0 <-> 1) [values.shape + (3,)] OF AN ARRAY OF VALUES"""
+        values = np.asarray(values, dtype=float)
+        rgb = np.stack([np.interp(values, self.z, self.rgb[:, band]) for band in range(3)], axis=-1)
+        if self.below is not None:
+            rgb[values < self.z[0]] = self.below
+        if self.above is not None:
+            rgb[values > self.z[-1]] = self.above
+        return rgb / 255.
+
+
+def intensity(grid, azimuth=AZIMUTH, amplitude=AMPLITUDE, sigma=SIGMA, offset=OFFSET):
+    """
+    grdgradient -A<azimuth> -Ne<amplitude>/<sigma>/<offset> OF THE INNER NODES OF A GRID WITH A ONE NODE HALO. THE
+    GRADIENT IS ONE SIDED NEXT TO NaN NODES (E.G. A HALO WITH NO NEIGHBOURING TILE). GRADIENTS ARE IN z PER DEGREE
+    """
+    z = grid.z.astype(float)
+    centre = z[1:-1, 1:-1]
+
+    def derivative(before, after):
+        has_before, has_after = np.isfinite(before), np.isfinite(after)
+        steps = has_before.astype(int) + has_after
+        difference = np.where(has_after, after, centre) - np.where(has_before, before, centre)
+        return np.where(steps > 0, difference / (np.maximum(steps, 1) * grid.increment), 0.)
+
+    # 1.0 GMT'S DIRECTIONAL DERIVATIVE IS POSITIVE ON SLOPES FACING THE AZIMUTH
+    dz_dx = derivative(z[1:-1, :-2], z[1:-1, 2:])
+    dz_dy = derivative(z[:-2, 1:-1], z[2:, 1:-1])
+    gradient = -(np.sin(np.radians(azimuth)) * dz_dx + np.cos(np.radians(azimuth)) * dz_dy) - offset
+    gradient = np.nan_to_num(gradient)
+
+    # 2.0 -Ne: CUMULATIVE LAPLACE DISTRIBUTION
+    return np.sign(gradient) * amplitude * (1. - np.exp(-np.sqrt(2.) * np.abs(gradient) / sigma))
+
+
+def rgb_to_hsv(rgb):
+    maximum, minimum = rgb.max(axis=-1), rgb.min(axis=-1)
+    delta = maximum - minimum
+    red, green, blue = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hue = np.select([delta == 0, maximum == red, maximum == green],
+                        [0., ((green - blue) / delta) % 6., (blue - red) / delta + 2.], (red - green) / delta + 4.)
+        saturation = np.where(maximum > 0, delta / maximum, 0.)
+    return hue / 6., saturation, maximum
+
+
+def hsv_to_rgb(hue, saturation, value):
+    sector = np.floor(hue * 6.)
+    fraction = hue * 6. - sector
+    sector = sector.astype(int) % 6
+    p = value * (1. - saturation)
+    q = value * (1. - saturation * fraction)
+    t = value * (1. - saturation * (1. - fraction))
+    choices = [sector == i for i in range(6)]
+    return np.stack([np.select(choices, [value, q, p, p, t, value]), np.select(choices, [t, value, value, q, p, p]),
+                     np.select(choices, [p, p, t, value, value, q])], axis=-1)
+
+
+def illuminate(rgb, intensity):
+    """grdimage -I: MOVE COLOURS (0 <-> 1) TOWARDS WHITE WHERE intensity > 0 AND TOWARDS DARK WHERE < 0, IN HSV"""
+    hue, saturation, value = rgb_to_hsv(rgb)
+    weight = np.abs(intensity)
+    brighter = intensity > 0
+    saturation = np.where(saturation == 0, 0., (1. - weight) * saturation +
+                          weight * np.where(brighter, HSV_MAX_SATURATION, HSV_MIN_SATURATION))
+    value = (1. - weight) * value + weight * np.where(brighter, HSV_MAX_VALUE, HSV_MIN_VALUE)
+    return hsv_to_rgb(hue, np.clip(saturation, 0., 1.), np.clip(value, 0., 1.))
+
+
+def shade(grid, colours):
+    """RETURN THE SHADED RGBA IMAGE (uint8, NORTH ROW FIRST) OF THE INNER NODES OF A GRID WITH A ONE NODE HALO"""
+    inner = grid.z[1:-1, 1:-1]
+    valid = np.isfinite(inner)
+    rgb = illuminate(colours(np.where(valid, inner, 0.)), intensity(grid))
+    image = np.empty(inner.shape + (4,), dtype=np.uint8)
+    image[..., 0:3] = np.round(255. * rgb)
+    image[..., 3] = np.where(valid, 255, 0)
+    return image[::-1]
+
+
+def read_with_halo(path):
+    """
+    READ A GRID WITH A ONE NODE HALO, FILLED FROM THE NEIGHBOURING TILES IN ITS DIRECTORY WHEN IT IS NAMED AS
+    world_tiles.py NAMES TILES (WRAPPING AROUND IN LONGITUDE), NaN ELSEWHERE
+    """
+    grid = read_grid(path)
+    increment = grid.increment
+    x = np.concatenate(([grid.x[0] - increment], grid.x, [grid.x[-1] + increment]))
+    y = np.concatenate(([grid.y[0] - increment], grid.y, [grid.y[-1] + increment]))
+    halo = Grid(x, y, np.full((len(y), len(x)), np.nan, dtype=np.float32), grid.registration)
+    corner = parse_tile_name(path)
+    if corner is not None:
+        west, east, south, north = grid.region
+        width, height = int(round(east - west)), int(round(north - south))
+        directory, extension = os.path.dirname(path), os.path.splitext(path)[1]
+        for step_x in (-1, 0, 1):
+            for step_y in (-1, 0, 1):
+                neighbour_west, neighbour_north = corner[0] + step_x * width, corner[1] + step_y * height
+                if (step_x, step_y) == (0, 0) or neighbour_north > 90 or neighbour_north - height < -90:
+                    continue
+                wrapped_west = (neighbour_west + 180) % 360 - 180
+                neighbour = os.path.join(directory, tile_name(wrapped_west, neighbour_north) + extension)
+                if not os.path.isfile(neighbour):
+                    continue
+                shift = neighbour_west - wrapped_west
+                edges = read_grid(neighbour, region=(x[0] - shift, x[-1] - shift, y[0], y[-1]))
+                if edges.z.size:
+                    halo.paste(Grid(edges.x + shift, edges.y, edges.z, edges.registration))
+    halo.paste(grid)
+    return halo
+
+
+# SUPER-OVERLAY ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def shrink(image):
+    """HALVE AN RGBA IMAGE, AVERAGING 2 x 2 PIXELS WEIGHTED BY THEIR OPACITY"""
+    height, width = image.shape[0:2]
+    padded = np.zeros((height + height % 2, width + width % 2, 4))
+    padded[:height, :width] = image
+    count = np.zeros(padded.shape[0:2])
+    count[:height, :width] = 1.
+    shape = (padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    blocks = padded.reshape(shape + (4,))
+    alpha = blocks[..., 3:4]
+    weight = alpha.sum(axis=(1, 3))
+    rgb = (blocks[..., 0:3] * alpha).sum(axis=(1, 3)) / np.maximum(weight, 1.)
+    opacity = weight / count.reshape(shape).sum(axis=(1, 3))[..., np.newaxis]
+    return np.round(np.concatenate([rgb, opacity], axis=-1)).astype(np.uint8)
+
+
+def png(image):
+    """ENCODE AN RGBA (uint8) IMAGE AS A PNG FILE ('UP' FILTERED ROWS)"""
+    height, width = image.shape[0:2]
+    rows = image.reshape(height, 4 * width)
+    filtered = np.empty((height, 4 * width + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    filtered[1:, 1:] = rows[1:] - rows[:-1]
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(filtered.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def kml_box(tag, box):
+    west, east, south, north = box
+    return ('<%s><north>%.10g</north><south>%.10g</south><east>%.10g</east><west>%.10g</west></%s>' %
+            (tag, north, south, east, west, tag))
+
+
+def kml_region(box, min_lod_pixels=MIN_LOD_PIXELS):
+    return ('<Region>%s<Lod><minLodPixels>%d</minLodPixels><maxLodPixels>-1</maxLodPixels></Lod></Region>\n' %
+            (kml_box('LatLonAltBox', box), min_lod_pixels))
+
+
+def kml_link(href, box, min_lod_pixels=MIN_LOD_PIXELS):
+    return ('<NetworkLink>%s<Link><href>%s</href><viewRefreshMode>onRegion</viewRefreshMode></Link></NetworkLink>\n' %
+            (kml_region(box, min_lod_pixels), href))
+
+
+def super_overlay(image, box, name, tile_size=TILE_SIZE):
+    """
+    RETURN THE FILES [(name in the kmz, bytes)] OF A KML SUPER-OVERLAY OF AN RGBA IMAGE (NORTH UP) COVERING box
+    (west, east, south, north). doc.kml LINKS THE ONE TILE OF LEVEL 0; EACH TILE files/<level>/<row>/<col>.kml
+    DRAWS ITS PNG AND LINKS ITS TILES (UP TO 4) OF THE NEXT LEVEL
+    """
+    # 1.0 HALVE THE IMAGE UNTIL IT FITS IN ONE TILE
+    levels = [image]
+    while max(levels[-1].shape[0:2]) > tile_size:
+        levels.append(shrink(levels[-1]))
+    levels.reverse()
+    west, east, south, north = box
+    pixel_width, pixel_height = (east - west) / image.shape[1], (north - south) / image.shape[0]
+
+    def tile(level, row, col):
+        return levels[level][row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+
+    def has_data(level, row, col):
+        pixels = tile(level, row, col)
+        return pixels.size > 0 and bool(pixels[..., 3].any())
+
+    def tile_box(level, row, col):
+        size = tile_size * 2 ** (len(levels) - 1 - level)
+        return (west + col * size * pixel_width, min(west + (col + 1) * size * pixel_width, east),
+                max(north - (row + 1) * size * pixel_height, south), north - row * size * pixel_height)
+
+    # 2.0 THE TILES WITH ANY DATA, LEVEL BY LEVEL (A TILE CAN ONLY HAVE DATA UNDER A TILE WITH DATA)
+    occupied = [{(0, 0)}]
+    for level in range(1, len(levels)):
+        occupied.append({(2 * row + i, 2 * col + j) for row, col in occupied[-1] for i in (0, 1) for j in (0, 1)
+                         if has_data(level, 2 * row + i, 2 * col + j)})
+
+    # 3.0 ONE PNG AND ONE KML PER TILE
+    files = [('doc.kml', (KML_HEADER + '<name>%s</name>\n' % name + kml_link('files/0/0/0.kml', box, 0) +
+                          KML_FOOTER).encode())]
+    for level, tiles in enumerate(occupied):
+        for row, col in sorted(tiles):
+            children = [(row_child, col_child) for row_child in (2 * row, 2 * row + 1)
+                        for col_child in (2 * col, 2 * col + 1)
+                        if level + 1 < len(levels) and (row_child, col_child) in occupied[level + 1]]
+            kml = (KML_HEADER + kml_region(tile_box(level, row, col), MIN_LOD_PIXELS if level else 0) +
+                   '<GroundOverlay><drawOrder>%d</drawOrder><Icon><href>%d.png</href></Icon>%s</GroundOverlay>\n' %
+                   (level, col, kml_box('LatLonBox', tile_box(level, row, col))) +
+                   ''.join(kml_link('../../%d/%d/%d.kml' % (level + 1, row_child, col_child),
+                                    tile_box(level + 1, row_child, col_child)) for row_child, col_child in children) +
+                   KML_FOOTER)
+            stem = 'files/%d/%d/%d' % (level, row, col)
+            files.append((stem + '.png', png(tile(level, row, col))))
+            files.append((stem + '.kml', kml.encode()))
+    return files
+
+
+def build_kmz(path, dst_dir, colours, tile_size=TILE_SIZE):
+    """SHADE ONE GRID AND WRITE ITS SUPER-OVERLAY AS dst_dir/<stem>.kmz. RETURNS (kmz path, image box)"""
+    grid = read_with_halo(path)
+    half = 0.5 * grid.increment
+    box = (grid.x[1] - half, grid.x[-2] + half, grid.y[1] - half, grid.y[-2] + half)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    files = super_overlay(shade(grid, colours), box, stem, tile_size)
+    kmz_path = os.path.join(dst_dir, stem + '.kmz')
+    with atomic_write(kmz_path, 'wb') as handle:
+        with zipfile.ZipFile(handle, 'w') as kmz:
+            for name, data in files:
+                kmz.writestr(name, data, zipfile.ZIP_STORED if name.endswith('.png') else zipfile.ZIP_DEFLATED)
+    return kmz_path, box
+
+
+def build_kmzs(paths, dst_dir, colours, tile_size=TILE_SIZE, workers=1):
+    """build_kmz EACH GRID ON workers PROCESSES. RETURNS [(kmz path, image box)]"""
+    os.makedirs(dst_dir, exist_ok=True)
+    if workers > 1 and len(paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(build_kmz, path, dst_dir, colours, tile_size) for path in paths]
+            return [future.result() for future in futures]
+    return [build_kmz(path, dst_dir, colours, tile_size) for path in paths]
+
+
+def write_index(path, kmzs, name):
+    """WRITE A KML LINKING EACH .kmz [(kmz path, box)] IN ITS DIRECTORY, LOADED WHEN ITS REGION COMES INTO VIEW"""
+    with atomic_write(path) as kml:
+        kml.write(KML_HEADER + '<name>%s</name>\n' % name)
+        for kmz_path, box in kmzs:
+            kml.write(kml_link(os.path.basename(kmz_path), box))
+        kml.write(KML_FOOTER)
+    return path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Make Google Earth KMZ super-overlays of shaded grids')
+    parser.add_argument('src', help='a grid, or a directory of grids')
+    parser.add_argument('dst_dir')
+    parser.add_argument('--cpt', default=CPT, help='GMT RGB colour table (default ~/topo.cpt, if it is there)')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE, help='pixels on a side of the PNG tiles')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    parser.add_argument('--extension', default='.grd', help='extension of the grids in a directory')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    colours = ColourTable.default(args.cpt)
+    if os.path.isdir(args.src):
+        paths = sorted(glob.glob(os.path.join(args.src, '*' + args.extension)))
+        if not paths:
+            print("ERROR: no %s files in %s" % (args.extension, args.src))
+            return 1
+    else:
+        paths = [args.src]
+    kmzs = build_kmzs(paths, args.dst_dir, colours, args.tile_size, args.workers)
+    if os.path.isdir(args.src):
+        name = os.path.basename(os.path.normpath(args.src))
+        print("linked the .kmz files in %s" % write_index(os.path.join(args.dst_dir, name + '.kml'), kmzs, name))
+    print("wrote %d .kmz files in %s (%.1f s)" % (len(kmzs), args.dst_dir, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,386 @@
+"""
+A global land/water mask rasterised once per resolution and kept on disk (replaces the grdlandmask runs of
+com/land/grdLandMask_wrapper.sh and 02worldMakeAllTiles.sh).
+
+grdlandmask is run once over the whole world, a band of latitude at a time on a pool of processes, giving the GSHHS
+level of every node: 0 ocean, 1 land, 2 lake, 3 island in a lake, 4 pond on such an island. The levels are stored as 3
+bit planes packed 8 nodes to a byte (numpy packbits), 3 bits a node instead of the 32 of a float grid, in
+<cacheDir>/landmask.<resolution>.<increment>.npy with its nodes in a .json next to it. Every later mask is read from
+that file through a memory map, so a tile window or a set of points touches only its own rows.
+
+Mask values are given as grdlandmask takes them: wet/dry (ocean, lake and pond are wet; land and island are dry) or
+ocean/land/lake/island/pond. A grid (or point) takes the level of its nearest node in the cache: a grid is masked
+with the mask of its own node spacing unless another --increment is given, and masking fails if the grid is finer
+than the mask; points use the 15c mask unless told otherwise. The coastline --resolution is given as grdlandmask -D
+takes it, including the + that falls back to a coarser coastline where the finer one has none (f+). The mask of
+each increment and coastline resolution used is built once by the build command (a step of its own in the scripts);
+masking with a mask that is not built fails rather than building it on the way, so many tiles masked at once never
+each start a world build. Grids are masked and written a band of WRITE_ROWS rows at a
+time (grid_io.GridWriter), so a global grid is never held in memory.
+
+Usage:
+    python land_mask.py build [--increment 15c] [--resolution f+] [--from levels.grd] [--workers N] [--rebuild]
+    python land_mask.py mask ifile.grd ofile.grd NaN/1 [--increment 15c] [--resolution f+]
+                                                      (ifile x mask values, grdLandMask_wrapper.sh)
+    python land_mask.py grid template.grd wet.grd 1/NaN [--increment 15c] [--resolution f+]
+                                                      (the mask values at the nodes of a grid)
+    python land_mask.py points [--keep dry|wet] [--lon-field 1] [--lat-field 2] < points > points_and_level
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+import tempfile
+import time
+import concurrent.futures
+import numpy as np
+from grid_io import GRIDLINE, Grid, GridWriter, gmt_command, is_netcdf, parse_increment, read_grid, read_nodes
+
+WORLD = (-180., 180., -90., 90.)
+
+# WHERE THE MASKS ARE KEPT
+CACHE_DIR = os.environ.get('LAND_MASK_DIR', os.path.expanduser('~/landMask'))
+
+# COASTLINE RESOLUTIONS OF grdlandmask -D (EACH MAY END IN +), AND THE INCREMENT OF A MASK UNLESS ONE IS GIVEN
+RESOLUTIONS = ('c', 'l', 'i', 'h', 'f', 'a')
+INCREMENT = '15c'
+
+# GSHHS LEVELS OF grdlandmask, AND THE LEVELS A WET/DRY PAIR OF MASK VALUES CALLS DRY
+LEVELS = ('ocean', 'land', 'lake', 'island', 'pond')
+DRY_LEVELS = (1, 3)
+
+# BIT PLANES NEEDED FOR LEVELS 0 <-> 4
+N_PLANES = 3
+
+# LATITUDE BANDS (DEG) RASTERISED BY ONE grdlandmask RUN WHILE BUILDING
+BAND_HEIGHT = 15
+
+# ROWS OF A GRID MASKED AND WRITTEN AT A TIME (256 ROWS OF A GLOBAL 15c GRID ARE 88 MB OF float32)
+WRITE_ROWS = 256
+
+CACHE_VERSION = 1
+
+
+def increment_name(spacing):
+    """THE GMT INCREMENT OF A NODE SPACING IN DEGREES: WHOLE MINUTES ('1m'), WHOLE SECONDS ('15c') OR DEGREES"""
+    seconds = spacing * 3600.
+    if abs(seconds - round(seconds)) > 1e-6 * seconds:
+        return '%.10gd' % spacing
+    seconds = int(round(seconds))
+    return '%dm' % (seconds // 60) if seconds % 60 == 0 else '%dc' % seconds
+
+
+def cache_path(increment=INCREMENT, resolution='f', cache_dir=CACHE_DIR):
+    """PATH (.npy) OF THE MASK OF A GMT INCREMENT AND COASTLINE RESOLUTION (c, l, i, h, f OR a, AND AN OPTIONAL +)"""
+    return os.path.join(cache_dir, 'landmask.%s.%s.npy' % (resolution, increment_name(parse_increment(increment))))
+
+
+def coastline_resolution(resolution):
+    """CHECK A grdlandmask -D RESOLUTION (argparse type)"""
+    if resolution.rstrip('+') not in RESOLUTIONS or resolution.count('+') > 1:
+        raise argparse.ArgumentTypeError("resolution is one of %s, optionally followed by +, not '%s'" %
+                                         (', '.join(RESOLUTIONS), resolution))
+    return resolution
+
+
+def parse_mask_values(mask_values):
+    """RETURN THE VALUE OF EACH LEVEL (float[5]) FROM grdlandmask -N VALUES, E.G. 'NaN/1' OR 'NaN/NaN/NaN/1/NaN'"""
+    values = [float(value) for value in mask_values.split('/')]
+    if len(values) == 2:
+        return np.array([values[1] if level in DRY_LEVELS else values[0] for level in range(len(LEVELS))])
+    if len(values) != len(LEVELS):
+        raise ValueError("mask values are wet/dry or ocean/land/lake/island/pond, not '%s'" % mask_values)
+    return np.array(values)
+
+
+class LandMask:
+    """
+    THE LEVELS OF A CACHED MASK, MEMORY MAPPED
+
+    planes[plane, row, byte] = BIT plane OF THE LEVELS OF 8 NODES OF A ROW; ROWS RUN SOUTH TO NORTH AS IN A Grid
+    """
+    def __init__(self, path):
+        with open(os.path.splitext(path)[0] + '.json') as header_file:
+            header = json.load(header_file)
+        self.path = path
+        self.increment = header['increment']
+        self.resolution = header['resolution']
+        self.registration = header['registration']
+        self.west, self.south = header['west'], header['south']
+        self.n_rows, self.n_cols = header['shape']
+        self.spacing = parse_increment(self.increment)
+        self.period = int(round(360. / self.spacing))
+        self.planes = np.load(path, mmap_mode='r')
+
+    @property
+    def offset(self):
+        return 0.5 * self.spacing if self.registration != GRIDLINE else 0.
+
+    def rows(self, lat):
+        """ROW OF THE NEAREST NODE OF EACH LATITUDE (CLIPPED TO THE GRID)"""
+        row = np.round((np.asarray(lat, dtype=float) - self.south - self.offset) / self.spacing)
+        return np.clip(row, 0, self.n_rows - 1).astype(np.int64)
+
+    def cols(self, lon):
+        """COLUMN OF THE NEAREST NODE OF EACH LONGITUDE (WRAPPED AROUND THE WORLD)"""
+        col = np.round((np.asarray(lon, dtype=float) - self.west - self.offset) / self.spacing).astype(np.int64)
+        return col % self.period
+
+    def read_levels(self, planes, rows, cols):
+        """LEVELS (uint8) AT (row, col) INDEX ARRAYS OF BIT PLANES planes (THE MEMORY MAP OR A BAND OF ROWS OF IT)"""
+        byte, shift = cols >> 3, (7 - (cols & 7)).astype(np.uint8)
+        levels = np.zeros(np.broadcast(rows, cols).shape, dtype=np.uint8)
+        for plane in range(N_PLANES):
+            levels |= ((planes[plane][rows, byte] >> shift) & 1) << plane
+        return levels
+
+    def levels(self, lon, lat):
+        """LEVEL OF THE NEAREST NODE OF EACH POINT"""
+        return self.read_levels(self.planes, self.rows(lat), self.cols(lon))
+
+    def is_land(self, lon, lat):
+        """TRUE FOR POINTS ON DRY LAND (LAND OR AN ISLAND IN A LAKE)"""
+        return np.isin(self.levels(lon, lat), DRY_LEVELS)
+
+    def window(self, x, y):
+        """LEVELS [len(y), len(x)] AT THE NODES OF A GRID, READING ONLY THE ROWS THEY SPAN"""
+        rows, cols = self.rows(y), self.cols(x)
+        band = np.asarray(self.planes[:, rows.min():rows.max() + 1])
+        return self.read_levels(band, (rows - rows.min())[:, None], cols[None, :])
+
+    def mask_values(self, x, y, mask_values):
+        """THE grdlandmask -N VALUES AT THE NODES OF A GRID"""
+        return parse_mask_values(mask_values)[self.window(x, y)]
+
+
+# BUILD ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def run_grdlandmask(region, increment, resolution):
+    """RASTERISE THE GSHHS LEVELS OF A REGION WITH grdlandmask (GRIDLINE NODES). RETURNS A Grid"""
+    workdir = tempfile.mkdtemp(prefix='land_mask.')
+    try:
+        path = os.path.join(workdir, 'levels.grd')
+        subprocess.run(gmt_command('grdlandmask') + ['-R%g/%g/%g/%g' % region, '-I' + increment, '-D' + resolution,
+                                                     '-N0/1/2/3/4', '-G' + path],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return read_grid(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def build_band(path, band, increment, resolution, source=None):
+    """
+    WRITE THE PACKED LEVELS OF A LATITUDE BAND (south, north) INTO THE MASK BEING BUILT AT path, FROM THE levels GRID
+    source OR FROM grdlandmask
+    """
+    region = (WORLD[0], WORLD[1]) + band
+    levels = read_grid(source, region) if source is not None else run_grdlandmask(region, increment, resolution)
+    mask = LandMask(path)
+    row = int(mask.rows(levels.y[0]))
+    z = np.nan_to_num(levels.z).astype(np.uint8)
+    planes = np.load(path, mmap_mode='r+')
+    for plane in range(N_PLANES):
+        planes[plane, row:row + len(levels.y)] = np.packbits((z >> plane) & 1, axis=1)
+    planes.flush()
+    return len(levels.y)
+
+
+def build_band_job(job):
+    return build_band(*job)
+
+
+def build(increment=INCREMENT, resolution='f', cache_dir=CACHE_DIR, source=None, workers=1):
+    """
+    RASTERISE THE WORLD MASK OF AN INCREMENT AND COASTLINE RESOLUTION INTO THE CACHE, FROM A GLOBAL GRID OF
+    LEVELS (source, E.G. grdlandmask -Rd -N0/1/2/3/4) OR BY RUNNING grdlandmask BAND BY BAND. RETURNS ITS PATH
+    """
+    path = cache_path(increment, resolution, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # 1.0 THE NODES OF THE MASK: THOSE OF source, OR GRIDLINE NODES COVERING THE WORLD
+    if source is not None:
+        x, y, registration = read_nodes(source)
+        spacing = float(x[1] - x[0])
+        if abs((x[-1] - x[0]) + (spacing if registration != GRIDLINE else 0.) - 360.) > 0.5 * spacing:
+            raise ValueError("%s is not a global grid" % source)
+        if abs(spacing - parse_increment(increment)) > 1e-6 * spacing:
+            raise ValueError("%s has a node spacing of %g degrees, not %s" % (source, spacing, increment))
+        offset = 0.5 * spacing if registration != GRIDLINE else 0.
+        west, south = float(x[0]) - offset, float(y[0]) - offset
+        band_rows = int(round(BAND_HEIGHT / spacing))
+        bands = [(float(y[start]), float(y[min(start + band_rows, len(y)) - 1]))
+                 for start in range(0, len(y), band_rows)]
+    else:
+        spacing = parse_increment(increment)
+        registration, west, south = GRIDLINE, WORLD[0], WORLD[2]
+        x = np.arange(int(round(360. / spacing)) + 1)
+        y = np.arange(int(round(180. / spacing)) + 1)
+        bands = [(float(band_south), float(band_south + BAND_HEIGHT))
+                 for band_south in range(int(WORLD[2]), int(WORLD[3]), BAND_HEIGHT)]
+
+    # 2.0 CREATE THE PLANES NEXT TO path, FILL THEM BAND BY BAND AND RENAME THEM INTO PLACE WHEN COMPLETE (A TILE
+    # SCRIPT RUNNING MANY MASKS AT ONCE MAY BUILD THE SAME MASK TWICE, BUT NEVER READS A PART BUILT ONE)
+    stem = os.path.splitext(path)[0]
+    building = '%s.building.%d' % (stem, os.getpid())
+    header = {'version': CACHE_VERSION, 'increment': increment, 'resolution': resolution,
+              'registration': registration, 'west': west, 'south': south, 'shape': [len(y), len(x)]}
+    with open(building + '.json', 'w') as header_file:
+        json.dump(header, header_file)
+    planes = np.lib.format.open_memmap(building + '.npy', mode='w+', dtype=np.uint8,
+                                       shape=(N_PLANES, len(y), (len(x) + 7) // 8))
+    del planes
+    jobs = [(building + '.npy', band, increment, resolution, source) for band in bands]
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(build_band_job, jobs))
+    else:
+        for job in jobs:
+            build_band_job(job)
+    os.replace(building + '.json', stem + '.json')
+    os.replace(building + '.npy', path)
+    return path
+
+
+def open_mask(increment=INCREMENT, resolution='f', cache_dir=CACHE_DIR):
+    """RETURN THE LandMask OF AN INCREMENT AND RESOLUTION (FileNotFoundError IF IT HAS NOT BEEN BUILT)"""
+    path = cache_path(increment, resolution, cache_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError("the %s land mask (%s coastline) is not built in %s: run land_mask.py build "
+                                "--increment %s --resolution %s first" % (increment, resolution, cache_dir,
+                                                                          increment, resolution))
+    return LandMask(path)
+
+
+# COMMANDS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def write_bands(ofile, x, y, registration, band_values):
+    """
+    WRITE A GRID OF NODES x, y BAND BY BAND: band_values(rows) GIVES THE VALUES OF A SLICE OF WRITE_ROWS ROWS. THE GRID
+    IS WRITTEN NEXT TO ofile AND RENAMED OVER IT WHEN COMPLETE (SO ofile MAY BE READ BY band_values)
+    """
+    directory = os.path.dirname(os.path.abspath(ofile))
+    fd, building = tempfile.mkstemp(prefix='.' + os.path.basename(ofile) + '.', suffix=os.path.splitext(ofile)[1],
+                                    dir=directory)
+    os.close(fd)
+    try:
+        with GridWriter(building, x, y, registration) as writer:
+            for start in range(0, len(y), WRITE_ROWS):
+                rows = slice(start, min(start + WRITE_ROWS, len(y)))
+                writer.write(Grid(x, y[rows], band_values(rows), registration))
+        os.replace(building, ofile)
+    except BaseException:
+        if os.path.exists(building):
+            os.remove(building)
+        raise
+    return ofile
+
+
+def grid_mask(path, increment=None, resolution='f', cache_dir=CACHE_DIR):
+    """
+    RETURN THE LandMask TO MASK THE GRID AT path WITH: THE MASK OF increment, OR OF THE GRID'S OWN NODE SPACING IF
+    None. RAISES ValueError IF THE GRID IS FINER THAN THE MASK (ITS NODES WOULD COPY THE LEVELS OF COARSER ONES)
+    """
+    x, y, registration = read_nodes(path)
+    spacing = min(abs(float(x[1] - x[0])) if len(x) > 1 else np.inf, abs(float(y[1] - y[0])) if len(y) > 1 else np.inf)
+    mask = open_mask(increment or increment_name(spacing), resolution, cache_dir)
+    if mask.spacing > spacing * (1. + 1e-6):
+        raise ValueError("%s has nodes every %s, finer than the %s land mask: build one with --increment %s" %
+                         (path, increment_name(spacing), mask.increment, increment_name(spacing)))
+    return mask
+
+
+def mask_grid(mask, ifile, ofile, mask_values):
+    """WRITE ifile MULTIPLIED BY THE MASK VALUES AT ITS NODES TO ofile (ifile MAY BE ofile)"""
+    x, y, registration = read_nodes(ifile)
+    values = parse_mask_values(mask_values)
+
+    # AN .npz GRID IS READ WHOLE (GridWriter HOLDS ONE WHOLE TOO); A netCDF GRID A BAND AT A TIME
+    whole = None if is_netcdf(ifile) else read_grid(ifile)
+
+    def band_values(rows):
+        region = (x[0], x[-1], y[rows.start], y[rows.stop - 1])
+        band = whole.window(region) if whole is not None else read_grid(ifile, region)
+        return (band.z * values[mask.window(x, y[rows])]).astype(np.float32)
+    return write_bands(ofile, x, y, registration, band_values)
+
+
+def values_grid(mask, template, ofile, mask_values):
+    """WRITE THE MASK VALUES AT THE NODES OF template TO ofile (grdlandmask -R$template)"""
+    x, y, registration = read_nodes(template)
+    values = parse_mask_values(mask_values).astype(np.float32)
+    return write_bands(ofile, x, y, registration, lambda rows: values[mask.window(x, y[rows])])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Land/water mask rasterised once and read from a memory map')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--increment', help='node spacing of the mask (GMT -I; default %s, or that of the grid '
+                                            'masked)' % INCREMENT)
+    common.add_argument('--resolution', default='f', type=coastline_resolution, help='coastline (GMT -D, e.g. f+)')
+    common.add_argument('--cache-dir', default=CACHE_DIR)
+    commands = parser.add_subparsers(dest='command')
+    build_parser = commands.add_parser('build', parents=[common],
+                                       help='rasterise the mask of --increment and --resolution')
+    build_parser.add_argument('--from', dest='source', help='global grid of levels 0-4 (grdlandmask -N0/1/2/3/4)')
+    build_parser.add_argument('--rebuild', action='store_true', help='replace the mask if it is already built')
+    build_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes building the mask')
+    mask_parser = commands.add_parser('mask', parents=[common],
+                                      help='multiply a grid by mask values (grdLandMask_wrapper.sh)')
+    mask_parser.add_argument('ifile')
+    mask_parser.add_argument('ofile')
+    mask_parser.add_argument('mask_values', help='wet/dry or ocean/land/lake/island/pond, e.g. NaN/1')
+    grid_parser = commands.add_parser('grid', parents=[common],
+                                      help='write the mask values at the nodes of a grid (grdlandmask)')
+    grid_parser.add_argument('template')
+    grid_parser.add_argument('ofile')
+    grid_parser.add_argument('mask_values')
+    points_parser = commands.add_parser('points', parents=[common],
+                                        help='append the level (0-4) of points read from stdin')
+    points_parser.add_argument('--keep', choices=('dry', 'wet'), help='only write the points on dry land (or not)')
+    points_parser.add_argument('--lon-field', type=int, default=1, help='field number of the longitude (from 1)')
+    points_parser.add_argument('--lat-field', type=int, default=2, help='field number of the latitude (from 1)')
+    args = parser.parse_args(argv)
+    if args.command not in ('build', 'mask', 'grid', 'points'):
+        parser.print_help()
+        return 1
+
+    start = time.time()
+    if args.command == 'build':
+        increment = args.increment or INCREMENT
+        path = cache_path(increment, args.resolution, args.cache_dir)
+        if os.path.exists(path) and not args.rebuild:
+            print("%s is already built (--rebuild to replace it)" % path)
+            return 0
+        path = build(increment, args.resolution, args.cache_dir, args.source, args.workers)
+        print("built %s (%.1f s)" % (path, time.time() - start))
+        return 0
+    try:
+        if args.command == 'points':
+            mask = open_mask(args.increment or INCREMENT, args.resolution, args.cache_dir)
+        else:
+            grid = args.ifile if args.command == 'mask' else args.template
+            mask = grid_mask(grid, args.increment, args.resolution, args.cache_dir)
+    except (FileNotFoundError, ValueError) as error:
+        print("Error: %s" % error, file=sys.stderr)
+        return 1
+    if args.command == 'mask':
+        mask_grid(mask, args.ifile, args.ofile, args.mask_values)
+    elif args.command == 'grid':
+        values_grid(mask, args.template, args.ofile, args.mask_values)
+    else:
+        lines = sys.stdin.read().splitlines()
+        fields = [line.split() for line in lines]
+        lon = np.array([float(field[args.lon_field - 1]) for field in fields])
+        lat = np.array([float(field[args.lat_field - 1]) for field in fields])
+        levels = mask.levels(lon, lat)
+        dry = np.isin(levels, DRY_LEVELS)
+        for line, level, is_dry in zip(lines, levels, dry):
+            if args.keep is None or is_dry == (args.keep == 'dry'):
+                sys.stdout.write('%s %d\n' % (line, level))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
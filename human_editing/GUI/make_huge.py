@@ -0,0 +1,161 @@
+"""
+Make huge.xyzi, the pings of every agency in one file, from the .cm archive (replaces makeAgencyCm.csh and
+removeShoalPings.sh, the work of 01makeHuge.csh).
+
+Each .cm file is read once (cm_io.read_cm_text) and, in the same pass: broken lines (fewer than 8 fields, or one of
+the first 8 that is not a number) are reported and left out, flagged pings (sigma_d = 9999) are dropped, longitudes
+are wrapped to -180 <-> 180 and the pings above maxZ (shoaler than a few metres, probably bad) are split off into the
+shoal file, except for the agencies whose shallow data is good (lakes, 3DGBR). Files are read on a pool of
+processes and their pings are written straight to huge.xyzi and huge.shoal.xyzi: no per agency text files are made
+and catted together again.
+
+The output is binary xyzi (little endian float64 lon lat depth sid, read by GMT with -bi4), a third smaller than the
+text and read without parsing; --text writes the text lines makeAgencyCm.csh wrote.
+
+Usage:
+    python make_huge.py hugeFile shoalFile AGENCY=cmDir [AGENCY=cmDir ...] [--max-z -1] [--keep-shoal lakes 3DGBR]
+                        [--text] [--workers N]
+"""
+import os
+import sys
+import glob
+import argparse
+import time
+import concurrent.futures
+import numpy as np
+from cm_io import CHUNK_ROWS, atomic_write, format_rows, read_cm_text, wrap_longitude
+from cruise_store import FLAG_VALUE
+from ping_index import XYZI_BINARY_DTYPE, XYZI_FORMAT
+from world_tiles import read_ahead
+
+# PINGS ABOVE THIS DEPTH (m, NEGATIVE BELOW SEA LEVEL) GO TO THE SHOAL FILE (removeShoalPings.sh -1 IN 01makeHuge.csh)
+MAX_Z = -1.
+
+# AGENCIES WHOSE PINGS ARE ALL KEPT: LAKES ARE ABOVE SEA LEVEL, 3DGBR HAS GOOD DATA FROM 0 DOWN
+KEEP_SHOAL = ('lakes', '3DGBR')
+
+# .cm COLUMNS MADE INTO xyzi (lon lat depth sid) AND THE FLAG COLUMN (sigma_d)
+LON, LAT, DEPTH, SID, FLAG = 1, 2, 3, 6, 5
+
+
+class AgencySummary:
+    """
+    COUNTS FOR ONE AGENCY: n_files READ, n_pings WRITTEN TO THE huge FILE, n_shoal TO THE SHOAL FILE, n_flagged
+    DROPPED, broken = [(.cm path, LINE NUMBERS)] OF THE BROKEN LINES LEFT OUT
+    """
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+        self.n_files = 0
+        self.n_pings = 0
+        self.n_shoal = 0
+        self.n_flagged = 0
+        self.broken = []
+
+    @property
+    def n_broken(self):
+        return sum(len(lines) for path, lines in self.broken)
+
+
+def cm_paths(directory):
+    """THE .cm FILES OF AN AGENCY DIRECTORY (NOT ITS SUBDIRECTORIES, AS makeAgencyCm.csh FINDS THEM)"""
+    return sorted(glob.glob(os.path.join(directory, '*.cm')))
+
+
+def file_pings(path, max_z=MAX_Z):
+    """
+    RETURN (pings, shoal, n_flagged, broken) FOR ONE .cm FILE: ITS UNFLAGGED PINGS AS xyzi [n, 4] SPLIT INTO THOSE AT
+    OR BELOW max_z AND THOSE ABOVE (shoal; NONE IF max_z IS None), AND THE LINE NUMBERS OF ITS BROKEN LINES
+    """
+    values, broken = read_cm_text(path)
+    good = values[:, FLAG] != FLAG_VALUE
+    xyzi = np.column_stack((wrap_longitude(values[good, LON]), values[good, LAT], values[good, DEPTH],
+                            values[good, SID]))
+    shoal = xyzi[:, 2] > max_z if max_z is not None else np.zeros(len(xyzi), dtype=bool)
+    return xyzi[~shoal], xyzi[shoal], int(np.count_nonzero(~good)), broken
+
+
+def file_pings_job(job):
+    return file_pings(*job)
+
+
+def write_xyzi(handle, xyzi, text=False):
+    """WRITE xyzi [n, 4] TO AN OPEN (BINARY MODE) FILE, AS BINARY OR AS makeAgencyCm.csh TEXT"""
+    if not text:
+        handle.write(xyzi.astype(XYZI_BINARY_DTYPE).tobytes())
+        return
+    for start in range(0, len(xyzi), CHUNK_ROWS):
+        chunk = xyzi[start:start + CHUNK_ROWS]
+        handle.write(format_rows(XYZI_FORMAT, [chunk[:, 0], chunk[:, 1], chunk[:, 2], chunk[:, 3]]).encode())
+
+
+def make_huge(agencies, huge_path, shoal_path, max_z=MAX_Z, keep_shoal=KEEP_SHOAL, text=False, workers=1):
+    """
+    WRITE THE PINGS OF THE .cm FILES OF agencies [(name, directory)] TO huge_path AND THEIR SHOAL PINGS TO shoal_path,
+    IN AGENCY AND FILE ORDER. FILES ARE READ ON workers PROCESSES. RETURNS [AgencySummary]
+    """
+    summaries = [AgencySummary(name, directory) for name, directory in agencies]
+    jobs = [(summary, path) for summary in summaries for path in cm_paths(summary.directory)]
+    arguments = [(path, None if summary.name in keep_shoal else max_z) for summary, path in jobs]
+    with atomic_write(huge_path, 'wb') as huge, atomic_write(shoal_path, 'wb') as shoal_file:
+        if workers > 1 and len(jobs) > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            results = read_ahead(executor, file_pings_job, arguments, 2 * workers)
+        else:
+            executor = None
+            results = (file_pings_job(job) for job in arguments)
+        try:
+            for (summary, path), (pings, shoal, n_flagged, broken) in zip(jobs, results):
+                write_xyzi(huge, pings, text)
+                write_xyzi(shoal_file, shoal, text)
+                summary.n_files += 1
+                summary.n_pings += len(pings)
+                summary.n_shoal += len(shoal)
+                summary.n_flagged += n_flagged
+                if len(broken):
+                    summary.broken.append((path, broken.tolist()))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    return summaries
+
+
+def parse_agency(argument):
+    name, separator, directory = argument.partition('=')
+    if not separator or not name or not directory:
+        raise argparse.ArgumentTypeError("agencies are given as NAME=directory, not '%s'" % argument)
+    return name, directory
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Make huge.xyzi from the .cm files of each agency')
+    parser.add_argument('huge_file')
+    parser.add_argument('shoal_file')
+    parser.add_argument('agencies', nargs='+', type=parse_agency, metavar='AGENCY=cmDir')
+    parser.add_argument('--max-z', type=float, default=MAX_Z, help='pings above this depth (m) are shoal pings')
+    parser.add_argument('--keep-shoal', nargs='*', default=list(KEEP_SHOAL), help='agencies keeping all pings')
+    parser.add_argument('--text', action='store_true', help='write xyzi text instead of binary')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    for name, directory in args.agencies:
+        if not os.path.isdir(directory):
+            print("WARNING: %s directory %s not found" % (name, directory))
+    summaries = make_huge(args.agencies, args.huge_file, args.shoal_file, args.max_z, args.keep_shoal, args.text,
+                          args.workers)
+    print("%-12s %8s %12s %12s %10s %8s" % ('agency', 'files', 'pings', 'shoal', 'flagged', 'broken'))
+    for summary in summaries:
+        for path, lines in summary.broken:
+            for line in lines:
+                print("Error: %s:line %d is broken" % (path, line))
+        print("%-12s %8d %12d %12d %10d %8d" % (summary.name, summary.n_files, summary.n_pings, summary.n_shoal,
+                                                 summary.n_flagged, summary.n_broken))
+    print("wrote %d pings to %s and %d shoal pings to %s (%.1f s)" %
+          (sum(summary.n_pings for summary in summaries), args.huge_file,
+           sum(summary.n_shoal for summary in summaries), args.shoal_file, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,377 @@
+"""
+Catalogue of the .cm ping archive, used to open a region for editing.
+
+The archive is the agency directories under MOA_public and MOA_private (set in demPaths.sh and read by
+01makeHuge.csh). ArchiveIndex records for every .cm file its extent and the one degree cells its pings fall in, and
+saves that to a small JSON file. Building it reads every file once; rebuilding only rereads files whose size or
+modification time changed.
+
+open_region() looks up the files with pings in a box or polygon, reads only those, and returns a CruiseSession whose
+merged store holds just the pings inside the region. Flags set on it are written back to each originating file.
+"""
+import os
+import glob
+import json
+import re
+import concurrent.futures
+import numpy as np
+from cm_io import FLOAT_FORMAT, atomic_write, sidecar_path, parse_cm_text, wrap_longitude
+from cruise_session import CruiseSession, DEFAULT_MEMORY_BUDGET
+from cruise_store import CM_COLUMNS, FLAG_COLUMN, FLAG_VALUE
+from polygon_io import PolygonSet
+
+# AGENCY DIRECTORIES OF THE PING ARCHIVE (AS LISTED IN com/bathymetry/01makeHuge.csh)
+PUBLIC_AGENCIES = ('AGSO', 'CCOM', 'GEOMAR', 'IBCAO', 'JAMSTEC', 'NAVO', 'NGDC', 'NOAA', 'NOAA_geodas', 'SIO',
+                   'US_multi', 'lakes')
+PRIVATE_AGENCIES = ('3DGBR', 'GEBCO', 'IFREMER', 'NGA')
+
+# SIZE (DEGREES) OF THE CELLS RECORDED FOR EACH FILE
+CELL_SIZE = 1.0
+
+INDEX_VERSION = 1
+
+# FIELD (FROM 0) OF THE FLAG ON A .cm LINE, AND THE TEXT WRITTEN THERE TO FLAG OR UNFLAG A PING
+FLAG_FIELD = CM_COLUMNS.index(FLAG_COLUMN)
+CM_ID, LON, LAT, DEPTH = (CM_COLUMNS.index(name) for name in ('cm_id', 'lon', 'lat', 'depth'))
+FLAG_TEXT = '%d' % FLAG_VALUE
+UNFLAG_TEXT = '0'
+
+
+def read_dem_settings(path, names):
+    """RETURN {name: value} OF THE (UNQUOTED OR DOUBLE QUOTED, SINGLE WORD) SHELL VARIABLES names SET IN demPaths.sh"""
+    values = {}
+    pattern = re.compile(r'\s*(%s)\s*=\s*"?([^"\s#]+)"?' % '|'.join(names))
+    with open(path) as dem_paths:
+        for line in dem_paths:
+            match = pattern.match(line)
+            if match:
+                values[match.group(1)] = match.group(2)
+    return values
+
+
+def read_dem_paths(path):
+    """RETURN (MOA_public, MOA_private) AS SET IN demPaths.sh"""
+    values = read_dem_settings(path, ('MOA_public', 'MOA_private'))
+    return values.get('MOA_public'), values.get('MOA_private')
+
+
+def archive_dirs(moa_public, moa_private):
+    """RETURN THE AGENCY DIRECTORIES OF THE ARCHIVE THAT EXIST"""
+    dirs = [os.path.join(moa_public, agency) for agency in PUBLIC_AGENCIES] if moa_public else []
+    dirs += [os.path.join(moa_private, agency) for agency in PRIVATE_AGENCIES] if moa_private else []
+    return [directory for directory in dirs if os.path.isdir(directory)]
+
+
+def cell_numbers(lon, lat, cell_size=CELL_SIZE):
+    """RETURN THE NUMBER OF THE cell_size CELL CONTAINING EACH POINT"""
+    n_lon = int(round(360. / cell_size))
+    n_lat = int(round(180. / cell_size))
+    i = np.clip(((wrap_longitude(lon) + 180.) / cell_size).astype(np.int64), 0, n_lon - 1)
+    j = np.clip(((lat + 90.) / cell_size).astype(np.int64), 0, n_lat - 1)
+    return j * n_lon + i
+
+
+def box_cells(bbox, cell_size=CELL_SIZE):
+    """RETURN THE NUMBERS OF THE CELLS OVERLAPPING A (west, east, south, north) BOX"""
+    n_lon = int(round(360. / cell_size))
+    west, east, south, north = bbox
+    i = np.arange(int((west + 180.) // cell_size), int((east + 180.) // cell_size) + 1) % n_lon
+    j = np.clip(np.arange(int((south + 90.) // cell_size), int((north + 90.) // cell_size) + 1), 0,
+                int(round(180. / cell_size)) - 1)
+    return (j[:, np.newaxis] * n_lon + i).ravel()
+
+
+class ArchiveIndex:
+    """
+    EXTENT AND OCCUPIED CELLS OF EVERY .cm FILE IN THE ARCHIVE
+
+    path = JSON FILE THE CATALOGUE IS KEPT IN
+    """
+    def __init__(self, path, cell_size=CELL_SIZE):
+        self.path = path
+        self.cell_size = cell_size
+        self.files = {}  # .cm PATH -> {'mtime', 'size', 'rows', 'bbox', 'cells'}
+        self.errors = {}  # .cm PATH -> WHY THE LAST build() COULD NOT INDEX IT
+        if os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.files)
+
+    def load(self):
+        with open(self.path) as index_file:
+            index = json.load(index_file)
+        if index.get('version') == INDEX_VERSION and index.get('cell_size') == self.cell_size:
+            self.files = index['files']
+
+    def save(self):
+        with atomic_write(self.path, 'w') as index_file:
+            json.dump({'version': INDEX_VERSION, 'cell_size': self.cell_size, 'files': self.files}, index_file)
+
+    def build(self, dirs, verbose=False):
+        """
+        ADD (OR REFRESH) EVERY .cm FILE IN dirs. FILES WHOSE SIZE AND MODIFICATION TIME ARE UNCHANGED ARE NOT REREAD,
+        AND FILES THAT NO LONGER EXIST ARE DROPPED. A FILE THAT CANNOT BE READ IS RECORDED IN self.errors AND KEEPS
+        ITS PREVIOUS ENTRY, IF ANY. RETURNS THE NUMBER OF FILES READ
+        """
+        seen = set()
+        n_read = 0
+        self.errors = {}
+        for directory in dirs:
+            for cm_path in sorted(glob.glob(os.path.join(directory, '*.cm'))):
+                seen.add(cm_path)
+                try:
+                    read = self.add(cm_path)
+                except (OSError, ValueError) as error:
+                    self.errors[cm_path] = str(error)
+                    continue
+                if read:
+                    n_read += 1
+                    if verbose:
+                        print("indexed %s" % cm_path)
+        for cm_path in list(self.files):
+            if cm_path not in seen:
+                del self.files[cm_path]
+        self.save()
+        return n_read
+
+    def add(self, cm_path):
+        """INDEX ONE FILE (IF IT HAS CHANGED). RETURNS True IF IT WAS READ"""
+        stat = os.stat(cm_path)
+        entry = self.files.get(cm_path)
+        if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return False
+        values, rows = read_cm_rows(cm_path)
+        lon = wrap_longitude(values[:, LON])
+        lat = values[:, LAT]
+        self.files[cm_path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'rows': len(values),
+                               'bbox': [float(lon.min()), float(lon.max()), float(lat.min()), float(lat.max())]
+                               if len(values) else None,
+                               'cells': np.unique(cell_numbers(lon, lat, self.cell_size)).tolist()}
+        return True
+
+    def files_in_box(self, bbox):
+        """RETURN THE .cm FILES WITH PINGS IN THE CELLS OVERLAPPING A (west, east, south, north) BOX"""
+        cells = set(box_cells(bbox, self.cell_size).tolist())
+        return sorted(cm_path for cm_path, entry in self.files.items()
+                      if entry['bbox'] is not None and not cells.isdisjoint(entry['cells']))
+
+    def open_region(self, bbox=None, polygons=None, memory_budget=DEFAULT_MEMORY_BUDGET, pings=None):
+        """
+        OPEN THE PINGS INSIDE A (west, east, south, north) BOX AND/OR INSIDE ANY OF A LIST OF POLYGONS ((N, 2)
+        lon/lat VERTEX ARRAYS, OR A PolygonSet). RETURNS (CruiseSession, MERGED CruiseStore OF THE PINGS INSIDE)
+
+        pings = OPTIONAL PingIndex BUILT FROM THE .cm FILES; THE PINGS INSIDE ARE THEN FOUND IN THE INDEX INSTEAD OF
+                BY SCANNING EVERY CANDIDATE FILE (FLAGGED PINGS ARE NOT IN A PingIndex SO THEY ARE NOT OPENED)
+        """
+        if polygons is not None and not isinstance(polygons, PolygonSet):
+            polygons = PolygonSet.from_polygons(polygons)
+        if bbox is None:
+            bbox = polygons.bbox
+        if pings is not None:
+            return self.open_indexed_region(pings, bbox, polygons, memory_budget)
+        paths = self.files_in_box(bbox)
+        session = CruiseSession(paths, memory_budget=memory_budget, name='region')
+
+        # 1.0 FIND THE PINGS INSIDE THE REGION IN EACH CANDIDATE FILE
+        rows = {}
+        for source_id in range(len(paths)):
+            cruise = session.cruise(source_id)
+            lon = wrap_longitude(cruise['lon'])
+            lat = cruise['lat']
+            inside = (lon >= bbox[0]) & (lon <= bbox[1]) & (lat >= bbox[2]) & (lat <= bbox[3])
+            if polygons is not None:
+                candidates = np.flatnonzero(inside)
+                inside[candidates[~polygons.contains(lon[candidates], lat[candidates])]] = False
+            if inside.any():
+                rows[source_id] = np.flatnonzero(inside)
+            session.evict(keep=list(rows))
+
+        # 2.0 MERGE THEM INTO ONE STORE FOR EDITING
+        return session, session.merge(sorted(rows), rows)
+
+    def open_indexed_region(self, pings, bbox, polygons, memory_budget):
+        """
+        open_region() USING A PingIndex TO FIND THE SOURCE FILE AND ROW OF EACH PING INSIDE THE REGION. RAISES
+        ValueError IF ANY OF THOSE FILES CHANGED SINCE IT WAS INDEXED (ITS ROWS WOULD NOT MATCH)
+        """
+        if polygons is not None:
+            records = pings.query_polygons(polygons)
+        else:
+            records = pings.query_box(*bbox)
+        sources = np.unique(records['source'])
+        pings.check(sources.tolist())
+        paths = pings.source_paths()
+        session = CruiseSession([paths[source] for source in sources], memory_budget=memory_budget, name='region')
+        rows = {}
+        for source_id, source in enumerate(sources):
+            rows[source_id] = np.sort(records['row'][records['source'] == source])
+        return session, session.merge(sorted(rows), rows)
+
+    def files_for_polygons(self, polygons):
+        """RETURN {.cm PATH: INDICES OF THE POLYGONS WHOSE BOUNDING BOX TOUCHES ITS CELLS}"""
+        cell_polygons = {}
+        for i, bbox in enumerate(polygons.bboxes):
+            for cell in box_cells(bbox, self.cell_size).tolist():
+                cell_polygons.setdefault(cell, []).append(i)
+        files = {}
+        for cm_path, entry in self.files.items():
+            hits = set()
+            for cell in entry['cells']:
+                hits.update(cell_polygons.get(cell, ()))
+            if hits:
+                files[cm_path] = sorted(hits)
+        return files
+
+    def apply_polygons(self, polygons, flagged=True, workers=1, dry_run=False, report=None):
+        """
+        FLAG (OR UNFLAG) EVERY PING IN THE ARCHIVE INSIDE ANY OF THE POLYGONS (A PolygonSet) IN ONE PASS: EACH
+        AFFECTED FILE IS READ ONCE, TESTED AGAINST ONLY THE POLYGONS NEAR IT, AND THE FLAG FIELD OF THE LINES WHOSE
+        FLAG CHANGED IS REWRITTEN (rewrite_flags). FILES ARE PROCESSED ON workers PROCESSES. dry_run = FIND THE
+        CHANGES WITHOUT WRITING THEM. A FILE THAT CANNOT BE READ OR WRITTEN DOES NOT STOP THE OTHERS: ITS FileChange
+        RECORDS THE error.
+
+        report = OPTIONAL FUNCTION CALLED WITH EACH FileChange AS SOON AS ITS FILE IS DONE, SO THE CHANGES ALREADY
+                 WRITTEN ARE RECORDED EVEN IF THE RUN IS STOPPED
+
+        RETURNS A LIST OF FileChange (ONE PER FILE TESTED)
+        """
+        jobs = [(cm_path, PolygonSet.from_polygons([polygons[i] for i in polygon_numbers]), polygon_numbers)
+                for cm_path, polygon_numbers in sorted(self.files_for_polygons(polygons).items())]
+        changes = []
+        try:
+            if workers > 1 and len(jobs) > 1:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = dict((executor.submit(apply_polygons_to_file, cm_path, file_polygons, flagged, dry_run),
+                                    polygon_numbers) for cm_path, file_polygons, polygon_numbers in jobs)
+                    for future in concurrent.futures.as_completed(futures):
+                        changes.append(self.file_done(future.result(), futures[future], dry_run, report))
+            else:
+                for cm_path, file_polygons, polygon_numbers in jobs:
+                    changes.append(self.file_done(apply_polygons_to_file(cm_path, file_polygons, flagged, dry_run),
+                                                  polygon_numbers, dry_run, report))
+        finally:
+            self.save()
+        return sorted(changes, key=lambda change: change.path)
+
+    def file_done(self, change, polygon_numbers, dry_run, report):
+        """RECORD WHICH POLYGONS WERE TESTED AGAINST A FILE, REINDEX IT IF IT WAS REWRITTEN AND REPORT THE CHANGE"""
+        change.polygons = polygon_numbers
+        if change.n_changed and not dry_run and change.error is None:
+            try:
+                self.add(change.path)
+            except (OSError, ValueError) as error:
+                change.error = 'rewritten but not reindexed: %s' % error
+        if report is not None:
+            report(change)
+        return change
+
+
+class FileChange:
+    """
+    FLAG CHANGES MADE TO ONE .cm FILE BY apply_polygons_to_file
+
+    rows = ROW NUMBERS WHOSE FLAG CHANGED; cm_id, lon, lat, depth = THOSE PINGS; sigma_d = THEIR FLAG FIELD BEFORE
+    THE CHANGE, AS IT WAS WRITTEN IN THE FILE (restore_flags PUTS IT BACK); error = WHY THE FILE COULD NOT BE READ OR
+    WRITTEN (NOTHING WAS CHANGED), OR None
+    """
+    def __init__(self, path, n_rows, n_inside, rows, cm_id, lon, lat, depth, sigma_d=(), error=None):
+        self.path = path
+        self.n_rows = n_rows
+        self.n_inside = n_inside
+        self.rows = rows
+        self.cm_id = cm_id
+        self.lon = lon
+        self.lat = lat
+        self.depth = depth
+        self.sigma_d = list(sigma_d)
+        self.error = error
+        self.polygons = []
+
+    @property
+    def n_changed(self):
+        return len(self.rows)
+
+
+def row_lines(lines):
+    """LINE NUMBERS (FROM 0) OF THE ROWS OF A .cm FILE SPLIT INTO lines: ITS NON BLANK, NON COMMENT LINES"""
+    return [number for number, line in enumerate(lines) if line.strip() and not line.lstrip().startswith(b'#')]
+
+
+def read_cm_rows(cm_path):
+    """
+    READ A .cm FILE WITH parse_cm_text, WHICH LEAVES OUT BROKEN LINES INSTEAD OF RAISING. RETURNS (values, THE ROW
+    NUMBER OF EACH PING AS rewrite_flags COUNTS ROWS), SO FLAGS ARE WRITTEN BACK TO THE RIGHT LINES EVEN WHEN A BROKEN
+    LINE COMES BEFORE THEM
+    """
+    with open(cm_path, 'rb') as cm_file:
+        text = cm_file.read()
+    values, broken = parse_cm_text(text)
+    lines = text.split(b'\n')
+    good = np.ones(len(lines), dtype=bool)
+    good[broken - 1] = False
+    numbers = np.asarray(row_lines(lines), dtype=np.int64)
+    rows = np.flatnonzero(good[numbers])
+    if rows.size != len(values):
+        raise ValueError("%s: the parsed rows do not match its lines" % cm_path)
+    return values, rows
+
+
+def rewrite_flags(cm_path, rows, texts):
+    """
+    WRITE texts (ONE STRING PER ROW, OR ONE FOR ALL) INTO THE FLAG FIELD OF THE GIVEN ROWS (NON BLANK, NON COMMENT
+    LINES, FROM 0, AS read_cm_rows NUMBERS THEM) OF A .cm FILE, COPYING EVERY OTHER BYTE OF THE FILE THROUGH UNCHANGED.
+    A BINARY SIDECAR OF THE FILE IS REMOVED RATHER THAN LEFT OUT OF DATE. RETURNS THE FLAG FIELDS THAT WERE REPLACED
+    """
+    with open(cm_path, 'rb') as cm_file:
+        lines = cm_file.read().split(b'\n')
+    numbers = row_lines(lines)
+    if isinstance(texts, str):
+        texts = [texts] * len(rows)
+    previous = []
+    for row, text in zip(np.asarray(rows, dtype=np.int64).tolist(), texts):
+        number = numbers[row]
+        fields = [match.span() for match in re.finditer(rb'\S+', lines[number])]
+        start, stop = fields[FLAG_FIELD]
+        previous.append(lines[number][start:stop].decode())
+        lines[number] = lines[number][:start] + text.encode() + lines[number][stop:]
+    with atomic_write(cm_path, 'wb') as cm_file:
+        cm_file.write(b'\n'.join(lines))
+    if os.path.exists(sidecar_path(cm_path)):
+        os.remove(sidecar_path(cm_path))
+    return previous
+
+
+def apply_polygons_to_file(cm_path, polygons, flagged=True, dry_run=False):
+    """
+    FLAG (OR UNFLAG) THE PINGS OF ONE .cm FILE INSIDE THE POLYGONS. RETURNS A FileChange, WITH THE error IF THE FILE
+    COULD NOT BE READ OR WRITTEN
+    """
+    try:
+        values, file_rows = read_cm_rows(cm_path)
+        inside = polygons.contains(wrap_longitude(values[:, LON]), values[:, LAT])
+        changed = np.flatnonzero(inside & ((values[:, FLAG_FIELD] == FLAG_VALUE) != flagged))
+        change = FileChange(cm_path, len(values), int(inside.sum()), file_rows[changed], values[changed, CM_ID],
+                            values[changed, LON], values[changed, LAT], values[changed, DEPTH])
+        if changed.size and not dry_run:
+            change.sigma_d = rewrite_flags(cm_path, change.rows, FLAG_TEXT if flagged else UNFLAG_TEXT)
+        else:
+            change.sigma_d = [FLOAT_FORMAT % value for value in values[changed, FLAG_FIELD].tolist()]
+    except (OSError, ValueError) as error:
+        empty = np.empty(0)
+        change = FileChange(cm_path, 0, 0, np.empty(0, dtype=np.int64), empty, empty, empty, empty, error=str(error))
+    return change
+
+
+def restore_flags(cm_path, rows, cm_id, sigma_d):
+    """
+    PUT BACK THE FLAG FIELDS sigma_d A FileChange RECORDED FOR rows OF A .cm FILE, CHECKING THE PINGS cm_id ARE STILL
+    ON THOSE ROWS. RETURNS THE FLAG FIELDS THAT WERE REPLACED
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    values, file_rows = read_cm_rows(cm_path)
+    found = np.minimum(np.searchsorted(file_rows, rows), max(len(file_rows) - 1, 0))
+    if rows.size and (not len(file_rows) or np.any(file_rows[found] != rows) or
+                      np.any(values[found, CM_ID] != np.asarray(cm_id))):
+        raise ValueError("%s has changed since its flags were recorded" % cm_path)
+    return rewrite_flags(cm_path, rows, sigma_d)
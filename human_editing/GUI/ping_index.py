@@ -0,0 +1,397 @@
+"""
+Persistent spatial index of the ping archive (huge.xyzi, or .cm files).
+
+Pings are stored sorted by the Hilbert curve key of their position, so pings that are close on the ground are close on
+disk. Each sorted run is cut into fixed size blocks and a small directory keeps the key range and lon/lat box of every
+block. A box or polygon query reads the block directory, memory maps the run and touches only the blocks whose box
+overlaps the query, instead of scanning the whole archive as selectAndSort does.
+
+New pings are added as a new sorted run (nothing already written is rewritten); compact() merges the runs back into one
+when there are too many.
+
+The size and modification time of every source file are kept with it. A file changed since it was indexed (a .cm file
+whose flags were saved, a remade huge.xyzi) is stale: its rows no longer match the index. stale_sources() lists them,
+check() raises for them and refresh() reads them again in place of their old pings.
+
+Index directory layout:
+    index.json          RUN LIST AND SOURCE FILE LIST (path, mtime, size)
+    run_NNNNN.npy       PING RECORDS OF ONE RUN (numpy STRUCTURED ARRAY, SORTED BY key)
+    run_NNNNN.blk.npy   BLOCK DIRECTORY OF THE RUN
+
+Usage:
+    python ping_index.py build index_dir huge.xyzi [more.xyzi ...]
+    python ping_index.py append index_dir new.xyzi|new.cm [...]
+    python ping_index.py query index_dir west east south north > picked.xyzi
+    python ping_index.py compact index_dir
+    python ping_index.py refresh index_dir                                  (read changed source files again)
+    python ping_index.py select huge.xyzi west east south north > picked.xyzi     (scan a text or binary xyzi file)
+"""
+import os
+import sys
+import json
+import itertools
+import numpy as np
+from cm_io import read_cm, atomic_write, wrap_longitude
+from polygon_io import PolygonSet
+
+# BITS PER AXIS OF THE HILBERT KEY (2**20 CELLS OF 360/2**20 DEGREES = ~40 m AT THE EQUATOR)
+HILBERT_ORDER = 20
+
+# PINGS PER BLOCK
+BLOCK_SIZE = 4096
+
+# NUMBER OF RUNS ABOVE WHICH append() COMPACTS THE INDEX
+MAX_RUNS = 16
+
+# PINGS READ FROM A TEXT FILE AT A TIME
+READ_ROWS = 1000000
+
+# LINE FORMAT OF xyzi TEXT (AS makeAgencyCm.csh WROTE IT). BINARY xyzi IS LITTLE ENDIAN float64 x y z sid (GMT -bi4)
+XYZI_FORMAT = '%.7f %r %r %05d\n'
+XYZI_BINARY_DTYPE = np.dtype('<f8')
+
+INDEX_VERSION = 2
+
+# ONE PING. source/row ARE THE FILE (POSITION IN THE INDEX SOURCE LIST) AND ROW THE PING CAME FROM
+PING_DTYPE = np.dtype([('key', '<u8'), ('lon', '<f8'), ('lat', '<f8'), ('depth', '<f8'), ('sid', '<i4'),
+                       ('source', '<i4'), ('row', '<i8')])
+BLOCK_DTYPE = np.dtype([('key_min', '<u8'), ('key_max', '<u8'), ('lon_min', '<f8'), ('lon_max', '<f8'),
+                        ('lat_min', '<f8'), ('lat_max', '<f8')])
+
+
+def hilbert_keys(lon, lat, order=HILBERT_ORDER):
+    """RETURN THE HILBERT CURVE KEY OF EACH lon/lat POSITION (ON A 2**order x 2**order GLOBAL GRID)"""
+    n = 1 << order
+    x = np.clip(((wrap_longitude(np.asarray(lon, dtype=float)) + 180.) / 360. * n).astype(np.int64), 0, n - 1)
+    y = np.clip(((np.asarray(lat, dtype=float) + 90.) / 180. * n).astype(np.int64), 0, n - 1)
+    key = np.zeros(len(x), dtype=np.uint64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        key += np.uint64(s) * np.uint64(s) * ((3 * rx) ^ ry).astype(np.uint64)
+        # ROTATE THE QUADRANT SO THE CURVE IS CONTINUOUS
+        flip = ~ry
+        swap = flip & rx
+        x = np.where(swap, n - 1 - x, x)
+        y = np.where(swap, n - 1 - y, y)
+        x, y = np.where(flip, y, x), np.where(flip, x, y)
+        s >>= 1
+    return key
+
+
+def ping_records(lon, lat, depth, sid, source=-1, row=None):
+    """RETURN PING RECORDS (UNSORTED) FOR THE GIVEN COLUMNS"""
+    records = np.empty(len(lon), dtype=PING_DTYPE)
+    records['lon'] = wrap_longitude(np.asarray(lon, dtype=float))
+    records['lat'] = lat
+    records['depth'] = depth
+    records['sid'] = sid
+    records['source'] = source
+    records['row'] = np.arange(len(lon)) if row is None else row
+    records['key'] = hilbert_keys(records['lon'], records['lat'])
+    return records
+
+
+def is_binary(path, n_bytes=256):
+    """TRUE IF A FILE DOES NOT START WITH TEXT (E.G. BINARY xyzi)"""
+    with open(path, 'rb') as source:
+        start = source.read(n_bytes)
+    return any(byte > 126 or (byte < 32 and byte not in b'\t\n\r') for byte in start)
+
+
+def read_xyzi(path, read_rows=READ_ROWS):
+    """YIELD PING RECORDS FROM AN xyzi TEXT OR BINARY FILE (lon lat depth sid), read_rows AT A TIME"""
+    if is_binary(path):
+        values = np.memmap(path, dtype=XYZI_BINARY_DTYPE, mode='r').reshape(-1, 4)
+        for first_row in range(0, len(values), read_rows):
+            chunk = values[first_row:first_row + read_rows]
+            yield ping_records(chunk[:, 0], chunk[:, 1], chunk[:, 2], chunk[:, 3],
+                               row=np.arange(first_row, first_row + len(chunk)))
+        return
+    first_row = 0
+    with open(path) as xyzi:
+        while True:
+            # read_rows LINES AT A TIME; numpy IS ONLY GIVEN LINES WITH A PING ON THEM, SO IT IS NEVER LEFT WITH
+            # NOTHING TO READ AT THE END OF THE FILE
+            block = list(itertools.islice(xyzi, read_rows))
+            lines = [line for line in block if line.strip() and not line.lstrip().startswith('#')]
+            if lines:
+                chunk = np.loadtxt(lines, ndmin=2)
+                sid = chunk[:, 3] if chunk.shape[1] > 3 else np.zeros(len(chunk))
+                yield ping_records(chunk[:, 0], chunk[:, 1], chunk[:, 2], sid,
+                                   row=np.arange(first_row, first_row + len(chunk)))
+                first_row += len(chunk)
+            if len(block) < read_rows:
+                return
+
+
+def read_cm_pings(path, source):
+    """RETURN THE UNFLAGGED PINGS OF A .cm FILE AS PING RECORDS (AS makeAgencyCm.csh SELECTS THEM)"""
+    store = read_cm(path)
+    good = ~store.flagged
+    return ping_records(store['lon'][good], store['lat'][good], store['depth'][good], store['score'][good]
+                        if 'score' in store else 0, source=source, row=np.flatnonzero(good))
+
+
+def block_directory(records, block_size=BLOCK_SIZE):
+    """RETURN THE BLOCK DIRECTORY OF A SORTED RUN"""
+    starts = np.arange(0, len(records), block_size)
+    blocks = np.empty(len(starts), dtype=BLOCK_DTYPE)
+    if len(records) == 0:
+        return blocks
+    blocks['key_min'] = records['key'][starts]
+    blocks['key_max'] = records['key'][np.minimum(starts + block_size, len(records)) - 1]
+    blocks['lon_min'] = np.minimum.reduceat(records['lon'], starts)
+    blocks['lon_max'] = np.maximum.reduceat(records['lon'], starts)
+    blocks['lat_min'] = np.minimum.reduceat(records['lat'], starts)
+    blocks['lat_max'] = np.maximum.reduceat(records['lat'], starts)
+    return blocks
+
+
+class PingIndex:
+    """
+    HILBERT-SORTED, BLOCKED PING INDEX KEPT IN A DIRECTORY
+
+    directory = INDEX DIRECTORY (CREATED IF IT DOES NOT EXIST)
+    """
+    def __init__(self, directory, block_size=BLOCK_SIZE):
+        self.directory = directory
+        self.block_size = block_size
+        self.runs = []  # RUN FILE STEMS, OLDEST FIRST
+        self.sources = []  # FILES THE PINGS CAME FROM {'path', 'mtime', 'size'} (source = POSITION IN THIS LIST)
+        self.next_run = 0
+        self.cache = {}  # RUN STEM -> (MEMORY MAPPED RECORDS, BLOCK DIRECTORY)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.path('index.json')):
+            self.load()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        with open(self.path('index.json')) as index_file:
+            index = json.load(index_file)
+        if index.get('version') != INDEX_VERSION or index.get('hilbert_order') != HILBERT_ORDER:
+            raise ValueError("%s was built by a different version of ping_index" % self.directory)
+        self.runs = index['runs']
+        self.sources = index['sources']
+        self.next_run = index['next_run']
+        self.block_size = index['block_size']
+
+    def save(self):
+        with atomic_write(self.path('index.json'), 'w') as index_file:
+            json.dump({'version': INDEX_VERSION, 'hilbert_order': HILBERT_ORDER, 'block_size': self.block_size,
+                       'next_run': self.next_run, 'runs': self.runs, 'sources': self.sources}, index_file)
+
+    def __len__(self):
+        return sum(len(self.run(stem)[0]) for stem in self.runs)
+
+    def run(self, stem):
+        """RETURN (RECORDS, BLOCKS) OF A RUN (RECORDS ARE MEMORY MAPPED, NOT READ)"""
+        try:
+            return self.cache[stem]
+        except KeyError:
+            pass
+        records = np.load(self.path(stem + '.npy'), mmap_mode='r')
+        blocks = np.load(self.path(stem + '.blk.npy'))
+        self.cache[stem] = (records, blocks)
+        return records, blocks
+
+    # WRITING ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def write_run(self, records):
+        """SORT RECORDS BY KEY AND WRITE THEM AS A NEW RUN. RETURNS THE RUN STEM"""
+        records = records[np.argsort(records['key'], kind='stable')]
+        stem = 'run_%05d' % self.next_run
+        self.next_run += 1
+        with atomic_write(self.path(stem + '.npy'), 'wb') as run_file:
+            np.save(run_file, records, allow_pickle=False)
+        with atomic_write(self.path(stem + '.blk.npy'), 'wb') as block_file:
+            np.save(block_file, block_directory(records, self.block_size), allow_pickle=False)
+        return stem
+
+    def add_source(self, path):
+        """RETURN THE source NUMBER OF A FILE, ADDING IT (WITH ITS SIZE AND MODIFICATION TIME) TO THE SOURCE LIST"""
+        path = os.path.abspath(path)
+        if path in self.source_paths():
+            raise ValueError("%s is already in the index" % path)
+        self.sources.append({'path': path})
+        self.stamp_source(len(self.sources) - 1)
+        return len(self.sources) - 1
+
+    def stamp_source(self, source):
+        """RECORD THE SIZE AND MODIFICATION TIME OF A SOURCE FILE AS IT IS READ"""
+        stat = os.stat(self.sources[source]['path'])
+        self.sources[source].update(mtime=stat.st_mtime, size=stat.st_size)
+
+    def read_source(self, source):
+        """RETURN THE PING RECORDS OF A SOURCE FILE (xyzi OR .cm)"""
+        path = self.sources[source]['path']
+        if path.endswith('.cm'):
+            return read_cm_pings(path, source)
+        parts = []
+        for records in read_xyzi(path):
+            records['source'] = source
+            parts.append(records)
+        return np.concatenate(parts) if parts else np.empty(0, dtype=PING_DTYPE)
+
+    def append(self, paths):
+        """
+        ADD THE PINGS OF xyzi OR .cm FILES AS ONE NEW RUN (EXISTING RUNS ARE NOT REWRITTEN). RETURNS THE NUMBER
+        OF PINGS ADDED
+        """
+        parts = [self.read_source(self.add_source(path)) for path in paths]
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=PING_DTYPE)
+        if len(records):
+            self.runs.append(self.write_run(records))
+        self.save()
+        if len(self.runs) > MAX_RUNS:
+            self.compact()
+        return len(records)
+
+    def compact(self):
+        """MERGE ALL RUNS INTO ONE"""
+        if len(self.runs) <= 1:
+            return
+        self.replace_runs(np.concatenate([np.asarray(self.run(stem)[0]) for stem in self.runs]))
+
+    def replace_runs(self, records):
+        """WRITE records AS THE ONE RUN OF THE INDEX, REMOVING THE OLD RUNS"""
+        old_runs = list(self.runs)
+        self.runs = [self.write_run(records)] if len(records) else []
+        self.save()
+        self.cache.clear()
+        for stem in old_runs:
+            os.remove(self.path(stem + '.npy'))
+            os.remove(self.path(stem + '.blk.npy'))
+
+    def refresh(self):
+        """
+        READ THE STALE SOURCE FILES AGAIN: THEIR OLD PINGS ARE DROPPED AND THEIR PINGS NOW ADDED, AND THE RUNS ARE
+        MERGED INTO ONE. A SOURCE FILE THAT NO LONGER EXISTS KEEPS ITS NUMBER BUT HAS NO PINGS. RETURNS THE STALE PATHS
+        """
+        stale = self.stale_sources()
+        if not stale:
+            return []
+        source_numbers = np.flatnonzero(np.isin(self.source_paths(), stale))
+        parts = []
+        for stem in self.runs:
+            records = self.run(stem)[0]
+            parts.append(np.asarray(records[~np.isin(records['source'], source_numbers)]))
+        for source in source_numbers.tolist():
+            if os.path.exists(self.sources[source]['path']):
+                self.stamp_source(source)
+                parts.append(self.read_source(source))
+            else:
+                self.sources[source].update(mtime=None, size=None)
+        self.replace_runs(np.concatenate(parts) if parts else np.empty(0, dtype=PING_DTYPE))
+        return stale
+
+    # SOURCE FILES ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def source_paths(self):
+        """RETURN THE PATHS OF THE SOURCE FILES (INDEXED BY source)"""
+        return [entry['path'] for entry in self.sources]
+
+    def stale_sources(self, sources=None):
+        """
+        RETURN THE PATHS OF THE SOURCE FILES (ALL, OR THE source NUMBERS GIVEN) CHANGED OR REMOVED SINCE THEY WERE
+        INDEXED
+        """
+        stale = []
+        for source in range(len(self.sources)) if sources is None else sources:
+            entry = self.sources[source]
+            try:
+                stat = os.stat(entry['path'])
+            except FileNotFoundError:
+                if entry['size'] is not None:
+                    stale.append(entry['path'])
+                continue
+            if stat.st_mtime != entry['mtime'] or stat.st_size != entry['size']:
+                stale.append(entry['path'])
+        return stale
+
+    def check(self, sources=None):
+        """RAISE ValueError IF ANY OF THE SOURCE FILES (ALL, OR THE source NUMBERS GIVEN) IS STALE"""
+        stale = self.stale_sources(sources)
+        if stale:
+            raise ValueError("%s: %d source files changed since they were indexed (%s%s), run ping_index.py refresh" %
+                             (self.directory, len(stale), ', '.join(stale[:3]), ' ...' if len(stale) > 3 else ''))
+
+    # QUERIES ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def query_box(self, west, east, south, north):
+        """RETURN THE PING RECORDS INSIDE A lon/lat BOX (lon IN -180 <-> 180, AS selectAndSort)"""
+        parts = []
+        for stem in self.runs:
+            records, blocks = self.run(stem)
+            hit = np.flatnonzero((blocks['lon_max'] >= west) & (blocks['lon_min'] <= east) &
+                                 (blocks['lat_max'] >= south) & (blocks['lat_min'] <= north))
+            if hit.size == 0:
+                continue
+
+            # READ RUNS OF CONSECUTIVE BLOCKS AS ONE SLICE
+            breaks = np.flatnonzero(np.diff(hit) != 1) + 1
+            for first, last in zip(hit[np.r_[0, breaks]], hit[np.r_[breaks - 1, len(hit) - 1]]):
+                chunk = records[first * self.block_size:(last + 1) * self.block_size]
+                inside = ((chunk['lon'] >= west) & (chunk['lon'] <= east) &
+                          (chunk['lat'] >= south) & (chunk['lat'] <= north))
+                parts.append(np.asarray(chunk[inside]))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=PING_DTYPE)
+
+    def query_polygons(self, polygons):
+        """RETURN THE PING RECORDS INSIDE ANY OF A LIST OF POLYGONS ((N, 2) lon/lat VERTEX ARRAYS, OR A PolygonSet)"""
+        if not isinstance(polygons, PolygonSet):
+            polygons = PolygonSet.from_polygons(polygons)
+        records = self.query_box(*polygons.bbox)
+        return records[polygons.contains(records['lon'], records['lat'])]
+
+
+def select_box(path, west, east, south, north):
+    """YIELD THE PING RECORDS OF AN xyzi FILE INSIDE A lon/lat BOX, SCANNING THE FILE (AS selectAndSort, NO INDEX)"""
+    for records in read_xyzi(path):
+        yield records[(records['lon'] >= west) & (records['lon'] <= east) & (records['lat'] >= south) &
+                      (records['lat'] <= north)]
+
+
+def write_xyzi(handle, records):
+    """WRITE PING RECORDS AS xyzi TEXT (THE FORMAT makeAgencyCm.csh WRITES)"""
+    for start in range(0, len(records), READ_ROWS):
+        chunk = records[start:start + READ_ROWS]
+        handle.write(''.join(XYZI_FORMAT % row for row in
+                             zip(chunk['lon'].tolist(), chunk['lat'].tolist(), chunk['depth'].tolist(),
+                                 chunk['sid'].tolist())))
+
+
+def main(argv):
+    if len(argv) == 6 and argv[0] == 'select':
+        west, east, south, north = [float(value) for value in argv[2:6]]
+        for records in select_box(argv[1], west, east, south, north):
+            write_xyzi(sys.stdout, records)
+        return 0
+    if len(argv) < 2 or argv[0] not in ('build', 'append', 'query', 'compact', 'refresh'):
+        print(__doc__)
+        return 1
+    command, index = argv[0], PingIndex(argv[1])
+    if command in ('build', 'append'):
+        if command == 'build' and index.runs:
+            print("%s already holds an index, use append" % argv[1])
+            return 1
+        print("added %d pings" % index.append(argv[2:]), file=sys.stderr)
+    elif command == 'query':
+        west, east, south, north = [float(value) for value in argv[2:6]]
+        for path in index.stale_sources():
+            print("WARNING: %s changed since it was indexed" % path, file=sys.stderr)
+        write_xyzi(sys.stdout, index.query_box(west, east, south, north))
+    elif command == 'refresh':
+        for path in index.refresh():
+            print("refreshed %s" % path, file=sys.stderr)
+    else:
+        index.compact()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
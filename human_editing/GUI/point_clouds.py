@@ -1,157 +1,208 @@
 import vtk
+import numpy as np
+from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+from cruise_store import FLAG_COLUMN
 
 
 class VtkPointCloud:
     """
-    DOC STRING
-    """
-    def __init__(self, xyz, xyz_difference, xyz_score, maxNumPoints=10e7):
+    VTK POINT CLOUD OF THE .cm PINGS.
 
-        # INITIALISE POINT DATA
-        self.xyz = xyz  # % THIS IS THE XYZ DATA
-        self.xyz_difference = xyz_difference  # % THIS IS THE XYZ WITH Z = DIFFERENCE BETWEEN OBS && PREDICTED
-        self.maxNumPoints = maxNumPoints
+    THE SCALAR ARRAYS WRAP THE CruiseStore COLUMNS WITHOUT COPYING THEM, SO EDITS MADE THROUGH THE STORE (E.G. FLAGS)
+    ONLY NEED A Modified() CALL TO SHOW UP IN THE RENDER.
+    """
+    def __init__(self, xyz, store):
+
+        # INITIALISE POINT DATA (KEEP REFERENCES TO EVERY ARRAY WRAPPED BY VTK SO THEY ARE NOT GARBAGE COLLECTED)
+        self.xyz = np.ascontiguousarray(xyz, dtype=float)  # % THIS IS THE (SCALED) PROJECTED XYZ DATA
+        self.store = store
+        self.line_numbers = store.line_number
+        self.depth_values = np.ascontiguousarray(self.xyz[:, 2])
+        if 'difference' in store:
+            self.diff_values = np.ascontiguousarray(store['difference'], dtype=float)
+        else:
+            self.diff_values = np.zeros(len(store))
+        n = len(self.xyz)
 
         # CREATE vtkPolyData OBJECT
         self.cm_poly_data = vtk.vtkPolyData()
         self.xyz_points = vtk.vtkPoints()
+        self.xyz_points.SetData(numpy_to_vtk(self.xyz, deep=False))
         self.cm_poly_data.SetPoints(self.xyz_points)
 
-        # CREATE vtkPolyData VERTICES
+        # CREATE vtkPolyData VERTICES (ONE VERTEX CELL PER POINT)
+        self.cell_ids = np.empty((n, 2), dtype=np.int64)
+        self.cell_ids[:, 0] = 1
+        self.cell_ids[:, 1] = np.arange(n)
         self.xyz_cells = vtk.vtkCellArray()
+        self.xyz_cells.SetCells(n, numpy_to_vtkIdTypeArray(self.cell_ids.ravel(), deep=True))
         self.cm_poly_data.SetVerts(self.xyz_cells)
-        # self.xyz_cells.SetName('XYArray')
 
         # CREATE vtkPolyData SCALAR VALUES
 
         # SCALAR 1 = cm file line number - This is used for numpy array data manipulation
-        self.cm_line_number = vtk.vtkDoubleArray()
-        self.cm_line_number.SetName('cm_line_number')
-        self.cm_poly_data.GetPointData().AddArray(self.cm_line_number)
+        self.cm_line_number = self.add_array(self.line_numbers, 'cm_line_number')
 
         # SCALAR 2 = cm file id
-        self.cm_id = vtk.vtkDoubleArray()
-        self.cm_id.SetName('cm_id')
-        self.cm_poly_data.GetPointData().AddArray(self.cm_id)
+        self.cm_id = self.add_array(store['cm_id'], 'cm_id')
 
         # SCALAR 3 = DEPTH
-        self.xyz_depth = vtk.vtkDoubleArray()
-        self.xyz_depth.SetName('Z')
-        self.cm_poly_data.GetPointData().AddArray(self.xyz_depth)
+        self.xyz_depth = self.add_array(self.depth_values, 'Z')
         self.cm_poly_data.GetPointData().SetScalars(self.xyz_depth)
         self.cm_poly_data.GetPointData().SetActiveScalars('Z')
 
         # SCALAR 4 = DIFFERENCE (PREDICTED-OBSERVED) DEPTHS
-        self.diff = vtk.vtkDoubleArray()
-        self.diff.SetName('DIFF')
-        self.cm_poly_data.GetPointData().AddArray(self.diff)
+        self.diff = self.add_array(self.diff_values, 'DIFF')
 
         # SCALAR 5 = ML SCORE
-        self.score = vtk.vtkDoubleArray()
-        self.score.SetName('SCORE')
-        self.cm_poly_data.GetPointData().AddArray(self.score)
+        self.score = self.add_array(store['score'], 'SCORE')
+
+        # SCALAR 6 = FLAG COLUMN (SHARED WITH THE MAP VIEW)
+        self.flag = self.add_array(store[FLAG_COLUMN], 'FLAG')
 
-        # OLD METHOD~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # SET COLOR MAPPER
         self.mapper = vtk.vtkPolyDataMapper()
         self.mapper.SetInputData(self.cm_poly_data)
         self.mapper.SetColorModeToDefault()
         self.mapper.SetScalarRange(self.xyz[:, 2].min(), self.xyz[:, 2].max())
         self.mapper.SetScalarVisibility(1)
-        self.vtkActor = vtk.vtkActor()
-        self.vtkActor.SetMapper(self.mapper)
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
         # CREATE ACTOR TO BE ADDED TO RENDER
         self.vtkActor = vtk.vtkActor()
         self.vtkActor.SetMapper(self.mapper)
 
-    def addPoint(self, point, xyz_cm_id, xyz_cm_line_number, difference_xyz, score_xyz):
-
-        if self.xyz_points.GetNumberOfPoints() < self.maxNumPoints:
-            pointId = self.xyz_points.InsertNextPoint(point[:])
-            self.xyz_depth.InsertNextValue(point[2])
-            self.xyz_cells.InsertNextCell(1)
-            self.xyz_cells.InsertCellPoint(pointId)
-            self.cm_id.InsertNextValue(xyz_cm_id)
-            self.cm_line_number.InsertNextValue(xyz_cm_line_number)
-            self.diff.InsertNextValue(difference_xyz[2])
-            self.score.InsertNextValue(score_xyz[2])
-        else:
-            print("ERROR: MORE THAN 10e6 POINTS IN FILE")
-            return
+    def add_array(self, values, name):
+        """WRAP A 1D NUMPY ARRAY AS A NAMED POINT DATA ARRAY (NO COPY)"""
+        vtk_array = numpy_to_vtk(values, deep=False)
+        vtk_array.SetName(name)
+        self.cm_poly_data.GetPointData().AddArray(vtk_array)
+        return vtk_array
+
+    def flags_modified(self):
+        """CALL AFTER THE STORE FLAG COLUMN HAS BEEN EDITED IN PLACE"""
+        self.flag.Modified()
+        self.cm_poly_data.Modified()
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-class VtkPointCloudPredicted:
-    def __init__(self, xyz, maxNumPoints=10e7):
-        print("STARTING  VtkPointCloudPredicted")
-        # INITIALISE POINT DATA
-        self.xyz = xyz  # % THIS IS THE XYZ DATA
-        self.maxNumPoints = maxNumPoints
+# MAXIMUM NUMBER OF PINGS TRIANGULATED WHEN THE PING MESH IS DECIMATED
+MESH_MAX_POINTS = 100000
 
-        print("CREATE vtkPolyData OBJECT")
-        # CREATE vtkPolyData OBJECT
-        self.poly_data = vtk.vtkPolyData()
-        self.xyz_points = vtk.vtkPoints()
-        self.poly_data.SetPoints(self.xyz_points)
 
-        print("CREATE vtkPolyData VERTICES")
-        # CREATE vtkPolyData VERTICES
-        self.xyz_cells = vtk.vtkCellArray()
-        self.poly_data.SetVerts(self.xyz_cells)
-
-        # % NB. SCALAR VALUES ARE INITIALISED HERE AND THEN THE VALUES ARE ADDED in addPoint
-        print("CREATE SCALAR")
-        # SCALAR 1 = DEPTH
-        self.xyz_depth = vtk.vtkDoubleArray()
-        self.xyz_depth.SetName('Z')
-        self.poly_data.GetPointData().AddArray(self.xyz_depth)
-        self.poly_data.GetPointData().SetScalars(self.xyz_depth)
-        self.poly_data.GetPointData().SetActiveScalars('Z')
-
-        #  %~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # % LUT TABLE
-        print("CREATE LUT")
-        self.lut = self.make_lookup_table()
+def xyz_to_poly_data(xyz, vertices=False):
+    """
+    BUILD A vtkPolyData OF POINTS (WITH A 'Z' SCALAR) FROM AN (N, 3) ARRAY IN ONE CALL.
+    vertices = ALSO ADD ONE VERTEX CELL PER POINT (NEEDED TO RENDER THE POINTS THEMSELVES)
+    """
+    xyz = np.ascontiguousarray(xyz, dtype=float)
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(xyz, deep=True))
+    poly_data = vtk.vtkPolyData()
+    poly_data.SetPoints(points)
+    if vertices:
+        cell_ids = np.empty((len(xyz), 2), dtype=np.int64)
+        cell_ids[:, 0] = 1
+        cell_ids[:, 1] = np.arange(len(xyz))
+        cells = vtk.vtkCellArray()
+        cells.SetCells(len(xyz), numpy_to_vtkIdTypeArray(cell_ids.ravel(), deep=True))
+        poly_data.SetVerts(cells)
+    depth = numpy_to_vtk(np.ascontiguousarray(xyz[:, 2]), deep=True)
+    depth.SetName('Z')
+    poly_data.GetPointData().SetScalars(depth)
+    return poly_data
+
+
+def decimate_xyz(xyz, max_points=MESH_MAX_POINTS):
+    """
+    REDUCE AN (N, 3) POINT SET TO AT MOST ~max_points BY AVERAGING THE POINTS IN EACH CELL OF A REGULAR XY GRID.
+    THE CELL SIZE IS CHOSEN FROM THE EXTENT SO THAT THE GRID HAS max_points CELLS.
+    """
+    if len(xyz) <= max_points:
+        return xyz
+    x_min, y_min = xyz[:, 0].min(), xyz[:, 1].min()
+    width = max(xyz[:, 0].max() - x_min, 1e-9)
+    height = max(xyz[:, 1].max() - y_min, 1e-9)
+    cell_size = np.sqrt(width * height / max_points)
+    nx = int(width / cell_size) + 1
+    cell = (((xyz[:, 1] - y_min) / cell_size).astype(np.int64) * nx +
+            ((xyz[:, 0] - x_min) / cell_size).astype(np.int64))
+    occupied, inverse = np.unique(cell, return_inverse=True)
+    counts = np.bincount(inverse)
+    decimated = np.empty((len(occupied), 3))
+    for i in range(3):
+        decimated[:, i] = np.bincount(inverse, weights=xyz[:, i]) / counts
+    return decimated
+
+
+def grid_shape(xy):
+    """
+    RETURN (ny, nx) IF THE ROWS OF xy ARE THE NODES OF A REGULAR GRID DUMPED ROW BY ROW (AS WRITTEN BY grd2xyz),
+    OTHERWISE None
+    """
+    if len(xy) < 4:
+        return None
+    row_changes = np.flatnonzero(xy[1:, 1] != xy[:-1, 1])
+    if len(row_changes) == 0:
+        return None
+    nx = int(row_changes[0]) + 1
+    if len(xy) % nx != 0:
+        return None
+    ny = len(xy) // nx
+    y = xy[:, 1].reshape(ny, nx)
+    if not np.all(y == y[:, :1]):
+        return None
+    return ny, nx
+
+
+class VtkPredictedSurface:
+    """
+    HEIGHT FIELD SURFACE OF THE PREDICTED BATHYMETRY.
+
+    THE PREDICTED DATA ARE ALREADY A REGULAR GRID, SO THE NODES ARE PLACED STRAIGHT INTO A vtkStructuredGrid
+    (NO TRIANGULATION). IF THE NODES DO NOT FORM A GRID THEY ARE TRIANGULATED WITH vtkDelaunay2D INSTEAD.
+
+    xyz = (N, 3) PROJECTED X, Y AND DEPTH OF THE NODES IN grd2xyz ORDER
+    xy_geographic = (N, 2) LON/LAT OF THE SAME NODES (USED TO DETECT THE GRID LAYOUT)
+    """
+    def __init__(self, xyz, xy_geographic, lut):
+        self.xyz = np.array(xyz, dtype=float)
+        self.shape = grid_shape(xy_geographic)
+
+        # NaN NODES (e.g. OUTSIDE THE GRID) ARE HIDDEN
+        missing = np.isnan(self.xyz[:, 2])
+        self.xyz[missing, 2] = np.nanmin(self.xyz[:, 2]) if not missing.all() else 0.
+
+        if self.shape is not None:
+            ny, nx = self.shape
+            points = vtk.vtkPoints()
+            points.SetData(numpy_to_vtk(self.xyz, deep=True))
+            self.grid = vtk.vtkStructuredGrid()
+            self.grid.SetDimensions(nx, ny, 1)
+            self.grid.SetPoints(points)
+            depth = numpy_to_vtk(np.ascontiguousarray(self.xyz[:, 2]), deep=True)
+            depth.SetName('Z')
+            self.grid.GetPointData().SetScalars(depth)
+            if missing.any():
+                ghosts = numpy_to_vtk(np.where(missing, vtk.vtkDataSetAttributes.HIDDENPOINT, 0).astype(np.uint8),
+                                      deep=True, array_type=vtk.VTK_UNSIGNED_CHAR)
+                ghosts.SetName(vtk.vtkDataSetAttributes.GhostArrayName())
+                self.grid.GetPointData().AddArray(ghosts)
+            self.surface_filter = vtk.vtkStructuredGridGeometryFilter()
+            self.surface_filter.SetInputData(self.grid)
+        else:
+            self.surface_filter = vtk.vtkDelaunay2D()
+            self.surface_filter.SetInputData(xyz_to_poly_data(self.xyz[~missing]))
+        self.surface_filter.Update()
+
+        # SET MAPPER INPUTS
         self.mapper = vtk.vtkPolyDataMapper()
-        self.mapper.SetLookupTable(self.lut)
-        self.mapper.SelectColorArray('Z')
-        #  %~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        print("CREATE SET MAPPER STUFF")
+        self.mapper.SetInputConnection(self.surface_filter.GetOutputPort())
+        self.mapper.SetLookupTable(lut)
         self.mapper.SetScalarRange(self.xyz[:, 2].min(), self.xyz[:, 2].max())
-        self.mapper.SetInputData(self.poly_data)
-        self.mapper.SetScalarModeToUsePointFieldData()
+        self.mapper.SetScalarVisibility(1)
 
-        # % CREATE ACTOR
+        # CREATE ACTOR
         self.vtkActor = vtk.vtkActor()
         self.vtkActor.SetMapper(self.mapper)
-
-    def addPoint(self, point):
-        if self.xyz_points.GetNumberOfPoints() < self.maxNumPoints:
-            pointId = self.xyz_points.InsertNextPoint(point[:])
-            self.xyz_depth.InsertNextValue(point[2])
-            self.xyz_cells.InsertNextCell(1)
-            self.xyz_cells.InsertCellPoint(pointId)
-        else:
-            print("ERROR: MORE THAN 10e8 POINTS IN FILE")
-            return
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-    def make_lookup_table(self):
-        """
-        Make a lookup table using vtkColorSeries.
-        :return: An indexed lookup table.
-        """
-        a = self.xyz[:, 2].min()
-        b = self.xyz[:, 2].max()
-        lut = vtk.vtkColorTransferFunction()
-
-        # % NB. FORMAT:: VALUE THEN RGB CODE (THREE NUMBERS)
-        lut.AddRGBPoint(a, 0.25, 0.25, 0.25)
-        lut.AddRGBPoint(b, 0.75, 0.75, 0.75)
-        return lut
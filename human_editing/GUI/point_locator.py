@@ -0,0 +1,139 @@
+"""
+Persistent spatial index of the pings used for picking in the 3D viewer.
+
+The pings are sorted into a regular grid of XY bins once per load (or after rows are deleted). Each bin keeps the
+bounding box of its points, so an area pick only tests the points of the bins cut by the frustum planes, and bins
+that lie wholly inside the frustum are taken without testing their points. Picks return the selected row numbers
+(cm_line_number) as a numpy array; no VTK geometry is copied.
+
+The index is built from the unscaled projected coordinates. Queries take the display scale so the index does not
+need rebuilding when the axes are rescaled.
+"""
+import numpy as np
+
+# AVERAGE NUMBER OF POINTS PER BIN
+POINTS_PER_BIN = 256
+
+
+def ranges_to_indices(starts, stops):
+    """CONCATENATE THE INTEGER RANGES [start, stop) INTO ONE ARRAY (WITHOUT A PYTHON LOOP)"""
+    lengths = stops - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # EACH ELEMENT IS ITS RANGE START PLUS ITS POSITION IN THE RANGE
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return offsets + np.arange(total)
+
+
+class PointLocator:
+    """
+    XY BIN INDEX OF AN (N, 3) ARRAY OF POINTS
+
+    xyz = UNSCALED PROJECTED X, Y AND DEPTH OF THE PINGS (ROW i = cm_line_number i)
+    """
+    def __init__(self, xyz, points_per_bin=POINTS_PER_BIN):
+        xyz = np.asarray(xyz, dtype=float)
+        self.n_points = len(xyz)
+
+        # 1.0 CHOOSE A BIN SIZE GIVING ~points_per_bin POINTS PER BIN
+        self.origin = xyz[:, 0:2].min(axis=0) if self.n_points else np.zeros(2)
+        extent = np.maximum(xyz[:, 0:2].max(axis=0) - self.origin, 1e-9) if self.n_points else np.ones(2)
+        n_bins = max(self.n_points // points_per_bin, 1)
+        self.bin_size = np.sqrt(extent[0] * extent[1] / n_bins)
+        self.shape = (extent / self.bin_size).astype(np.int64) + 1
+
+        # 2.0 SORT THE POINTS BY BIN (THE SORTED COPY KEEPS THE POINTS OF EACH BIN CONTIGUOUS IN MEMORY)
+        ij = ((xyz[:, 0:2] - self.origin) / self.bin_size).astype(np.int64)
+        bins = ij[:, 1] * self.shape[0] + ij[:, 0]
+        self.order = np.argsort(bins, kind='stable')
+        self.xyz = xyz[self.order]
+        counts = np.bincount(bins, minlength=int(self.shape[0] * self.shape[1]))
+
+        # 3.0 KEEP THE POINT RANGE AND BOUNDING BOX OF EACH OCCUPIED BIN
+        occupied = counts > 0
+        stops = np.cumsum(counts)
+        self.bin_stop = stops[occupied]
+        self.bin_start = self.bin_stop - counts[occupied]
+        if self.n_points:
+            self.bin_min = np.minimum.reduceat(self.xyz, self.bin_start, axis=0)
+            self.bin_max = np.maximum.reduceat(self.xyz, self.bin_start, axis=0)
+        else:
+            self.bin_min = self.bin_max = np.empty((0, 3))
+
+    def __len__(self):
+        return self.n_points
+
+    def select_frustum(self, normals, origins, scale=(1., 1., 1.)):
+        """
+        RETURN THE (SORTED) ROW NUMBERS OF THE POINTS INSIDE A FRUSTUM
+
+        normals, origins = (6, 3) PLANE NORMALS AND POINTS IN DISPLAY (SCALED) COORDINATES, AS RETURNED BY
+                           vtkAreaPicker.GetFrustum() (A POINT IS INSIDE WHEN IT IS BEHIND EVERY PLANE)
+        scale = THE X, Y, Z SCALING APPLIED TO THE DISPLAYED POINTS
+        """
+        normals = np.asarray(normals, dtype=float)
+        origins = np.asarray(origins, dtype=float)
+
+        # 1.0 MOVE THE PLANES INTO UNSCALED COORDINATES: n.(S p - o) = (S n).p - n.o
+        plane_normals = normals * np.asarray(scale, dtype=float)
+        plane_offsets = -(normals * origins).sum(axis=1)
+
+        # 2.0 RANGE OF EACH PLANE FUNCTION OVER EACH BIN BOX (BINS x PLANES)
+        low = self.bin_min[:, np.newaxis, :] * plane_normals
+        high = self.bin_max[:, np.newaxis, :] * plane_normals
+        f_min = np.minimum(low, high).sum(axis=2) + plane_offsets
+        f_max = np.maximum(low, high).sum(axis=2) + plane_offsets
+
+        outside = (f_min > 0).any(axis=1)
+        inside = (f_max <= 0).all(axis=1)
+        partial = ~outside & ~inside
+
+        # 3.0 TAKE WHOLE BINS INSIDE THE FRUSTUM AND TEST THE POINTS OF BINS CUT BY IT
+        selected = [ranges_to_indices(self.bin_start[inside], self.bin_stop[inside])]
+        candidates = ranges_to_indices(self.bin_start[partial], self.bin_stop[partial])
+        if candidates.size:
+            values = self.xyz[candidates] @ plane_normals.T + plane_offsets
+            selected.append(candidates[(values <= 0).all(axis=1)])
+        return np.sort(self.order[np.concatenate(selected)])
+
+    def pick_ray(self, start, end, tolerance, scale=(1., 1., 1.)):
+        """
+        RETURN THE ROW NUMBER OF THE POINT NEAREST TO start THAT LIES WITHIN tolerance OF THE SEGMENT start-end
+        (E.G. THE NEAR AND FAR CLIPPING POINTS UNDER THE MOUSE), OR None IF THERE IS NO SUCH POINT
+
+        start, end, tolerance ARE IN DISPLAY (SCALED) COORDINATES
+        """
+        scale = np.asarray(scale, dtype=float)
+        start = np.asarray(start, dtype=float)
+        direction = np.asarray(end, dtype=float) - start
+        length2 = float(direction @ direction)
+        if length2 == 0. or self.n_points == 0:
+            return None
+
+        # 1.0 FIND THE BINS WHOSE (EXPANDED) BOX THE SEGMENT PASSES THROUGH (SLAB TEST)
+        box_min = self.bin_min * scale - tolerance
+        box_max = self.bin_max * scale + tolerance
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1 = (box_min - start) / direction
+            t2 = (box_max - start) / direction
+        t_near = np.where(direction == 0, np.where((start >= box_min) & (start <= box_max), -np.inf, np.inf),
+                          np.minimum(t1, t2)).max(axis=1)
+        t_far = np.where(direction == 0, np.where((start >= box_min) & (start <= box_max), np.inf, -np.inf),
+                         np.maximum(t1, t2)).min(axis=1)
+        hit = (t_near <= t_far) & (t_far >= 0) & (t_near <= 1)
+
+        # 2.0 DISTANCE OF THE CANDIDATE POINTS FROM THE SEGMENT
+        candidates = ranges_to_indices(self.bin_start[hit], self.bin_stop[hit])
+        if candidates.size == 0:
+            return None
+        offset = self.xyz[candidates] * scale - start
+        t = np.clip(offset @ direction / length2, 0., 1.)
+        distance2 = ((offset - t[:, np.newaxis] * direction) ** 2).sum(axis=1)
+        close = distance2 <= tolerance ** 2
+        if not close.any():
+            return None
+
+        # 3.0 THE POINT CLOSEST TO THE CAMERA WINS
+        nearest = candidates[close][np.argmin(t[close])]
+        return int(self.order[nearest])
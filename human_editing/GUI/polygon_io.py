@@ -0,0 +1,243 @@
+"""
+Reading, writing and applying editing polygons.
+
+Polygons come from the map (drawnItems.toGeoJSON()), from GeoJSON files saved by the editor (including the older
+export layout, where the FeatureCollection is nested in a Feature id), from GMT multi-segment text files (segments
+separated by '>' or '>>' header lines, one "lon lat" vertex per line) and from KML/KMZ files drawn in Google Earth
+(the outer boundary of every Polygon). They are parsed with json / ElementTree / numpy directly into
+a PolygonSet: one (N, 2) vertex array for all polygons plus offsets and bounding boxes, so thousands of polygons can
+be tested against millions of pings without building a shapely object per polygon.
+"""
+import json
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+
+
+def points_in_polygon(x, y, polygon):
+    """
+    RETURN A BOOLEAN MASK OF THE POINTS INSIDE A POLYGON ((N, 2) ARRAY OF VERTICES, CLOSED OR NOT), TESTING ALL
+    POINTS AGAINST ONE EDGE AT A TIME (EVEN-ODD RULE)
+    """
+    polygon = np.asarray(polygon, dtype=float)
+    inside = np.zeros(len(x), dtype=bool)
+    x1, y1 = polygon[-1]
+    for x2, y2 in polygon:
+        crosses = (y1 > y) != (y2 > y)
+        if crosses.any():
+            x_cross = x1 + (y[crosses] - y1) * (x2 - x1) / (y2 - y1)
+            inside[crosses] ^= x[crosses] < x_cross
+        x1, y1 = x2, y2
+    return inside
+
+
+def polygons_bbox(polygons):
+    """(west, east, south, north) BOX AROUND A LIST OF POLYGONS"""
+    vertices = np.concatenate([np.asarray(polygon, dtype=float) for polygon in polygons])
+    return vertices[:, 0].min(), vertices[:, 0].max(), vertices[:, 1].min(), vertices[:, 1].max()
+
+
+class PolygonSet:
+    """
+    MANY POLYGONS HELD AS ONE VERTEX ARRAY
+
+    vertices = (N, 2) lon/lat OF ALL POLYGONS, ONE AFTER THE OTHER
+    offsets = (n_polygons + 1) START OF EACH POLYGON IN vertices
+    """
+    def __init__(self, vertices, offsets):
+        self.vertices = np.ascontiguousarray(vertices, dtype=float).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        starts, stops = self.offsets[:-1], self.offsets[1:]
+        if len(starts):
+            self.bboxes = np.column_stack((np.minimum.reduceat(self.vertices[:, 0], starts),
+                                           np.maximum.reduceat(self.vertices[:, 0], starts),
+                                           np.minimum.reduceat(self.vertices[:, 1], starts),
+                                           np.maximum.reduceat(self.vertices[:, 1], starts))) \
+                if (stops > starts).all() else np.empty((0, 4))
+        else:
+            self.bboxes = np.empty((0, 4))
+
+    @classmethod
+    def from_polygons(cls, polygons):
+        """CREATE A PolygonSet FROM A LIST OF (N, 2) VERTEX ARRAYS (EMPTY POLYGONS ARE DROPPED)"""
+        polygons = [np.asarray(polygon, dtype=float).reshape(-1, 2) for polygon in polygons]
+        polygons = [polygon for polygon in polygons if len(polygon)]
+        lengths = [len(polygon) for polygon in polygons]
+        vertices = np.concatenate(polygons) if polygons else np.empty((0, 2))
+        return cls(vertices, np.concatenate(([0], np.cumsum(lengths))).astype(np.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.vertices[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        return PolygonSet.from_polygons(list(self) + list(other))
+
+    @property
+    def bbox(self):
+        """(west, east, south, north) BOX AROUND ALL POLYGONS"""
+        return (self.bboxes[:, 0].min(), self.bboxes[:, 1].max(), self.bboxes[:, 2].min(), self.bboxes[:, 3].max())
+
+    def contains(self, lon, lat):
+        """
+        RETURN A BOOLEAN MASK OF THE POINTS INSIDE ANY POLYGON.
+
+        THE POINTS ARE SORTED BY LONGITUDE ONCE SO EACH POLYGON ONLY TESTS THE POINTS IN ITS BOUNDING BOX.
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        inside = np.zeros(len(lon), dtype=bool)
+        if len(self) == 0 or len(lon) == 0:
+            return inside
+        order = np.argsort(lon, kind='stable')
+        sorted_lon = lon[order]
+        first = np.searchsorted(sorted_lon, self.bboxes[:, 0], side='left')
+        last = np.searchsorted(sorted_lon, self.bboxes[:, 1], side='right')
+        for i in np.flatnonzero(last > first):
+            candidates = order[first[i]:last[i]]
+            candidates = candidates[(lat[candidates] >= self.bboxes[i, 2]) & (lat[candidates] <= self.bboxes[i, 3])
+                                    & ~inside[candidates]]
+            if candidates.size:
+                inside[candidates[points_in_polygon(lon[candidates], lat[candidates], self[i])]] = True
+        return inside
+
+
+# GEOJSON ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def geojson_rings(node):
+    """YIELD THE OUTER RING OF EVERY Polygon / MultiPolygon FOUND ANYWHERE IN A PARSED GEOJSON OBJECT"""
+    if isinstance(node, list):
+        for item in node:
+            for ring in geojson_rings(item):
+                yield ring
+        return
+    if not isinstance(node, dict):
+        return
+    node_type = node.get('type')
+    if node_type == 'Polygon':
+        yield node['coordinates'][0]
+    elif node_type == 'MultiPolygon':
+        for polygon in node['coordinates']:
+            yield polygon[0]
+    elif node_type == 'GeometryCollection':
+        for ring in geojson_rings(node.get('geometries')):
+            yield ring
+    else:
+        # FeatureCollection / Feature (OLDER EDITOR EXPORTS KEEP THE FeatureCollection IN THE Feature id)
+        for key in ('features', 'geometry', 'id'):
+            for ring in geojson_rings(node.get(key)):
+                yield ring
+
+
+def parse_geojson(text):
+    """PARSE GEOJSON TEXT INTO A PolygonSet"""
+    rings = geojson_rings(json.loads(text))
+    return PolygonSet.from_polygons([np.asarray(ring, dtype=float)[:, 0:2] for ring in rings])
+
+
+def read_geojson(path):
+    with open(path) as geojson_file:
+        return parse_geojson(geojson_file.read())
+
+
+def to_geojson(polygons):
+    """RETURN A GEOJSON FeatureCollection (dict) OF THE POLYGONS"""
+    features = []
+    for polygon in polygons:
+        ring = polygon.tolist()
+        if ring and ring[0] != ring[-1]:
+            ring.append(ring[0])
+        features.append({'type': 'Feature', 'properties': {},
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def write_geojson(path, polygons):
+    with open(path, 'w') as geojson_file:
+        json.dump(to_geojson(polygons), geojson_file)
+
+
+# GMT MULTI-SEGMENT TEXT ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def parse_gmt(text):
+    """PARSE GMT MULTI-SEGMENT TEXT ('>' OR '>>' SEGMENT HEADERS, "lon lat" VERTEX LINES) INTO A PolygonSet"""
+    lines = text.splitlines()
+    header = np.array([line.startswith('>') for line in lines], dtype=bool)
+    data = [line for line, is_header in zip(lines, header) if not is_header and line.strip() and
+            not line.startswith('#')]
+    if not data:
+        return PolygonSet.from_polygons([])
+    vertices = np.loadtxt(data, usecols=(0, 1), ndmin=2)
+
+    # THE SEGMENT OF EACH VERTEX IS THE NUMBER OF HEADERS BEFORE IT
+    is_data = np.array([not is_header and line.strip() != '' and not line.startswith('#')
+                        for line, is_header in zip(lines, header)], dtype=bool)
+    segment = np.cumsum(header)[is_data]
+    starts = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]])
+    return PolygonSet(vertices, np.r_[starts, len(vertices)])
+
+
+def read_gmt(path):
+    with open(path) as gmt_file:
+        return parse_gmt(gmt_file.read())
+
+
+def write_gmt(path, polygons):
+    """WRITE POLYGONS AS GMT MULTI-SEGMENT TEXT (THE EDITOR'S '>> Polygon i' LAYOUT)"""
+    with open(path, 'w') as gmt_file:
+        for i, polygon in enumerate(polygons):
+            gmt_file.write('>> Polygon %d\n' % i)
+            gmt_file.write(''.join('%.10g %.10g\n' % (x, y) for x, y in polygon.tolist()))
+
+
+# KML / KMZ (GOOGLE EARTH) ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def local_name(tag):
+    """TAG NAME WITHOUT ITS {namespace}"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_kml(text):
+    """PARSE KML TEXT INTO A PolygonSet OF THE OUTER BOUNDARY OF EVERY Polygon (lon,lat[,alt] COORDINATES)"""
+    root = ElementTree.fromstring(text)
+    polygons = []
+    for element in root.iter():
+        if local_name(element.tag) != 'outerBoundaryIs':
+            continue
+        for coordinates in element.iter():
+            if local_name(coordinates.tag) == 'coordinates' and coordinates.text:
+                values = coordinates.text.replace(',', ' ').split()
+                tuples = coordinates.text.split()
+                n_values = len(values) // len(tuples) if tuples else 2
+                polygons.append(np.array(values, dtype=float).reshape(-1, n_values)[:, 0:2])
+    return PolygonSet.from_polygons(polygons)
+
+
+def read_kml(path):
+    """READ A .kml FILE, OR THE .kml FILES INSIDE A .kmz"""
+    if path.lower().endswith('.kmz'):
+        polygons = PolygonSet.from_polygons([])
+        with zipfile.ZipFile(path) as kmz:
+            for name in kmz.namelist():
+                if name.lower().endswith('.kml'):
+                    polygons = polygons + parse_kml(kmz.read(name))
+        return polygons
+    with open(path, 'rb') as kml_file:
+        return parse_kml(kml_file.read())
+
+
+def read_polygons(path):
+    """READ A POLYGON FILE (GEOJSON, KML/KMZ, OR GMT MULTI-SEGMENT TEXT)"""
+    if path.lower().endswith(('.kml', '.kmz')):
+        return read_kml(path)
+    with open(path) as polygon_file:
+        text = polygon_file.read()
+    if text.lstrip().startswith('{'):
+        return parse_geojson(text)
+    return parse_gmt(text)
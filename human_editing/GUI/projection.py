@@ -0,0 +1,142 @@
+"""
+Projection of lon/lat columns to metric coordinates for the 3D viewer.
+
+One ProjectionCache (PROJECTIONS) is shared by the editor and the 3D viewer. It keeps one pyproj Transformer per
+target CRS, projects whole numpy columns in a single call and memoizes the projected columns per store (its token)
+and version, so reopening the 3D viewer or re-rendering does not reproject anything.
+
+A cruise that lies in a single UTM zone is projected to that zone. A cruise that straddles zones (or the dateline)
+is projected with a transverse mercator centred on the cruise instead, so the far end is not distorted by using the
+zone of the centroid.
+"""
+import math as m
+import collections
+import weakref
+import numpy as np
+
+WGS84 = 'epsg:4326'
+
+# NUMBER OF PROJECTED COLUMN PAIRS KEPT IN MEMORY
+MAX_CACHED_PROJECTIONS = 8
+
+
+def utm_epsg_code(lon, lat):
+    """RETURN THE EPSG CODE (AS A STRING) OF THE UTM ZONE CONTAINING lon, lat"""
+    utm_band = str((m.floor((lon + 180) / 6) % 60) + 1)
+    if len(utm_band) == 1:
+        utm_band = '0' + utm_band
+    if lat >= 0:
+        epsg_code = '326' + utm_band
+    else:
+        epsg_code = '327' + utm_band
+    return epsg_code
+
+
+def central_longitude(lon):
+    """CIRCULAR MEAN OF THE LONGITUDES (SO CRUISES OVER THE DATELINE ARE CENTRED CORRECTLY)"""
+    radians = np.radians(lon)
+    return m.degrees(m.atan2(np.mean(np.sin(radians)), np.mean(np.cos(radians))))
+
+
+class ProjectionCache:
+    """
+    CACHE OF pyproj TRANSFORMERS (ONE PER TARGET CRS) AND OF PROJECTED COLUMNS (ONE PER CRUISE VERSION)
+    """
+    def __init__(self, max_cached=MAX_CACHED_PROJECTIONS):
+        self.transformers = {}
+        self.projected = collections.OrderedDict()
+        self.crs_for_key = {}
+        self.max_cached = max_cached
+
+    def transformer(self, crs):
+        """RETURN THE (CACHED) lon/lat -> crs TRANSFORMER"""
+        try:
+            return self.transformers[crs]
+        except KeyError:
+            from pyproj import Transformer  # pyproj IS ONLY LOADED WHEN THE FIRST CRUISE IS PROJECTED
+            transformer = Transformer.from_crs(WGS84, crs, always_xy=True)
+            self.transformers[crs] = transformer
+            return transformer
+
+    def choose_crs(self, lon, lat):
+        """
+        RETURN THE TARGET CRS FOR A SET OF POINTS: THE UTM ZONE IF THEY ALL FALL IN ONE ZONE, OTHERWISE A TRANSVERSE
+        MERCATOR CENTRED ON THE POINTS
+        """
+        lon = np.asarray(lon)
+        lat = np.asarray(lat)
+        zones = np.unique(np.floor((np.mod(lon + 180., 360.)) / 6.).astype(int))
+        center_lon = central_longitude(lon)
+        center_lat = float(np.mean(lat))
+        if len(zones) == 1:
+            return 'epsg:' + utm_epsg_code(center_lon, center_lat)
+        return ('+proj=tmerc +lat_0=0 +lon_0=%.6f +k=0.9996 +x_0=500000 +y_0=0 +datum=WGS84 +units=m +no_defs'
+                % center_lon)
+
+    def project(self, lon, lat, crs, x_out=None, y_out=None):
+        """
+        PROJECT lon/lat COLUMNS TO crs. THE RESULT IS WRITTEN INTO x_out/y_out (float64 ARRAYS) WHEN GIVEN,
+        OTHERWISE NEW ARRAYS ARE RETURNED. RETURNS (x, y)
+        """
+        if x_out is None:
+            x_out = np.array(lon, dtype=float)
+        else:
+            x_out[:] = lon
+        if y_out is None:
+            y_out = np.array(lat, dtype=float)
+        else:
+            y_out[:] = lat
+        self.transformer(crs).transform(x_out, y_out, inplace=True)
+        return x_out, y_out
+
+    def project_cached(self, key, lon, lat, crs):
+        """PROJECT lon/lat TO crs, REUSING THE RESULT STORED UNDER key IF THERE IS ONE"""
+        cache_key = (key, crs)
+        try:
+            xy = self.projected[cache_key]
+            self.projected.move_to_end(cache_key)
+            return xy
+        except KeyError:
+            pass
+        xy = self.project(lon, lat, crs)
+        self.projected[cache_key] = xy
+        while len(self.projected) > self.max_cached:
+            self.projected.popitem(last=False)
+        return xy
+
+    def store_key(self, store):
+        """CACHE KEY FOR THE CURRENT GEOMETRY OF A CruiseStore (ITS token: id() IS REUSED ONCE A STORE IS FREED)"""
+        return store.token, store.geometry_version
+
+    def store_crs(self, store):
+        """TARGET CRS OF A CruiseStore (FIXED WHEN THE STORE IS FIRST PROJECTED SO ALL ITS DATA SHARE ONE CRS)"""
+        if store.token not in self.crs_for_key:
+            self.crs_for_key[store.token] = self.choose_crs(store['lon'], store['lat'])
+            # A STORE THAT IS FREED WITHOUT forget TAKES ITS ENTRIES WITH IT
+            weakref.finalize(store, self.forget_token, store.token)
+        return self.crs_for_key[store.token]
+
+    def forget(self, store):
+        """DROP EVERYTHING CACHED FOR A CruiseStore THAT IS BEING REPLACED OR CLOSED"""
+        self.forget_token(store.token)
+
+    def forget_token(self, token):
+        """DROP EVERYTHING CACHED UNDER A CruiseStore.token"""
+        for cache_key in [cache_key for cache_key in self.projected if cache_key[0][0] == token]:
+            del self.projected[cache_key]
+        self.crs_for_key.pop(token, None)
+
+    def project_store(self, store):
+        """RETURN THE PROJECTED (x, y) OF THE PINGS IN A CruiseStore"""
+        return self.project_cached(self.store_key(store), store['lon'], store['lat'], self.store_crs(store))
+
+    def project_predicted(self, store):
+        """RETURN THE store.predicted_xyz GRID NODES AS AN (N, 3) ARRAY OF PROJECTED x, y AND DEPTH"""
+        predicted = store.predicted_xyz
+        key = (store.token, 'predicted', store.predicted_version)
+        x, y = self.project_cached(key, predicted[:, 0], predicted[:, 1], self.store_crs(store))
+        return np.column_stack((x, y, predicted[:, 2]))
+
+
+# CACHE SHARED BY THE EDITOR AND THE 3D VIEWER
+PROJECTIONS = ProjectionCache()
@@ -1,7 +1,8 @@
 #!/usr/bin/env bash
 
-## STEP 1.0 GET INPUT cm FILE
+## STEP 1.0 GET INPUT cm FILE (AND OPTIONALLY THE DIRECTORY HOLDING THE GRIDS AND CPT)
 cm_file=$1
+grid_dir=${2:-.}
 
 #------------------------------------------------------------------------------
 ## STEP 2.0 GET REGION LIMITS OF CM FILE + 0.5 arc min
@@ -14,15 +15,15 @@ echo ${R}
 #------------------------------------------------------------------------------
 ## STEP 3.0 CUT THE OUT GRIDS FOR THE GIVEN INPUT REGION
 ## 3.1 CUT PREDICTED BATHYMETRY
-gmt grdcut SRTM15+V2_predicted_bathy_only-bs.nc=bs ${R} -GTMP_predictions_only.nc=bs
+gmt grdcut ${grid_dir}/SRTM15+V2_predicted_bathy_only-bs.nc=bs ${R} -GTMP_predictions_only.nc=bs
 #gmt grdimage --PS_MEDIA=A2 SRTM15+V2_predicted_bathy_only-bs.nc=bs ${R} -JM30c -Bxf5a5 -Byf5a5 -P \
 #  -I+a315+nt0.9 -Ctopo > 1_TMP_SRTM15+V2_predicted_bathy_only-bs.ps
 
 ## 3.2 CUT CURRENT SRTM15+V2.1_SHIP DATA
-gmt grdcut SRTM15+V2.1_ship_data_only-bs.nc=bs ${R} -GTMP_SRTM_ship_data.nc=bs
+gmt grdcut ${grid_dir}/SRTM15+V2.1_ship_data_only-bs.nc=bs ${R} -GTMP_SRTM_ship_data.nc=bs
 
 ## 3.3 CUT CURRENT SRTM15+V2.1_SHIP DATA
-gmt grdcut SID_MASK_V2.1-bb_NaN.nc ${R} -GTMP_SID_MASK_V2.1-bb.nc=bb
+gmt grdcut ${grid_dir}/SID_MASK_V2.1-bb_NaN.nc ${R} -GTMP_SID_MASK_V2.1-bb.nc=bb
 #gmt grdimage --PS_MEDIA=A2 TMP_SID_MASK_V2.1-bb.nc=bb -JM30c -Bxf5a5 -Byf5a5 -P -Cmask.cpt > 2_TMP_SID_MASK_V2.1-bb.ps
 
 ##3.4 CREATE MASK OF PREDICTED DATA
@@ -33,7 +34,7 @@ gmt grdmath TMP_SID_MASK_V2.1-bb.nc=bb ISNAN = TMP_SID_NANs_MASK-bb.nc=bb
 
 #------------------------------------------------------------------------------
 # STEP 4.0 CONVERT THE CM FILE TO GRID AN SET FLAGGED POINTS AS NaN
-awk '{ if ($5 != 9999) print $2, $3, $4; else print $2, $3, "NaN"}' ${cm_file} |\
+awk '{ if ($6 != 9999) print $2, $3, $4; else print $2, $3, "NaN"}' ${cm_file} |\
   gmt xyz2grd ${R} -I15s/15s -rp -GTMP_input_data.nc=bs
 #------------------------------------------------------------------------------
 
@@ -87,14 +88,15 @@ gmt grdmath TMP_predictions_only.nc=bs TMP_INTERP3.nc=bs ADD = TMP_RESTORED.nc=b
 #  -CSRTM15+v2.1.cpt -I+a315+nt0.9 > 11_TMP_RESTORED.ps
 #------------------------------------------------------------------------------
 
-gmt grdimage --MAP_FRAME_TYPE=inside TMP_RESTORED.nc=bs ${R} -JX1 -CSRTM15+v2.1.cpt -I+a315+nt0.9 -E1440 > 12_TMP_RESTORED.ps
+gmt grdimage --MAP_FRAME_TYPE=inside TMP_RESTORED.nc=bs ${R} -JX1 -C${grid_dir}/SRTM15+v2.1.cpt -I+a315+nt0.9 -E1440 > 12_TMP_RESTORED.ps
 gmt psconvert 12_TMP_RESTORED.ps -E2000 -A+u -Tt -W+g
 gdal2tiles.py --zoom=8-9 --s_srs=EPSG:4326 --webviewer=leaflet --xyz 12_TMP_RESTORED.tif TMP_RESTORED
 
 echo "FINISHED REGRDDING"
 
+mkdir -p TMP_PS
 mv TMP*nc  TMP_PS
 mv *.ps TMP_PS
 
 ## EXIT
-exit 1
\ No newline at end of file
+exit 0
\ No newline at end of file
@@ -2,17 +2,31 @@
 Rubber band mode for 3D point picking
 """
 import vtk
+import numpy as np
 from vtk.util.numpy_support import vtk_to_numpy
+from point_clouds import xyz_to_poly_data
+from instrumentation import span, count
+
+# A CLICK (PRESS AND RELEASE WITHIN THIS MANY PIXELS) PICKS THE SINGLE NEAREST POINT INSTEAD OF AN AREA
+CLICK_PIXELS = 3
+
+# SINGLE POINT PICK TOLERANCE AS A FRACTION OF THE POINT CLOUD DIAGONAL
+PICK_TOLERANCE = 0.005
+
 
 class RubberBand(vtk.vtkInteractorStyleRubberBandPick):
-    def __init__(self, renderWindow, renderer, pointcloud, interactor, area_picker, cm):
-        print("entering rubber band mode")
-        self.cm = cm
+    def __init__(self, renderWindow, renderer, pointcloud, interactor, area_picker, store, locator, scale):
+        self.store = store
         self.renderWindow = renderWindow
         self.renderer = renderer
         self.pointcloud = pointcloud
         self.Interactor = interactor
+        self.locator = locator  # PointLocator OF THE UNSCALED PINGS
+        self.scale = scale  # X, Y, Z SCALING OF THE DISPLAYED POINTS
+        self.selected_indices = np.empty(0, dtype=np.int64)  # SELECTED ROW NUMBERS (cm_line_number)
+        self.press_position = None
         self.selected_mapper = vtk.vtkDataSetMapper()
+        self.selected_mapper.ScalarVisibilityOff()
         self.selected_actor = vtk.vtkActor()
         self.selected_actor.SetMapper(self.selected_mapper)
         self.area_picker = area_picker
@@ -22,7 +36,7 @@ class RubberBand(vtk.vtkInteractorStyleRubberBandPick):
         self.Interactor.AddObserver("LeftButtonReleaseEvent", self.LeftButtonReleaseEvent)
 
     def leftButtonPressEvent(self, obj, event):
-        print("LEFT BUTTON PRESSED")
+        self.press_position = self.Interactor.GetEventPosition()
         self.OnLeftButtonDown()
         '# % REMOVE THE CURRENT HIGHLIGHT ACTOR (IF THERE IS ONE) FROM SCREEN'
         try:
@@ -32,28 +46,22 @@ class RubberBand(vtk.vtkInteractorStyleRubberBandPick):
         self.renderWindow.Render()
 
     def LeftButtonReleaseEvent(self, obj, event):
-        print("LEFT BUTTON RELEASED")
         self.OnLeftButtonUp()
 
-        self.frustum = self.area_picker.GetFrustum()
-
-        self.extract_geometry = vtk.vtkExtractGeometry()
-        self.extract_geometry.SetImplicitFunction(self.frustum)
-        self.extract_geometry.SetInputData(self.pointcloud.cm_poly_data)
-        self.extract_geometry.Update()
-
-        self.glyph_filter = vtk.vtkVertexGlyphFilter()
-        self.glyph_filter.SetInputConnection(self.extract_geometry.GetOutputPort())
-        self.glyph_filter.Update()
+        release_position = self.Interactor.GetEventPosition()
+        if self.press_position is not None and \
+                max(abs(release_position[0] - self.press_position[0]),
+                    abs(release_position[1] - self.press_position[1])) <= CLICK_PIXELS:
+            with span('pick_point'):
+                self.selected_indices = self.pick_point(release_position)
+        else:
+            with span('pick_area'):
+                self.selected_indices = self.pick_area()
+        count('pings_selected', len(self.selected_indices))
 
-        self.selected = self.glyph_filter.GetOutput()
-        self.p1 = self.selected.GetNumberOfPoints()
-        self.p2 = self.selected.GetNumberOfCells()
-        print("Number of points = %s" % self.p1)
-        print("Number of cells = %s" % self.p2)
-
-        '# % COLOR SELECTED POINTS RED'
-        self.selected_mapper.SetInputData(self.selected)
+        '# % COLOR SELECTED POINTS'
+        self.selected_mapper.SetInputData(xyz_to_poly_data(self.pointcloud.xyz[self.selected_indices],
+                                                           vertices=True))
         try:
             self.selected_actor.GetProperty().SetPointSize(10)
             self.selected_actor.GetProperty().SetColor(0, 0, 0)  # (R, G, B)
@@ -61,14 +69,34 @@ class RubberBand(vtk.vtkInteractorStyleRubberBandPick):
         except AttributeError:
             pass
 
-    def save_output(self):
-        """CREATES A NEW NUMPY ARRAY of the cm FILE WITH SELECTED NODES REMOVED"""
-        pass
-        # np.column_stack((self.selected_cm_ids, self.selected_xyz))
+    def pick_area(self):
+        """RETURN THE ROW NUMBERS OF THE POINTS INSIDE THE RUBBER BAND FRUSTUM"""
+        frustum = self.area_picker.GetFrustum()
+        normals = vtk_to_numpy(frustum.GetNormals())
+        origins = vtk_to_numpy(frustum.GetPoints().GetData())
+        return self.locator.select_frustum(normals, origins, self.scale)
+
+    def pick_point(self, position):
+        """RETURN THE ROW NUMBER (AS A ONE ELEMENT ARRAY) OF THE POINT UNDER THE MOUSE, IF THERE IS ONE"""
+        # 1.0 THE RAY UNDER THE MOUSE RUNS FROM THE NEAR TO THE FAR CLIPPING PLANE
+        ends = []
+        for depth in (0., 1.):
+            self.renderer.SetDisplayPoint(position[0], position[1], depth)
+            self.renderer.DisplayToWorld()
+            world = self.renderer.GetWorldPoint()
+            ends.append(np.array(world[0:3]) / world[3])
+
+        # 2.0 FIND THE NEAREST POINT WITHIN THE TOLERANCE OF THE RAY
+        extent = self.pointcloud.xyz.max(axis=0) - self.pointcloud.xyz.min(axis=0)
+        tolerance = PICK_TOLERANCE * np.sqrt((extent ** 2).sum())
+        index = self.locator.pick_ray(ends[0], ends[1], tolerance, self.scale)
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        return np.array([index], dtype=np.int64)
 
     def color_picked(self):
         try:
             self.renderer.AddActor(self.selected_actor)
             self.renderWindow.Render()
         except AttributeError:
-            pass
\ No newline at end of file
+            pass
@@ -0,0 +1,222 @@
+"""
+Reading Sandwell's global Mercator .img grids (topo.img, the predicted bathymetry) straight from the binary file.
+
+An .img file is a bare array of big endian 16 bit integers, one row per Mercator latitude from north to south and one
+column per longitude from 0 to 360 degrees (the layouts of img2web.f and img2web.f_2min, told apart by the file
+size). ImgGrid memory maps it with a big endian dtype, so no byte swapped copy (topo.swapped.img) is needed on Intel
+machines and only the pages that are used are read. Odd values mark cells constrained by soundings; multiplying by
+scale gives metres (1, topography) or mGal (0.1, gravity).
+
+    ImgGrid(path).window(west, east, south, north)   the cells of a box as a grid_io.Grid (img2web)
+    ImgGrid(path).sample(lon, lat)                    bilinear values at points (interp_ship)
+
+The command line replaces img2web (and the awk longitude wrap after it in 02worldMakeAllTiles.sh) and interp_ship:
+
+    python sandwell_img.py xyz topo.img S N W E [--scale 1] [--binary] [--no-wrap] > predicted.xyz
+    python sandwell_img.py sample topo.img [--scale 1] [--lon-field 1] [--lat-field 2] < points > points_and_value
+
+xyz writes lon lat value text as img2web does, or with --binary double precision x y z (read with -bi3), a band of
+rows at a time.
+"""
+import os
+import sys
+import argparse
+import numpy as np
+from grid_io import Grid, PIXEL
+
+# (COLUMNS, ROWS, SOUTHERN EDGE (DEG), SPACING (DEG)) OF THE .img LAYOUTS, BY FILE SIZE (img2web.f, img2web.f_2min)
+IMG_LAYOUTS = {2 * 21600 * 17280: (21600, 17280, -80.738, 1. / 60.),
+               2 * 10800 * 6336: (10800, 6336, -72.006, 1. / 30.)}
+
+# ROWS CONVERTED AT A TIME BY xyz_chunks (BOUNDS THE MEMORY USED TO DUMP THE WHOLE GRID)
+CHUNK_ROWS = 64
+
+
+def mercator_y(lat):
+    """MERCATOR ORDINATE (RADIANS) OF A LATITUDE (DEG); +/-inf AT THE POLES"""
+    with np.errstate(divide='ignore'):
+        return np.log(np.tan(np.radians(45. + 0.5 * np.clip(np.asarray(lat, dtype=float), -90., 90.))))
+
+
+def clear_flag(raw):
+    """VALUES WITH THE CONSTRAINED (ODD) BIT REMOVED, AS interp_ship USES THEM"""
+    return raw - (raw & 1)
+
+
+class ImgGrid:
+    """
+    A GLOBAL MERCATOR .img GRID, MEMORY MAPPED
+
+    scale = FACTOR TURNING THE STORED INTEGERS INTO VALUES (1 TOPOGRAPHY, 0.1 GRAVITY)
+    byte_order = '>' FOR THE ORIGINAL FILES, '<' FOR A BYTE SWAPPED COPY
+    layout = (COLUMNS, ROWS, SOUTHERN EDGE, SPACING) IF THE FILE SIZE IS NOT ONE OF IMG_LAYOUTS
+    """
+    def __init__(self, path, scale=1., byte_order='>', layout=None):
+        if layout is None:
+            size = os.path.getsize(path)
+            if size not in IMG_LAYOUTS:
+                raise ValueError("%s: unknown .img layout (%d bytes); give the layout" % (path, size))
+            layout = IMG_LAYOUTS[size]
+        self.path = path
+        self.n_cols, self.n_rows, self.south, self.spacing = layout
+        self.scale = scale
+        self.data = np.memmap(path, dtype=byte_order + 'i2', mode='r', shape=(self.n_rows, self.n_cols))
+        self.y_south = float(mercator_y(self.south))
+        self.dy = np.radians(self.spacing)
+        self.north = float(self.row_latitudes(0.))
+
+    # CELL <-> LON/LAT ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def fractional_cells(self, lon, lat):
+        """RETURN (row, col) AS REAL NUMBERS: CELL (i, j) COVERS i <= row < i + 1 AND j <= col < j + 1"""
+        row = self.n_rows - (mercator_y(lat) - self.y_south) / self.dy
+        col = np.mod(np.asarray(lon, dtype=float), 360.) / self.spacing
+        return row, col
+
+    def cells(self, lon, lat):
+        """RETURN (row, col, inside): THE CELL HOLDING EACH POINT, AND WHETHER THE POINT IS ON THE GRID AT ALL"""
+        row, col = self.fractional_cells(lon, lat)
+        inside = (row >= 0.) & (row < self.n_rows)
+        row = np.clip(np.floor(row), 0, self.n_rows - 1).astype(np.int64)
+        col = np.floor(col).astype(np.int64) % self.n_cols
+        return row, col, inside
+
+    def row_latitudes(self, rows):
+        """LATITUDE OF THE CENTRE OF ROWS (REAL ROW NUMBERS ARE ALLOWED; row 0. IS THE NORTHERN EDGE)"""
+        rows = np.asarray(rows, dtype=float)
+        return np.degrees(2. * np.arctan(np.exp(self.y_south + self.dy * (self.n_rows - rows)))) - 90.
+
+    def col_longitudes(self, cols):
+        """LONGITUDE OF THE CENTRE OF COLUMNS (0 <-> 360, OR BEYOND FOR COLUMNS OUTSIDE 0 <-> n_cols)"""
+        return (np.asarray(cols, dtype=float) + 0.5) * self.spacing
+
+    def values(self, raw, without_flag=False):
+        values = clear_flag(raw) if without_flag else raw
+        return values.astype(np.float64) * self.scale
+
+    # WINDOWS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def window_cells(self, west, east, south, north):
+        """
+        RETURN (row slice, columns) OF THE CELLS OF A BOX, AS img2web CHOOSES THEM (FROM THE CELL HOLDING THE NORTH
+        WEST CORNER TO THE ONE HOLDING THE SOUTH EAST CORNER, CLIPPED TO THE GRID). COLUMNS ARE UNWRAPPED (THEY MAY
+        BE NEGATIVE OR PAST n_cols WHEN THE BOX CROSSES 0 DEGREES)
+        """
+        if south >= north or west >= east:
+            raise ValueError("need S < N and W < E")
+        first_row = int(np.clip(np.floor(self.fractional_cells(0., min(north, self.north))[0]), 0, self.n_rows - 1))
+        last_row = int(np.clip(np.floor(self.fractional_cells(0., max(south, self.south))[0]), 0, self.n_rows - 1))
+        first_col = int(np.floor(west / self.spacing))
+        last_col = min(int(np.floor(east / self.spacing)), first_col + self.n_cols - 1)
+        return slice(first_row, last_row + 1), np.arange(first_col, last_col + 1)
+
+    def read_cells(self, rows, cols):
+        """READ THE RAW INTEGERS OF A ROW SLICE AND (UNWRAPPED) COLUMNS, TOUCHING ONLY THOSE PAGES OF THE FILE"""
+        if cols[0] >= 0 and cols[-1] < self.n_cols:
+            return np.array(self.data[rows, cols[0]:cols[-1] + 1])
+        return np.take(self.data[rows], cols % self.n_cols, axis=1)
+
+    def window(self, west, east, south, north, without_flag=False):
+        """
+        RETURN THE CELLS OF A BOX AS A PIXEL REGISTERED grid_io.Grid (LATITUDES ARE THE MERCATOR ROW CENTRES, SO
+        THEY ARE NOT EVENLY SPACED; LONGITUDES FOLLOW west, E.G. -10 <-> 10 RATHER THAN 350 <-> 10)
+        """
+        rows, cols = self.window_cells(west, east, south, north)
+        z = self.values(self.read_cells(rows, cols), without_flag)
+        lat = self.row_latitudes(np.arange(rows.start, rows.stop) + 0.5)
+        return Grid(self.col_longitudes(cols), lat[::-1], z[::-1], PIXEL)
+
+    def xyz_chunks(self, west, east, south, north, wrap=True, chunk_rows=CHUNK_ROWS):
+        """YIELD [n, 3] lon lat value ARRAYS OF THE CELLS OF A BOX, NORTH TO SOUTH, chunk_rows ROWS AT A TIME"""
+        rows, cols = self.window_cells(west, east, south, north)
+        lon = self.col_longitudes(cols)
+        if wrap:
+            lon = np.where(lon > 180., lon - 360., lon)
+        for start in range(rows.start, rows.stop, chunk_rows):
+            band = slice(start, min(start + chunk_rows, rows.stop))
+            z = self.values(self.read_cells(band, cols))
+            lat = self.row_latitudes(np.arange(band.start, band.stop) + 0.5)
+            yield np.column_stack((np.tile(lon, len(lat)), np.repeat(lat, len(lon)), z.ravel()))
+
+    # POINTS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def sample(self, lon, lat, method='bilinear', without_flag=True):
+        """
+        VALUES AT POINTS (NaN OFF THE GRID). bilinear INTERPOLATES BETWEEN THE FOUR SURROUNDING CELL CENTRES (LINEAR
+        IN LONGITUDE AND LATITUDE, AS interp_ship DOES); nearest TAKES THE CELL HOLDING THE POINT
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        row, col, inside = self.cells(lon, lat)
+        if method == 'nearest':
+            values = self.values(self.data[row, col], without_flag)
+            return np.where(inside, values, np.nan)
+
+        # 1.0 THE CELL CENTRES NORTH (row0) AND SOUTH (row0 + 1) OF EACH POINT, AND WEST AND EAST OF IT
+        fractional_row, fractional_col = self.fractional_cells(lon, lat)
+        row0 = np.clip(np.floor(fractional_row - 0.5), 0, self.n_rows - 2).astype(np.int64)
+        col0 = np.floor(fractional_col - 0.5).astype(np.int64)
+        t = fractional_col - 0.5 - col0
+        lat_north = self.row_latitudes(row0 + 0.5)
+        lat_south = self.row_latitudes(row0 + 1.5)
+
+        # 2.0 POINTS BEYOND THE FIRST OR LAST ROW CENTRE TAKE THE EDGE ROW (THE CLOSEST POINT)
+        u = np.clip((lat - lat_south) / (lat_north - lat_south), 0., 1.)
+        col0 %= self.n_cols
+        col1 = (col0 + 1) % self.n_cols
+        north_west = self.values(self.data[row0, col0], without_flag)
+        north_east = self.values(self.data[row0, col1], without_flag)
+        south_west = self.values(self.data[row0 + 1, col0], without_flag)
+        south_east = self.values(self.data[row0 + 1, col1], without_flag)
+        values = ((1. - t) * (1. - u) * south_west + t * (1. - u) * south_east + t * u * north_east +
+                  (1. - t) * u * north_west)
+        return np.where(inside, values, np.nan)
+
+    def constrained(self, lon, lat):
+        """TRUE WHERE THE CELL HOLDING A POINT IS CONSTRAINED BY SOUNDINGS (AN ODD VALUE)"""
+        row, col, inside = self.cells(lon, lat)
+        return inside & (self.data[row, col] & 1).astype(bool)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Read a Sandwell .img grid without a byte swapped copy')
+    parser.add_argument('--byte-order', default='>', choices=('>', '<'), help="'<' for a byte swapped copy")
+    commands = parser.add_subparsers(dest='command')
+    xyz = commands.add_parser('xyz', help='write the cells of a box as lon lat value (img2web)')
+    xyz.add_argument('img')
+    xyz.add_argument('box', type=float, nargs=4, metavar=('S', 'N', 'W', 'E'))
+    xyz.add_argument('--scale', type=float, default=1., help='0.1 gravity, 1 topography, 0.01 geoid')
+    xyz.add_argument('--binary', action='store_true', help='write double precision x y z instead of text')
+    xyz.add_argument('--no-wrap', action='store_true', help='keep longitudes in 0 <-> 360')
+    sample = commands.add_parser('sample', help='append the bilinear value at points read from stdin (interp_ship)')
+    sample.add_argument('img')
+    sample.add_argument('--scale', type=float, default=1.)
+    sample.add_argument('--lon-field', type=int, default=1, help='field number of the longitude (from 1)')
+    sample.add_argument('--lat-field', type=int, default=2, help='field number of the latitude (from 1)')
+    args = parser.parse_args(argv)
+    if args.command not in ('xyz', 'sample'):
+        parser.print_help()
+        return 1
+    grid = ImgGrid(args.img, scale=args.scale, byte_order=args.byte_order)
+    output = sys.stdout.buffer
+
+    if args.command == 'xyz':
+        south, north, west, east = args.box
+        for chunk in grid.xyz_chunks(west, east, south, north, wrap=not args.no_wrap):
+            if args.binary:
+                output.write(chunk.astype('<f8').tobytes())
+            else:
+                np.savetxt(output, chunk, fmt='%.4f %.4f %.2f')
+        return 0
+
+    lines = sys.stdin.buffer.read().splitlines()
+    fields = [line.split() for line in lines]
+    lon = np.array([float(line[args.lon_field - 1]) for line in fields])
+    lat = np.array([float(line[args.lat_field - 1]) for line in fields])
+    for line, value in zip(lines, grid.sample(lon, lat)):
+        output.write(line + (' %.2f\n' % value).encode())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,119 @@
+"""
+Startup time of Py-CMeditor.
+
+Starts the editor in a fresh python process --repeat times and measures, in each, the time to import Py-CMeditor.py
+and the time from there until the main frame is built and the event loop is idle. It also records which of the heavy
+modules (vtk, matplotlib, folium, geopandas, shapely, pyproj) were loaded by then. The medians are appended to a JSON
+history file (with the git commit and an optional label), so the effect of a change on startup can be compared with
+earlier runs.
+
+Usage:
+    python startup_benchmark.py [--repeat 5] [--history startup_benchmark.json] [--label text] [--cold]
+
+--cold deletes the cached base map page before each run, to time the first start after a change to the map.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import statistics
+import subprocess
+import importlib.util
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+# MODULES THAT SHOULD ONLY BE LOADED WHEN THE FEATURE USING THEM IS FIRST USED
+HEAVY_MODULES = ('vtk', 'matplotlib', 'folium', 'geopandas', 'shapely', 'pyproj')
+
+
+def time_startup():
+    """(RUN IN THE CHILD PROCESS) START THE EDITOR, STOP WHEN IT IS IDLE AND PRINT THE TIMINGS AS JSON"""
+    sys.path.insert(0, HERE)
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('pycmeditor', os.path.join(HERE, 'Py-CMeditor.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+
+    import wx
+    app = wx.App(False)
+    frame = module.PyCMeditor()
+    frame.Show()
+    result = {'import_s': imported - start}
+
+    def idle():
+        result['frame_s'] = time.perf_counter() - imported
+        frame.Destroy()
+        app.ExitMainLoop()
+
+    wx.CallAfter(idle)
+    app.MainLoop()
+    result['modules'] = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time the startup of Py-CMeditor')
+    parser.add_argument('--repeat', type=int, default=5, help='number of starts')
+    parser.add_argument('--history', default=os.path.join(HERE, 'startup_benchmark.json'), help='JSON history file')
+    parser.add_argument('--label', default='', help='note stored with the result')
+    parser.add_argument('--cold', action='store_true', help='rebuild the cached base map page on every start')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        time_startup()
+        return 0
+
+    # 1.0 START THE EDITOR repeat TIMES, EACH IN A NEW PROCESS
+    runs = []
+    for i in range(args.repeat):
+        if args.cold:
+            for name in os.listdir(HERE):
+                if name.startswith('Py-CMeditor_base_v') and name.endswith('.html'):
+                    os.remove(os.path.join(HERE, name))
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.realpath(__file__), '--child'], cwd=HERE,
+                                stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['process_s'] = time.perf_counter() - start
+        runs.append(run)
+        print("start %d: import %.3f s, frame %.3f s, process %.3f s, loaded %s" %
+              (i + 1, run['import_s'], run['frame_s'], run['process_s'], ', '.join(run['modules']) or 'none'))
+
+    # 2.0 APPEND THE MEDIANS TO THE HISTORY
+    result = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+              'label': args.label, 'cold': args.cold, 'repeat': args.repeat,
+              'import_s': statistics.median([run['import_s'] for run in runs]),
+              'frame_s': statistics.median([run['frame_s'] for run in runs]),
+              'process_s': statistics.median([run['process_s'] for run in runs]),
+              'modules': runs[-1]['modules']}
+    history = []
+    if os.path.isfile(args.history):
+        with open(args.history) as history_file:
+            history = json.load(history_file)
+    history.append(result)
+    with open(args.history, 'w') as history_file:
+        json.dump(history, history_file, indent=1)
+
+    # 3.0 COMPARE WITH THE PREVIOUS RESULT OF THE SAME KIND
+    previous = [old for old in history[:-1] if old.get('cold') == args.cold]
+    print("median: import %.3f s, frame %.3f s, process %.3f s" % (result['import_s'], result['frame_s'],
+                                                                  result['process_s']))
+    if previous:
+        print("previous (%s %s): process %.3f s" % (previous[-1]['commit'], previous[-1]['label'],
+                                                    previous[-1]['process_s']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,963 @@
+"""
+Tension spline gridding (GMT surface) of a large region as many small overlapping blocks solved in parallel (replaces
+com/bathymetry/surface_tile.csh).
+
+surface_tile.csh cut the world into six latitude bands overlapping by 2 degrees, ran surface on them one after the
+other and grdblended them with a fixed blend.txt. Here the region is cut into square cores of --block-size degrees
+(by default the largest whose blocks have no more than MAX_BLOCK_NODES a side, so every block takes about the same
+time) and each core is solved as a block reaching --overlap degrees past it all round, on a pool of processes:
+
+    1. THE MEDIANS (x y z ON THE NODES, AS blockmedian -C WRITES THEM) ARE SORTED BY CORE INTO ONE FILE, SO A BLOCK
+       READS ONLY ITS OWN CORE AND THE EIGHT AROUND IT
+    2. EACH BLOCK IS SOLVED FOR (1 - T) DEL4 z - T DEL2 z = 0 WITH ITS MEDIANS HELD FIXED (-T -Z -C -N -Ll -Lu AS
+       surface TAKES THEM), WITH THE ASPECT RATIO OF ITS OWN LATITUDE (surface -A), COARSE TO FINE: THE MEDIANS ARE
+       SOLVED ON GRIDS 2, 4, 8 ... TIMES COARSER FIRST, AND EACH GRID IS IMPROVED BY MULTIGRID V CYCLES OF COLOURED
+       OVER-RELAXATION (-Z) UNTIL THE ERROR LEFT, ESTIMATED FROM THE LAST CHANGE AND THE RATE THE CHANGES FALL, IS
+       BELOW -C OR -N CYCLES ARE DONE
+    3. EACH CORE IS WRITTEN AS A TILE, BLENDING THE BLOCKS OVERLAPPING IT WITH WEIGHTS RAMPING LINEARLY FROM 1 TO 0
+       ACROSS THE OVERLAP (THE WEIGHTS OF NEIGHBOURING BLOCKS ADD UP TO 1, SO NO BLOCK EDGE SHOWS)
+    4. THE TILES ARE PASTED INTO THE OUTPUT GRID (world_tiles.py paste)
+
+A process holds one block (or the nine around a core) at a time, so memory is bounded by the block size and the run
+scales with the number of processes. A region spanning 360 degrees of longitude wraps around. Blocks without medians
+are not solved; their nodes are --empty (NaN by default) where no other block reaches.
+
+Given the pings (--pings, a ping_index.py index directory or the xyzi file) only the nodes within the search radius
+(-S) of a ping are solved for: cells of the region holding pings are found from the block directory of the index
+(reading only the pings of the blocks spread over several cells), each block is solved over the box of its nodes in
+reach with the rest held at --empty (0 for differences, so the predicted grid fills them), and the blocks with no
+medians in reach are not solved at all. The fill medians (zeros over land and voids) far from the pings cost nothing.
+
+The cycles, error estimate and residual of every block are printed and written to dst.grd.surface.json (--report),
+with the tiles reached by the blocks whose error is still more than -C after -N cycles: those are not passed silently,
+the run exits 1 unless --allow-unconverged is given.
+
+Usage:
+    python surface_engine.py medians.xyz dst.grd [-T0.55 -Z1.4 -C1.0 -N200 -Ll-800 -Lu800] [--increment 15c]
+                             [--region -180 180 -90 90] [--block-size 5] [--overlap 1] [--empty 0] [--columns 3]
+                             [--workers N] [--tiles-dir dir] [--extension .grd] [--report dst.grd.surface.json]
+                             [--allow-unconverged] [--pings index_dir|pings.xyzi -S300m --empty 0]
+"""
+import os
+import sys
+import json
+import argparse
+import shutil
+import tempfile
+import time
+import concurrent.futures
+import numpy as np
+from cm_io import atomic_write
+from grid_io import GRIDLINE, Grid, parse_increment, write_grid
+from ping_index import PingIndex, is_binary, read_xyzi
+from world_tiles import WORLD, paste, tile_name
+
+# surface OPTIONS OF demPaths.sh (surfaceOpts)
+TENSION = 0.55
+RELAX = 1.4
+CONVERGENCE = 1.
+MAX_ITERATIONS = 200
+
+# OVERLAP OF THE BLOCKS (DEG), AND THE MOST NODES A SIDE OF A BLOCK WHEN ITS CORE SIZE IS CHOSEN (5 DEGREE CORES OF 15c
+# NODES WITH THEIR OVERLAP): THE CYCLES OF A BLOCK TAKE TIME IN PROPORTION TO ITS NODES
+OVERLAP = 1
+MAX_BLOCK_NODES = 1700
+
+# SMALLEST ASPECT RATIO GIVEN TO A BLOCK (surface_tile.csh USED -A.50 FOR ITS POLAR BANDS)
+MIN_ASPECT = 0.5
+
+# MEDIANS READ AT A TIME
+READ_ROWS = 1000000
+
+# COLOURS OF THE NODES RELAXED TOGETHER: NO TWO NODES OF A COLOUR ARE IN EACH OTHER'S 13 POINT DEL4 STENCIL
+# (FINE_OFFSETS) ON THE GRID SOLVED, NOR IN EACH OTHER'S 5 x 5 STENCIL (OFFSETS) ON THE COARSER GRIDS OF A V CYCLE
+# (COARSE_STEP x COARSE_STEP COLOURS)
+N_COLOURS = 5
+COARSE_STEP = 3
+OFFSETS = [(row, col) for row in range(-2, 3) for col in range(-2, 3)]
+FINE_OFFSETS = [(row, col) for row, col in OFFSETS if abs(row) + abs(col) <= 2]
+
+# V CYCLES: SWEEPS BEFORE AND AFTER EACH CORRECTION. THE COARSEST GRID IS SOLVED DIRECTLY IF IT HAS NO MORE THAN
+# DENSE_NODES (OR BY COARSEST_SWEEPS IF A SIDE OF 2 NODES STOPS IT FIRST). THE MEDIANS ARE SOLVED ON COARSER GRIDS FIRST
+# DOWN TO COARSEST_NODES A SIDE
+SMOOTHING_SWEEPS = 2
+COARSEST_SWEEPS = 20
+DENSE_NODES = 1000
+COARSEST_NODES = 5
+
+# CELLS OF THE PING OCCUPANCY ACROSS THE SEARCH RADIUS (-S)
+SEARCH_CELLS = 4
+
+
+class SurfaceOptions:
+    """
+    THE surface OPTIONS OF A RUN: -T tension, -Z relax, -C convergence (m), -N max_iterations, -Ll lower AND -Lu upper
+    LIMITS (None IF NOT GIVEN), -S search RADIUS (DEG, None IF NOT GIVEN)
+    """
+    # OPTIONS OF surface THAT DO NOT CHANGE THE SOLUTION HERE, OR ARE GIVEN OTHERWISE (-R --region, -I --increment)
+    IGNORED = 'AVfbRIG'
+
+    def __init__(self, tension=TENSION, relax=RELAX, convergence=CONVERGENCE, max_iterations=MAX_ITERATIONS,
+                 lower=None, upper=None, search=None):
+        self.tension = tension
+        self.relax = relax
+        self.convergence = convergence
+        self.max_iterations = max_iterations
+        self.lower = lower
+        self.upper = upper
+        self.search = search
+
+    @classmethod
+    def parse(cls, words):
+        """OPTIONS FROM GMT STYLE WORDS, E.G. ['-T0.55', '-Z1.4', '-C1.0', '-N200', '-S300m', '-Ll-800', '-Lu800']"""
+        options = cls()
+        for word in words:
+            flag, value = word[1:2], word[2:]
+            if flag == 'T':
+                options.tension = float(value.lstrip('bi'))
+            elif flag == 'Z':
+                options.relax = float(value)
+            elif flag == 'C':
+                options.convergence = float(value)
+            elif flag == 'N':
+                options.max_iterations = int(value)
+            elif flag == 'L' and value[:1] == 'l':
+                options.lower = float(value[1:])
+            elif flag == 'L' and value[:1] == 'u':
+                options.upper = float(value[1:])
+            elif flag == 'S':
+                options.search = parse_increment(value)
+            elif flag not in cls.IGNORED:
+                raise ValueError("surface option %s is not supported" % word)
+        return options
+
+
+# SOLVER ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def second_differences(z):
+    """SECOND DIFFERENCES OF z ALONG x AND ALONG y AT EVERY NODE (0 ON AN EDGE: THE SURFACE IS NOT CURVED ACROSS IT)"""
+    along_x, along_y = np.zeros(z.shape), np.zeros(z.shape)
+    along_x[:, 1:-1] = z[:, 2:] + z[:, :-2] - 2. * z[:, 1:-1]
+    along_y[1:-1] = z[2:] + z[:-2] - 2. * z[1:-1]
+    return along_x, along_y
+
+
+def spread_second_differences(along_x, along_y):
+    """THE TRANSPOSE OF second_differences: THE VALUE OF EACH NODE SPREAD BACK OVER THE NODES ITS DIFFERENCES TAKE"""
+    spread = np.zeros(along_x.shape)
+    spread[:, :-2] += along_x[:, 1:-1]
+    spread[:, 2:] += along_x[:, 1:-1]
+    spread[:, 1:-1] -= 2. * along_x[:, 1:-1]
+    spread[:-2] += along_y[1:-1]
+    spread[2:] += along_y[1:-1]
+    spread[1:-1] -= 2. * along_y[1:-1]
+    return spread
+
+
+def spread_differences(z, aspect):
+    """-DEL2 z FROM THE DIFFERENCES BETWEEN NEIGHBOURS (NONE ACROSS AN EDGE)"""
+    spread = np.zeros(z.shape)
+    across = (z[:, 1:] - z[:, :-1]) / aspect ** 2
+    spread[:, :-1] -= across
+    spread[:, 1:] += across
+    down = z[1:] - z[:-1]
+    spread[:-1] -= down
+    spread[1:] += down
+    return spread
+
+
+def operator(z, tension, aspect, spacing=1.):
+    """
+    (1 - T) DEL4 z - T DEL2 z AT EVERY NODE OF z, THE y SPACING OF z BEING spacing NODES OF THE FINEST GRID. IT IS THE
+    GRADIENT OF THE ENERGY ((1 - T) |DEL2 z|^2 + T |GRAD z|^2) / 2 WITH NO SECOND DIFFERENCE ACROSS AN EDGE, SO THE
+    TWO NODES NEXT TO AN EDGE TAKE THE EQUATIONS OF THAT ENERGY AND THE SYSTEM IS SYMMETRIC (THE V CYCLES CONVERGE
+    THERE TOO)
+    """
+    along_x, along_y = second_differences(z)
+    del2 = along_x / aspect ** 2 + along_y
+    return ((1. - tension) * spread_second_differences(del2 / aspect ** 2, del2) / spacing ** 4 +
+            tension * spread_differences(z, aspect) / spacing ** 2)
+
+
+def lattice(values, row, col, shape, step):
+    """THE NODES OF values EVERY step NODES FROM row, col (shape OF THEM), AS A VIEW"""
+    return values[row:row + step * (shape[0] - 1) + 1:step, col:col + step * (shape[1] - 1) + 1:step]
+
+
+def probe(apply, shape, offsets, step=5):
+    """
+    THE COEFFICIENTS ([len(offsets), ROWS, COLUMNS]) OF THE LINEAR apply ON A GRID OF shape, WHOSE STENCIL IS offsets
+    (NO MORE THAN 2 NODES AWAY), FROM step x step CALLS ON COMBS OF NODES step APART
+    """
+    coefficients = np.zeros((len(offsets),) + tuple(shape))
+    for row in range(step):
+        for col in range(step):
+            comb = np.zeros(shape)
+            comb[row::step, col::step] = 1.
+            applied = apply(comb)
+            for k, (row_offset, col_offset) in enumerate(offsets):
+                nodes = np.s_[(row - row_offset) % step::step, (col - col_offset) % step::step]
+                coefficients[k][nodes] = applied[nodes]
+    return coefficients
+
+
+def edge_nodes(n, small=5):
+    """THE NODE OF A GRID small NODES ACROSS WITH THE EQUATION OF EACH OF n NODES (ONLY THE 2 NEXT TO AN EDGE DIFFER)"""
+    nodes = np.arange(n)
+    if n <= small:
+        return nodes
+    return np.where(nodes < 2, nodes, np.where(nodes >= n - 2, nodes - n + small, small // 2))
+
+
+def coarse_shape(shape):
+    """SHAPE OF THE GRID TWICE AS COARSE, SHARING EVERY OTHER NODE"""
+    return (shape[0] + 1) // 2, (shape[1] + 1) // 2
+
+
+def coarse_data(z, fixed):
+    """THE fixed VALUES OF z MOVED TO THE NEAREST NODE OF THE GRID TWICE AS COARSE (THEIR MEAN WHERE SEVERAL MEET)"""
+    shape = coarse_shape(z.shape)
+    rows, cols = np.nonzero(fixed)
+    node = np.minimum((rows + 1) // 2, shape[0] - 1) * shape[1] + np.minimum((cols + 1) // 2, shape[1] - 1)
+    counts = np.bincount(node, minlength=shape[0] * shape[1]).reshape(shape)
+    sums = np.bincount(node, weights=z[fixed], minlength=shape[0] * shape[1]).reshape(shape)
+    coarse_fixed = counts > 0
+    coarse = np.zeros(shape)
+    coarse[coarse_fixed] = sums[coarse_fixed] / counts[coarse_fixed]
+    return coarse, coarse_fixed
+
+
+def prolong(coarse, shape):
+    """BILINEAR INTERPOLATION OF coarse ONTO THE FINER GRID OF shape (AN EVEN LAST ROW OR COLUMN REPEATS ITS LAST)"""
+    fine = np.zeros(shape)
+    fine[::2, ::2] = coarse
+    fine[::2, 1:-1:2] = 0.5 * (fine[::2, :-2:2] + fine[::2, 2::2])
+    if shape[1] % 2 == 0:
+        fine[::2, -1] = fine[::2, -2]
+    fine[1:-1:2] = 0.5 * (fine[:-2:2] + fine[2::2])
+    if shape[0] % 2 == 0:
+        fine[-1] = fine[-2]
+    return fine
+
+
+def restrict(values):
+    """THE TRANSPOSE OF prolong: EACH NODE OF values ADDED TO THE COARSER NODES IT IS INTERPOLATED FROM, WEIGHTED"""
+    values = values.copy()
+    if values.shape[0] % 2 == 0:
+        values[-2] += values[-1]
+    values[:-2:2] += 0.5 * values[1:-1:2]
+    values[2::2] += 0.5 * values[1:-1:2]
+    values = values[::2]
+    if values.shape[1] % 2 == 0:
+        values[:, -2] += values[:, -1]
+    values[:, :-2:2] += 0.5 * values[:, 1:-1:2]
+    values[:, 2::2] += 0.5 * values[:, 1:-1:2]
+    return np.ascontiguousarray(values[:, ::2])
+
+
+class FineLevel:
+    """
+    THE GRID SOLVED, WITH ITS fixed NODES: operator IS THE SAME 13 POINT STENCIL (weights) AT EVERY NODE BUT THOSE OF
+    THE TWO ROWS AND COLUMNS NEXT TO THE EDGES, WHOSE COEFFICIENTS ARE KEPT. THE FREE NODES OF A COLOUR ARE RELAXED
+    TOGETHER, AS SUB-GRIDS OF EVERY N_COLOURS NODES, SO ONLY THEIR RESIDUALS ARE COMPUTED
+    """
+    inverse = None
+
+    def __init__(self, fixed, aspect, options, spacing=1.):
+        self.fixed = fixed
+        self.shape = fixed.shape
+        self.tension = options.tension
+        self.aspect = aspect
+        self.spacing = spacing
+        n_rows, n_cols = fixed.shape
+
+        # 1.0 THE COEFFICIENTS OF A GRID NO MORE THAN 5 NODES A SIDE HOLD THOSE OF EVERY NODE
+        def apply(values):
+            return operator(values, self.tension, aspect, spacing)
+        self.weights = probe(apply, (5, 5), FINE_OFFSETS)[:, 2, 2]
+        small = probe(apply, (min(n_rows, 5), min(n_cols, 5)), FINE_OFFSETS)
+        rows, cols = edge_nodes(n_rows), edge_nodes(n_cols)
+        self.edge_rows = dict((row, small[:, rows[row], cols]) for row in range(n_rows)
+                              if row < 2 or row >= n_rows - 2)
+        self.edge_cols = dict((col, small[:, rows, cols[col]]) for col in range(n_cols)
+                              if col < 2 or col >= n_cols - 2)
+        centre = FINE_OFFSETS.index((0, 0))
+        self.diagonal = np.full(self.shape, self.weights[centre])
+        for row, coefficients in self.edge_rows.items():
+            self.diagonal[row] = coefficients[centre]
+        for col, coefficients in self.edge_cols.items():
+            self.diagonal[:, col] = coefficients[centre]
+
+        # 2.0 THE SUB-GRIDS OF EACH COLOUR ((ROW + 2 COLUMN) % N_COLOURS) HOLDING FREE NODES, WITH 1 / THE DIAGONAL OF
+        # THEIR FREE NODES (0 FOR THE FIXED)
+        self.colours = []
+        for colour in range(N_COLOURS):
+            sub_grids = []
+            for row in range(min(N_COLOURS, n_rows)):
+                col = 3 * (colour - row) % N_COLOURS  # 2 x 3 = 1 (MOD 5)
+                if col >= n_cols:
+                    continue
+                shape = (len(range(row, n_rows, N_COLOURS)), len(range(col, n_cols, N_COLOURS)))
+                free = ~lattice(fixed, row, col, shape, N_COLOURS)
+                if free.any():
+                    sub_grids.append((row, col, shape,
+                                      np.where(free, 1. / lattice(self.diagonal, row, col, shape, N_COLOURS), 0.)))
+            self.colours.append(sub_grids)
+
+    def apply(self, values):
+        """operator OF values ON THE FREE NODES (THE fixed NODES TAKEN AS 0, AND LEFT 0)"""
+        applied = operator(np.where(self.fixed, 0., values), self.tension, self.aspect, self.spacing)
+        applied[self.fixed] = 0.
+        return applied
+
+    def sub_grid(self, padded, row, col, shape):
+        """operator AT THE NODES EVERY N_COLOURS FROM row, col (shape OF THEM), padded HOLDING THE VALUES 2 NODES IN"""
+        applied = np.zeros(shape)
+        for weight, (row_offset, col_offset) in zip(self.weights, FINE_OFFSETS):
+            applied += weight * lattice(padded, row + 2 + row_offset, col + 2 + col_offset, shape, N_COLOURS)
+        for edge_row, coefficients in self.edge_rows.items():
+            if edge_row >= row and (edge_row - row) % N_COLOURS == 0:
+                applied[(edge_row - row) // N_COLOURS] = sum(
+                    coefficients[k, col::N_COLOURS] *
+                    padded[edge_row + 2 + row_offset, col + 2 + col_offset::N_COLOURS][:shape[1]]
+                    for k, (row_offset, col_offset) in enumerate(FINE_OFFSETS))
+        for edge_col, coefficients in self.edge_cols.items():
+            if edge_col >= col and (edge_col - col) % N_COLOURS == 0:
+                applied[:, (edge_col - col) // N_COLOURS] = sum(
+                    coefficients[k, row::N_COLOURS] *
+                    padded[row + 2 + row_offset::N_COLOURS, edge_col + 2 + col_offset][:shape[0]]
+                    for k, (row_offset, col_offset) in enumerate(FINE_OFFSETS))
+        return applied
+
+    def relax(self, values, rhs, sweeps, relax=1., reverse=False):
+        """
+        SWEEPS OF GAUSS SEIDEL, OVER-RELAXED BY relax, OF operator(values) = rhs ON THE FREE NODES, ONE COLOUR AT A TIME
+        (IN reverse ORDER AFTER A CORRECTION, SO A V CYCLE IS SYMMETRIC)
+        """
+        padded = np.pad(values, 2)
+        colours = self.colours[::-1] if reverse else self.colours
+        for sweep in range(sweeps):
+            for sub_grids in colours:
+                for row, col, shape, inverse in sub_grids:
+                    remaining = lattice(rhs, row, col, shape, N_COLOURS) - self.sub_grid(padded, row, col, shape)
+                    lattice(padded, row + 2, col + 2, shape, N_COLOURS)[...] += relax * inverse * remaining
+        values[...] = padded[2:-2, 2:-2]
+
+
+class CoarseLevel:
+    """
+    A GRID OF A V CYCLE TWICE AS COARSE AS finer. ITS OPERATOR IS restrict(finer.apply(prolong(values))) (GALERKIN: THE
+    CORRECTION IT GIVES IS THE BEST THE COARSER GRID HOLDS), KEPT AS THE 5 x 5 STENCIL OF EACH NODE. ITS fixed NODES ARE
+    THOSE prolong TAKES TO NO FREE NODE OF finer. THE NODES EVERY COARSE_STEP NODES ARE RELAXED TOGETHER
+    """
+    inverse = None
+
+    def __init__(self, finer):
+        self.shape = coarse_shape(finer.shape)
+        self.fixed = restrict((~finer.fixed).astype(float)) == 0.
+        self.coefficients = probe(lambda values: restrict(finer.apply(prolong(values, finer.shape))), self.shape,
+                                  OFFSETS)
+        diagonal = self.coefficients[OFFSETS.index((0, 0))]
+        self.inverse_diagonal = np.where(self.fixed, 0., 1. / np.where(self.fixed, 1., diagonal))
+
+    def apply(self, values):
+        """THE OPERATOR OF THIS LEVEL OF values"""
+        padded = np.pad(values, 2)
+        applied = np.zeros(self.shape)
+        for coefficients, (row_offset, col_offset) in zip(self.coefficients, OFFSETS):
+            applied += coefficients * padded[2 + row_offset:2 + row_offset + self.shape[0],
+                                             2 + col_offset:2 + col_offset + self.shape[1]]
+        return applied
+
+    def relax(self, values, rhs, sweeps, relax=1., reverse=False):
+        """SWEEPS OF GAUSS SEIDEL, OVER-RELAXED BY relax, OF THE OPERATOR OF values = rhs, AS FineLevel.relax"""
+        padded = np.pad(values, 2)
+        sub_grids = [(row, col, (len(range(row, self.shape[0], COARSE_STEP)),
+                                 len(range(col, self.shape[1], COARSE_STEP))))
+                     for row in range(min(COARSE_STEP, self.shape[0]))
+                     for col in range(min(COARSE_STEP, self.shape[1]))]
+        for sweep in range(sweeps):
+            for row, col, shape in (sub_grids[::-1] if reverse else sub_grids):
+                remaining = lattice(rhs, row, col, shape, COARSE_STEP).copy()
+                for coefficients, (row_offset, col_offset) in zip(self.coefficients, OFFSETS):
+                    remaining -= (lattice(coefficients, row, col, shape, COARSE_STEP) *
+                                  lattice(padded, row + 2 + row_offset, col + 2 + col_offset, shape, COARSE_STEP))
+                lattice(padded, row + 2, col + 2, shape, COARSE_STEP)[...] += \
+                    relax * lattice(self.inverse_diagonal, row, col, shape, COARSE_STEP) * remaining
+        values[...] = padded[2:-2, 2:-2]
+
+
+def dense_inverse(level):
+    """THE FREE NODES OF A SMALL level AND THE (PSEUDO) INVERSE OF ITS OPERATOR ON THEM, AS A MATRIX"""
+    coefficients = probe(level.apply, level.shape, OFFSETS)
+    n_rows, n_cols = level.shape
+    rows, cols = np.indices(level.shape)
+    matrix = np.zeros((n_rows * n_cols, n_rows * n_cols))
+    for k, (row_offset, col_offset) in enumerate(OFFSETS):
+        inside = ((rows + row_offset >= 0) & (rows + row_offset < n_rows) &
+                  (cols + col_offset >= 0) & (cols + col_offset < n_cols))
+        matrix[(rows * n_cols + cols)[inside],
+               ((rows + row_offset) * n_cols + cols + col_offset)[inside]] = coefficients[k][inside]
+    free = np.flatnonzero(~level.fixed.ravel())
+    return free, np.linalg.pinv(matrix[np.ix_(free, free)], hermitian=True)
+
+
+def cycle_levels(fixed, aspect, options, spacing=1.):
+    """THE LEVELS OF A V CYCLE ON A GRID, FROM ITSELF DOWN TO THE COARSEST (SOLVED DIRECTLY IF SMALL ENOUGH)"""
+    levels = [FineLevel(fixed, aspect, options, spacing)]
+    while levels[-1].fixed.size > DENSE_NODES and min(levels[-1].shape) > 2:
+        levels.append(CoarseLevel(levels[-1]))
+    if levels[-1].fixed.size <= DENSE_NODES:
+        levels[-1].inverse = dense_inverse(levels[-1])
+    return levels
+
+
+def v_cycle(levels, rhs, relax=1.):
+    """
+    THE CORRECTION FROM ONE V CYCLE, STARTING FROM 0, FOR levels[0].apply(correction) = rhs: SMOOTH, SOLVE FOR THE
+    REMAINING RESIDUAL ON THE COARSER LEVELS, ADD IT AND SMOOTH AGAIN
+    """
+    level = levels[0]
+    correction = np.zeros(level.shape)
+    if level.inverse is not None:
+        free, inverse = level.inverse
+        correction.flat[free] = inverse @ rhs.ravel()[free]
+        return correction
+    if len(levels) == 1:
+        level.relax(correction, rhs, COARSEST_SWEEPS, relax)
+        level.relax(correction, rhs, COARSEST_SWEEPS, relax, reverse=True)
+        return correction
+    level.relax(correction, rhs, SMOOTHING_SWEEPS, relax)
+    coarser = prolong(v_cycle(levels[1:], restrict(rhs - level.apply(correction)), relax), level.shape)
+    coarser[level.fixed] = 0.
+    correction += coarser
+    level.relax(correction, rhs, SMOOTHING_SWEEPS, relax, reverse=True)
+    return correction
+
+
+def solve(z, fixed, aspect, options, spacing=1.):
+    """
+    SOLVE FOR THE NODES OF z (float64, UPDATED IN PLACE) THAT ARE NOT fixed, COARSE TO FINE AS surface DOES: THE
+    fixed VALUES ARE MOVED TO THE NODES OF A GRID TWICE AS COARSE AND SOLVED THERE FIRST, THE SOLUTION INTERPOLATED
+    ONTO THIS GRID AND IMPROVED BY V CYCLES. THE LARGEST CHANGE OF A CYCLE FALLS BY ABOUT THE SAME rate EVERY CYCLE, SO
+    THE SOLUTION IS STILL UP TO change / (1 - rate) AWAY: THE CYCLES STOP WHEN THAT IS BELOW -C, OR -N CYCLES ARE DONE.
+    RETURNS (CYCLES, THAT ERROR (m, inf WHILE THE CHANGES DO NOT FALL), LARGEST RESIDUAL AS THE CHANGE IT WOULD MAKE TO
+    A NODE (m))
+    """
+    if not fixed.any():
+        return 0, 0., 0.
+
+    # 1.0 START FROM THE SOLUTION OF THE COARSER GRID (THE MEAN ON THE COARSEST)
+    if min(z.shape) > COARSEST_NODES:
+        coarse, fixed_coarse = coarse_data(z, fixed)
+        solve(coarse, fixed_coarse, aspect, options, 2. * spacing)
+        z[~fixed] = prolong(coarse, z.shape)[~fixed]
+    else:
+        z[~fixed] = z[fixed].mean()
+
+    # 2.0 V CYCLES UNTIL THE ERROR LEFT (FROM THE RATE OF THE LAST TWO CYCLES) IS BELOW -C
+    levels = cycle_levels(fixed, aspect, options, spacing)
+    changes, error = [], 0.
+    while (~fixed).any() and len(changes) < options.max_iterations:
+        remaining = -operator(z, options.tension, aspect, spacing)
+        remaining[fixed] = 0.
+        correction = v_cycle(levels, remaining, options.relax)
+        before = z[~fixed]
+        z[~fixed] += correction[~fixed]
+        if options.lower is not None or options.upper is not None:
+            np.clip(z, options.lower, options.upper, out=z)
+        changes.append(float(np.abs(z[~fixed] - before).max()))
+        rates = [later / earlier for earlier, later in zip(changes[-3:-1], changes[-2:]) if earlier > 0.]
+        rate = max(rates) if rates else 1.
+        error = 0. if changes[-1] == 0. else changes[-1] / (1. - rate) if rate < 1. else np.inf
+        if error < options.convergence:
+            break
+    remaining = np.abs(operator(z, options.tension, aspect, spacing)[~fixed] / levels[0].diagonal[~fixed])
+    return len(changes), error, float(remaining.max()) if remaining.size else 0.
+
+
+# SEARCH RADIUS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Occupancy:
+    """
+    THE CELLS OF cell DEGREES (FROM THE SOUTH WEST CORNER OF region) HOLDING PINGS, AND THE cells REACHED: THOSE
+    WITHIN search DEGREES OF THEM (surface -S). A periodic REGION (360 DEGREES OF LONGITUDE) WRAPS AROUND
+    """
+    def __init__(self, region, search, cell, periodic=False):
+        self.west, self.east, self.south, self.north = region
+        self.search = search
+        self.cell = cell
+        self.periodic = periodic
+        shape = (max(int(np.ceil((self.north - self.south) / cell)), 1),
+                 max(int(np.ceil((self.east - self.west) / cell)), 1))
+        self.hit = np.zeros(shape, dtype=bool)
+        self.reached = None
+
+    def rows(self, lat):
+        """CELL ROW OF EACH LATITUDE (THE EDGE ROW WITHIN search OUTSIDE THE REGION, -1 FARTHER OUT)"""
+        lat = np.asarray(lat, dtype=float)
+        rows = np.clip(np.floor((lat - self.south) / self.cell).astype(np.int64), 0, self.hit.shape[0] - 1)
+        return np.where((lat >= self.south - self.search) & (lat <= self.north + self.search), rows, -1)
+
+    def cols(self, lon):
+        """CELL COLUMN OF EACH LONGITUDE (WRAPPED ON A periodic REGION, AS rows OTHERWISE)"""
+        lon = np.asarray(lon, dtype=float)
+        if self.periodic:
+            return np.minimum(np.floor(((lon - self.west) % 360.) / self.cell).astype(np.int64),
+                              self.hit.shape[1] - 1)
+        cols = np.clip(np.floor((lon - self.west) / self.cell).astype(np.int64), 0, self.hit.shape[1] - 1)
+        return np.where((lon >= self.west - self.search) & (lon <= self.east + self.search), cols, -1)
+
+    def add(self, lon, lat):
+        """MARK THE CELLS OF PINGS"""
+        rows, cols = self.rows(lat), self.cols(lon)
+        near = (rows >= 0) & (cols >= 0)
+        self.hit[rows[near], cols[near]] = True
+
+    def add_pings(self, path, read_rows=READ_ROWS):
+        """
+        MARK THE CELLS OF THE PINGS OF A ping_index.py INDEX DIRECTORY OR AN xyzi FILE. A BLOCK OF THE INDEX INSIDE ONE
+        CELL MARKS IT FROM ITS BOX IN THE BLOCK DIRECTORY; ONLY THE PINGS OF THE BLOCKS SPREAD OVER CELLS ARE READ
+        """
+        if not os.path.isdir(path):
+            for records in read_xyzi(path, read_rows):
+                self.add(records['lon'], records['lat'])
+            return
+        index = PingIndex(path)
+        for stem in index.runs:
+            records, blocks = index.run(stem)
+            boxed = ((self.rows(blocks['lat_min']) == self.rows(blocks['lat_max'])) &
+                     (self.cols(blocks['lon_min']) == self.cols(blocks['lon_max'])))
+            self.add(blocks['lon_min'][boxed], blocks['lat_min'][boxed])
+            spread = np.flatnonzero(~boxed)
+            if spread.size == 0:
+                continue
+            breaks = np.flatnonzero(np.diff(spread) != 1) + 1
+            for first, last in zip(spread[np.r_[0, breaks]], spread[np.r_[breaks - 1, len(spread) - 1]]):
+                for start in range(first * index.block_size, (last + 1) * index.block_size, read_rows):
+                    chunk = records[start:min(start + read_rows, (last + 1) * index.block_size)]
+                    self.add(chunk['lon'], chunk['lat'])
+
+    def reach(self):
+        """SET AND RETURN reached: THE CELLS WITHIN search OF A CELL HOLDING PINGS"""
+        radius = int(np.ceil(self.search / self.cell))
+        n_rows, n_cols = self.hit.shape
+        padded = np.pad(self.hit, ((radius, radius), (0, 0) if self.periodic else (radius, radius)))
+        self.reached = np.zeros(self.hit.shape, dtype=bool)
+        for row in range(-radius, radius + 1):
+            for col in range(-radius, radius + 1):
+                # NEAREST POINTS OF THE TWO CELLS WITHIN search
+                if (max(abs(row) - 1, 0) ** 2 + max(abs(col) - 1, 0) ** 2) * self.cell ** 2 > self.search ** 2:
+                    continue
+                shifted = padded[radius + row:radius + row + n_rows]
+                if self.periodic:
+                    shifted = np.roll(shifted, -col, axis=1)
+                else:
+                    shifted = shifted[:, radius + col:radius + col + n_cols]
+                self.reached |= shifted
+        return self.reached
+
+    def reached_nodes(self, x, y):
+        """reached AT THE NODES x, y ([len(y), len(x)])"""
+        return self.reached[np.ix_(self.rows(y), self.cols(x))]
+
+
+# BLOCKS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Axis:
+    """
+    ONE AXIS OF THE BLOCKS: NODES first + increment * i (i = 0 <-> n - 1, GRIDLINE) CUT INTO n_cores CORES OF size
+    NODES, EACH SOLVED overlap NODES PAST ITS EDGES. A periodic AXIS (360 DEGREES OF LONGITUDE) WRAPS AROUND, ITS LAST
+    NODE BEING ITS FIRST; NODE NUMBERS OUTSIDE 0 <-> n - 1 ARE THEN THE SAME NODES A PERIOD AWAY
+    """
+    def __init__(self, first, last, increment, size, overlap, periodic=False):
+        self.first = first
+        self.increment = increment
+        self.n = int(round((last - first) / increment)) + 1
+        self.size = size
+        self.overlap = overlap
+        self.periodic = periodic
+        if (self.n - 1) % size:
+            raise ValueError("%g <-> %g is not a whole number of %g degree blocks" % (first, last, size * increment))
+        self.n_cores = (self.n - 1) // size
+
+    @property
+    def period(self):
+        return self.n - 1
+
+    def nodes(self, coordinates):
+        """NEAREST NODE OF EACH COORDINATE (WRAPPED ON A PERIODIC AXIS); -1 OFF THE AXIS"""
+        nodes = np.rint((np.asarray(coordinates, dtype=float) - self.first) / self.increment).astype(np.int64)
+        if self.periodic:
+            return nodes % self.period
+        return np.where((nodes >= 0) & (nodes < self.n), nodes, -1)
+
+    def cores(self, nodes):
+        """CORE HOLDING EACH NODE (THE LAST NODE OF A NON PERIODIC AXIS IS IN THE LAST CORE)"""
+        return np.minimum(nodes // self.size, self.n_cores - 1)
+
+    def solve_nodes(self, core):
+        """(start, stop) NODES SOLVED FOR A CORE (stop EXCLUSIVE; BEYOND 0 <-> n - 1 ONLY ON A PERIODIC AXIS)"""
+        start, stop = core * self.size - self.overlap, (core + 1) * self.size + self.overlap + 1
+        if not self.periodic:
+            start, stop = max(start, 0), min(stop, self.n)
+        return start, stop
+
+    def neighbours(self, core):
+        """[(core, offset)] OF THE CORES NEXT TO core AND ITSELF, offset MOVING THEIR NODES NEXT TO core's"""
+        neighbours = []
+        for step in (-1, 0, 1):
+            neighbour, offset = core + step, 0
+            if self.periodic and neighbour < 0:
+                neighbour, offset = self.n_cores - 1, -self.period
+            elif self.periodic and neighbour >= self.n_cores:
+                neighbour, offset = 0, self.period
+            if 0 <= neighbour < self.n_cores:
+                neighbours.append((neighbour, offset))
+        return neighbours
+
+    def weights(self, core, nodes):
+        """
+        BLEND WEIGHT OF THE BLOCK OF core AT nodes: 1 INSIDE THE CORE, RAMPING TO 0.5 AT ITS EDGES AND TO 0 AT THE
+        EDGES OF THE BLOCK. EDGES OF A NON PERIODIC AXIS ARE NOT RAMPED
+        """
+        nodes = np.asarray(nodes, dtype=float)
+        start, stop = core * self.size, (core + 1) * self.size
+
+        def ramp(inside):
+            if self.overlap == 0:
+                return (inside >= 0.).astype(float)
+            return np.clip(0.5 + inside / (2. * self.overlap), 0., 1.)
+        west = ramp(nodes - start) if self.periodic or core > 0 else np.ones(len(nodes))
+        east = ramp(stop - nodes) if self.periodic or core < self.n_cores - 1 else np.ones(len(nodes))
+        return np.minimum(west, east)
+
+    def coordinates(self, nodes):
+        return self.first + self.increment * np.asarray(nodes, dtype=float)
+
+
+def read_xyz_chunks(path, columns=3, read_rows=READ_ROWS):
+    """YIELD [n, columns] ARRAYS OF A BINARY (DOUBLE PRECISION, GMT -bi) OR TEXT xyz FILE, read_rows AT A TIME"""
+    if is_binary(path):
+        values = np.memmap(path, dtype='<f8', mode='r').reshape(-1, columns)
+        for first_row in range(0, len(values), read_rows):
+            yield np.array(values[first_row:first_row + read_rows])
+        return
+    with open(path) as xyz:
+        while True:
+            chunk = np.loadtxt(xyz, ndmin=2, max_rows=read_rows)
+            if len(chunk) == 0:
+                return
+            yield chunk[:, :columns]
+            if len(chunk) < read_rows:
+                return
+
+
+def sort_medians(xyz_path, workdir, rows, cols, columns=3):
+    """
+    COPY THE MEDIANS INSIDE THE REGION TO workdir/medians.npy ([n, 3], SORTED BY CORE) AND THE FIRST ROW OF EACH CORE
+    TO workdir/cores.npy. RETURNS THE NUMBER OF MEDIANS (INSIDE, OUTSIDE)
+    """
+    # 1.0 THE CORE OF EVERY MEDIAN (-1 OUTSIDE)
+    keys = []
+    for chunk in read_xyz_chunks(xyz_path, columns):
+        row_nodes, col_nodes = rows.nodes(chunk[:, 1]), cols.nodes(chunk[:, 0])
+        inside = (row_nodes >= 0) & (col_nodes >= 0)
+        keys.append(np.where(inside, rows.cores(row_nodes) * cols.n_cores + cols.cores(col_nodes), -1))
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+    counts = np.bincount(keys[keys >= 0], minlength=rows.n_cores * cols.n_cores)
+    first = np.concatenate(([0], np.cumsum(counts)))
+    np.save(os.path.join(workdir, 'cores.npy'), first)
+
+    # 2.0 COPY EACH CHUNK, SORTED, INTO THE ROWS LEFT FOR ITS CORES
+    medians = np.lib.format.open_memmap(os.path.join(workdir, 'medians.npy'), mode='w+', dtype=np.float64,
+                                        shape=(int(first[-1]), 3))
+    filled = first[:-1].copy()
+    start = 0
+    for chunk in read_xyz_chunks(xyz_path, columns):
+        chunk_keys = keys[start:start + len(chunk)]
+        start += len(chunk)
+        order = np.argsort(chunk_keys, kind='stable')
+        order = order[chunk_keys[order] >= 0]
+        sorted_keys = chunk_keys[order]
+        chunk_cores, chunk_first, chunk_counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+        position = filled[sorted_keys] + np.arange(len(order)) - np.repeat(chunk_first, chunk_counts)
+        medians[position] = chunk[order, :3]
+        filled[chunk_cores] += chunk_counts
+    medians.flush()
+    return int(first[-1]), int(np.count_nonzero(keys < 0))
+
+
+def block_path(workdir, row_core, col_core):
+    return os.path.join(workdir, 'block.%d.%d.npy' % (row_core, col_core))
+
+
+def block_medians(workdir, rows, cols, row_core, col_core):
+    """THE MEDIANS OF THE CORES AROUND A BLOCK THAT FALL IN IT, AS (row, col) INSIDE THE BLOCK AND z"""
+    medians = np.load(os.path.join(workdir, 'medians.npy'), mmap_mode='r')
+    first = np.load(os.path.join(workdir, 'cores.npy'))
+    row_start, row_stop = rows.solve_nodes(row_core)
+    col_start, col_stop = cols.solve_nodes(col_core)
+    cores = set((row, col) for row, _ in rows.neighbours(row_core) for col, _ in cols.neighbours(col_core))
+    values = [medians[first[key]:first[key + 1]] for key in sorted(row * cols.n_cores + col for row, col in cores)]
+    values = np.concatenate(values) if values else np.empty((0, 3))
+    row = rows.nodes(values[:, 1]) - row_start
+    col = cols.nodes(values[:, 0]) - col_start
+    if cols.periodic:
+        col %= cols.period
+    inside = (row >= 0) & (row < row_stop - row_start) & (col >= 0) & (col < col_stop - col_start)
+    return row[inside], col[inside], values[inside, 2]
+
+
+class BlockSummary:
+    """
+    THE SOLUTION OF THE BLOCK OF A CORE: ITS medians, THE nodes SOLVED FOR, THE cycles RUN ON THEM, THE error (m) STILL
+    IN THEM AS solve ESTIMATES IT, THE LARGEST residual (m) LEFT AND THE seconds TAKEN. A BLOCK WITHOUT MEDIANS IS NOT
+    SOLVED
+    """
+    def __init__(self, row_core, col_core, medians=0, nodes=0, cycles=0, error=0., residual=0., seconds=0.,
+                 converged=True):
+        self.row_core = row_core
+        self.col_core = col_core
+        self.medians = medians
+        self.nodes = nodes
+        self.cycles = cycles
+        self.error = error
+        self.residual = residual
+        self.seconds = seconds
+        self.converged = converged
+
+    def as_dict(self):
+        # AN error THAT COULD NOT BE ESTIMATED (THE CHANGES DID NOT FALL) IS null IN THE JSON REPORT
+        summary = dict(self.__dict__)
+        summary['error'] = self.error if np.isfinite(self.error) else None
+        return summary
+
+
+def solve_block(workdir, rows, cols, row_core, col_core, options, occupancy=None, fill=np.nan):
+    """
+    SOLVE THE BLOCK OF A CORE AND SAVE IT IN workdir (NOTHING IS SAVED FOR A BLOCK WITHOUT MEDIANS). WITH AN
+    Occupancy ONLY THE NODES IT REACHES ARE SOLVED FOR, THE OTHERS BEING HELD AT fill AND THEIR MEDIANS LEFT OUT.
+    RETURNS ITS BlockSummary
+    """
+    start = time.time()
+    row, col, z = block_medians(workdir, rows, cols, row_core, col_core)
+    row_start, row_stop = rows.solve_nodes(row_core)
+    col_start, col_stop = cols.solve_nodes(col_core)
+    shape = (row_stop - row_start, col_stop - col_start)
+    reached = np.ones(shape, dtype=bool)
+    if occupancy is not None:
+        reached = occupancy.reached_nodes(cols.coordinates(np.arange(col_start, col_stop)),
+                                          rows.coordinates(np.arange(row_start, row_stop)))
+        inside = reached[row, col]
+        row, col, z = row[inside], col[inside], z[inside]
+    if len(z) == 0:
+        return BlockSummary(row_core, col_core)
+
+    # 1.0 EACH NODE WITH MEDIANS IS HELD AT THEIR MEAN (ONE MEDIAN A NODE FROM blockmedian -C), EACH NODE OUT OF
+    # REACH AT fill
+    node = row * shape[1] + col
+    counts = np.bincount(node, minlength=shape[0] * shape[1]).reshape(shape)
+    sums = np.bincount(node, weights=z, minlength=shape[0] * shape[1]).reshape(shape)
+    fixed = (counts > 0) | ~reached
+    grid = np.zeros(shape)
+    grid[counts > 0] = sums[counts > 0] / counts[counts > 0]
+    grid[~reached] = fill
+
+    # 2.0 SOLVE WITH THE ASPECT RATIO AT THE MIDDLE OF THE CORE, ONLY OVER THE NODES IN REACH AND TWO NODES OF fill
+    # ROUND THEM (THE DEL4 STENCIL)
+    middle = rows.coordinates((row_core + 0.5) * rows.size)
+    aspect = max(np.cos(np.radians(middle)), MIN_ASPECT)
+    reached_rows, reached_cols = np.flatnonzero(reached.any(axis=1)), np.flatnonzero(reached.any(axis=0))
+    window = np.s_[max(reached_rows[0] - 2, 0):reached_rows[-1] + 3, max(reached_cols[0] - 2, 0):reached_cols[-1] + 3]
+    cycles, error, residual_left = solve(grid[window], fixed[window], aspect, options)
+    np.save(block_path(workdir, row_core, col_core), grid.astype(np.float32))
+    return BlockSummary(row_core, col_core, len(z), int(np.count_nonzero(~fixed)), cycles, error, residual_left,
+                        time.time() - start, error < options.convergence)
+
+
+def solve_block_job(job):
+    return solve_block(*job)
+
+
+def blend_core(workdir, rows, cols, row_core, col_core, path, empty=np.nan):
+    """
+    WRITE THE TILE OF A CORE (ITS NODES AND THE EDGE NODES IT SHARES) TO path, BLENDING THE BLOCKS OVERLAPPING IT.
+    A BLOCK THAT WAS NOT SOLVED COUNTS AS empty (OR NOT AT ALL IF empty IS NaN)
+    """
+    tile_rows = np.arange(row_core * rows.size, min((row_core + 1) * rows.size + 1, rows.n))
+    tile_cols = np.arange(col_core * cols.size, (col_core + 1) * cols.size + 1)
+    total = np.zeros((len(tile_rows), len(tile_cols)))
+    weight = np.zeros(total.shape)
+    for block_row, row_offset in rows.neighbours(row_core):
+        for block_col, col_offset in cols.neighbours(col_core):
+            row_start, row_stop = rows.solve_nodes(block_row)
+            col_start, col_stop = cols.solve_nodes(block_col)
+            row_index = tile_rows - row_offset - row_start
+            col_index = tile_cols - col_offset - col_start
+            row_inside = (row_index >= 0) & (row_index < row_stop - row_start)
+            col_inside = (col_index >= 0) & (col_index < col_stop - col_start)
+            if not row_inside.any() or not col_inside.any():
+                continue
+            path_block = block_path(workdir, block_row, block_col)
+            if os.path.exists(path_block):
+                values = np.load(path_block)[np.ix_(row_index[row_inside], col_index[col_inside])]
+            elif not np.isnan(empty):
+                values = np.full((np.count_nonzero(row_inside), np.count_nonzero(col_inside)), empty)
+            else:
+                continue
+            block_weight = np.outer(rows.weights(block_row, tile_rows[row_inside] - row_offset),
+                                    cols.weights(block_col, tile_cols[col_inside] - col_offset))
+            block_weight[~np.isfinite(values)] = 0.
+            total[np.ix_(row_inside, col_inside)] += block_weight * np.nan_to_num(values)
+            weight[np.ix_(row_inside, col_inside)] += block_weight
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(weight > 0., total / weight, np.nan).astype(np.float32)
+    write_grid(path, Grid(cols.coordinates(tile_cols), rows.coordinates(tile_rows), z, GRIDLINE))
+    return path
+
+
+def blend_core_job(job):
+    return blend_core(*job)
+
+
+def core_tile(rows, cols, row_core, col_core):
+    """NAME OF THE TILE OF A CORE (world_tiles.py NAMES, BY ITS WEST AND NORTH EDGES)"""
+    west = cols.coordinates(col_core * cols.size)
+    north = rows.coordinates(min((row_core + 1) * rows.size, rows.n - 1))
+    return tile_name(int(round(west)), int(round(north)))
+
+
+def choose_block_size(region, spacing, overlap=OVERLAP, workers=1, max_nodes=MAX_BLOCK_NODES):
+    """
+    THE CORE SIZE (WHOLE DEGREES DIVIDING BOTH SIDES OF region) OF THE LARGEST BLOCKS WITH NO MORE THAN max_nodes A
+    SIDE, SMALLER STILL IF NEEDED TO GIVE EVERY ONE OF workers A BLOCK
+    """
+    west, east, south, north = region
+    width, height = east - west, north - south
+    sizes = [size for size in range(1, int(min(width, height)) + 1)
+             if abs(width / size - round(width / size)) < 1e-9 and abs(height / size - round(height / size)) < 1e-9]
+    if not sizes:
+        raise ValueError("%g x %g degrees can not be cut into whole degree blocks" % (width, height))
+    fitting = [size for size in sizes if (size + 2 * overlap) / spacing < max_nodes + 1 and
+               round(width / size) * round(height / size) >= workers]
+    return max(fitting) if fitting else min(sizes)
+
+
+def write_report(path, blocks, rows, cols, options):
+    """
+    WRITE THE BlockSummary OF EVERY SOLVED BLOCK TO path (JSON), WITH THE TILES A BLOCK THAT DID NOT CONVERGE REACHES.
+    RETURNS THOSE TILES
+    """
+    unconverged = [block for block in blocks if not block.converged]
+    tiles = sorted(set(core_tile(rows, cols, row, col) for block in unconverged
+                       for row, _ in rows.neighbours(block.row_core) for col, _ in cols.neighbours(block.col_core)))
+    report = {'convergence': options.convergence, 'max_cycles': options.max_iterations,
+              'block_size': rows.size * rows.increment, 'overlap': rows.overlap * rows.increment,
+              'blocks': [block.as_dict() for block in blocks if block.medians],
+              'unconverged_blocks': [[block.row_core, block.col_core] for block in unconverged],
+              'unconverged_tiles': tiles}
+    with atomic_write(path) as report_file:
+        json.dump(report, report_file, indent=1)
+    return tiles
+
+
+def surface(xyz_path, dst_path, region=WORLD, increment='15c', options=None, block_size=None, overlap=OVERLAP,
+            empty=np.nan, workers=1, tiles_dir=None, extension='.grd', columns=3, report_path=None, pings=None):
+    """
+    GRID THE MEDIANS OF xyz_PATH OVER region INTO dst_path, BLOCK BY BLOCK (tiles_dir KEEPS THE TILES OF THE CORES;
+    block_size None CHOOSES IT). GIVEN pings (A ping_index.py INDEX DIRECTORY OR AN xyzi FILE) ONLY THE NODES WITHIN
+    THE SEARCH RADIUS (-S) OF THEM ARE SOLVED FOR, THE REST ARE empty. THE BlockSummary OF EVERY BLOCK IS WRITTEN TO
+    report_path (<dst_path>.surface.json BY DEFAULT). RETURNS ([BlockSummary], [TILES REACHED BY BLOCKS THAT DID NOT
+    CONVERGE])
+    """
+    options = options or SurfaceOptions()
+    spacing = parse_increment(increment)
+    if pings is not None and (options.search is None or np.isnan(empty)):
+        raise ValueError("solving near the pings needs a search radius (-S) and a value for the rest (--empty)")
+    if block_size is None:
+        block_size = choose_block_size(region, spacing, overlap, workers)
+    block_nodes, overlap_nodes = int(round(block_size / spacing)), int(round(overlap / spacing))
+    west, east, south, north = region
+    rows = Axis(south, north, spacing, block_nodes, overlap_nodes)
+    cols = Axis(west, east, spacing, block_nodes, overlap_nodes, periodic=abs(east - west - 360.) < 0.5 * spacing)
+    workdir = tempfile.mkdtemp(prefix='surface_engine.', dir=os.path.dirname(os.path.abspath(dst_path)))
+    tiles_dir = tiles_dir or os.path.join(workdir, 'tiles')
+    os.makedirs(tiles_dir, exist_ok=True)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # 1.0 SORT THE MEDIANS BY CORE AND FIND THE CELLS WITHIN THE SEARCH RADIUS OF THE PINGS
+        sort_medians(xyz_path, workdir, rows, cols, columns)
+        occupancy = None
+        if pings is not None:
+            occupancy = Occupancy(region, options.search, max(options.search / SEARCH_CELLS, spacing), cols.periodic)
+            occupancy.add_pings(pings)
+            occupancy.reach()
+
+        # 2.0 SOLVE EVERY BLOCK WITH MEDIANS IN REACH
+        cores = [(row_core, col_core) for row_core in range(rows.n_cores) for col_core in range(cols.n_cores)]
+        jobs = [(workdir, rows, cols, row_core, col_core, options, occupancy, empty) for row_core, col_core in cores]
+        blocks = list(executor.map(solve_block_job, jobs) if executor else map(solve_block_job, jobs))
+
+        # 3.0 BLEND THE BLOCKS INTO A TILE PER CORE, AND PASTE THE TILES
+        jobs = [(workdir, rows, cols, row_core, col_core,
+                 os.path.join(tiles_dir, core_tile(rows, cols, row_core, col_core) + extension), empty)
+                for row_core, col_core in cores]
+        list(executor.map(blend_core_job, jobs) if executor else map(blend_core_job, jobs))
+        paste(tiles_dir, dst_path, workers, extension)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    tiles = write_report(report_path or dst_path + '.surface.json', blocks, rows, cols, options)
+    return blocks, tiles
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Tension spline gridding in overlapping blocks (surface_tile.csh)')
+    parser.add_argument('xyz', help='medians (x y z on the nodes), binary double precision or text')
+    parser.add_argument('dst_file')
+    parser.add_argument('--increment', default='15c', help='node spacing (GMT -I)')
+    parser.add_argument('--region', type=float, nargs=4, default=WORLD, metavar=('W', 'E', 'S', 'N'))
+    parser.add_argument('--block-size', type=int, help='degrees on a side of a block core (default: the largest '
+                        'with blocks of at most %d nodes a side)' % MAX_BLOCK_NODES)
+    parser.add_argument('--overlap', type=float, default=OVERLAP, help='degrees solved past each core edge')
+    parser.add_argument('--empty', type=float, default=np.nan, help='value of blocks without medians')
+    parser.add_argument('--columns', type=int, default=3, help='columns of a binary xyz file (3, or 4 for xyzi)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    parser.add_argument('--tiles-dir', help='keep the tile of each core here')
+    parser.add_argument('--extension', default='.grd', help='tile file extension (.grd, .nc or .npz)')
+    parser.add_argument('--report', help='block report (default: dst_file.surface.json)')
+    parser.add_argument('--pings', help='ping index directory or xyzi file: solve only within -S of these pings, '
+                        'the rest being --empty')
+    parser.add_argument('--allow-unconverged', action='store_true',
+                        help='exit 0 even if blocks are still changing by more than -C after -N cycles')
+    gmt_options = [word for word in argv if len(word) > 2 and word[0] == '-' and word[1].isalpha()]
+    args = parser.parse_args([word for word in argv if word not in gmt_options])
+    options = SurfaceOptions.parse(gmt_options)
+    if args.pings and (options.search is None or np.isnan(args.empty)):
+        parser.error('--pings needs a search radius (-S) and --empty')
+
+    start = time.time()
+    blocks, tiles = surface(args.xyz, args.dst_file, tuple(args.region), args.increment, options, args.block_size,
+                            args.overlap, args.empty, args.workers, args.tiles_dir, args.extension, args.columns,
+                            args.report, args.pings)
+    solved = [block for block in blocks if block.medians]
+    print("%-10s %10s %10s %7s %10s %10s %8s" %
+          ('block', 'medians', 'nodes', 'cycles', 'error', 'residual', 'seconds'))
+    for block in solved:
+        print("%4d,%-5d %10d %10d %7d %10.3g %10.3g %8.1f%s" %
+              (block.row_core, block.col_core, block.medians, block.nodes, block.cycles, block.error,
+               block.residual, block.seconds, '' if block.converged else '  UNCONVERGED'))
+    print("solved %d of %d blocks (%d medians, %d nodes) into %s (%.1f s)" %
+          (len(solved), len(blocks), sum(block.medians for block in blocks), sum(block.nodes for block in blocks),
+           args.dst_file, time.time() - start))
+    if tiles:
+        print("WARNING: %d blocks still in error by more than %g after %d cycles reach tiles %s (see %s)" %
+              (len(solved) - sum(block.converged for block in solved), options.convergence, options.max_iterations,
+               ' '.join(tiles), args.report or args.dst_file + '.surface.json'))
+        return 0 if args.allow_unconverged else 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
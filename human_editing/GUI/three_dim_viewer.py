@@ -1,19 +1,15 @@
-import matplotlib as mpl
-mpl.use('WXAgg')
 import wx
 import wx.lib.agw.aui as aui
 import vtk
 from vtk.wx.wxVTKRenderWindowInteractor import wxVTKRenderWindowInteractor
-from vtk.util.numpy_support import vtk_to_numpy
 from rubber_band import RubberBand
-from point_clouds import VtkPointCloud
-from point_clouds import VtkPointCloudPredicted
-import math as m
+from point_clouds import VtkPointCloud, VtkPredictedSurface, MESH_MAX_POINTS, decimate_xyz, xyz_to_poly_data
+from cruise_store import FLAGS_CHANGED, ROWS_CHANGED
+from cm_io import write_cm
 import numpy as np
-import shapely.speedups
-shapely.speedups.enable()
-import geopandas as gpd
-from pyproj import Transformer
+from projection import PROJECTIONS
+from point_locator import PointLocator
+from instrumentation import span, timed, count
 
 """
 Three dimensional viewer for Py-Cmeditor
@@ -24,8 +20,7 @@ class ThreeDimViewer(wx.Frame):
     """
     Three dimensional viewer for Py-Cmeditor
     """
-    def __init__(self, parent, id, title, cm, xyz, xyz_cm_id, xyz_meta_data,
-                 xyz_cm_line_number, predicted_xyz, difference_xyz, score_xyz):
+    def __init__(self, parent, id, title, store):
         wx.Frame.__init__(self, None, wx.ID_ANY, '3D Viewer', size=(1200, 900))
 
         # START AUI WINDOW MANAGER
@@ -47,6 +42,9 @@ class ThreeDimViewer(wx.Frame):
         self.tdv_mgr.AddPane(self.tdv_left_panel, aui.AuiPaneInfo().Name('left').Left())
         self.tdv_mgr.Update()
 
+        # CREATE STATUS BAR (MESSAGES SUCH AS "NO PINGS SELECTED" ARE SHOWN HERE)
+        self.statusbar = self.CreateStatusBar(1, style=wx.NO_BORDER)
+
         # SET THE VTK RENDERER AS AN OBJECT
         self.renderer = vtk.vtkRenderer()
         self.renderer.SetBackground(0.8, 0.8, 0.8)
@@ -133,6 +131,10 @@ class ThreeDimViewer(wx.Frame):
         self.delaunay_button = wx.Button(self.tdv_left_panel, -1, "Grid", size=(150, 20), style=wx.ALIGN_CENTRE)
         self.delaunay_button.Bind(wx.EVT_BUTTON, self.delaunay)
 
+        # DECIMATE THE PINGS BEFORE GRIDDING (KEEPS THE GRID INTERACTIVE FOR LARGE CRUISES)
+        self.decimate_checkbox = wx.CheckBox(self.tdv_left_panel, -1, "Decimate grid", size=(150, 20))
+        self.decimate_checkbox.SetValue(True)
+
         # ADD PREDICTED DELAUNAY BUTTON
         self.predicted_delaunay_button = wx.Button(self.tdv_left_panel, -1, "Grid Predicted", size=(150, 20),
                                                    style=wx.ALIGN_CENTRE)
@@ -165,33 +167,36 @@ class ThreeDimViewer(wx.Frame):
         self.predicted_max_color_slider.Bind(wx.EVT_SLIDER, self.predicted_max)
 
         # ADD BUTTONS ETC TO LEFT BOX
-        self.left_box = wx.FlexGridSizer(cols=1, rows=20, hgap=5, vgap=5)
+        self.left_box = wx.FlexGridSizer(cols=1, rows=21, hgap=5, vgap=5)
         self.left_box.AddMany([self.picker_button, self.x_scale_text, self.x_scale_slider, self.y_scale_text,
                                self.y_scale_slider, self.z_scale_text, self.z_scale_slider, self.size_text,
-                               self.size_slider, self.flag_button, self.delaunay_button, self.predicted_delaunay_button,
+                               self.size_slider, self.flag_button, self.delaunay_button, self.decimate_checkbox,
+                               self.predicted_delaunay_button,
                                self.delete_selected_button, self.save_cm_button, self.toggle_button,
                                self.predicted_min_text, self.predicted_min_color_slider, self.predicted_max_text,
                                self.predicted_max_color_slider])
 
         # INITIALIZE OBJECTS FOR LATER ---------------------------------------------------------------------------------
-        self.cm = cm
-
-        self.wgs84_xyz = xyz
-
-        # CONVERT LAT LONG TO UTM SO WE CAN PLOT IN METERS
-        converted_xy = self.convert_input_coords(xyz[:, 0:2])
-        self.xyz = np.column_stack((converted_xy, self.wgs84_xyz[:, 2]))
-        self.xyz_original = np.copy(self.xyz)  # REQUIRED FOR INTERACTIVE RESCALING
-
-        # ASSIGN META DATA TO OBJECTS
-        self.xyz_cm_id = xyz_cm_id
-        self.xyz_meta_data = xyz_meta_data
-        self.xyz_cm_line_number = xyz_cm_line_number
-        self.predicted_xyz = predicted_xyz
-        self.predicted_xyz_original = np.copy(self.predicted_xyz)  # REQUIRED FOR INTERACTIVE RESCALING
-        self.difference_xyz = difference_xyz
-        self.difference_xyz_original = np.copy(self.difference_xyz)  # REQUIRED FOR INTERACTIVE RESCALING
-        self.score_xyz = score_xyz
+        # ALL .cm DATA IS READ FROM (AND EDITED THROUGH) THE SHARED CruiseStore
+        self.store = store
+        self.store.subscribe(self.on_store_changed)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+        # CONVERT LAT LONG TO UTM SO WE CAN PLOT IN METERS (UNSCALED COPY IS REQUIRED FOR INTERACTIVE RESCALING)
+        self.xyz_original = self.project_store()
+        self.xyz = np.copy(self.xyz_original)
+
+        # SPATIAL INDEX OF THE PINGS USED FOR PICKING (BUILT ONCE, REBUILT ONLY WHEN PINGS ARE DELETED)
+        with span('build_locator'):
+            self.locator = PointLocator(self.xyz_original)
+
+        if self.store.predicted_xyz is not None:
+            self.predicted_xyz = PROJECTIONS.project_predicted(self.store)
+        else:
+            self.predicted_xyz = None
+        self.flagged_actor = None
+        self.mesh_actor = None
+        self.predicted_meshActor = None
         self.predicted_color_min = 0.25
         self.predicted_color_max = 1.65
 
@@ -219,47 +224,16 @@ class ThreeDimViewer(wx.Frame):
         self.tdv_right_panel.SetSize(self.GetSize())
         self.tdv_left_panel.SetSize(self.GetSize())
 
-        # INITIALIZE SWITCHES
-        self.grid_created = 0
-
         # UPDATE AUI MANGER
         self.tdv_mgr.Update()
 
-    def convert_wgs_to_utm(self, lon, lat):
-        utm_band = str((m.floor((lon + 180) / 6) % 60) + 1)
-        if len(utm_band) == 1:
-            utm_band = '0' + utm_band
-        if lat >= 0:
-            epsg_code = '326' + utm_band
-        else:
-            epsg_code = '327' + utm_band
-        print(epsg_code)
-        return epsg_code
-
-    def get_centeroid(self, arr):
-        length = arr.shape[0]
-        sum_x = np.sum(arr[:, 0])
-        sum_y = np.sum(arr[:, 1])
-        return sum_x/length, sum_y/length
-
-    def convert_input_coords(self, input_arr):
-        # 1.0 CONVERT INPUT XY INPUT A GEOPANDAS DATA FRAME
-        gpd_data = gpd.GeoDataFrame(geometry=gpd.points_from_xy(input_arr[:, 0], input_arr[:, 1]))
-
-        # 2.0 GET THE CENTROID POINT OF THE INPUT XY
-        input_lon_center, input_lat_center = self.get_centeroid(input_arr)
-
-        # 3.0 GET BEST UTM ZONE/EPSG CODE FOR CENTER COORDINATE PAIR
-        utm_code = self.convert_wgs_to_utm(input_lon_center, input_lat_center)
-        epsg_out = ("epsg:%s" % utm_code)
-
-        # 4.0 TRANSFORM THE COORDS TO UTM METERS
-        transformer = Transformer.from_crs("epsg:4326", epsg_out)
-        utm_coords = transformer.transform(input_arr[:, 1], input_arr[:, 0])
-
-        # 5.0 RETURN CONVERTED DATA
-        return np.column_stack((utm_coords[0], utm_coords[1]))
+    @timed('project')
+    def project_store(self):
+        """RETURN THE STORE PINGS AS AN (N, 3) ARRAY OF PROJECTED X, Y (METERS) AND DEPTH"""
+        x, y = PROJECTIONS.project_store(self.store)
+        return np.column_stack((x, y, self.store['depth']))
 
+    @timed('vtk_build')
     def do_point_render(self):
         """
         RENDER 3D POINTS
@@ -270,28 +244,12 @@ class ThreeDimViewer(wx.Frame):
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # Render XYZ POINTS
-        self.pointcloud = VtkPointCloud(self.xyz, self.difference_xyz, self.score_xyz)
-
-        for k in range(len(self.xyz)):
-            point = self.xyz[k]
-
-            point[0] *= self.x_scale
-            point[1] *= self.y_scale
-            point[2] *= self.z_scale
-
-            xyz_cm_id = self.xyz_cm_id[k]
-            xyz_cm_line_number = self.xyz_cm_line_number[k]
-            score_xyz = self.score_xyz[k]
-            if self.difference_xyz is not None:
-                difference_xyz = self.difference_xyz[k]
-            else:
-                difference_xyz = np.zeros_like(point)
-
-            # NOW ADD THE POINT TO THE POINT CLOUD
-            self.pointcloud.addPoint(point, xyz_cm_id, xyz_cm_line_number, difference_xyz, score_xyz)
+        self.xyz = np.multiply(self.xyz_original, (self.x_scale, self.y_scale, self.z_scale))
+        self.pointcloud = VtkPointCloud(self.xyz, self.store)
 
         # ADD ACTOR TO RENDER
         self.renderer.AddActor(self.pointcloud.vtkActor)
+        self.draw_flagged()
 
         # SET POINT SIZE
         self.pointcloud.vtkActor.GetProperty().SetPointSize(4)
@@ -309,7 +267,6 @@ class ThreeDimViewer(wx.Frame):
 
         # CREATE COLOR SCALE BAR
         self.cb_mapper = self.pointcloud.vtkActor.GetMapper()
-        print(self.cb_mapper)
         self.cb_mapper.SetScalarRange(self.xyz[:, 2].min(), self.xyz[:, 2].max())
         self.sb = vtk.vtkScalarBarActor()
         self.sb.SetLookupTable(self.cb_mapper.GetLookupTable())
@@ -345,119 +302,60 @@ class ThreeDimViewer(wx.Frame):
         # self.balloonWidget.AddBalloon(self.pointcloud.vtkActor, self.pointcloud.cm_poly_data.GetPoints().GetPoint())
 
     def delaunay(self, event):
-        """CREATE 3D GRID"""
-        if self.grid_created == 1:
-            if self.meshActor.GetVisibility() == 1:
-                self.meshActor.SetVisibility(False)
-            else:
-                self.meshActor.SetVisibility(True)
-            self.renderWindow.Render()
-            print("meshActor exists")
-        else:
-            self.grid_created = 1
-            self.cell_array = vtk.vtkCellArray()
-            self.boundary = self.pointcloud.cm_poly_data
-            self.boundary.SetPoints(self.pointcloud.cm_poly_data.GetPoints())
-            self.boundary.SetPolys(self.cell_array)
-
-            self.delaunay = vtk.vtkDelaunay2D()
-
-            self.delaunay.SetInputData(self.pointcloud.cm_poly_data)
-            self.delaunay.SetSourceData(self.boundary)
-
-            self.delaunay.Update()
-
-            self.meshMapper = vtk.vtkPolyDataMapper()
-            self.meshMapper.SetInputData(self.pointcloud.cm_poly_data)
-            self.meshMapper.SetColorModeToDefault()
-            self.meshMapper.SetScalarRange(self.xyz[:, 2].min(), self.xyz[:, 2].max())
-            self.meshMapper.SetScalarVisibility(1)
-            self.meshMapper.SetInputConnection(self.delaunay.GetOutputPort())
-            self.meshActor = vtk.vtkActor()
-            self.meshActor.SetMapper(self.meshMapper)
-            # self.meshActor.GetProperty().SetEdgeColor(0, 0, 1)
-            self.meshActor.GetProperty().SetInterpolationToFlat()
-            # self.meshActor.GetProperty().SetRepresentationToWireframe()
-
-            self.renderer.AddActor(self.meshActor)
+        """CREATE (OR TOGGLE) THE 3D GRID OF THE PINGS"""
+        if self.mesh_actor is not None:
+            self.mesh_actor.SetVisibility(not self.mesh_actor.GetVisibility())
             self.renderWindow.Render()
+            return
+
+        # TRIANGULATE THE UNSCALED PINGS (DECIMATED FOR LARGE CRUISES) - THE ACTOR IS SCALED TO MATCH THE POINTS
+        xyz = self.xyz_original[~self.store.flagged]
+        if self.decimate_checkbox.GetValue():
+            xyz = decimate_xyz(xyz, MESH_MAX_POINTS)
+        self.mesh_delaunay = vtk.vtkDelaunay2D()
+        self.mesh_delaunay.SetInputData(xyz_to_poly_data(xyz))
+        self.mesh_delaunay.Update()
+
+        self.meshMapper = vtk.vtkPolyDataMapper()
+        self.meshMapper.SetInputConnection(self.mesh_delaunay.GetOutputPort())
+        self.meshMapper.SetColorModeToDefault()
+        self.meshMapper.SetScalarRange(xyz[:, 2].min(), xyz[:, 2].max())
+        self.meshMapper.SetScalarVisibility(1)
+        self.mesh_actor = vtk.vtkActor()
+        self.mesh_actor.SetMapper(self.meshMapper)
+        self.mesh_actor.SetScale(self.x_scale, self.y_scale, self.z_scale)
+        self.mesh_actor.GetProperty().SetInterpolationToFlat()
+
+        self.renderer.AddActor(self.mesh_actor)
+        self.renderWindow.Render()
+
+    def remove_mesh(self):
+        """REMOVE THE PING GRID (e.g. AFTER PINGS ARE DELETED). IT IS REBUILT THE NEXT TIME GRID IS PRESSED"""
+        if self.mesh_actor is not None:
+            self.renderer.RemoveActor(self.mesh_actor)
+            self.mesh_actor = None
 
     def render_predicted(self, event):
-        print("self.predicted_xyz ==")
-        print(self.predicted_xyz)
-        try:
-            print("rendering predicted")
-            #Render XYZ POINTS
-            self.predicted_pointcloud = VtkPointCloudPredicted(self.predicted_xyz)
-            print("ADDING POINTS")
-            for k in range(len(self.predicted_xyz)):
-                point = self.predicted_xyz[k]
-                self.predicted_pointcloud.addPoint(point)
-
-            # RENDER THE GRID
-            print("DOING delaunay_predicted")
-            self.delaunay_predicted()
-
-            # RERENDER THE ACTIVE WINDOW
-            self.re_render()
+        """CREATE (OR TOGGLE) THE SURFACE OF THE PREDICTED BATHYMETRY"""
+        if self.predicted_xyz is None:
+            self.show_status("No predicted grid loaded: get the predicted bathymetry in the main window first")
+            return
 
-            print("DONE")
-        except AttributeError:
-            print("ERROR FAILED TO RENDER predicted_xyz")
-
-    def delaunay_predicted(self):
-        """CREATE GRID OF PREDICTED BATHYMETRY"""
-        try:
-            if self.predicted_meshActor.GetVisibility() == 1:
-                self.predicted_meshActor.SetVisibility(False)
-            else:
-                self.predicted_meshActor.SetVisibility(True)
+        if self.predicted_meshActor is not None:
+            self.predicted_meshActor.SetVisibility(not self.predicted_meshActor.GetVisibility())
             self.renderWindow.Render()
-            print("predicted_meshActor exists")
-        except AttributeError:
-            try:
-                print("CREATING PREDICTED GRID")
-                self.cell_array = vtk.vtkCellArray()
-                self.predicted_boundary = self.predicted_pointcloud.poly_data
-                self.predicted_boundary.SetPoints(self.predicted_pointcloud.poly_data.GetPoints())
-                self.predicted_boundary.SetPolys(self.cell_array)
-
-                self.predicted_delaunay = vtk.vtkDelaunay2D()
-                if vtk.VTK_MAJOR_VERSION <= 5:
-                    self.predicted_delaunay.SetInput(self.predicted_pointcloud.poly_data.GetOutput())
-                    self.predicted_delaunay.SetSource(self.predicted_boundary)
-                else:
-                    self.predicted_delaunay.SetInputData(self.predicted_pointcloud.poly_data)
-                    self.predicted_delaunay.SetSourceData(self.predicted_boundary)
-
-                self.predicted_delaunay.Update()
-
-                print("MAKING MAPPER")
-                self.predicted_meshMapper = vtk.vtkPolyDataMapper()
-                self.predicted_meshMapper.SetInputData(self.predicted_pointcloud.poly_data)
-
-                print("MAKING LUT")
-                # CREATE COLOR LOOK UP TABLE
-                self.predicted_lut = self.make_lookup_table()
-                self.predicted_meshMapper.SetLookupTable(self.predicted_lut)
-
-                print("SET MAPPER INPUTS")
-                # SET MAPPER INPUTS
-                self.predicted_meshMapper.SetScalarRange(self.predicted_xyz[:, 2].min(), self.predicted_xyz[:, 2].max())
-                self.predicted_meshMapper.SetScalarVisibility(1)
-                self.predicted_meshMapper.SetInputConnection(self.predicted_delaunay.GetOutputPort())
-
-                # CREATE ACTOR
-                self.predicted_meshActor = vtk.vtkActor()
-                self.predicted_meshActor.SetMapper(self.predicted_meshMapper)
-                self.predicted_meshActor.GetProperty().SetInterpolationToFlat()
-
-                # ADD MESH TO RENDER
-                self.renderer.AddActor(self.predicted_meshActor)
-                self.renderWindow.Render()
-                self.re_render()
-            except AttributeError:
-                print("FAILED ON CREATING PREDICTED")
+            return
+
+        # THE PREDICTED NODES ARE ALREADY A REGULAR GRID, SO BUILD THE SURFACE DIRECTLY FROM THEM
+        self.predicted_lut = self.make_lookup_table()
+        self.predicted_surface = VtkPredictedSurface(self.predicted_xyz, self.store.predicted_xyz[:, 0:2],
+                                                     self.predicted_lut)
+        self.predicted_meshMapper = self.predicted_surface.mapper
+        self.predicted_meshActor = self.predicted_surface.vtkActor
+
+        # ADD MESH TO RENDER
+        self.renderer.AddActor(self.predicted_meshActor)
+        self.re_render()
 
     def make_lookup_table(self):
         """
@@ -519,53 +417,45 @@ class ThreeDimViewer(wx.Frame):
         return
 
     def predicted_min(self, value):
-        """RESCALE THE PREDICTED GRID COLOR SCALE"""
-        try:
-            #% GET THE NEW SCALE VALUE
-            self.predicted_color_min = float(self.predicted_min_color_slider.GetValue())
-            self.new_lut = self.make_lookup_table()
-
-            self.predicted_meshMapper.SetLookupTable(self.new_lut)
-
-            self.renderWindow.Render()
-        except AttributeError:
-            print("ERROR IN predicted_min")
-            pass
-        return
+        """RESCALE THE PREDICTED GRID COLOR SCALE (KEPT FOR WHEN THE SURFACE IS MADE IF THERE IS NONE YET)"""
+        #% GET THE NEW SCALE VALUE
+        self.predicted_color_min = float(self.predicted_min_color_slider.GetValue())
+        if self.predicted_meshActor is None:
+            return
+        self.new_lut = self.make_lookup_table()
+        self.predicted_meshMapper.SetLookupTable(self.new_lut)
+        self.renderWindow.Render()
 
     def predicted_max(self, value):
-        """RESCALE THE PREDICTED GRID COLOR SCALE"""
-        try:
-            #% GET THE NEW SCALE VALUE
-            self.predicted_color_max = float(self.predicted_max_color_slider.GetValue())
-            self.new_lut = self.make_lookup_table()
-
-            self.predicted_meshMapper.SetLookupTable(self.new_lut)
-
-            self.renderWindow.Render()
-        except AttributeError:
-            print("ERROR IN predicted_max")
-            pass
-        return
+        """RESCALE THE PREDICTED GRID COLOR SCALE (KEPT FOR WHEN THE SURFACE IS MADE IF THERE IS NONE YET)"""
+        #% GET THE NEW SCALE VALUE
+        self.predicted_color_max = float(self.predicted_max_color_slider.GetValue())
+        if self.predicted_meshActor is None:
+            return
+        self.new_lut = self.make_lookup_table()
+        self.predicted_meshMapper.SetLookupTable(self.new_lut)
+        self.renderWindow.Render()
 
     def toggle(self, event):
         """Toggle Display (depth/difference/score)"""
         if self.pointcloud.cm_poly_data.GetPointData().GetScalars().GetName() == 'Z':
             self.pointcloud.cm_poly_data.GetPointData().SetActiveScalars('DIFF')
-            self.pointcloud.mapper.SetScalarRange(self.difference_xyz[:, 2].min(), self.difference_xyz[:, 2].max())
+            self.pointcloud.mapper.SetScalarRange(self.pointcloud.diff_values.min(), self.pointcloud.diff_values.max())
         elif self.pointcloud.cm_poly_data.GetPointData().GetScalars().GetName() == 'DIFF':
             self.pointcloud.cm_poly_data.GetPointData().SetActiveScalars('SCORE')
-            self.pointcloud.mapper.SetScalarRange(self.score_xyz[:, 2].min(), self.score_xyz[:, 2].max())
+            self.pointcloud.mapper.SetScalarRange(self.store['score'].min(), self.store['score'].max())
         else:
             self.pointcloud.cm_poly_data.GetPointData().SetActiveScalars('Z')
             self.pointcloud.mapper.SetScalarRange(self.xyz[:, 2].min(), self.xyz[:, 2].max())
         self.renderWindow.Render()
 
-    def re_render(self):
+    @timed('vtk_re_render')
+    def re_render(self, rebuild=False):
         """
-        RERENDER 3D VIEWER AFTER CHANGE TO DISPLAY
+        RERENDER 3D VIEWER AFTER CHANGE TO DISPLAY. THE POINT CLOUD IS REBUILT IN THE BASE STYLE, OR IN EITHER STYLE
+        WHEN rebuild IS SET (THE PINGS THEMSELVES CHANGED)
         """
-        if self.current_style == 'base_style':
+        if self.current_style == 'base_style' or rebuild:
 
             # RESCALE POINTS
             # self.pointcloud.vtkActor.SetScale(self.x_scale, self.y_scale, self.z_scale)
@@ -576,24 +466,14 @@ class ThreeDimViewer(wx.Frame):
 
             # CREATE POINT DATA WITH NEW SCALING VALUES
             self.xyz = np.multiply(self.xyz_original, (self.x_scale, self.y_scale, self.z_scale))
-            self.difference_xyz = np.multiply(self.difference_xyz_original, (self.x_scale, self.y_scale, self.z_scale))
 
             # CREATE THE POINT CLOUD VTK ACTOR
-            self.pointcloud = VtkPointCloud(self.xyz, self.difference_xyz, self.score_xyz)
-            for k in range(len(self.xyz)):
-                point = self.xyz[k]
-                xyz_cm_id = self.xyz_cm_id[k]
-                xyz_cm_line_number = self.xyz_cm_line_number[k]
-                score_xyz = self.score_xyz[k]
-                if self.difference_xyz is not None:
-                    difference_xyz = self.difference_xyz[k]
-                else:
-                    difference_xyz = np.zeros_like(point)
-                self.pointcloud.addPoint(point, xyz_cm_id, xyz_cm_line_number, difference_xyz, score_xyz)
+            self.pointcloud = VtkPointCloud(self.xyz, self.store)
 
             # RENDER THE NEW POINT CLOUD
             self.renderer.AddActor(self.pointcloud.vtkActor)
             self.set_point_size(float(self.size_slider.GetValue()))
+            self.draw_flagged()
 
 
             # RESCALE THE AXIS OUTLINE
@@ -605,24 +485,24 @@ class ThreeDimViewer(wx.Frame):
                                         self.xyz_original[:, 2].max() * self.z_scale)
 
         # RERENDER THE PREDICTED GRID IF IT IS SHOWING
-        try:
+        if self.predicted_meshActor is not None:
             self.predicted_meshActor.SetScale(self.x_scale, self.y_scale, self.z_scale)
-        except AttributeError:
-            pass
 
-        # CHECK IF GRID ACTOR IS ON
-        if self.grid_created == 1:
-            self.grid_created = 0
-            self.renderer.AddActor(self.meshActor)
+        # RESCALE THE GRID OF THE PINGS
+        if self.mesh_actor is not None:
+            self.mesh_actor.SetScale(self.x_scale, self.y_scale, self.z_scale)
+
+        # KEEP THE RUBBER BAND PICKING FROM THE POINTS ON SCREEN
+        if self.current_style == 'rubber_band':
+            self.rubber_style.pointcloud = self.pointcloud
+            self.rubber_style.locator = self.locator
+            self.rubber_style.scale = (self.x_scale, self.y_scale, self.z_scale)
 
         # RE RENDER THE WINDOW
         self.pointcloud.vtkActor.Modified()
         self.renderWindow.Render()
 
     def get_cam(self):
-        print("!!!!!!!")
-        print("get cam")
-        print("!!!!!!!!")
         self.focal_point = self.cam.GetFocalPoint()
         self.positon = self.cam.GetPosition()
         self.view_up = self.cam.GetViewUp()
@@ -630,25 +510,8 @@ class ThreeDimViewer(wx.Frame):
         self.parallel_projection = self.cam.GetParallelProjection()
         self.parallel_scale = self.cam.GetParallelScale()
         self.clip = self.cam.GetClippingRange()
-        print(self.focal_point)
-        print(self.positon)
-        print(self.view_up)
-        print(self.view_angle)
-        print(self.parallel_projection)
-        print(self.parallel_scale)
-        print(self.clip)
 
     def set_cam(self):
-        print("##########")
-        print("set_cam")
-        print("##########")
-        print(self.focal_point)
-        print(self.positon)
-        print(self.view_up)
-        print(self.view_angle)
-        print(self.parallel_projection)
-        print(self.parallel_scale)
-        print(self.clip)
         self.cam.SetFocalPoint(self.focal_point)
         self.cam.SetPosition(self.positon)
         self.cam.SetViewUp(self.view_up)
@@ -658,66 +521,90 @@ class ThreeDimViewer(wx.Frame):
         self.cam.SetClippingRange(self.clip)
         return
 
-    def delete_selected(self):
-        """CREATES A NEW NUMPY ARRAY of the cm FILE WITH SELECTED NODES REMOVED"""
-        print("Deleting")
-        try:
-            # DELETE SELECTED VALUES
-            self.selected_cm_line_number = vtk_to_numpy(
-                self.rubber_style.selected.GetPointData().GetArray("cm_line_number")).astype(int)
-            self.new_cm = np.delete(self.cm, self.selected_cm_line_number, 0)
-            self.cm = self.new_cm
-
-            # REPLACE CURRENT RENDER WITH NEW DATA
-            self.renderer.RemoveActor(self.rubber_style.selected_actor)
-            self.re_render()
-
-            # UPDATE RENDER
-            self.renderWindow.Render()
-
-        except AttributeError:
-            print("attr error")
-            pass
+    def show_status(self, text):
+        """SHOW A MESSAGE IN THE STATUS BAR OF THE VIEWER"""
+        self.statusbar.SetStatusText(text)
+
+    def selection(self):
+        """RETURN THE ROWS PICKED WITH THE RUBBER BAND, OR None (SAYING SO IN THE STATUS BAR) IF THERE ARE NONE"""
+        if self.current_style != 'rubber_band' or len(self.rubber_style.selected_indices) == 0:
+            self.show_status("No pings selected: press r (or Picking mode) and drag a box around them")
+            return None
+        return self.rubber_style.selected_indices
+
+    def delete_selected(self, event=None):
+        """REMOVE THE SELECTED NODES FROM THE SHARED STORE"""
+        # DELETE SELECTED VALUES
+        self.selected_cm_line_number = self.selection()
+        if self.selected_cm_line_number is None:
+            return
+        self.renderer.RemoveActor(self.rubber_style.selected_actor)
+
+        # THE STORE NOTIFIES ALL VIEWS (INCLUDING THIS ONE) WHICH THEN RE-RENDER
+        n_deleted = len(self.selected_cm_line_number)
+        count('pings_deleted', n_deleted)
+        self.store.delete_rows(self.selected_cm_line_number)
+        self.show_status("Deleted %d pings" % n_deleted)
 
     def set_flag(self, event):
         """SETS FLAG FOR SELECTED NODES"""
-        print("SETTING FLAG")
-        try:
-            # DELETE SELECTED VALUES
-            self.selected_cm_line_number = vtk_to_numpy(
-                self.rubber_style.selected.GetPointData().GetArray("cm_line_number")).astype(int)
-
-            # CLONE CURRENT cm file
-            self.new_cm = np.copy(self.cm)
-
-            # SET FLAG AS 1 FOR ALL SELECTED NODES
-            flag_column_index = np.shape(self.cm)[1]
-            for x in range(len(self.selected_cm_line_number)):
-                index = self.selected_cm_line_number[x]  # % GET INDEX VALUE
-                self.new_cm[index, 4] = 1  # % INSERT FLAG IN COL 4
-
-            # REMOVE SELECTED ACTOR
-            self.renderer.RemoveActor(self.rubber_style.selected_actor)
-
-            # DRAW FLAGGED ACTOR
-            self.rubber_style.flagged_mapper = vtk.vtkDataSetMapper()
-            self.rubber_style.flagged_actor = vtk.vtkActor()
-            self.rubber_style.flagged_actor.SetMapper(self.rubber_style.flagged_mapper)
-            self.rubber_style.flagged_mapper.SetInputData(self.rubber_style.selected)
-            self.rubber_style.flagged_actor.GetMapper().ScalarVisibilityOff()
-            self.rubber_style.flagged_actor.GetProperty().SetColor(0, 0, 0)  # (R, G, B)
-            self.rubber_style.flagged_actor.GetProperty().SetPointSize(10)
-            self.renderer.AddActor(self.rubber_style.flagged_actor)
-
-            # REPLACE CURRENT RENDER WITH NEW DATA
+        # GET SELECTED VALUES
+        self.selected_cm_line_number = self.selection()
+        if self.selected_cm_line_number is None:
+            return
+
+        # REMOVE SELECTED ACTOR
+        self.renderer.RemoveActor(self.rubber_style.selected_actor)
+
+        # SET FLAG FOR ALL SELECTED NODES (THE STORE NOTIFIES ALL VIEWS)
+        self.store.set_flags(self.selected_cm_line_number)
+        self.show_status("Flagged %d pings" % len(self.selected_cm_line_number))
+
+    @timed('vtk_draw_flagged')
+    def draw_flagged(self):
+        """DRAW THE FLAGGED NODES IN BLACK ON TOP OF THE POINT CLOUD"""
+        if self.flagged_actor is not None:
+            self.renderer.RemoveActor(self.flagged_actor)
+
+        flagged_poly_data = xyz_to_poly_data(self.xyz[self.store.flagged], vertices=True)
+
+        flagged_mapper = vtk.vtkDataSetMapper()
+        flagged_mapper.SetInputData(flagged_poly_data)
+        flagged_mapper.ScalarVisibilityOff()
+        self.flagged_actor = vtk.vtkActor()
+        self.flagged_actor.SetMapper(flagged_mapper)
+        self.flagged_actor.GetProperty().SetColor(0, 0, 0)  # (R, G, B)
+        self.flagged_actor.GetProperty().SetPointSize(10)
+        self.renderer.AddActor(self.flagged_actor)
+
+    def on_store_changed(self, store, change, indices):
+        """UPDATE THE 3D VIEW AFTER AN EDIT TO THE SHARED STORE (FROM THIS VIEW OR THE MAP)"""
+        if change == FLAGS_CHANGED:
+            # FLAGS ARE EDITED IN PLACE SO ONLY THE FLAG ARRAY AND THE FLAGGED OVERLAY NEED UPDATING
+            with span('vtk_flag_update'):
+                self.pointcloud.flags_modified()
+                self.draw_flagged()
+                self.renderWindow.Render()
+        elif change == ROWS_CHANGED:
+            self.xyz_original = self.project_store()
+            self.locator = PointLocator(self.xyz_original)
+            self.remove_mesh()
+            self.clear_selection()
+            self.re_render(rebuild=True)
+        else:
             self.re_render()
 
-            # UPDATE LIVE RENDER
-            self.renderWindow.Render()
+    def clear_selection(self):
+        """DROP THE RUBBER BAND SELECTION (ITS ROW NUMBERS NO LONGER MATCH THE STORE ONCE ROWS ARE REMOVED)"""
+        self.selected_cm_line_number = np.empty(0, dtype=np.int64)
+        if self.current_style == 'rubber_band':
+            self.renderer.RemoveActor(self.rubber_style.selected_actor)
+            self.rubber_style.selected_indices = np.empty(0, dtype=np.int64)
 
-        except AttributeError:
-            print("attr error")
-            pass
+    def on_close(self, event):
+        """STOP LISTENING TO THE STORE WHEN THE VIEWER IS CLOSED"""
+        self.store.unsubscribe(self.on_store_changed)
+        self.Destroy()
 
     def save_cm(self, event):
         """# %SET OUTPUT FILE NAME AND DIR"""
@@ -726,9 +613,9 @@ class ThreeDimViewer(wx.Frame):
         if save_file_dialog.ShowModal() == wx.ID_CANCEL:
             return  # %THE USER CHANGED THEIR MIND
 
-        #SAVE TO DISC
+        # SAVE TO DISC (SAME .cm LAYOUT AS THE MAIN WINDOW)
         outputfile = save_file_dialog.GetPath()
-        np.savetxt(outputfile, self.cm, delimiter=" ")
+        write_cm(outputfile, self.store, names=self.store.column_names[0:9], binary=True)
 
     def keyPressEvent(self, event, obj):
         key = self.Interactor.GetKeyCode()
@@ -758,7 +645,6 @@ class ThreeDimViewer(wx.Frame):
         :return: None
         """
         #self.get_cam()
-        print("current style = %s" % self.current_style)
         if self.current_style == 'rubber_band':
             # REMOVE THE CURRENT HIGHLIGHT ACTOR (IF THERE IS ONE) FROM SCREEN
             if self.rubber_style.selected_actor:
@@ -766,14 +652,12 @@ class ThreeDimViewer(wx.Frame):
                 del self.rubber_style.selected_actor
 
             del self.rubber_style
-            print('setting style as base_style')
             self.Interactor.SetInteractorStyle(self.base_style)
             self.current_style = str('base_style')
 
             # self.renderer.Render()
             self.renderWindow.Render()
         else:
-            print('setting style as rubber_band')
             # MAKE AREA PICKER ACTOR
             self.area_picker = vtk.vtkAreaPicker()
 
@@ -782,7 +666,8 @@ class ThreeDimViewer(wx.Frame):
 
             # CREATE RUBBER BAND INTERACTOR STYLE
             self.rubber_style = RubberBand(self.renderWindow, self.renderer, self.pointcloud, self.Interactor,
-                                           self.area_picker, self.cm)
+                                           self.area_picker, self.store, self.locator,
+                                           (self.x_scale, self.y_scale, self.z_scale))
 
             # SET INTERACTOR STYLE
             self.Interactor.SetInteractorStyle(self.rubber_style)
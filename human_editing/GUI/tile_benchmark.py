@@ -0,0 +1,697 @@
+"""
+Benchmark and regression check of the tile pipeline stages on a small synthetic region.
+
+The bathymetry part of com/bathymetry/02worldMakeAllTiles.sh is run tile by tile on synthetic pings (x y z sid, z
+being the ping minus predicted difference that surface grids):
+
+    selectAndSort   pick the pings inside the tile out of the huge.xyzi file (bin/selectAndSort)
+    medianId        block median of the tile, keeping the source id of the median ping (bin/medianId -C -bo4)
+    surface         tension spline of two overlapping latitude bands, as surface_tile.csh does for the world
+                    (surface with the options of demPaths.sh)
+    grdblend        blend the bands into the tile grid (grdblend with a blend.txt as surface_tile.csh writes it)
+
+Each stage has one or more implementations (the original program, numpy versions of the simple ones and
+surface_engine.py for surface); --use picks one, e.g. --use medianId=numpy. A stage with no implementation that can run
+here (e.g. gmt or the Mac bin/ programs are missing) is skipped, with the stages after it. The wall time of every stage
+is recorded per tile, with its throughput (pings or grid nodes per second), in a JSON history, and compared with the
+previous run of the same size and implementation.
+
+The outputs of every tile are compared with golden outputs (--golden, written by --update-golden from a trusted run).
+With --isolate each stage reads the golden output of the stage before it instead of the output of this run, so a
+replacement for one stage is checked on exactly the input the original had. A difference larger than the stage's
+tolerance (--tolerance stage=value, defaults in TOLERANCES) makes the run fail.
+
+check runs the stages on a small region (FIXTURE) against golden outputs kept in tile_benchmark_fixture/: --against
+original (the default) compares with the outputs of the original programs (bin/ and gmt, ORIGINALS), which must be
+made with check --update-golden on a machine where they run; --against replacements compares with the outputs the
+replacements that run without them (numpy, surface_engine) made, which only catches drift in those replacements. It
+fails if any stage differs from the golden outputs by more than its tolerance (TOLERANCES).
+
+solver checks the V cycles of surface_engine.py against the converged solution of the same equations (a dense
+solve) on small synthetic blocks: the run fails if a block stops further than -C from it.
+
+Usage:
+    python tile_benchmark.py run [--pings 200000] [--seed 0] [--region -4 4 -4 4] [--tile-size 4] [--increment 1m]
+                                 [--use stage=implementation ...] [--golden dir] [--update-golden] [--isolate]
+                                 [--tolerance stage=value ...] [--history file] [--label text] [--keep dir]
+    python tile_benchmark.py list
+    python tile_benchmark.py check [--against original|replacements] [--use stage=implementation ...] [--isolate]
+                                   [--update-golden]
+    python tile_benchmark.py solver [--seed 0] [--convergence 1.0]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import importlib.util
+import subprocess
+import collections
+import numpy as np
+from grid_io import Grid, block_median, gmt_command, grid_nodes, read_grid, write_grid, is_netcdf
+from cm_io import wrap_longitude
+from ping_archive import read_dem_settings
+from benchmark import git_commit, read_history, max_rss_mb, REGRESSION_RATIO
+import surface_engine
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+BIN_DIR = os.path.join(HERE, '..', '..', 'bin')
+DEM_PATHS = os.path.join(HERE, '..', '..', 'demPaths.sh')
+
+# SYNTHETIC REGION: TILES OF TILE_SIZE DEGREES, EACH GRIDDED AS TWO LATITUDE BANDS OVERLAPPING BY 2 * BAND_OVERLAP
+REGION = (-4., 4., -4., 4.)
+TILE_SIZE = 4.
+INCREMENT = '1m'
+BAND_OVERLAP = 0.5
+PINGS = 200000
+
+# PINGS ARE ALSO GENERATED THIS FAR (DEGREES) AROUND THE REGION, SO selectAndSort HAS SOMETHING TO DROP
+MARGIN = 1.
+
+# PINGS PER SYNTHETIC TRACK, AND THE SPACING OF THEIR PINGS (DEGREES)
+TRACK_PINGS = 2000
+TRACK_SPACING = 0.002
+
+# LIMITS ON THE PING - PREDICTED DIFFERENCE GIVEN TO surface (-Ll -Lu IN surface_tile.csh)
+MAX_DIFFERENCE = 800.
+
+# surface OPTIONS SET IN demPaths.sh (surfaceOpts)
+SURFACE_SETTINGS = ('tension', 'relaxFactor', 'convergence', 'maxItertion', 'search')
+
+# LARGEST DIFFERENCE FROM THE GOLDEN OUTPUT ACCEPTED FOR EACH STAGE (m):
+#   selectAndSort   THE SAME PINGS, READ BACK FROM TEXT AS THE ORIGINAL WROTE THEM: EXACT
+#   medianId        THE MEDIAN PING OF EACH BLOCK; ONLY THE ROUNDING OF A MEDIAN OF TWO PINGS CAN DIFFER
+#   surface         surface STOPS ITERATING WHEN NO NODE MOVES MORE THAN -C (1 m IN demPaths.sh), SO TWO SOLVERS
+#                   OF THE SAME EQUATIONS CAN STOP UP TO ABOUT -C APART
+#   grdblend        A WEIGHTED MEAN OF THE surface BANDS, SO IT INHERITS THEIR TOLERANCE
+TOLERANCES = {'selectAndSort': 0., 'medianId': 1e-6, 'surface': 1., 'grdblend': 1.}
+
+# THE IMPLEMENTATIONS OF THE ORIGINAL PIPELINE (bin/ PROGRAMS AND gmt), WHICH THE original GOLDEN OUTPUTS COME FROM
+ORIGINALS = collections.OrderedDict((('selectAndSort', 'bin'), ('medianId', 'bin'), ('surface', 'gmt'),
+                                     ('grdblend', 'gmt')))
+
+# SETTINGS OF THE check RUN (ONE SMALL TILE AT 2 MINUTES, SO ITS GOLDEN OUTPUTS ARE SMALL ENOUGH TO COMMIT) AND THE
+# DIRECTORIES OF ITS GOLDEN OUTPUTS: FROM THE ORIGINAL PROGRAMS, AND FROM THE REPLACEMENTS THAT RUN WITHOUT THEM
+FIXTURE = ['--pings', '20000', '--seed', '0', '--region', '-1', '1', '-1', '1', '--tile-size', '2', '--increment', '2m']
+FIXTURE_DIR = os.path.join(HERE, 'tile_benchmark_fixture')
+FIXTURE_DIRS = collections.OrderedDict((('original', os.path.join(FIXTURE_DIR, 'original')),
+                                        ('replacements', os.path.join(FIXTURE_DIR, 'replacements'))))
+
+# SYNTHETIC BLOCKS OF THE solver CHECK: (ROWS, COLUMNS, FRACTION OF NODES HOLDING A MEDIAN, -T, ASPECT RATIO). THE
+# BLOCKS ARE LARGE ENOUGH FOR COARSE LEVELS BELOW THE DENSE ONE AND SMALL ENOUGH TO SOLVE DENSELY
+SOLVER_BLOCKS = ((64, 72, 0.05, 0.55, 1.), (72, 64, 0.01, 0.55, 0.7), (64, 64, 0.2, 0.25, 0.5), (48, 80, 0.05, 0.9, 1.))
+
+# KIND OF OUTPUT OF EACH STAGE, IN PIPELINE ORDER
+STAGES = collections.OrderedDict((('selectAndSort', 'xyzi_text'), ('medianId', 'xyzi_binary'),
+                                  ('surface', 'grids'), ('grdblend', 'grids')))
+
+
+# SYNTHETIC PINGS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def difference_field(lon, lat):
+    """SMOOTH SYNTHETIC PING - PREDICTED DIFFERENCE (m): A FEW BROAD HIGHS AND LOWS AND SHORTER SEAMOUNT-LIKE BUMPS"""
+    return (120. * np.sin(np.radians(lon) * 40.) * np.cos(np.radians(lat) * 30.) +
+            60. * np.sin(lon * 2.3 + 1.) * np.sin(lat * 1.7))
+
+
+def write_synthetic_pings(path, n_pings, region, seed=0):
+    """WRITE n_PINGS SYNTHETIC PINGS ALONG RANDOM STRAIGHT TRACKS AS huge.xyzi TEXT (x y z sid)"""
+    rng = np.random.default_rng(seed)
+    west, east, south, north = region
+    n_tracks = -(-n_pings // TRACK_PINGS)
+    start_lon = rng.uniform(west - MARGIN, east + MARGIN, n_tracks)
+    start_lat = rng.uniform(south - MARGIN, north + MARGIN, n_tracks)
+    heading = rng.uniform(0., 2. * np.pi, n_tracks)
+    steps = np.arange(TRACK_PINGS) * TRACK_SPACING
+    lon = (start_lon[:, None] + np.outer(np.sin(heading), steps)).ravel()[:n_pings]
+    lat = (start_lat[:, None] + np.outer(np.cos(heading), steps)).ravel()[:n_pings]
+    lat = np.clip(lat, -90., 90.)
+    z = difference_field(lon, lat) + rng.normal(0., 5., n_pings)
+    sid = np.repeat(rng.integers(1, 30000, n_tracks), TRACK_PINGS)[:n_pings]
+
+    # THE .cm ARCHIVE HAS LONGITUDES IN 0 <-> 360 AS WELL AS -180 <-> 180
+    lon = np.where(rng.random(n_pings) < 0.5, np.mod(lon, 360.), lon)
+    np.savetxt(path, np.column_stack((lon, lat, np.round(z, 1), sid)), fmt='%.7f %.7f %.1f %d')
+    return path
+
+
+def make_tiles(region, tile_size):
+    """SPLIT A REGION INTO tile_size TILES: [{'name': ..., 'region': (west, east, south, north)}]"""
+    west, east, south, north = region
+    tiles = []
+    for tile_south in np.arange(south, north - 1e-9, tile_size):
+        for tile_west in np.arange(west, east - 1e-9, tile_size):
+            tile = (tile_west, min(tile_west + tile_size, east), tile_south, min(tile_south + tile_size, north))
+            tiles.append({'name': 'tile_%g_%g' % (tile[0], tile[2]), 'region': tile})
+    return tiles
+
+
+def tile_bands(tile_region, overlap=BAND_OVERLAP):
+    """
+    RETURN [(band region, blend region)] OF THE TWO LATITUDE BANDS OF A TILE, AS surface_tile.csh SPLITS THE WORLD:
+    THE BANDS (B) OVERLAP BY 2 * overlap, THE BLEND REGIONS (C) MEET IN THE MIDDLE
+    """
+    west, east, south, north = tile_region
+    middle = 0.5 * (south + north)
+    return [((west, east, south, middle + overlap), (west, east, south, middle)),
+            ((west, east, middle - overlap, north), (west, east, middle, north))]
+
+
+# STAGE IMPLEMENTATIONS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def region_option(region):
+    return '-R%.10g/%.10g/%.10g/%.10g' % tuple(region)
+
+
+def read_xyzi_text(path):
+    return np.fromfile(path, sep=' ').reshape(-1, 4)
+
+
+def read_xyzi_binary(path):
+    return np.fromfile(path, dtype='<f8').reshape(-1, 4)
+
+
+def select_bin(settings, tile, inputs, workdir):
+    inside = os.path.join(workdir, tile['name'] + '.xyzi')
+    subprocess.run([os.path.join(settings.bin_dir, 'selectAndSort'), inputs[0], inside, os.devnull] +
+                   ['%.10g' % value for value in tile['region']], check=True, stdout=subprocess.DEVNULL)
+    return [inside]
+
+
+def select_numpy(settings, tile, inputs, workdir):
+    """selectAndSort: KEEP THE PINGS INSIDE THE TILE (WRAPPING THE LONGITUDE FOR THE TEST ONLY), LINES UNCHANGED"""
+    inside = os.path.join(workdir, tile['name'] + '.xyzi')
+    west, east, south, north = tile['region']
+    with open(inputs[0], 'rb') as source_file:
+        lines = np.array(source_file.read().splitlines(keepends=True), dtype=object)
+    values = read_xyzi_text(inputs[0])
+    x = values[:, 0]
+    x = np.where(x > 180., x - 360., np.where(x < -180., x + 360., x))
+    keep = (x >= west) & (x <= east) & (values[:, 1] >= south) & (values[:, 1] <= north)
+    with open(inside, 'wb') as inside_file:
+        inside_file.write(b''.join(lines[keep]))
+    return [inside]
+
+
+def median_bin(settings, tile, inputs, workdir):
+    output = os.path.join(workdir, tile['name'] + '.median.xyzi')
+    with open(output, 'wb') as output_file:
+        subprocess.run([os.path.join(settings.bin_dir, 'medianId'), '-fg', region_option(tile['region']),
+                        '-I' + settings.increment, '-C', '-bo4', inputs[0]], check=True, stdout=output_file)
+    return [output]
+
+
+def median_numpy(settings, tile, inputs, workdir):
+    output = os.path.join(workdir, tile['name'] + '.median.xyzi')
+    block_median(read_xyzi_text(inputs[0]), tile['region'], settings.increment).astype('<f8').tofile(output)
+    return [output]
+
+
+def surface_gmt(settings, tile, inputs, workdir):
+    """surface EACH LATITUDE BAND OF THE TILE WITH THE demPaths.sh OPTIONS, AS surface_tile.csh DOES"""
+    values = read_xyzi_binary(inputs[0])
+    bands = []
+    for i, (band, blend) in enumerate(tile_bands(tile['region'])):
+        stem = os.path.join(workdir, '%s.B%d' % (tile['name'], i + 1))
+        inside = (values[:, 1] >= band[2]) & (values[:, 1] <= band[3])
+        values[inside, 0:3].astype('<f8').tofile(stem + '.xyz')
+        aspect = np.cos(np.radians(0.5 * (band[2] + band[3])))
+        subprocess.run(gmt_command('surface') + [stem + '.xyz', '-bi3d', '-fg', '-I' + settings.increment,
+                                                 '-A%.3f' % aspect, '-Ll-%g' % MAX_DIFFERENCE,
+                                                 '-Lu%g' % MAX_DIFFERENCE, region_option(band), '-G' + stem + '.grd'] +
+                       settings.surface_options, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        bands.append(stem + '.grd')
+    return bands
+
+
+def surface_engine_bands(settings, tile, inputs, workdir):
+    """
+    surface EACH LATITUDE BAND OF THE TILE WITH surface_engine.py, THE BAND SOLVED AS ONE BLOCK WITH THE demPaths.sh
+    OPTIONS (THE MEDIANS OF A NODE HELD AT THEIR MEAN, AS surface_engine.solve_block DOES)
+    """
+    values = read_xyzi_binary(inputs[0])
+    options = surface_engine.SurfaceOptions.parse(settings.surface_options +
+                                                  ['-Ll-%g' % MAX_DIFFERENCE, '-Lu%g' % MAX_DIFFERENCE])
+    extension = '.grd' if netcdf_available(settings) else '.npz'
+    bands = []
+    for i, (band, blend) in enumerate(tile_bands(tile['region'])):
+        grid = Grid.empty(band, settings.increment, fill=0., dtype=np.float64)
+        row = np.rint((values[:, 1] - grid.y[0]) / grid.increment).astype(np.int64)
+        col = np.rint((wrap_longitude(values[:, 0]) - grid.x[0]) / grid.increment).astype(np.int64)
+        inside = (row >= 0) & (row < grid.shape[0]) & (col >= 0) & (col < grid.shape[1])
+        node = row[inside] * grid.shape[1] + col[inside]
+        counts = np.bincount(node, minlength=grid.z.size).reshape(grid.shape)
+        sums = np.bincount(node, weights=values[inside, 2], minlength=grid.z.size).reshape(grid.shape)
+        fixed = counts > 0
+        grid.z[fixed] = sums[fixed] / counts[fixed]
+        aspect = max(np.cos(np.radians(0.5 * (band[2] + band[3]))), surface_engine.MIN_ASPECT)
+        surface_engine.solve(grid.z, fixed, aspect, options)
+        grid.z = grid.z.astype(np.float32)
+        bands.append(write_grid(os.path.join(workdir, '%s.B%d%s' % (tile['name'], i + 1, extension)), grid))
+    return bands
+
+
+def blend_file(tile, bands, workdir):
+    """WRITE THE grdblend blend.txt OF A TILE (EACH BAND OVER ITS BLEND REGION, WEIGHT 1)"""
+    path = os.path.join(workdir, tile['name'] + '.blend.txt')
+    with open(path, 'w') as blend:
+        for band_grid, (band, region) in zip(bands, tile_bands(tile['region'])):
+            blend.write('%s %s 1\n' % (band_grid, region_option(region)))
+    return path
+
+
+def grdblend_gmt(settings, tile, inputs, workdir):
+    output = os.path.join(workdir, tile['name'] + '.grd')
+    subprocess.run(gmt_command('grdblend') + [blend_file(tile, inputs, workdir), '-G' + output, '-fg',
+                                              region_option(tile['region']), '-I' + settings.increment],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return [output]
+
+
+def grdblend_numpy(settings, tile, inputs, workdir):
+    """grdblend OF BANDS WITH WEIGHT 1: EACH NODE IS THE MEAN OF THE BANDS WHOSE BLEND REGION HOLDS IT"""
+    total = Grid.empty(tile['region'], settings.increment, fill=0., dtype=np.float64)
+    weight = np.zeros(total.shape)
+    for band_grid, (band, region) in zip(inputs, tile_bands(tile['region'])):
+        grid = read_grid(band_grid, region)
+        rows, cols = total.index_window(region)
+        total.z[rows, cols] += np.nan_to_num(grid.z)
+        weight[rows, cols] += np.isfinite(grid.z)
+    with np.errstate(invalid='ignore'):
+        total.z = (total.z / weight).astype(np.float32)
+    output = os.path.join(workdir, tile['name'] + ('.grd' if is_netcdf(inputs[0]) else '.npz'))
+    write_grid(output, total)
+    return [output]
+
+
+def bin_available(name):
+    """TRUE IF bin/<name> RUNS ON THIS MACHINE (THE CHECKED IN PROGRAMS ARE MAC EXECUTABLES)"""
+    def available(settings):
+        path = os.path.join(settings.bin_dir, name)
+        try:
+            subprocess.run([path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+        except (OSError, subprocess.SubprocessError):
+            return False
+        return True
+    return available
+
+
+def gmt_available(module):
+    def available(settings):
+        return (shutil.which('gmt') or shutil.which(module)) is not None and netcdf_available(settings)
+    return available
+
+
+def netcdf_available(settings):
+    return importlib.util.find_spec('netCDF4') is not None
+
+
+# STAGE -> {IMPLEMENTATION NAME: (function(settings, tile, input paths, workdir) -> output paths, available(settings))}
+# THE FIRST AVAILABLE IMPLEMENTATION IS USED UNLESS --use PICKS ANOTHER
+IMPLEMENTATIONS = collections.OrderedDict((
+    ('selectAndSort', collections.OrderedDict((('bin', (select_bin, bin_available('selectAndSort'))),
+                                               ('numpy', (select_numpy, None))))),
+    ('medianId', collections.OrderedDict((('bin', (median_bin, bin_available('medianId'))),
+                                          ('numpy', (median_numpy, None))))),
+    ('surface', collections.OrderedDict((('gmt', (surface_gmt, gmt_available('surface'))),))),
+    ('grdblend', collections.OrderedDict((('gmt', (grdblend_gmt, gmt_available('grdblend'))),
+                                          ('numpy', (grdblend_numpy, None))))),
+))
+
+
+def register(stage, name, function, available=None):
+    """ADD AN IMPLEMENTATION OF A STAGE (E.G. A FASTER REPLACEMENT TO CHECK AGAINST THE GOLDEN OUTPUTS)"""
+    IMPLEMENTATIONS[stage][name] = (function, available)
+
+
+register('surface', 'surface_engine', surface_engine_bands)
+
+
+def is_available(stage, name, settings):
+    available = IMPLEMENTATIONS[stage][name][1]
+    return available is None or available(settings)
+
+
+def choose_implementations(settings, requested):
+    """RETURN {stage: implementation name or None} (THE REQUESTED ONE, OR THE FIRST THAT CAN RUN)"""
+    chosen = {}
+    for stage, implementations in IMPLEMENTATIONS.items():
+        if stage in requested:
+            if requested[stage] not in implementations:
+                raise SystemExit("%s has no implementation %s (%s)" % (stage, requested[stage],
+                                                                       ', '.join(implementations)))
+            if not is_available(stage, requested[stage], settings):
+                raise SystemExit("%s %s cannot run here" % (stage, requested[stage]))
+            chosen[stage] = requested[stage]
+        else:
+            chosen[stage] = next((name for name in implementations if is_available(stage, name, settings)), None)
+    return chosen
+
+
+# OUTPUTS AND GOLDEN COMPARISON ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def load_outputs(kind, paths):
+    """RETURN A STAGE'S OUTPUT AS ARRAYS: POINTS SORTED BY (x, y, z, sid) OR A LIST OF Grids"""
+    if kind == 'grids':
+        return [read_grid(path) for path in paths]
+    points = read_xyzi_text(paths[0]) if kind == 'xyzi_text' else read_xyzi_binary(paths[0])
+    points = points.copy()
+    points[:, 0] = wrap_longitude(points[:, 0])
+    return [points[np.lexsort(points.T[::-1])]]
+
+
+def golden_path(golden_dir, stage, tile, i):
+    return os.path.join(golden_dir, '%s.%s.%d.npz' % (tile['name'], stage, i))
+
+
+def save_golden(golden_dir, stage, tile, outputs):
+    for i, output in enumerate(outputs):
+        if isinstance(output, Grid):
+            write_grid(golden_path(golden_dir, stage, tile, i), output)
+        else:
+            np.savez_compressed(golden_path(golden_dir, stage, tile, i), points=output)
+
+
+def load_golden(golden_dir, stage, tile):
+    outputs = []
+    while os.path.isfile(golden_path(golden_dir, stage, tile, len(outputs))):
+        path = golden_path(golden_dir, stage, tile, len(outputs))
+        with np.load(path) as archive:
+            outputs.append(archive['points'] if 'points' in archive else read_grid(path))
+    return outputs
+
+
+def write_golden_input(kind, outputs, stage, tile, workdir, grid_extension='.grd'):
+    """WRITE GOLDEN OUTPUTS IN THE FORMAT THE NEXT STAGE READS (FOR --isolate). RETURNS THE PATHS"""
+    paths = []
+    for i, output in enumerate(outputs):
+        stem = os.path.join(workdir, '%s.golden.%s.%d' % (tile['name'], stage, i))
+        if kind == 'grids':
+            paths.append(write_grid(stem + grid_extension, output))
+        elif kind == 'xyzi_text':
+            np.savetxt(stem + '.xyzi', output, fmt='%.7f %.7f %.1f %d')
+            paths.append(stem + '.xyzi')
+        else:
+            output.astype('<f8').tofile(stem + '.xyzi')
+            paths.append(stem + '.xyzi')
+    return paths
+
+
+def difference(outputs, golden):
+    """RETURN (max |difference|, rms difference, problem or '') BETWEEN AN OUTPUT AND ITS GOLDEN OUTPUT"""
+    if len(outputs) != len(golden):
+        return np.inf, np.inf, '%d outputs, golden has %d' % (len(outputs), len(golden))
+    largest, squares, n = 0., 0., 0
+    for output, expected in zip(outputs, golden):
+        if isinstance(output, Grid):
+            if output.shape != expected.shape:
+                return np.inf, np.inf, 'grid is %s, golden is %s' % (output.shape, expected.shape)
+            a, b = output.z.astype(float), expected.z.astype(float)
+            if not np.array_equal(np.isnan(a), np.isnan(b)):
+                return np.inf, np.inf, 'empty nodes differ'
+        else:
+            if output.shape != expected.shape:
+                return np.inf, np.inf, '%d points, golden has %d' % (len(output), len(expected))
+            a, b = output, expected
+        delta = np.abs(a - b)[np.isfinite(a)]
+        if delta.size:
+            largest = max(largest, float(delta.max()))
+            squares += float((delta ** 2).sum())
+            n += delta.size
+    return largest, np.sqrt(squares / n) if n else 0., ''
+
+
+# SOLVER CHECK ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def synthetic_block(n_rows, n_cols, fraction, seed=0):
+    """A BLOCK OF difference_field MEDIANS AT A RANDOM fraction OF ITS NODES (1 MINUTE APART): (z, fixed)"""
+    rng = np.random.default_rng(seed)
+    fixed = rng.random((n_rows, n_cols)) < fraction
+    lat, lon = np.indices(fixed.shape) / 60.
+    z = np.where(fixed, difference_field(lon, lat) + rng.normal(0., 5., fixed.shape), 0.)
+    return z, fixed
+
+
+def converged_block(z, fixed, tension, aspect):
+    """THE SOLUTION OF THE EQUATIONS surface_engine SOLVES ON A SMALL BLOCK, BY A DENSE SOLVE OF ITS FREE NODES"""
+    matrix = np.zeros((fixed.size, fixed.size))
+    for node in range(fixed.size):
+        unit = np.zeros(fixed.size)
+        unit[node] = 1.
+        matrix[:, node] = surface_engine.operator(unit.reshape(fixed.shape), tension, aspect).ravel()
+    free = ~fixed.ravel()
+    solution = np.where(fixed, z, 0.).ravel()
+    solution[free] = np.linalg.solve(matrix[np.ix_(free, free)], -matrix[np.ix_(free, ~free)] @ solution[~free])
+    return solution.reshape(fixed.shape)
+
+
+def check_solver(seed=0, convergence=surface_engine.CONVERGENCE):
+    """SOLVE THE SOLVER_BLOCKS WITH surface_engine.solve AND COMPARE WITH converged_block. FALSE IF ANY IS OFF BY -C"""
+    ok = True
+    print("%-22s %7s %10s %10s %8s" % ('block', 'cycles', 'estimate', 'error', 'seconds'))
+    for n_rows, n_cols, fraction, tension, aspect in SOLVER_BLOCKS:
+        z, fixed = synthetic_block(n_rows, n_cols, fraction, seed)
+        expected = converged_block(z, fixed, tension, aspect)
+        options = surface_engine.SurfaceOptions(tension=tension, convergence=convergence)
+        start = time.perf_counter()
+        cycles, estimate, _ = surface_engine.solve(z, fixed, aspect, options)
+        seconds = time.perf_counter() - start
+        error = float(np.abs(z - expected).max())
+        ok = ok and error <= convergence
+        print("%3dx%-3d %3g%% T%-4g A%-4g %7d %10.3g %10.3g %8.2f%s" %
+              (n_rows, n_cols, 100. * fraction, tension, aspect, cycles, estimate, error, seconds,
+               '' if error <= convergence else '  FAILED'))
+    return ok
+
+
+# RUN ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def count_items(kind, tile, increment, stage_input):
+    """WHAT A STAGE'S THROUGHPUT IS MEASURED IN: PINGS READ FOR THE POINT STAGES, GRID NODES MADE FOR THE OTHERS"""
+    if kind == 'grids':
+        x, y = grid_nodes(tile['region'], increment)
+        return len(x) * len(y)
+    return stage_input
+
+
+def run_pipeline(settings, chosen, workdir):
+    """RUN THE STAGES ON EVERY TILE. RETURNS {stage: result}"""
+    golden_ok = os.path.isfile(os.path.join(settings.golden, 'manifest.json')) and not settings.update_golden
+    results = collections.OrderedDict()
+    for stage, kind in STAGES.items():
+        results[stage] = {'implementation': chosen[stage], 'tiles': collections.OrderedDict()}
+
+    for tile in settings.tiles:
+        stage_input, n_input = [settings.source], settings.pings
+        for stage, kind in STAGES.items():
+            result = results[stage]
+            if chosen[stage] is None or stage_input is None:
+                result['skipped'] = 'no implementation can run here' if chosen[stage] is None else \
+                    'no input (an earlier stage was skipped)'
+                stage_input = None
+                continue
+
+            # 1.0 RUN AND TIME THE STAGE ON THE TILE
+            function = IMPLEMENTATIONS[stage][chosen[stage]][0]
+            start = time.perf_counter()
+            outputs = function(settings, tile, stage_input, workdir)
+            seconds = time.perf_counter() - start
+            tile_result = {'wall_s': seconds, 'items': count_items(kind, tile, settings.increment, n_input),
+                           'max_rss_mb': max_rss_mb()}
+            result['tiles'][tile['name']] = tile_result
+
+            # 2.0 COMPARE WITH (OR SAVE) THE GOLDEN OUTPUT
+            try:
+                loaded = load_outputs(kind, outputs)
+            except ImportError as error:
+                loaded = None
+                tile_result['golden'] = 'not compared (%s)' % error
+            if loaded is not None and settings.update_golden:
+                save_golden(settings.golden, stage, tile, loaded)
+            elif loaded is not None and golden_ok:
+                golden = load_golden(settings.golden, stage, tile)
+                largest, rms, problem = difference(loaded, golden) if golden else (np.inf, np.inf, 'no golden')
+                tile_result.update({'max_abs_diff': largest, 'rms_diff': rms,
+                                    'passed': not problem and largest <= settings.tolerances[stage]})
+                if problem:
+                    tile_result['problem'] = problem
+
+            # 3.0 INPUT OF THE NEXT STAGE
+            n_input = len(loaded[0]) if loaded is not None and kind != 'grids' else n_input
+            stage_input = outputs
+            if settings.isolate and golden_ok:
+                golden = load_golden(settings.golden, stage, tile)
+                if golden:
+                    stage_input = write_golden_input(kind, golden, stage, tile, workdir,
+                                                     os.path.splitext(outputs[0])[1])
+                    n_input = len(golden[0]) if kind != 'grids' else n_input
+
+    # 4.0 TOTALS OVER THE TILES
+    for stage, result in results.items():
+        tiles = result['tiles'].values()
+        if tiles:
+            result['wall_s'] = sum(tile['wall_s'] for tile in tiles)
+            result['per_tile_s'] = result['wall_s'] / len(tiles)
+            result['items_per_s'] = sum(tile['items'] for tile in tiles) / max(result['wall_s'], 1e-9)
+            compared = [tile for tile in tiles if 'passed' in tile]
+            if compared:
+                result['passed'] = all(tile['passed'] for tile in compared)
+                result['max_abs_diff'] = max(tile['max_abs_diff'] for tile in compared)
+    return results
+
+
+def report(result, history):
+    """PRINT EACH STAGE NEXT TO THE PREVIOUS RUN OF THE SAME SIZE AND IMPLEMENTATION. RETURNS FALSE IF ANY FAILED"""
+    same = [old for old in history if old['settings'] == result['settings']]
+    settings = result['settings']
+    print("%d pings, %d tiles of %g degrees at %s:" % (settings['pings'], settings['n_tiles'], settings['tile_size'],
+                                                       settings['increment']))
+    ok = True
+    for stage, stage_result in result['stages'].items():
+        name = '%s (%s)' % (stage, stage_result['implementation'] or '-')
+        if 'wall_s' not in stage_result:
+            print("  %-26s skipped (%s)" % (name, stage_result.get('skipped', '')))
+            continue
+        line = "  %-26s %9.3f s %9.3f s/tile %12.0f /s" % (name, stage_result['wall_s'], stage_result['per_tile_s'],
+                                                            stage_result['items_per_s'])
+        previous = [old['stages'][stage] for old in same
+                    if old['stages'].get(stage, {}).get('implementation') == stage_result['implementation'] and
+                    'wall_s' in old['stages'][stage]]
+        if previous and previous[-1]['wall_s'] > 0:
+            ratio = stage_result['wall_s'] / previous[-1]['wall_s']
+            line += "   x%.2f of previous%s" % (ratio, '  <-- SLOWER' if ratio > REGRESSION_RATIO else '')
+        if 'passed' in stage_result:
+            line += "   golden %s (max diff %.3g)" % ('ok' if stage_result['passed'] else 'FAILED',
+                                                      stage_result['max_abs_diff'])
+            ok = ok and stage_result['passed']
+        print(line)
+    return ok
+
+
+def parse_pairs(pairs, convert=str):
+    """['stage=value', ...] -> {stage: value}"""
+    values = {}
+    for pair in pairs:
+        stage, _, value = pair.partition('=')
+        if stage not in STAGES or not value:
+            raise SystemExit("expected stage=value with stage one of %s, got %s" % (', '.join(STAGES), pair))
+        values[stage] = convert(value)
+    return values
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time the tile pipeline stages and check them against golden grids')
+    commands = parser.add_subparsers(dest='command')
+    listing = commands.add_parser('list', help='list the stages and their implementations')
+    listing.add_argument('--bin-dir', default=BIN_DIR)
+    run = commands.add_parser('run', help='run the stages on a synthetic region')
+    run.add_argument('--pings', type=int, default=PINGS)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--region', type=float, nargs=4, default=REGION, metavar=('W', 'E', 'S', 'N'))
+    run.add_argument('--tile-size', type=float, default=TILE_SIZE, help='degrees')
+    run.add_argument('--increment', default=INCREMENT, help='grid spacing, e.g. 1m or 15c')
+    run.add_argument('--use', nargs='*', default=[], help='stage=implementation')
+    run.add_argument('--golden', default=os.path.join(HERE, 'tile_benchmark_golden'), help='golden output dir')
+    run.add_argument('--update-golden', action='store_true', help='save the outputs of this run as the golden ones')
+    run.add_argument('--isolate', action='store_true', help='run each stage on the golden output of the one before')
+    run.add_argument('--tolerance', nargs='*', default=[], help='stage=largest accepted difference')
+    run.add_argument('--bin-dir', default=BIN_DIR, help='directory of selectAndSort and medianId')
+    run.add_argument('--dem-paths', default=DEM_PATHS, help='demPaths.sh giving the surface options')
+    run.add_argument('--history', default=os.path.join(HERE, 'tile_benchmark_history.json'), help='JSON history')
+    run.add_argument('--label', default='', help='note stored with the results')
+    run.add_argument('--keep', help='keep the intermediate files in this directory')
+    check = commands.add_parser('check', help='run the stages on the FIXTURE region against its golden outputs')
+    check.add_argument('--against', choices=list(FIXTURE_DIRS), default='original',
+                       help='golden outputs of the original programs, or of the replacements')
+    check.add_argument('--use', nargs='*', default=[], help='stage=implementation')
+    check.add_argument('--isolate', action='store_true', help='run each stage on the golden output of the one before')
+    check.add_argument('--update-golden', action='store_true', help='save the outputs of this run as the golden ones')
+    solver = commands.add_parser('solver', help='check surface_engine against converged solutions')
+    solver.add_argument('--seed', type=int, default=0)
+    solver.add_argument('--convergence', type=float, default=surface_engine.CONVERGENCE, help='-C (m)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for stage, implementations in IMPLEMENTATIONS.items():
+            print("%-14s %s" % (stage, ', '.join('%s%s' % (name, '' if is_available(stage, name, args) else
+                                                            ' (cannot run here)') for name in implementations)))
+        return 0
+    if args.command == 'solver':
+        return 0 if check_solver(args.seed, args.convergence) else 1
+    if args.command == 'check':
+        golden = FIXTURE_DIRS[args.against]
+        use = args.use
+        if args.against == 'original' and args.update_golden:
+            # 0.1 THE original GOLDEN OUTPUTS CAN ONLY COME FROM THE ORIGINAL PROGRAMS
+            if any(pair not in ['%s=%s' % item for item in ORIGINALS.items()] for pair in use):
+                raise SystemExit("the original golden outputs are made by %s only" %
+                                 ', '.join('%s=%s' % item for item in ORIGINALS.items()))
+            use = ['%s=%s' % item for item in ORIGINALS.items()]
+        elif not args.update_golden and not os.path.isfile(os.path.join(golden, 'manifest.json')):
+            raise SystemExit("no golden outputs of the original programs in %s: make them with check --update-golden "
+                             "where the bin/ programs and gmt run" % golden if args.against == 'original' else
+                             "no golden outputs in %s" % golden)
+        return main(['run'] + FIXTURE + ['--golden', golden, '--label', 'check ' + args.against, '--use'] + use +
+                    (['--isolate'] if args.isolate else []) + (['--update-golden'] if args.update_golden else []))
+    if args.command != 'run':
+        parser.print_help()
+        return 1
+
+    # 1.0 SETTINGS AND SYNTHETIC PINGS
+    settings = args
+    settings.tiles = make_tiles(args.region, args.tile_size)
+    settings.tolerances = dict(TOLERANCES, **parse_pairs(args.tolerance, float))
+    dem_settings = read_dem_settings(args.dem_paths, SURFACE_SETTINGS) if os.path.isfile(args.dem_paths) else {}
+    settings.surface_options = [dem_settings[name] for name in SURFACE_SETTINGS if name in dem_settings]
+    chosen = choose_implementations(settings, parse_pairs(args.use))
+    workdir = args.keep or tempfile.mkdtemp(prefix='tile_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    description = {'pings': args.pings, 'seed': args.seed, 'region': list(args.region), 'tile_size': args.tile_size,
+                   'n_tiles': len(settings.tiles), 'increment': args.increment,
+                   'surface_options': settings.surface_options}
+    try:
+        settings.source = write_synthetic_pings(os.path.join(workdir, 'huge.xyzi'), args.pings, args.region,
+                                                args.seed)
+
+        # 2.0 THE GOLDEN OUTPUTS MUST COME FROM THE SAME SETTINGS
+        manifest = os.path.join(args.golden, 'manifest.json')
+        if args.update_golden:
+            shutil.rmtree(args.golden, ignore_errors=True)
+            os.makedirs(args.golden)
+        elif os.path.isfile(manifest):
+            with open(manifest) as manifest_file:
+                golden_settings = json.load(manifest_file)
+            if golden_settings['settings'] != description:
+                raise SystemExit("the golden outputs in %s were made with other settings: %s" %
+                                 (args.golden, golden_settings['settings']))
+            print("golden outputs made by %s" % ', '.join('%s=%s' % (stage, name) for stage, name in
+                                                            golden_settings['implementations'].items()))
+
+        # 3.0 RUN
+        stages = run_pipeline(settings, chosen, workdir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.update_golden:
+        with open(manifest, 'w') as manifest_file:
+            json.dump({'settings': description, 'implementations': chosen, 'commit': git_commit()}, manifest_file,
+                      indent=1)
+
+    # 4.0 REPORT AND RECORD
+    result = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+              'label': args.label, 'settings': description, 'python': platform.python_version(),
+              'numpy': np.__version__, 'stages': stages}
+    history = read_history(args.history)
+    ok = report(result, history)
+    history.append(result)
+    with open(args.history, 'w') as history_file:
+        json.dump(history, history_file, indent=1)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
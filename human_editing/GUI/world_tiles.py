@@ -0,0 +1,174 @@
+"""
+Carve a global grid into tiles and paste tiles back into one grid (replaces com/carveUpWorld.sh and
+com/pasteWorldTogether.sh).
+
+carve reads the source grid once, one strip of tiles (tileHeight degrees tall) at a time, and writes the tiles of a
+strip on a pool of processes while the next strip is read. paste creates the whole output grid first and copies every
+tile straight into its rows and columns, reading the next tiles on the pool meanwhile, instead of pasting strips
+together through temporary files.
+
+Tiles are named after their north west corner as carveUpWorld.sh names them, e.g. w180n90.grd, e165s75.grd.
+
+Usage:
+    python world_tiles.py carve tileWidth tileHeight srcFile dstDir [--workers N] [--extension .grd]
+    python world_tiles.py paste srcDir dstFile [--workers N] [--extension .grd]
+"""
+import os
+import sys
+import glob
+import re
+import argparse
+import time
+import collections
+import concurrent.futures
+from grid_io import GridWriter, grid_nodes, read_grid, write_grid
+
+WORLD = (-180, 180, -90, 90)
+
+TILE_NAME = re.compile(r'([ew])(\d{3})([ns])(\d{2})$')
+
+
+def tile_name(west, north):
+    """NAME OF THE TILE WHOSE NORTH WEST CORNER IS (west, north), E.G. w180n90"""
+    return '%s%03d%s%02d' % ('w' if west < 0 else 'e', abs(west), 's' if north < 0 else 'n', abs(north))
+
+
+def parse_tile_name(name):
+    """RETURN THE (west, north) CORNER OF A TILE NAME (OR FILE NAME), OR None"""
+    match = TILE_NAME.match(os.path.splitext(os.path.basename(name))[0])
+    if match is None:
+        return None
+    east_west, west, north_south, north = match.groups()
+    return (-1 if east_west == 'w' else 1) * int(west), (-1 if north_south == 's' else 1) * int(north)
+
+
+def tile_strips(tile_width, tile_height, region=WORLD):
+    """RETURN THE TILES OF A REGION, NORTH TO SOUTH, AS STRIPS (WEST TO EAST) OF (name, (west, east, south, north))"""
+    west, east, south, north = region
+    strips = []
+    for tile_north in range(north, south + tile_height - 1, -tile_height):
+        strips.append([(tile_name(tile_west, tile_north),
+                        (tile_west, tile_west + tile_width, tile_north - tile_height, tile_north))
+                       for tile_west in range(west, east - tile_width + 1, tile_width)])
+    return strips
+
+
+def read_ahead(executor, function, items, depth):
+    """YIELD function(item) FOR EACH ITEM IN ORDER, KEEPING AT MOST depth CALLS RUNNING AHEAD ON THE EXECUTOR"""
+    items = iter(items)
+    pending = collections.deque(executor.submit(function, item) for _, item in zip(range(depth), items))
+    while pending:
+        result = pending.popleft().result()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            break
+        yield result
+
+
+# CARVE ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def carve(src_path, dst_dir, tile_width, tile_height, workers=1, extension='.grd'):
+    """
+    CUT A GLOBAL (-180/180/-90/90) GRID INTO tile_width x tile_height DEGREE TILES IN dst_dir, AS grdcut DOES (A
+    GRIDLINE REGISTERED TILE KEEPS THE NODES ON ITS EDGES). RETURNS THE TILE PATHS
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    paths = []
+    writing = []
+    try:
+        for strip in tile_strips(tile_width, tile_height):
+            # 1.0 READ THE ROWS OF THE STRIP (WHILE THE TILES OF THE LAST STRIP ARE WRITTEN)
+            strip_south, strip_north = strip[0][1][2], strip[0][1][3]
+            band = read_grid(src_path, region=(WORLD[0], WORLD[1], strip_south, strip_north))
+
+            # 2.0 WAIT FOR THE LAST STRIP, SO NO MORE THAN TWO STRIPS ARE HELD, THEN WRITE THE TILES OF THIS ONE
+            for future in writing:
+                future.result()
+            writing = []
+            for name, region in strip:
+                tile = band.window(region)
+                if tile.z.size == 0:
+                    raise ValueError("%s has no nodes in tile %s %s" % (src_path, name, region))
+                path = os.path.join(dst_dir, name + extension)
+                if executor is None:
+                    write_grid(path, tile)
+                else:
+                    writing.append(executor.submit(write_grid, path, tile))
+                paths.append(path)
+        for future in writing:
+            future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return paths
+
+
+# PASTE ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def tile_paths(src_dir, extension='.grd'):
+    """RETURN THE TILE FILES OF A DIRECTORY, NORTH TO SOUTH AND WEST TO EAST"""
+    paths = [path for path in glob.glob(os.path.join(src_dir, '*' + extension)) if parse_tile_name(path)]
+    return sorted(paths, key=lambda path: (-parse_tile_name(path)[1], parse_tile_name(path)[0]))
+
+
+def paste(src_dir, dst_path, workers=1, extension='.grd'):
+    """
+    PASTE THE TILES OF src_dir INTO ONE GRID COVERING THEM ALL, WITH THE INCREMENT AND REGISTRATION OF THE TILES
+    (TILES ARE ALL THE SIZE OF THE FIRST ONE, AS pasteWorldTogether.sh ASSUMES). RETURNS THE NUMBER OF TILES PASTED
+    """
+    paths = tile_paths(src_dir, extension)
+    if not paths:
+        raise ValueError("no tiles (e.g. w180n90%s) in %s" % (extension, src_dir))
+
+    # 1.0 THE OUTPUT REGION IS THE UNION OF THE TILES
+    first = read_grid(paths[0])
+    first_west, first_east, first_south, first_north = first.region
+    tile_width, tile_height = first_east - first_west, first_north - first_south
+    corners = [parse_tile_name(path) for path in paths]
+    region = (min(west for west, north in corners), max(west for west, north in corners) + tile_width,
+              min(north for west, north in corners) - tile_height, max(north for west, north in corners))
+    x, y = grid_nodes(region, first.increment, first.registration)
+
+    # 2.0 COPY EACH TILE INTO PLACE AS IT IS READ
+    with GridWriter(dst_path, x, y, first.registration) as writer:
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                for tile in read_ahead(executor, read_grid, paths, 2 * workers):
+                    writer.write(tile)
+        else:
+            for path in paths:
+                writer.write(read_grid(path))
+    return len(paths)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Carve a global grid into tiles, or paste tiles into one grid')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    parser.add_argument('--extension', default='.grd', help='tile file extension (.grd, .nc or .npz)')
+    commands = parser.add_subparsers(dest='command')
+    carve_parser = commands.add_parser('carve', help='cut a global grid into tiles (carveUpWorld.sh)')
+    carve_parser.add_argument('tile_width', type=int, help='degrees')
+    carve_parser.add_argument('tile_height', type=int, help='degrees')
+    carve_parser.add_argument('src_file')
+    carve_parser.add_argument('dst_dir')
+    paste_parser = commands.add_parser('paste', help='paste a directory of tiles into one grid (pasteWorldTogether.sh)')
+    paste_parser.add_argument('src_dir')
+    paste_parser.add_argument('dst_file')
+    args = parser.parse_args(argv)
+    if args.command not in ('carve', 'paste'):
+        parser.print_help()
+        return 1
+
+    start = time.time()
+    if args.command == 'carve':
+        paths = carve(args.src_file, args.dst_dir, args.tile_width, args.tile_height, args.workers, args.extension)
+        print("carved %s into %d tiles in %s (%.1f s)" % (args.src_file, len(paths), args.dst_dir, time.time() - start))
+    else:
+        n_tiles = paste(args.src_dir, args.dst_file, args.workers, args.extension)
+        print("pasted %d tiles into %s (%.1f s)" % (n_tiles, args.dst_file, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))